@@ -0,0 +1,121 @@
+"""
+Samples taken and cutoff error of the control loops, at a fixed and an adaptive sample rate.
+
+Fills and heats lots on the simulated rig with the unmodified FlowMonitor and
+Heater. The fixed rate samples at the same rate for the whole lot, the
+adaptive rate samples between the given bounds, faster as the target comes
+closer. For each, the benchmark reports the samples per lot, and the error of
+the cutoff: for filling, the true volume once the pump has coasted down minus
+the target; for heating, the temperature at which the heater stopped minus the
+target.
+
+Run from the cda folder:
+    python -m benchmarks.adaptive_rate_benchmark --lots 3 --liters 5.0 --cutoff predictive
+"""
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import statistics
+import threading
+
+from simulation.physics import PumpModel
+from simulation.recording_publisher import RecordingPublisher
+# The rig installs the fake GPIO module, so it must be imported before the device code
+from simulation.rig import SimulatedRig
+
+from devices.mag6000.mag6000_connector import Mag6000Connector
+from functions.adaptive_rate import AdaptiveRate
+from functions.cutoff_predictor import CutoffPredictor
+from functions.flow_monitor import FlowMonitor
+from functions.heater import Heater
+
+
+def parse_rate(text: str) -> tuple[float, AdaptiveRate | None]:
+    """A single rate is fixed, "min,max" is adaptive."""
+    if "," in text:
+        adaptive = AdaptiveRate.parse(text)
+        return adaptive.min_hz, adaptive
+    return float(text), None
+
+
+def fill(rig: SimulatedRig, text: str, args) -> dict:
+    rate_hz, adaptive = parse_rate(text)
+    samples, errors = [], []
+    # The predictor learns over the lots of each rate
+    predictor = CutoffPredictor() if args.cutoff == "predictive" else None
+    with Mag6000Connector() as connector:
+        for index in range(args.lots):
+            rig.new_lot()
+            before = rig.snapshot()["total_liters"]
+            monitor = FlowMonitor(
+                target_liters=args.liters,
+                connector=connector,
+                pump_relay_pin=rig.pump_relay_pin,
+                publisher=RecordingPublisher(f"{index + 1}"),
+                stop_event=threading.Event(),
+                sample_rate_hz=rate_hz,
+                adaptive_rate=adaptive,
+                cutoff_predictor=predictor,
+            )
+            sink = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+            with sink:
+                monitor.run()
+            samples.append(monitor.scheduler.stats.ticks)
+            errors.append(rig.settle()["total_liters"] - before - args.liters)
+    return {"loop": "flow", "rate": text, "samples": statistics.fmean(samples), "error": statistics.fmean(errors) * 1000, "unit": "ml"}
+
+
+def heat(rig: SimulatedRig, text: str, args) -> dict:
+    rate_hz, adaptive = parse_rate(text)
+    samples, errors = [], []
+    for index in range(args.lots):
+        rig.new_lot()
+        with rig.lock:
+            rig.kettle.add_water(args.kettle_liters - rig.kettle.water_liters)
+        rig.w1.set_temperature(rig.sensor_id, rig.kettle.sensor_c)
+        heater = Heater(
+            target_temperature=args.temperature,
+            kettle_relay_pin=rig.kettle_relay_pin,
+            publisher=RecordingPublisher(f"{index + 1}"),
+            stop_event=threading.Event(),
+            sample_rate_hz=rate_hz,
+            adaptive_rate=adaptive,
+        )
+        sink = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+        with sink:
+            heater.run()
+        samples.append(heater.scheduler.stats.ticks)
+        errors.append(heater.cutoff_error)
+    return {"loop": "temp", "rate": text, "samples": statistics.fmean(samples), "error": statistics.fmean(errors), "unit": "°C"}
+
+
+def main(argv: list[str] | None = None) -> list[dict]:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lots", type=int, default=3, help="lots per rate")
+    parser.add_argument("--liters", type=float, default=5.0, help="liters to fill per lot")
+    parser.add_argument("--flow", type=float, default=1800.0, help="pump flow rate in L/h")
+    parser.add_argument("--cutoff", choices=("fixed", "predictive"), default="fixed", help="pump cutoff")
+    parser.add_argument("--kettle-liters", type=float, default=0.5, help="liters of water to heat per lot")
+    parser.add_argument("--temperature", type=float, default=40.0, help="target temperature in °C")
+    parser.add_argument("--flow-rates", nargs="+", default=["4", "1,20"], help="fixed rates, or min,max for adaptive")
+    parser.add_argument("--temp-rates", nargs="*", default=["10", "1,10"], help="fixed rates, or min,max for adaptive")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="simulated seconds per real second")
+    parser.add_argument("--verbose", action="store_true", help="show the output of the control loops")
+    args = parser.parse_args(argv)
+
+    results = []
+    print(f"{'loop':>5} {'rate Hz':>8} {'samples':>8} {'cutoff error':>13}")
+    with SimulatedRig(pump=PumpModel(max_flow_lph=args.flow), time_scale=args.time_scale) as rig:
+        for text in args.flow_rates:
+            results.append(fill(rig, text, args))
+            print(f"{'flow':>5} {text:>8} {results[-1]['samples']:8.1f} {results[-1]['error']:+10.1f} ml")
+        for text in args.temp_rates:
+            results.append(heat(rig, text, args))
+            print(f"{'temp':>5} {text:>8} {results[-1]['samples']:8.1f} {results[-1]['error']:+10.2f} °C")
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Delivered volume with the fixed and the predictive pump cutoff.
+
+Fills several lots in a row at each pump speed, with the unmodified FlowMonitor
+on the simulated rig. The fixed cutoff switches the pump off 50 ml before the
+target. The predictive cutoff switches it off by the coast volume, fitted from
+the lots before. The delivered volume is the true volume of the rig once the
+pump has coasted down.
+
+Run from the cda folder:
+    python -m benchmarks.cutoff_benchmark --lots 4 --liters 1.0 --flows 720 1800 3600
+"""
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import statistics
+import threading
+
+from simulation.physics import PumpModel
+from simulation.recording_publisher import RecordingPublisher
+# The rig installs the fake GPIO module, so it must be imported before the device code
+from simulation.rig import SimulatedRig
+
+from devices.mag6000.mag6000_connector import Mag6000Connector
+from functions.cutoff_predictor import CutoffPredictor
+from functions.flow_monitor import FlowMonitor
+
+
+def run(flow_lph: float, predictive: bool, args) -> dict:
+    predictor = CutoffPredictor() if predictive else None
+    errors = []
+    seconds = []
+    rig = SimulatedRig(pump=PumpModel(max_flow_lph=flow_lph), baudrate=args.baudrate or None, time_scale=args.time_scale)
+    with rig, Mag6000Connector() as connector:
+        for index in range(args.lots):
+            rig.new_lot()
+            before = rig.snapshot()
+            monitor = FlowMonitor(
+                target_liters=args.liters,
+                connector=connector,
+                pump_relay_pin=rig.pump_relay_pin,
+                publisher=RecordingPublisher(f"{index + 1}"),
+                stop_event=threading.Event(),
+                sample_rate_hz=args.rate,
+                cutoff_predictor=predictor,
+            )
+            sink = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+            with sink:
+                monitor.run()
+            after = rig.settle()
+            errors.append(after["total_liters"] - before["total_liters"] - args.liters)
+            seconds.append(after["sim_time"] - before["sim_time"])
+    return {
+        "flow_lph": flow_lph,
+        "cutoff": "predictive" if predictive else "fixed",
+        "mean_error_ml": statistics.fmean(errors) * 1000,
+        "max_error_ml": max(errors, key=abs) * 1000,
+        # The first lots of the predictive cutoff are still learning
+        "last_error_ml": errors[-1] * 1000,
+        "mean_seconds": statistics.fmean(seconds),
+        "coast_seconds": predictor.coast_seconds if predictor else None,
+    }
+
+
+def main(argv: list[str] | None = None) -> list[dict]:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lots", type=int, default=4, help="lots per pump speed and cutoff")
+    parser.add_argument("--liters", type=float, default=1.0, help="liters per lot")
+    parser.add_argument("--flows", type=float, nargs="+", default=[720.0, 1800.0, 3600.0], help="pump flow rates in L/h")
+    parser.add_argument("--rate", type=float, default=4.0, help="flow sample rate in Hz")
+    parser.add_argument("--baudrate", type=int, default=19200, help="baud rate to emulate, 0 for none")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="simulated seconds per real second")
+    parser.add_argument("--verbose", action="store_true", help="show the output of the filling loop")
+    args = parser.parse_args(argv)
+
+    results = []
+    print(f"{'L/h':>6} {'cutoff':>10} {'mean ml':>8} {'max ml':>8} {'last ml':>8} {'fill s':>7} {'coast s':>8}")
+    for flow_lph in args.flows:
+        for predictive in (False, True):
+            row = run(flow_lph, predictive, args)
+            results.append(row)
+            coast = f"{row['coast_seconds']:8.2f}" if row["coast_seconds"] is not None else f"{'-':>8}"
+            print(
+                f"{row['flow_lph']:6.0f} {row['cutoff']:>10} {row['mean_error_ml']:+8.1f} {row['max_error_ml']:+8.1f} "
+                f"{row['last_error_ml']:+8.1f} {row['mean_seconds']:7.2f} {coast}"
+            )
+    return results
+
+
+if __name__ == "__main__":
+    main()
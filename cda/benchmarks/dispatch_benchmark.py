@@ -0,0 +1,78 @@
+"""
+Cost of dispatching an incoming MQTT message against the number of registered callbacks.
+
+Compares the old dispatch, where every callback is called for every message and
+filters the topic itself, with the topic-indexed TopicDispatcher. The registered
+callbacks model a device that has processed many lots: one stop callback per lot
+under the old scheme, against per-lot stop filters under the dispatcher.
+
+Run from the cda folder:
+    python -m benchmarks.dispatch_benchmark --messages 20000
+"""
+from __future__ import annotations
+
+import argparse
+import time
+
+from mqtt.topic_dispatcher import TopicDispatcher
+from simulation.fake_mqtt import FakeMessage
+
+TOPICS = ["request/process", "request/process/stop", "sensor/flow_gauge/progress", "devices/1/status"]
+
+
+def filtering_callback(topic: str):
+    """A callback that checks the topic itself, like the callbacks before the dispatcher."""
+    def callback(client, userdata, msg):
+        if msg.topic != topic:
+            return
+    return callback
+
+
+def noop(client, userdata, msg):
+    pass
+
+
+def broadcast_dispatch(handlers: int):
+    callbacks = [filtering_callback("request/process/stop") for _ in range(handlers)]
+    callbacks.append(filtering_callback("request/process"))
+
+    def dispatch(msg):
+        for callback in callbacks:
+            try:
+                callback(None, None, msg)
+            except Exception as e:
+                print(f"External MQTT callback failed: {e}")
+    return dispatch
+
+
+def indexed_dispatch(handlers: int):
+    dispatcher = TopicDispatcher()
+    for lot in range(handlers):
+        dispatcher.add(f"lot/{lot}/stop", noop)
+    dispatcher.add("request/process", noop)
+    dispatcher.add("sensor/+/progress", noop)
+    return lambda msg: dispatcher.dispatch(None, None, msg)
+
+
+def measure(dispatch, messages: list[FakeMessage]) -> float:
+    started = time.perf_counter()
+    for msg in messages:
+        dispatch(msg)
+    return (time.perf_counter() - started) / len(messages) * 1e6
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=20000, help="messages to dispatch per measurement")
+    args = parser.parse_args(argv)
+
+    messages = [FakeMessage(TOPICS[i % len(TOPICS)], b"{}") for i in range(args.messages)]
+    print(f"{'handlers':>9} {'broadcast µs':>13} {'indexed µs':>11}")
+    for handlers in (1, 10, 100, 1000, 10000):
+        broadcast = measure(broadcast_dispatch(handlers), messages)
+        indexed = measure(indexed_dispatch(handlers), messages)
+        print(f"{handlers:9d} {broadcast:13.2f} {indexed:11.2f}")
+
+
+if __name__ == "__main__":
+    main()
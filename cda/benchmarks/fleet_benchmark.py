@@ -0,0 +1,105 @@
+"""
+Lots per second of a fleet of devices that share the orders of one topic.
+
+Each device is wired like main(), with a shared subscription on the order topic,
+and runs lots that take a fixed time. A burst of orders is published, and the
+benchmark reports the lots per second from the first start to the last end,
+the speedup over one device, how often orders were handed back to the fleet,
+and whether any lot ran twice. By default the devices share an in-memory
+broker; with --broker they connect to a local mosquitto instead.
+
+Run from the cda folder:
+    python -m benchmarks.fleet_benchmark --devices 1 2 4 --orders 40 --lot-seconds 0.2
+    python -m benchmarks.fleet_benchmark --broker localhost:1883
+"""
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import json
+import time
+import uuid
+from collections import Counter
+
+from simulation.fake_broker import FakeBroker
+from simulation.fake_mqtt import FakeMqttConnector
+from simulation.fleet import SimulatedDevice
+
+from mqtt.mqtt_watcher import REQUEST_TOPIC
+
+
+def run(count: int, args) -> dict:
+    group = f"cda-bench-{uuid.uuid4().hex[:8]}"
+    with contextlib.ExitStack() as stack:
+        if args.broker:
+            from mqtt.mqtt_connector import mqtt_connector
+            host, _, port = args.broker.partition(":")
+
+            def connect():
+                connector = mqtt_connector(host, mode="tcp", port=int(port or 1883))
+                connector.connect()
+                stack.callback(connector.disconnect)
+                return connector
+        else:
+            broker = stack.enter_context(FakeBroker())
+
+            def connect():
+                return FakeMqttConnector(broker)
+
+        # The devices print every order and hand-back
+        stack.enter_context(contextlib.redirect_stdout(io.StringIO()))
+        devices = [
+            SimulatedDevice(connect(), f"pi-{i}", share_group=group, lot_seconds=args.lot_seconds, max_pending=args.orders)
+            for i in range(count)
+        ]
+        for device in devices:
+            device.start()
+            stack.callback(device.stop)
+        sender = connect()
+        # Let the subscriptions reach the broker
+        time.sleep(0.5 if args.broker else 0.05)
+
+        for index in range(args.orders):
+            payload = {"liters": 1.0, "temperature": 40.0, "line": 1, "lot_number": f"{group}-{index}"}
+            sender.publish(REQUEST_TOPIC, json.dumps(payload), qos=1, retain=False)
+        deadline = time.monotonic() + args.orders * args.lot_seconds + 10
+        while sum(len(device.lots) for device in devices) < args.orders and time.monotonic() < deadline:
+            time.sleep(0.01)
+        lots = [lot for device in devices for lot in device.lots]
+
+    runs = Counter(lot_id for _, lot_id, _, _ in lots)
+    seconds = max(end for *_, end in lots) - min(start for _, _, start, _ in lots)
+    return {
+        "devices": count,
+        "lots": len(runs),
+        "lots_per_second": len(runs) / seconds,
+        "handed_back": sum(device.watcher.handed_back for device in devices),
+        "duplicates": sum(n - 1 for n in runs.values()),
+        "per_device": [len(device.lots) for device in devices],
+    }
+
+
+def main(argv: list[str] | None = None) -> list[dict]:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--devices", type=int, nargs="+", default=[1, 2, 4], help="fleet sizes to run")
+    parser.add_argument("--orders", type=int, default=40, help="orders published at once")
+    parser.add_argument("--lot-seconds", type=float, default=0.2, help="duration of each lot")
+    parser.add_argument("--broker", help="host:port of a local mosquitto, instead of the in-memory broker")
+    args = parser.parse_args(argv)
+
+    results = []
+    print(f"{'devices':>7} {'lots':>5} {'lots/s':>7} {'speedup':>8} {'handed back':>12} {'duplicates':>11}   lots per device")
+    for count in args.devices:
+        row = run(count, args)
+        results.append(row)
+        speedup = row["lots_per_second"] / results[0]["lots_per_second"] * results[0]["devices"]
+        print(
+            f"{row['devices']:7d} {row['lots']:5d} {row['lots_per_second']:7.2f} {speedup:8.2f}"
+            f" {row['handed_back']:12d} {row['duplicates']:11d}   {row['per_device']}"
+        )
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Per-tick cost and accuracy of the flow integration in FlowMonitor.
+
+Compares the previous approach, which kept every flow sample in a list and
+averaged all of them on each tick, with FlowIntegrator. The cost of a single
+tick is measured at increasing fill durations, which shows the list growing
+linearly while FlowIntegrator stays flat. Accuracy is compared against the
+true volume of a simulated fill where the flow rate changes.
+
+Run from the cda folder:
+    python -m benchmarks.flow_integrator_benchmark --hours 4
+"""
+from __future__ import annotations
+
+import argparse
+import math
+import time
+import tracemalloc
+
+from functions.flow_integrator import FlowIntegrator
+from simulation.physics import PumpModel
+
+
+def history_tick(history: list[float], volume: float, flow: float, elapsed: float) -> float:
+    """One tick of the previous FlowMonitor integration."""
+    history.append(flow)
+    average = sum(history) / len(history)
+    return volume + (average / 3600.0) * elapsed
+
+
+def time_tick(function, repeats: int) -> float:
+    """Return the mean time of *function* in microseconds."""
+    started = time.perf_counter()
+    for _ in range(repeats):
+        function()
+    return (time.perf_counter() - started) / repeats * 1e6
+
+
+def cost_table(hours: float, rate_hz: float, checkpoints: int, repeats: int) -> None:
+    print(f"Per-tick cost at {rate_hz:g} Hz")
+    print(f"{'fill time':>10} {'samples':>9} {'history µs':>11} {'integrator µs':>14} {'history KiB':>12} {'integrator KiB':>15}")
+    for index in range(1, checkpoints + 1):
+        samples = int(hours * 3600 * rate_hz * index / checkpoints)
+
+        # State of the previous approach after this many samples
+        tracemalloc.start()
+        history = [500.0] * samples
+        history_kib = tracemalloc.get_traced_memory()[0] / 1024
+        tracemalloc.stop()
+
+        # State of the integrator after this many samples
+        tracemalloc.start()
+        integrator = FlowIntegrator(window=4)
+        for tick in range(min(samples, 1000)):
+            integrator.add(500.0, tick / rate_hz)
+        integrator_kib = tracemalloc.get_traced_memory()[0] / 1024
+        tracemalloc.stop()
+
+        clock = [samples / rate_hz]
+
+        def integrator_tick():
+            clock[0] += 1.0 / rate_hz
+            integrator.add(500.0, clock[0])
+
+        def previous_tick():
+            history_tick(history, 0.0, 500.0, 1.0 / rate_hz)
+            history.pop()
+
+        print(
+            f"{samples / rate_hz / 60:8.0f} m {samples:9d} {time_tick(previous_tick, repeats):11.2f} "
+            f"{time_tick(integrator_tick, repeats):14.2f} {history_kib:12.1f} {integrator_kib:15.1f}"
+        )
+
+
+def accuracy_table(rate_hz: float) -> None:
+    # Fill with a pump that is throttled halfway, so the flow rate changes
+    pump = PumpModel(max_flow_lph=900.0, totalizer_step_liters=0.0)
+    integrator = FlowIntegrator(window=4)
+    history: list[float] = []
+    history_volume = 0.0
+    dt = 1.0 / rate_hz
+    pump.set_running(True)
+    integrator.add(0.0, 0.0)
+    print(f"\nAccuracy at {rate_hz:g} Hz, flow changes from 900 L/h to 300 L/h after 60 s")
+    print(f"{'time':>6} {'true L':>9} {'history L':>10} {'integrator L':>13}")
+    for tick in range(1, int(180 * rate_hz) + 1):
+        now = tick * dt
+        if math.isclose(now, 60.0):
+            pump.max_flow_lph = 300.0
+        pump.step(dt)
+        history_volume = history_tick(history, history_volume, pump.flow_lph, dt)
+        integrator.add(pump.flow_lph, now)
+        if tick % int(30 * rate_hz) == 0:
+            print(f"{now:5.0f}s {pump.total_liters:9.3f} {history_volume:10.3f} {integrator.volume_liters:13.3f}")
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hours", type=float, default=4.0, help="longest fill to measure")
+    parser.add_argument("--rate", type=float, default=4.0, help="sample rate in Hz")
+    parser.add_argument("--checkpoints", type=int, default=8, help="number of fill durations to measure")
+    parser.add_argument("--repeats", type=int, default=200, help="ticks timed per checkpoint")
+    args = parser.parse_args(argv)
+    cost_table(args.hours, args.rate, args.checkpoints, args.repeats)
+    accuracy_table(args.rate)
+
+
+if __name__ == "__main__":
+    main()
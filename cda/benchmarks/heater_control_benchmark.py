@@ -0,0 +1,101 @@
+"""
+Compares the heater controllers against the simulated kettle.
+
+For each controller, the unmodified Heater heats several lots of water in a row,
+with the same controller instance, so the predictive controller can learn from
+the lots before. With --hold, the heater keeps the target for that many
+seconds before it reports it reached, as with HEATER_HOLD_SECONDS. For each
+lot, the benchmark reports:
+- the simulated seconds until the heater reports the target reached
+- the overshoot of the true water temperature above the target, once it peaks
+- the number of relay switches
+- the error of the true water temperature when the heater stops, which with
+  --hold shows how well the controller kept the target during the hold
+
+The controllers work in real seconds, so a time scale above 1 makes the kettle
+look faster to them than it is, and their tuning no longer fits.
+
+Run from the cda folder:
+    python -m benchmarks.heater_control_benchmark --lots 2 --liters 0.5 --temperature 40
+"""
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import threading
+
+from simulation.physics import KettleModel
+from simulation.recording_publisher import RecordingPublisher
+# The rig installs the fake GPIO module, so it must be imported before the device code
+from simulation.rig import SimulatedRig
+
+from functions.heater import Heater
+from functions.heater_control import CONTROLLERS, make_controller
+
+
+def run(name: str, args) -> list[dict]:
+    controller = make_controller(name)
+    rows = []
+    with SimulatedRig(kettle=KettleModel(power_w=args.power), time_scale=args.time_scale) as rig:
+        for index in range(args.lots):
+            rig.new_lot()
+            with rig.lock:
+                rig.kettle.add_water(args.liters - rig.kettle.water_liters)
+            # Let the sensor files catch up with the drained kettle
+            rig.w1.set_temperature(rig.sensor_id, rig.kettle.sensor_c)
+            started = rig.snapshot()["sim_time"]
+
+            heater = Heater(
+                target_temperature=args.temperature,
+                kettle_relay_pin=rig.kettle_relay_pin,
+                publisher=RecordingPublisher(f"{index + 1}"),
+                stop_event=threading.Event(),
+                sample_rate_hz=args.rate,
+                controller=controller,
+                hold_seconds=args.hold,
+            )
+            sink = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+            with sink:
+                final_temp = heater.run()
+            stopped = rig.snapshot()
+            reached = stopped["sim_time"] - started
+            # Fast-forward until the water temperature peaks
+            peak = rig.settle()["peak_water_c"]
+            rows.append({
+                "controller": name,
+                "lot": index + 1,
+                "completed": final_temp is not None,
+                "seconds_to_target": reached,
+                "overshoot_c": peak - args.temperature,
+                "switches": heater.switch_count,
+                "end_error_c": stopped["water_c"] - args.temperature,
+            })
+    return rows
+
+
+def main(argv: list[str] | None = None) -> list[dict]:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lots", type=int, default=2, help="lots per controller")
+    parser.add_argument("--liters", type=float, default=0.5, help="liters of water per lot")
+    parser.add_argument("--temperature", type=float, default=40.0, help="target temperature in °C")
+    parser.add_argument("--power", type=float, default=2000.0, help="kettle power in W")
+    parser.add_argument("--rate", type=float, default=10.0, help="sample rate of the heating loop in Hz")
+    parser.add_argument("--hold", type=float, default=0.0, help="seconds to keep the target before the lot is completed")
+    parser.add_argument("--controllers", nargs="+", default=list(CONTROLLERS), help="controllers to compare")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="simulated seconds per real second")
+    parser.add_argument("--verbose", action="store_true", help="show the output of the heating loop")
+    args = parser.parse_args(argv)
+
+    results = []
+    print(f"{'controller':>11} {'lot':>4} {'to target s':>12} {'overshoot °C':>13} {'switches':>9} {'end error °C':>13}")
+    for name in args.controllers:
+        for row in run(name, args):
+            results.append(row)
+            to_target = f"{row['seconds_to_target']:12.1f}" if row["completed"] else f"{'failed':>12}"
+            print(f"{row['controller']:>11} {row['lot']:4d} {to_target} {row['overshoot_c']:13.2f} {row['switches']:9d} {row['end_error_c']:13.2f}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Tick jitter of a control loop that logs, when stdout is slow.
+
+A loop paced by the PeriodicScheduler logs a progress line on every tick, as
+the flow loop printed before, to a stream whose writes take --write-ms and
+stall for --stall-ms every --stall-every lines, like a container log driver
+that falls behind. With print() the stalls land in the tick; with the queue
+logger of functions.structured_log they land in its background thread, and
+records are dropped once its queue is full. For each mode, the benchmark
+reports the time the logging took in the tick, the missed deadlines and the
+largest overrun, and the lines written and dropped.
+
+Run from the cda folder:
+    python -m benchmarks.logging_jitter_benchmark --rate 20 --seconds 5 --write-ms 1 --stall-ms 200 --stall-every 20
+"""
+from __future__ import annotations
+
+import argparse
+import io
+import logging
+import time
+
+from functions.periodic_scheduler import PeriodicScheduler
+from functions.structured_log import get_logger, setup_logging
+
+
+class SlowStream(io.TextIOBase):
+    """A stream that takes *write_ms* for each line, and stalls for *stall_ms* every *stall_every* lines."""
+
+    def __init__(self, write_ms: float, stall_ms: float, stall_every: int) -> None:
+        self.write_seconds = write_ms / 1000
+        self.stall_seconds = stall_ms / 1000
+        self.stall_every = stall_every
+        self.lines = 0
+
+    def write(self, text: str) -> int:
+        for _ in range(text.count("\n")):
+            self.lines += 1
+            time.sleep(self.write_seconds)
+            if self.stall_every and self.lines % self.stall_every == 0:
+                time.sleep(self.stall_seconds)
+        return len(text)
+
+
+def run_loop(rate_hz: float, seconds: float, log_tick) -> dict:
+    """Run a loop at *rate_hz* for *seconds*, calling *log_tick* on every tick, and return its timing."""
+    scheduler = PeriodicScheduler(rate_hz)
+    ticks = round(rate_hz * seconds)
+    durations = []
+    for tick in range(ticks):
+        scheduler.wait()
+        started = time.perf_counter()
+        log_tick(tick)
+        durations.append(time.perf_counter() - started)
+    durations.sort()
+    stats = scheduler.stats
+    return {
+        "ticks": ticks,
+        "p50_log_ms": durations[len(durations) // 2] * 1000,
+        "max_log_ms": durations[-1] * 1000,
+        "missed_deadlines": stats.missed_deadlines,
+        "max_overrun_ms": stats.max_overrun * 1000,
+    }
+
+
+def main(argv: list[str] | None = None) -> list[dict]:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rate", type=float, default=20.0, help="ticks per second of the loop")
+    parser.add_argument("--seconds", type=float, default=5.0, help="how long each mode runs")
+    parser.add_argument("--write-ms", type=float, default=1.0, help="time to write one line")
+    parser.add_argument("--stall-ms", type=float, default=200.0, help="length of each stall of the stream")
+    parser.add_argument("--stall-every", type=int, default=20, help="lines between stalls, 0 for none")
+    parser.add_argument("--queue-size", type=int, default=1000, help="records the queue logger holds")
+    args = parser.parse_args(argv)
+
+    results = []
+    print(f"{'mode':>6} {'ticks':>6} {'p50 log ms':>10} {'max log ms':>10} {'missed':>7} {'max overrun ms':>14} {'written':>8} {'dropped':>8}")
+
+    def report(mode: str, result: dict, written: int, dropped: int) -> None:
+        result.update(mode=mode, written=written, dropped=dropped)
+        results.append(result)
+        print(f"{mode:>6} {result['ticks']:6d} {result['p50_log_ms']:10.3f} {result['max_log_ms']:10.1f} "
+              f"{result['missed_deadlines']:7d} {result['max_overrun_ms']:14.1f} {written:8d} {dropped:8d}")
+
+    stream = SlowStream(args.write_ms, args.stall_ms, args.stall_every)
+    result = run_loop(args.rate, args.seconds, lambda tick: print(f"Progress: {tick * 0.01:.2f} out of 5.00 liters passed", file=stream))
+    report("print", result, stream.lines, 0)
+
+    stream = SlowStream(args.write_ms, args.stall_ms, args.stall_every)
+    root = logging.getLogger()
+    handlers, level = root.handlers[:], root.level
+    # Without a rate limit, so every tick of the loop is offered to the queue
+    listener = setup_logging("INFO", queue_size=args.queue_size, per_second=1e9, burst=10 ** 9, stream=stream)
+    log = get_logger("benchmark.flow", target_liters=5.0)
+    try:
+        result = run_loop(args.rate, args.seconds, lambda tick: log.info("Progress", liters=tick * 0.01))
+    finally:
+        listener.stop()
+        root.handlers[:], root.level = handlers, level
+    report("queue", result, stream.lines, listener.dropped)
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""
+Closed-loop benchmark: runs whole lots against the simulated rig.
+
+For every lot, the unmodified filling and heating code runs end to end, and the
+benchmark reports control-loop tick timing, sample rate and overshoot of the
+target volume and temperature.
+
+Run from the cda folder:
+    python -m benchmarks.lot_benchmark --lots 3 --liters 1.0 --temperature 35
+"""
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import json
+import statistics
+import sys
+import threading
+import time
+
+from simulation.physics import KettleModel, PumpModel
+from simulation.recording_publisher import RecordingPublisher
+# The rig installs the fake GPIO module, so it must be imported before the device code
+from simulation.rig import SimulatedRig
+
+from devices.mag6000.mag6000_connector import Mag6000Connector
+from functions.flow_monitor import FlowMonitor
+from functions.heater import Heater
+
+
+def tick_stats(samples: list[tuple[float, float]]) -> dict:
+    """Summarize the intervals between consecutive progress samples."""
+    if len(samples) < 2:
+        return {"ticks": len(samples), "rate_hz": 0.0}
+    intervals = sorted(b[0] - a[0] for a, b in zip(samples, samples[1:]))
+    duration = samples[-1][0] - samples[0][0]
+    return {
+        "ticks": len(samples),
+        "rate_hz": (len(samples) - 1) / duration if duration > 0 else 0.0,
+        "mean_ms": statistics.fmean(intervals) * 1000,
+        "p50_ms": intervals[len(intervals) // 2] * 1000,
+        "p95_ms": intervals[min(len(intervals) - 1, int(len(intervals) * 0.95))] * 1000,
+        "max_ms": intervals[-1] * 1000,
+        "jitter_ms": statistics.pstdev(intervals) * 1000,
+    }
+
+
+def run_lot(rig: SimulatedRig, liters: float, temperature: float, lot_id: str,
+            flow_rate_hz: float = 4.0, temp_rate_hz: float = 10.0) -> dict:
+    """Run one lot like main() does, and measure it against the true rig state."""
+    rig.new_lot()
+    publisher = RecordingPublisher(lot_id)
+    stop_event = threading.Event()
+    start_total = rig.snapshot()["total_liters"]
+
+    # Filling phase
+    fill_started = time.monotonic()
+    with Mag6000Connector() as connector:
+        monitor = FlowMonitor(
+            target_liters=liters,
+            connector=connector,
+            pump_relay_pin=rig.pump_relay_pin,
+            publisher=publisher,
+            stop_event=stop_event,
+            sample_rate_hz=flow_rate_hz,
+        )
+        final_liters = monitor.run()
+    fill_seconds = time.monotonic() - fill_started
+
+    # Heating phase
+    heat_started = time.monotonic()
+    final_temp = None
+    heater = None
+    if final_liters is not None:
+        heater = Heater(
+            target_temperature=temperature,
+            kettle_relay_pin=rig.kettle_relay_pin,
+            publisher=publisher,
+            stop_event=stop_event,
+            sample_rate_hz=temp_rate_hz,
+        )
+        final_temp = heater.run()
+    heat_seconds = time.monotonic() - heat_started
+
+    # Let the pump coast down and the kettle temperature peak
+    settled = rig.settle()
+    delivered = settled["total_liters"] - start_total
+    return {
+        "lot": lot_id,
+        "fill": {
+            "seconds": fill_seconds,
+            "reported_liters": final_liters,
+            "delivered_liters": delivered,
+            "overshoot_liters": delivered - liters,
+            **tick_stats(publisher.flow_progress),
+            "scheduler": monitor.scheduler.stats.summary() if monitor.scheduler else {},
+        },
+        "heat": {
+            "seconds": heat_seconds,
+            "reported_c": final_temp,
+            "peak_c": settled["peak_water_c"],
+            "overshoot_c": settled["peak_water_c"] - temperature,
+            **tick_stats(publisher.temp_progress),
+            "scheduler": heater.scheduler.stats.summary() if heater and heater.scheduler else {},
+        },
+    }
+
+
+def print_report(results: list[dict]) -> None:
+    header = f"{'lot':>5} {'phase':>5} {'secs':>7} {'ticks':>6} {'Hz':>6} {'p50ms':>7} {'p95ms':>7} {'maxms':>7} {'missed':>6} {'overshoot':>10}"
+    print(header)
+    print("-" * len(header))
+    for result in results:
+        for phase, unit, key in (("fill", "L", "overshoot_liters"), ("heat", "°C", "overshoot_c")):
+            row = result[phase]
+            print(
+                f"{result['lot']:>5} {phase:>5} {row['seconds']:7.2f} {row['ticks']:6d} "
+                f"{row['rate_hz']:6.2f} {row.get('p50_ms', 0):7.1f} {row.get('p95_ms', 0):7.1f} "
+                f"{row.get('max_ms', 0):7.1f} {row['scheduler'].get('missed_deadlines', 0):6d} {row[key]:+8.3f} {unit}"
+            )
+
+
+def main(argv: list[str] | None = None) -> list[dict]:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lots", type=int, default=3, help="number of lots to run")
+    parser.add_argument("--liters", type=float, default=1.0, help="liters per lot")
+    parser.add_argument("--temperature", type=float, default=35.0, help="target temperature in °C")
+    parser.add_argument("--flow", type=float, default=720.0, help="pump flow rate in L/h")
+    parser.add_argument("--power", type=float, default=2000.0, help="kettle power in W")
+    parser.add_argument("--baudrate", type=int, default=19200, help="baud rate to emulate, 0 for none")
+    parser.add_argument("--turnaround", type=float, default=0.0, help="extra flow meter response time in seconds")
+    parser.add_argument("--flow-rate", type=float, default=4.0, help="flow sample rate in Hz")
+    parser.add_argument("--temp-rate", type=float, default=10.0, help="temperature sample rate in Hz")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="simulated seconds per real second")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    parser.add_argument("--verbose", action="store_true", help="show the output of the control loops")
+    args = parser.parse_args(argv)
+
+    rig = SimulatedRig(
+        pump=PumpModel(max_flow_lph=args.flow),
+        kettle=KettleModel(power_w=args.power),
+        baudrate=args.baudrate or None,
+        time_scale=args.time_scale,
+    )
+    rig.bus.turnaround = args.turnaround
+    results = []
+    with rig:
+        for index in range(args.lots):
+            # The control loops print on every tick, so hide that unless asked for
+            sink = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+            with sink:
+                results.append(run_lot(
+                    rig, args.liters, args.temperature, f"{index + 1}", args.flow_rate, args.temp_rate
+                ))
+
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        print_report(results)
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Bus time per flow sample: separate register reads versus one block read.
+
+Reads the flow rate and totalizer from the virtual MAG 6000 with the bus timing
+of 19200 baud emulated, first as two transactions (read_flow_rate and
+read_totalizer), then as one read_snapshot of registers 3002 to 3017.
+
+The block read also transfers the 10 registers between the two fields, so the
+gain comes from saving the fixed cost of a transaction: request frame, response
+header, interframe gaps and turnaround. USB RS485 adapters often add up to 16 ms
+of latency per transaction, which can be emulated with --turnaround 0.016.
+
+Run from the cda folder:
+    python -m benchmarks.mag6000_block_read_benchmark --samples 200
+"""
+from __future__ import annotations
+
+import argparse
+import statistics
+import time
+
+# The rig installs the fake GPIO module, so it must be imported before the device code
+from simulation.rig import SimulatedRig
+
+from devices.mag6000.mag6000_connector import Mag6000Connector
+from devices.mag6000.mag6000_reader import Mag6000Reader
+
+
+def measure(rig: SimulatedRig, read_sample, samples: int) -> dict:
+    durations = []
+    transactions = rig.bus.transactions
+    for _ in range(samples):
+        started = time.perf_counter()
+        read_sample()
+        durations.append(time.perf_counter() - started)
+    durations.sort()
+    return {
+        "mean_ms": statistics.fmean(durations) * 1000,
+        "p95_ms": durations[int(len(durations) * 0.95)] * 1000,
+        "transactions": (rig.bus.transactions - transactions) / samples,
+    }
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--samples", type=int, default=200, help="samples per method")
+    parser.add_argument("--baudrate", type=int, default=19200, help="baud rate to emulate")
+    parser.add_argument("--turnaround", type=float, default=0.002, help="slave processing time in seconds")
+    args = parser.parse_args(argv)
+
+    rig = SimulatedRig(baudrate=args.baudrate)
+    rig.bus.turnaround = args.turnaround
+    with rig, Mag6000Connector() as connector:
+        rig.pump.set_running(True)
+        reader = Mag6000Reader(connector)
+
+        def separate():
+            reader.read_flow_rate()
+            reader.read_totalizer()
+
+        results = {
+            "separate reads": measure(rig, separate, args.samples),
+            "block read": measure(rig, reader.read_snapshot, args.samples),
+        }
+
+    print(f"{args.samples} samples at {args.baudrate} baud, {args.turnaround * 1000:g} ms turnaround")
+    print(f"{'method':>15} {'transactions':>13} {'mean ms':>8} {'p95 ms':>8}")
+    for name, row in results.items():
+        print(f"{name:>15} {row['transactions']:13.1f} {row['mean_ms']:8.2f} {row['p95_ms']:8.2f}")
+    gain = results["separate reads"]["mean_ms"] / results["block read"]["mean_ms"]
+    print(f"Block read is {gain:.2f}x faster per sample")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Time to the first flow sample of a lot, with a connector per lot and with the warm pool.
+
+A virtual MAG 6000 is read with the timing of 19200 baud emulated. Each lot
+takes the time from the start of its filling stage to the baseline totalizer
+read, as LotRunner.fill() does. Per lot, the connector opens the serial port
+and builds the instrument first; with the pool, the port was opened and probed
+before the lot, so the lot only waits for its read. On a real USB adapter,
+opening the port also waits for the driver, which the pty of the rig does not.
+
+Run from the cda folder:
+    python -m benchmarks.mag6000_pool_benchmark --lots 50
+"""
+from __future__ import annotations
+
+import argparse
+import statistics
+import time
+
+# The rig installs the fake GPIO module, so it must be imported before the device code
+from simulation.rig import SimulatedRig
+
+from devices.mag6000.mag6000_connector import Mag6000Connector
+from devices.mag6000.mag6000_pool import Mag6000Pool
+from devices.mag6000.mag6000_reader import Mag6000Reader
+
+
+def first_sample(open_gauge) -> float:
+    started = time.monotonic()
+    with open_gauge() as connector:
+        Mag6000Reader(connector).read_totalizer()
+        return time.monotonic() - started
+
+
+def run(args, pooled: bool) -> dict:
+    rig = SimulatedRig(baudrate=args.baudrate)
+    rig.bus.turnaround = args.turnaround
+    times = []
+    with rig:
+        pool = Mag6000Pool(probe_interval=args.probe_seconds)
+        if pooled:
+            # Warm the gauge before the first lot, as main() does at startup
+            pool.add([1])
+            pool.check()
+            open_gauge = lambda: pool.lease(1)
+        else:
+            open_gauge = lambda: Mag6000Connector(1)
+        try:
+            for _ in range(args.lots):
+                times.append(first_sample(open_gauge))
+                # Idle between lots, when the pool probes the gauge
+                if pooled:
+                    pool.check()
+        finally:
+            pool.close()
+    times.sort()
+    return {
+        "mode": "pool" if pooled else "per lot",
+        "mean_ms": statistics.fmean(times) * 1000,
+        "p95_ms": times[int(len(times) * 0.95)] * 1000,
+        "max_ms": times[-1] * 1000,
+    }
+
+
+def main(argv: list[str] | None = None) -> list[dict]:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lots", type=int, default=50, help="lots per mode")
+    parser.add_argument("--baudrate", type=int, default=19200, help="baud rate to emulate")
+    parser.add_argument("--turnaround", type=float, default=0.0, help="seconds the meter takes to answer")
+    parser.add_argument("--probe-seconds", type=float, default=10.0, help="seconds between the probes of the pool")
+    args = parser.parse_args(argv)
+
+    results = []
+    print(f"{'mode':>8} {'mean ms':>8} {'p95 ms':>8} {'max ms':>8}")
+    for pooled in (False, True):
+        row = run(args, pooled)
+        results.append(row)
+        print(f"{row['mode']:>8} {row['mean_ms']:8.2f} {row['p95_ms']:8.2f} {row['max_ms']:8.2f}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
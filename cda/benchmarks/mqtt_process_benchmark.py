@@ -0,0 +1,134 @@
+"""
+Tick jitter of a control loop under MQTT load, with the network stack in the same process or in its own.
+
+A loop paced by the PeriodicScheduler runs at --rate Hz, while a publisher
+thread encodes --load JSON messages per second of --payload bytes and hands
+them to the connector, as the telemetry of several lines and the metrics do.
+The connector stands in for paho: a network thread frames every message in
+Python, masking each byte like the WebSocket transport, --frame-rounds times,
+and holds the GIL while it does. In the "thread" mode it runs in the process
+of the loop; in the "process" mode it runs behind MqttProcess, which only
+copies each message into the shared-memory ring.
+
+For each mode, the benchmark reports how far the tick intervals were from
+the period, the mean and largest wake-up delay of the scheduler, and the
+missed deadlines.
+
+Run from the cda folder:
+    python -m benchmarks.mqtt_process_benchmark --rate 50 --seconds 5 --load 200 --payload 512 --frame-rounds 2
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+
+from functions.periodic_scheduler import PeriodicScheduler
+from mqtt.mqtt_process import MqttProcess
+from simulation.fake_mqtt import FakeMqttConnector
+
+
+class FramingConnector(FakeMqttConnector):
+    """Frames each published message in a network thread, in Python, like paho's WebSocket transport."""
+
+    def __init__(self, frame_rounds: int) -> None:
+        super().__init__()
+        self.frame_rounds = frame_rounds
+        self.framed = 0
+        self._outgoing: queue.SimpleQueue = queue.SimpleQueue()
+        threading.Thread(target=self._network, name="framing", daemon=True).start()
+
+    def publish(self, topic: str, payload, qos: int = 1, retain: bool = True) -> None:
+        self._outgoing.put(payload.encode() if isinstance(payload, str) else payload)
+
+    def wait_idle(self) -> None:
+        """Wait until the messages published so far are framed."""
+        while not self._outgoing.empty():
+            time.sleep(0.01)
+
+    def _network(self) -> None:
+        while True:
+            payload = self._outgoing.get()
+            mask = os.urandom(4)
+            for _ in range(self.frame_rounds):
+                bytes(byte ^ mask[index & 3] for index, byte in enumerate(payload))
+            self.framed += 1
+
+
+def framing_connector(broker_url: str = "", frame_rounds: int = 1, **options) -> FramingConnector:
+    """Creates the connector, in the network process with MqttProcess."""
+    return FramingConnector(frame_rounds)
+
+
+def run(connector, args) -> dict:
+    stop = threading.Event()
+
+    def load() -> None:
+        # Paced publishes of JSON messages, encoded in this process as mqtt_publisher does
+        scheduler = PeriodicScheduler(args.load, stop)
+        sample = {"lot_number": "LOT-1", "line": 1, "device": "pi", "values": "x" * max(0, args.payload - 60)}
+        while scheduler.wait():
+            sample["timestamp"] = time.time()
+            connector.publish("sensor/flow_gauge/progress", json.dumps(sample), qos=1, retain=False)
+
+    publisher = threading.Thread(target=load, name="load")
+    publisher.start()
+    scheduler = PeriodicScheduler(args.rate)
+    period = scheduler.period
+    ticks = []
+    for _ in range(round(args.rate * args.seconds)):
+        scheduler.wait()
+        ticks.append(time.perf_counter())
+    stop.set()
+    publisher.join()
+
+    jitter = sorted(abs(later - earlier - period) for earlier, later in zip(ticks, ticks[1:]))
+    stats = scheduler.stats
+    return {
+        "ticks": len(ticks),
+        "p50_jitter_ms": jitter[len(jitter) // 2] * 1000,
+        "p99_jitter_ms": jitter[int(len(jitter) * 0.99)] * 1000,
+        "max_jitter_ms": jitter[-1] * 1000,
+        "mean_wakeup_delay_ms": stats.total_wakeup_delay / stats.ticks * 1000,
+        "max_wakeup_delay_ms": stats.max_wakeup_delay * 1000,
+        "missed_deadlines": stats.missed_deadlines,
+    }
+
+
+def main(argv: list[str] | None = None) -> list[dict]:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rate", type=float, default=50.0, help="ticks per second of the control loop")
+    parser.add_argument("--seconds", type=float, default=5.0, help="how long each mode runs")
+    parser.add_argument("--load", type=float, default=200.0, help="MQTT messages per second")
+    parser.add_argument("--payload", type=int, default=512, help="bytes per message")
+    parser.add_argument("--frame-rounds", type=int, default=2, help="times each byte is masked by the network thread")
+    parser.add_argument("--modes", nargs="+", default=["thread", "process"], choices=["thread", "process"])
+    args = parser.parse_args(argv)
+
+    results = []
+    print(f"{'mode':>8} {'ticks':>6} {'p50 jit ms':>10} {'p99 jit ms':>10} {'max jit ms':>10} {'mean wake ms':>12} {'max wake ms':>11} {'missed':>7}")
+    for mode in args.modes:
+        if mode == "thread":
+            connector = framing_connector(frame_rounds=args.frame_rounds)
+            result = run(connector, args)
+            # The framing backlog would otherwise load the next mode
+            connector.wait_idle()
+        else:
+            connector = MqttProcess("", ring_bytes=4 * 1024 * 1024, connector_factory=framing_connector, frame_rounds=args.frame_rounds)
+            try:
+                result = run(connector, args)
+                result["dropped"] = connector.stats()["dropped"]
+            finally:
+                connector.disconnect()
+        result["mode"] = mode
+        results.append(result)
+        print(f"{mode:>8} {result['ticks']:6d} {result['p50_jitter_ms']:10.3f} {result['p99_jitter_ms']:10.3f} {result['max_jitter_ms']:10.3f} "
+              f"{result['mean_wakeup_delay_ms']:12.3f} {result['max_wakeup_delay_ms']:11.3f} {result['missed_deadlines']:7d}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Messages per second and publish latency of the MQTT transport modes, against a local broker.
+
+For each mode, a publisher and a subscriber connector connect to the broker,
+and the publisher sends a burst of QoS 1 messages as fast as paho takes them.
+The benchmark reports the messages per second until the subscriber has
+received the last one, and the latency from publish() to the delivery of each
+message, which includes the in-flight window and the framing of the mode.
+
+The broker must listen on the port of each mode given. For mosquitto, a config
+with these listeners covers the tcp, tls and ws modes, with a certificate for TLS:
+    listener 1883
+    listener 8883
+    certfile server.crt
+    keyfile server.key
+    listener 8080
+    protocol websockets
+    allow_anonymous true
+
+Modes are given as mode or mode:port, such as ws:8080 for websockets without TLS.
+Run from the cda folder:
+    python -m benchmarks.mqtt_transport_benchmark --host localhost --modes tcp tls ws:8080 --ca-file ca.crt
+"""
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import statistics
+import struct
+import threading
+import time
+import uuid
+
+from mqtt.mqtt_connector import TRANSPORT_MODES, mqtt_connector
+
+
+def run(mode: str, port: int | None, inflight: int, args) -> dict:
+    topic = f"bench/{uuid.uuid4().hex[:8]}"
+    received: list[float] = []
+    done = threading.Event()
+
+    def on_message(client, userdata, msg):
+        # The payload starts with the time it was published
+        sent = struct.unpack_from("<d", msg.payload)[0]
+        received.append(time.perf_counter() - sent)
+        if len(received) == args.messages:
+            done.set()
+
+    def connect() -> mqtt_connector:
+        connector = mqtt_connector(
+            args.host, mode=mode, port=port, protocol=args.protocol, max_inflight=inflight, ca_file=args.ca_file,
+        )
+        connector.connect()
+        return connector
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        subscriber = connect()
+        publisher = connect()
+        subscriber.register_callback(topic, on_message)
+        subscriber.subscribe(topic, qos=1)
+    try:
+        # Let the subscription reach the broker
+        time.sleep(0.5)
+        padding = bytes(max(args.payload_bytes - 8, 0))
+        started = time.perf_counter()
+        for _ in range(args.messages):
+            publisher.publish(topic, struct.pack("<d", time.perf_counter()) + padding, qos=1, retain=False)
+        done.wait(args.timeout)
+        seconds = time.perf_counter() - started
+    finally:
+        with contextlib.redirect_stdout(io.StringIO()):
+            publisher.disconnect()
+            subscriber.disconnect()
+
+    latencies = sorted(received)
+    return {
+        "mode": mode,
+        "port": port or TRANSPORT_MODES[mode].port,
+        "inflight": inflight,
+        "received": len(received),
+        "messages_per_second": len(received) / seconds,
+        "latency_p50_ms": statistics.median(latencies) * 1000 if latencies else float("nan"),
+        "latency_p95_ms": latencies[int(len(latencies) * 0.95)] * 1000 if latencies else float("nan"),
+        "latency_max_ms": latencies[-1] * 1000 if latencies else float("nan"),
+    }
+
+
+def main(argv: list[str] | None = None) -> list[dict]:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="localhost", help="host of the broker")
+    parser.add_argument("--modes", nargs="+", default=["tcp"], help="modes to compare, as mode or mode:port")
+    parser.add_argument("--inflight", type=int, nargs="+", default=[20], help="in-flight windows to compare")
+    parser.add_argument("--protocol", choices=("3.1.1", "5"), default="3.1.1", help="MQTT version")
+    parser.add_argument("--messages", type=int, default=5000, help="messages per run")
+    parser.add_argument("--payload-bytes", type=int, default=100, help="size of each message")
+    parser.add_argument("--ca-file", help="CA certificate of the broker, for the TLS modes")
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds to wait for the last message")
+    args = parser.parse_args(argv)
+
+    results = []
+    print(f"{'mode':>10} {'port':>5} {'inflight':>8} {'received':>8} {'msg/s':>8} {'p50 ms':>7} {'p95 ms':>7} {'max ms':>7}")
+    for text in args.modes:
+        mode, _, port = text.partition(":")
+        for inflight in args.inflight:
+            row = run(mode, int(port) if port else None, inflight, args)
+            results.append(row)
+            print(
+                f"{row['mode']:>10} {row['port']:5d} {row['inflight']:8d} {row['received']:8d} {row['messages_per_second']:8.0f}"
+                f" {row['latency_p50_ms']:7.2f} {row['latency_p95_ms']:7.2f} {row['latency_max_ms']:7.2f}"
+            )
+    return results
+
+
+if __name__ == "__main__":
+    main()
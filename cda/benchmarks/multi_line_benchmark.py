@@ -0,0 +1,111 @@
+"""
+Lots per hour with one or more lines running at the same time.
+
+Runs the same number of lots through LineScheduler and LotRunner, like main()
+does, on a simulated rig with 1, 2 and 4 lines. The flow gauges of all lines
+share one emulated RS485 bus, so the benchmark also shows whether the bus keeps
+up with several filling loops.
+
+Run from the cda folder:
+    python -m benchmarks.multi_line_benchmark --lots 4 --liters 0.5 --temperature 30 --time-scale 4
+"""
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import time
+
+from simulation.fake_mqtt import FakeMqttConnector
+from simulation.physics import KettleModel, PumpModel
+# The rig installs the fake GPIO module, so it must be imported before the device code
+from simulation.rig import SimulatedRig
+
+from functions.line_config import LineConfig
+from functions.line_scheduler import LineScheduler
+from functions.lot_runner import LotRunner
+from mqtt.device_status import DeviceStatusPublisher
+from mqtt.mqtt_publisher import TEMP_FINAL_TOPIC
+from mqtt.stop_router import StopRouter
+
+# Relay pins of the extra simulated lines
+EXTRA_PINS = [(23, 24), (25, 8), (7, 1)]
+
+
+def run(lines: int, args) -> dict:
+    rig = SimulatedRig(
+        pump=PumpModel(max_flow_lph=args.flow),
+        kettle=KettleModel(power_w=args.power),
+        baudrate=args.baudrate or None,
+        time_scale=args.time_scale,
+    )
+    configs = {1: LineConfig(1, rig.pump_relay_pin, rig.kettle_relay_pin, 1, rig.sensor_id)}
+    for index in range(1, lines):
+        pump_pin, kettle_pin = EXTRA_PINS[index - 1]
+        line = rig.add_line(pump_pin, kettle_pin, index + 1, PumpModel(max_flow_lph=args.flow), KettleModel(power_w=args.power))
+        configs[index + 1] = LineConfig(index + 1, pump_pin, kettle_pin, index + 1, line.sensor_id)
+
+    mqtt = FakeMqttConnector()
+    runner = LotRunner(mqtt, DeviceStatusPublisher(mqtt, "benchmark"), StopRouter(mqtt))
+
+    def run_lot(config: LineConfig, order: dict) -> None:
+        # Start each lot with an empty kettle
+        rig.new_lot(config.line - 1)
+        runner.run(config, order)
+
+    scheduler = LineScheduler(configs, run_lot)
+    with rig:
+        sink = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+        with sink:
+            scheduler.start()
+            started_sim = rig.snapshot()["sim_time"]
+            started = time.monotonic()
+            for index in range(args.lots):
+                scheduler.submit({
+                    "liters": args.liters,
+                    "temperature": args.temperature,
+                    "line": index % lines + 1,
+                    "lot_number": f"{index + 1}",
+                })
+            scheduler.wait_idle()
+            elapsed = time.monotonic() - started
+            sim_elapsed = rig.snapshot()["sim_time"] - started_sim
+            scheduler.shutdown()
+        transactions = rig.bus.transactions
+    return {
+        "lines": lines,
+        "completed": len(mqtt.messages(TEMP_FINAL_TOPIC)),
+        "sim_minutes": sim_elapsed / 60,
+        "lots_per_hour": len(mqtt.messages(TEMP_FINAL_TOPIC)) / (sim_elapsed / 3600),
+        "real_seconds": elapsed,
+        "bus_transactions": transactions,
+    }
+
+
+def main(argv: list[str] | None = None) -> list[dict]:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lots", type=int, default=4, help="number of lots to run")
+    parser.add_argument("--lines", type=int, nargs="+", default=[1, 2, 4], help="line counts to compare")
+    parser.add_argument("--liters", type=float, default=0.5, help="liters per lot")
+    parser.add_argument("--temperature", type=float, default=30.0, help="target temperature in °C")
+    parser.add_argument("--flow", type=float, default=720.0, help="pump flow rate in L/h")
+    parser.add_argument("--power", type=float, default=2000.0, help="kettle power in W")
+    parser.add_argument("--baudrate", type=int, default=19200, help="baud rate to emulate, 0 for none")
+    parser.add_argument("--time-scale", type=float, default=4.0, help="simulated seconds per real second")
+    parser.add_argument("--verbose", action="store_true", help="show the output of the control loops")
+    args = parser.parse_args(argv)
+
+    results = []
+    print(f"{'lines':>5} {'lots':>5} {'sim min':>8} {'lots/h':>7} {'real s':>7} {'bus txns':>9}")
+    for lines in args.lines:
+        row = run(lines, args)
+        results.append(row)
+        print(
+            f"{row['lines']:5d} {row['completed']:5d} {row['sim_minutes']:8.2f} {row['lots_per_hour']:7.1f} "
+            f"{row['real_seconds']:7.1f} {row['bus_transactions']:9d}"
+        )
+    return results
+
+
+if __name__ == "__main__":
+    main()
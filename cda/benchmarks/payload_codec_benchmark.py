@@ -0,0 +1,81 @@
+"""
+Encoding cost and size of progress payloads.
+
+Compares the original dict merge and json.dumps of mqtt_publisher with the
+JsonCodec and StructCodec of mqtt.payload_codec, for single messages and
+batches of progress samples.
+
+Run from the cda folder:
+    python -m benchmarks.payload_codec_benchmark --messages 20000
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import time
+
+from mqtt.payload_codec import JsonCodec, StructCodec, decode_payload
+
+CONSTANTS = {"lot_number": "LOT-2024-000123", "line": 1, "device": "pi"}
+
+
+class StdlibCodec:
+    """The encoding mqtt_publisher used before the codecs."""
+
+    def __init__(self, constants: dict) -> None:
+        self._constants = constants
+
+    def encode(self, data: dict) -> str:
+        data |= self._constants
+        return json.dumps(data)
+
+    def encode_batch(self, samples: list[dict]) -> str:
+        return json.dumps([sample | self._constants for sample in samples])
+
+
+CODECS = {"json.dumps": StdlibCodec, "JsonCodec": JsonCodec, "StructCodec": StructCodec}
+
+
+def samples(count: int) -> list[dict]:
+    """Flow progress samples, like FlowMonitor produces them."""
+    start = time.time()
+    return [{"liters": round(i * 0.0501, 2), "timestamp": start + i * 0.25} for i in range(count)]
+
+
+def measure(codec, messages: list[dict], batch_size: int) -> dict:
+    # Encode fresh copies, since the stdlib path modifies the dictionaries
+    batches = [
+        [dict(sample) for sample in messages[i:i + batch_size]]
+        for i in range(0, len(messages), batch_size)
+    ]
+    started = time.perf_counter()
+    if batch_size == 1:
+        payloads = [codec.encode(batch[0]) for batch in batches]
+    else:
+        payloads = [codec.encode_batch(batch) for batch in batches]
+    elapsed = time.perf_counter() - started
+    # Check that every payload decodes again
+    decode_payload(payloads[-1] if isinstance(payloads[-1], bytes) else payloads[-1].encode())
+    sizes = [len(payload.encode() if isinstance(payload, str) else payload) for payload in payloads]
+    return {
+        "us_per_sample": elapsed / len(messages) * 1e6,
+        "bytes_per_sample": sum(sizes) / len(messages),
+    }
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=20000, help="progress samples to encode")
+    parser.add_argument("--batch", type=int, default=20, help="samples per batch")
+    args = parser.parse_args(argv)
+
+    messages = samples(args.messages)
+    print(f"{'codec':>12} {'batch':>6} {'µs/sample':>10} {'bytes/sample':>13}")
+    for batch_size in (1, args.batch):
+        for name, codec in CODECS.items():
+            row = measure(codec(CONSTANTS), messages, batch_size)
+            print(f"{name:>12} {batch_size:6d} {row['us_per_sample']:10.2f} {row['bytes_per_sample']:13.1f}")
+
+
+if __name__ == "__main__":
+    main()
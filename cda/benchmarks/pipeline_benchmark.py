@@ -0,0 +1,120 @@
+"""
+Lots per hour of one line, with the lots run one after the other or pipelined.
+
+The simulated line has a fill vessel and a transfer relay into the kettle. The
+sequential run fills, transfers and heats each lot before the next one starts,
+like the loop in main() did before pipelining. The pipelined run fills the next
+lot while the last one heats. Both go through LineScheduler and LotRunner, and
+the lots per hour are measured in simulated time.
+
+Run from the cda folder:
+    python -m benchmarks.pipeline_benchmark --lots 4 --liters 1 --temperature 30 --time-scale 4
+"""
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import time
+
+from simulation.fake_mqtt import FakeMqttConnector
+from simulation.physics import KettleModel, PumpModel
+# The rig installs the fake GPIO module, so it must be imported before the device code
+from simulation.rig import SimulatedRig
+
+from functions.line_config import LineConfig
+from functions.line_scheduler import LineScheduler
+from functions.lot_runner import Lot, LotRunner
+from mqtt.device_status import DeviceStatusPublisher
+from mqtt.mqtt_publisher import TEMP_FINAL_TOPIC
+from mqtt.stop_router import StopRouter
+
+TRANSFER_RELAY_PIN = 27
+
+
+class RigLotRunner(LotRunner):
+    """Empties the kettle of the rig after each lot, where the real line would dispense it."""
+
+    def __init__(self, rig: SimulatedRig, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.rig = rig
+
+    def heat(self, lot: Lot) -> bool:
+        try:
+            return super().heat(lot)
+        finally:
+            self.rig.drain_kettle()
+
+
+def run(pipelined: bool, args) -> dict:
+    rig = SimulatedRig(
+        pump=PumpModel(max_flow_lph=args.flow),
+        kettle=KettleModel(power_w=args.power),
+        transfer_relay_pin=TRANSFER_RELAY_PIN,
+        baudrate=args.baudrate or None,
+        time_scale=args.time_scale,
+    )
+    # The transfer relay is timed in real seconds, like the rest of the control code
+    config = LineConfig(
+        1, rig.pump_relay_pin, rig.kettle_relay_pin, 1, rig.sensor_id,
+        transfer_relay_pin=TRANSFER_RELAY_PIN,
+        transfer_seconds=args.transfer / args.time_scale,
+    )
+
+    mqtt = FakeMqttConnector()
+    runner = RigLotRunner(rig, mqtt, DeviceStatusPublisher(mqtt, "benchmark"), StopRouter(mqtt))
+    scheduler = LineScheduler({1: config}, runner.run, stages=runner if pipelined else None)
+    with rig:
+        sink = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+        with sink:
+            scheduler.start()
+            started_sim = rig.snapshot()["sim_time"]
+            started = time.monotonic()
+            for index in range(args.lots):
+                scheduler.submit({
+                    "liters": args.liters,
+                    "temperature": args.temperature,
+                    "line": 1,
+                    "lot_number": f"{index + 1}",
+                })
+            scheduler.wait_idle()
+            elapsed = time.monotonic() - started
+            sim_elapsed = rig.snapshot()["sim_time"] - started_sim
+            scheduler.shutdown()
+    completed = len(mqtt.messages(TEMP_FINAL_TOPIC))
+    return {
+        "mode": "pipelined" if pipelined else "sequential",
+        "completed": completed,
+        "sim_minutes": sim_elapsed / 60,
+        "lots_per_hour": completed / (sim_elapsed / 3600),
+        "real_seconds": elapsed,
+    }
+
+
+def main(argv: list[str] | None = None) -> list[dict]:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lots", type=int, default=4, help="number of lots to run")
+    parser.add_argument("--liters", type=float, default=1.0, help="liters per lot")
+    parser.add_argument("--temperature", type=float, default=30.0, help="target temperature in °C")
+    parser.add_argument("--flow", type=float, default=360.0, help="pump flow rate in L/h")
+    parser.add_argument("--power", type=float, default=3000.0, help="kettle power in W")
+    parser.add_argument("--transfer", type=float, default=2.0, help="simulated seconds of the transfer relay")
+    parser.add_argument("--baudrate", type=int, default=19200, help="baud rate to emulate, 0 for none")
+    parser.add_argument("--time-scale", type=float, default=4.0, help="simulated seconds per real second")
+    parser.add_argument("--verbose", action="store_true", help="show the output of the control loops")
+    args = parser.parse_args(argv)
+
+    results = []
+    print(f"{'mode':>10} {'lots':>5} {'sim min':>8} {'lots/h':>7} {'real s':>7}")
+    for pipelined in (False, True):
+        row = run(pipelined, args)
+        results.append(row)
+        print(
+            f"{row['mode']:>10} {row['completed']:5d} {row['sim_minutes']:8.2f} "
+            f"{row['lots_per_hour']:7.1f} {row['real_seconds']:7.1f}"
+        )
+    return results
+
+
+if __name__ == "__main__":
+    main()
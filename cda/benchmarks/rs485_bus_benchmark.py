@@ -0,0 +1,90 @@
+"""
+Wait of the control-loop reads on a shared RS485 bus, with and without priorities.
+
+Two virtual MAG 6000s share one bus with the timing of 19200 baud emulated.
+A control loop reads the snapshot of the first at a fixed rate, while
+diagnostic readers poll the second back to back. With priorities, the
+diagnostic readers queue behind the control reads; without them, every read
+is served in the order it arrives. The benchmark reports the duration of the
+control reads, and the per-slave statistics of the bus.
+
+Run from the cda folder:
+    python -m benchmarks.rs485_bus_benchmark --seconds 5 --diagnostic-readers 2
+"""
+from __future__ import annotations
+
+import argparse
+import statistics
+import threading
+import time
+
+# The rig installs the fake GPIO module, so it must be imported before the device code
+from simulation.rig import SimulatedRig
+
+from devices.mag6000.mag6000_connector import Mag6000Connector
+from devices.mag6000.mag6000_reader import Mag6000Reader
+from devices.mag6000.rs485_bus import PRIORITY_CONTROL, PRIORITY_DIAGNOSTIC
+from functions.periodic_scheduler import PeriodicScheduler
+
+
+def run(args, priorities: bool) -> dict:
+    rig = SimulatedRig(baudrate=args.baudrate)
+    rig.bus.turnaround = args.turnaround
+    rig.add_line(pump_relay_pin=23, kettle_relay_pin=24, slave_address=2)
+    durations = []
+    stop = threading.Event()
+    with rig, Mag6000Connector(1) as control, Mag6000Connector(2) as diagnostic:
+        control.bus.reset_stats()
+        def diagnose():
+            reader = Mag6000Reader(diagnostic, PRIORITY_DIAGNOSTIC if priorities else PRIORITY_CONTROL)
+            while not stop.is_set():
+                reader.read_snapshot()
+
+        threads = [threading.Thread(target=diagnose) for _ in range(args.diagnostic_readers)]
+        for thread in threads:
+            thread.start()
+        reader = Mag6000Reader(control, PRIORITY_CONTROL)
+        scheduler = PeriodicScheduler(args.rate)
+        deadline = time.monotonic() + args.seconds
+        while time.monotonic() < deadline and scheduler.wait():
+            started = time.perf_counter()
+            reader.read_snapshot()
+            durations.append(time.perf_counter() - started)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        summary = control.bus.summary()
+    durations.sort()
+    return {
+        "priorities": priorities,
+        "control_mean_ms": statistics.fmean(durations) * 1000,
+        "control_p95_ms": durations[int(len(durations) * 0.95)] * 1000,
+        "control_max_ms": durations[-1] * 1000,
+        "slaves": summary,
+    }
+
+
+def main(argv: list[str] | None = None) -> list[dict]:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=5.0, help="duration per mode")
+    parser.add_argument("--rate", type=float, default=10.0, help="control loop rate in Hz")
+    parser.add_argument("--diagnostic-readers", type=int, default=2, help="threads polling the second slave")
+    parser.add_argument("--baudrate", type=int, default=19200, help="baud rate to emulate")
+    parser.add_argument("--turnaround", type=float, default=0.002, help="slave processing time in seconds")
+    args = parser.parse_args(argv)
+
+    results = []
+    print(f"{'priorities':>10} {'control mean ms':>16} {'p95 ms':>7} {'max ms':>7}   slave: transactions, mean wait ms, mean latency ms")
+    for priorities in (False, True):
+        row = run(args, priorities)
+        results.append(row)
+        slaves = "  ".join(
+            f"{address}: {stats['transactions']}, {stats['mean_wait_ms']:.1f}, {stats['mean_latency_ms']:.1f}"
+            for address, stats in row["slaves"].items()
+        )
+        print(f"{'on' if priorities else 'off':>10} {row['control_mean_ms']:16.1f} {row['control_p95_ms']:7.1f} {row['control_max_ms']:7.1f}   {slaves}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
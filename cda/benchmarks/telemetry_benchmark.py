@@ -0,0 +1,92 @@
+"""
+MQTT messages and bytes per lot under different telemetry policies.
+
+Replays the progress samples of a simulated lot through mqtt_publisher, in
+simulated time, and counts what would be sent to the broker. QoS 1 messages
+each cost a PUBACK on the link, and every message is a write in InfluxDB.
+
+Run from the cda folder:
+    python -m benchmarks.telemetry_benchmark --liters 20 --temperature 72
+"""
+from __future__ import annotations
+
+import argparse
+from unittest import mock
+
+from mqtt.mqtt_publisher import (
+    DEFAULT_PROGRESS_POLICIES,
+    FLOW_PROGRESS_TOPIC,
+    TEMP_PROGRESS_TOPIC,
+    mqtt_publisher,
+)
+from mqtt.telemetry_policy import TelemetryPolicy
+from simulation.fake_mqtt import FakeMqttConnector
+from simulation.physics import KettleModel, PumpModel
+
+POLICIES = {
+    "every tick": {},
+    "default": DEFAULT_PROGRESS_POLICIES,
+    "qos 0": {
+        topic: policy._replace(qos=0, retain=False) for topic, policy in DEFAULT_PROGRESS_POLICIES.items()
+    },
+    "all, batched": {
+        FLOW_PROGRESS_TOPIC: TelemetryPolicy(min_interval=5.0, max_interval=10.0, batch_size=20, qos=0, retain=False),
+        TEMP_PROGRESS_TOPIC: TelemetryPolicy(min_interval=2.0, max_interval=10.0, batch_size=20, qos=0, retain=False),
+    },
+}
+
+
+def lot_samples(liters: float, temperature: float, flow_rate_hz: float, temp_rate_hz: float):
+    """Yield (time, method name, value) for the progress samples of one lot."""
+    now = 0.0
+    pump = PumpModel()
+    pump.set_running(True)
+    while pump.total_liters < liters:
+        pump.step(1.0 / flow_rate_hz)
+        now += 1.0 / flow_rate_hz
+        yield now, "publish_flow_progress", pump.totalizer_liters
+
+    kettle = KettleModel(water_liters=liters)
+    kettle.set_heating(True)
+    while kettle.sensor_c < temperature:
+        kettle.step(1.0 / temp_rate_hz)
+        now += 1.0 / temp_rate_hz
+        yield now, "publish_temp_progress", round(kettle.sensor_c * 16) / 16
+
+
+def replay(policies: dict, samples: list) -> dict:
+    connector = FakeMqttConnector()
+    clock = [0.0]
+    # Run the publisher on the simulated clock
+    with mock.patch("mqtt.mqtt_publisher.time.monotonic", lambda: clock[0]):
+        publisher = mqtt_publisher(connector, "benchmark", 1, policies)
+        for now, method, value in samples:
+            clock[0] = now
+            getattr(publisher, method)(value)
+        publisher.flush()
+    payloads = [(payload, qos) for _, _, payload, qos, _ in connector.published]
+    return {
+        "messages": len(payloads),
+        "acked": sum(1 for _, qos in payloads if qos > 0),
+        "kib": sum(len(payload) for payload, _ in payloads) / 1024,
+    }
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--liters", type=float, default=20.0, help="liters in the lot")
+    parser.add_argument("--temperature", type=float, default=72.0, help="target temperature in °C")
+    parser.add_argument("--flow-rate", type=float, default=4.0, help="flow sample rate in Hz")
+    parser.add_argument("--temp-rate", type=float, default=10.0, help="temperature sample rate in Hz")
+    args = parser.parse_args(argv)
+
+    samples = list(lot_samples(args.liters, args.temperature, args.flow_rate, args.temp_rate))
+    print(f"{len(samples)} progress samples over {samples[-1][0] / 60:.1f} simulated minutes")
+    print(f"{'policy':>12} {'messages':>9} {'PUBACKs':>8} {'KiB':>8}")
+    for name, policies in POLICIES.items():
+        row = replay(policies, samples)
+        print(f"{name:>12} {row['messages']:9d} {row['acked']:8d} {row['kib']:8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""
+Accuracy and cost of the volume estimates in FlowMonitor, replayed from flow meter traces.
+
+A trace is the list of readings FlowMonitor took during a fill: timestamp,
+flow rate and totalizer relative to the baseline, and where it is known the
+true volume. By default, traces are recorded from the pump model at several
+flow rates, with noise on the flow rate, jitter on the sample times and a
+totalizer that moves in steps. Recorded traces can be replayed instead with
+--traces, as CSV files with the columns timestamp, flow_rate_lph,
+totalizer_liters and optionally true_liters.
+
+Each trace is replayed through:
+- max: the larger of the totalizer and the integrated flow, as FlowMonitor did
+- totalizer: the totalizer alone
+- integrator: the integrated flow alone
+- kalman: VolumeEstimator
+and the error against the true volume is reported over all samples of the
+trace, along with the share of samples where the true volume is within the
+bounds of VolumeEstimator, and the cost of one update.
+
+Run from the cda folder:
+    python -m benchmarks.volume_estimator_benchmark --flows 720 1800 3600 --liters 2.0
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import random
+import statistics
+import time
+from pathlib import Path
+from typing import NamedTuple
+
+from functions.flow_integrator import FlowIntegrator
+from functions.volume_estimator import VolumeEstimator
+from simulation.physics import PumpModel
+
+
+class Reading(NamedTuple):
+    timestamp: float
+    flow_rate_lph: float
+    totalizer_liters: float
+    true_liters: float | None
+
+
+def record_trace(flow_lph: float, liters: float, rate_hz: float, step: float, noise: float, jitter: float, seed: int) -> list[Reading]:
+    """Fill *liters* with the pump model, and record the readings of the meter until the flow stops."""
+    rng = random.Random(seed)
+    pump = PumpModel(max_flow_lph=flow_lph, totalizer_step_liters=step)
+    # The meter has already counted part of a step when the fill starts
+    pump.total_liters = rng.uniform(0.0, step)
+    baseline = pump.totalizer_liters
+    start = pump.total_liters
+    pump.set_running(True)
+    dt = 0.001
+    now = 0.0
+    next_sample = 1.0 / rate_hz
+    readings = []
+    while pump.running or pump.flow_lph > 0:
+        pump.step(dt)
+        now += dt
+        if now < next_sample:
+            continue
+        next_sample += (1.0 + rng.uniform(-jitter, jitter)) / rate_hz
+        flow = max(0.0, pump.flow_lph + rng.gauss(0.0, noise * pump.max_flow_lph))
+        readings.append(Reading(now, flow, pump.totalizer_liters - baseline, pump.total_liters - start))
+        if pump.total_liters - start >= liters:
+            pump.set_running(False)
+    return readings
+
+
+def load_trace(path: Path) -> list[Reading]:
+    with path.open(newline="") as file:
+        return [
+            Reading(
+                float(row["timestamp"]),
+                float(row["flow_rate_lph"]),
+                float(row["totalizer_liters"]),
+                float(row["true_liters"]) if row.get("true_liters") not in (None, "") else None,
+            )
+            for row in csv.DictReader(file)
+        ]
+
+
+def save_trace(path: Path, trace: list[Reading]) -> None:
+    with path.open("w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(Reading._fields)
+        writer.writerows(trace)
+
+
+def replay_max(trace: list[Reading]):
+    integrator = FlowIntegrator()
+    integrator.add(0.0, 0.0)
+    for reading in trace:
+        yield max(reading.totalizer_liters, integrator.add(reading.flow_rate_lph, reading.timestamp)), None
+
+
+def replay_totalizer(trace: list[Reading]):
+    for reading in trace:
+        yield reading.totalizer_liters, None
+
+
+def replay_integrator(trace: list[Reading]):
+    integrator = FlowIntegrator()
+    integrator.add(0.0, 0.0)
+    for reading in trace:
+        yield integrator.add(reading.flow_rate_lph, reading.timestamp), None
+
+
+def replay_kalman(trace: list[Reading], step: float):
+    estimator = VolumeEstimator(totalizer_step_liters=step)
+    estimator.reset(0.0)
+    for reading in trace:
+        estimate = estimator.update(reading.timestamp, reading.flow_rate_lph, reading.totalizer_liters)
+        yield estimate.volume_liters, (estimate.lower_liters, estimate.upper_liters)
+
+
+def accuracy(name: str, trace: list[Reading], step: float) -> dict:
+    replay = {
+        "max": replay_max,
+        "totalizer": replay_totalizer,
+        "integrator": replay_integrator,
+        "kalman": lambda readings: replay_kalman(readings, step),
+    }[name]
+    errors = []
+    inside = 0
+    for reading, (volume, bounds) in zip(trace, replay(trace)):
+        if reading.true_liters is None:
+            continue
+        errors.append(volume - reading.true_liters)
+        if bounds is not None and bounds[0] <= reading.true_liters <= bounds[1]:
+            inside += 1
+    return {
+        "bias_ml": statistics.fmean(errors) * 1000,
+        "mean_abs_ml": statistics.fmean(abs(error) for error in errors) * 1000,
+        "max_abs_ml": max(abs(error) for error in errors) * 1000,
+        "final_ml": errors[-1] * 1000,
+        "coverage": inside / len(errors) if name == "kalman" else None,
+    }
+
+
+def cost_us(name: str, trace: list[Reading], step: float, repeats: int) -> float:
+    """Mean time of one update in microseconds."""
+    replay = {
+        "max": replay_max,
+        "totalizer": replay_totalizer,
+        "integrator": replay_integrator,
+        "kalman": lambda readings: replay_kalman(readings, step),
+    }[name]
+    started = time.perf_counter()
+    for _ in range(repeats):
+        for _ in replay(trace):
+            pass
+    return (time.perf_counter() - started) / (repeats * len(trace)) * 1e6
+
+
+def main(argv: list[str] | None = None) -> list[dict]:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--flows", type=float, nargs="+", default=[720.0, 1800.0, 3600.0], help="pump flow rates in L/h")
+    parser.add_argument("--liters", type=float, default=2.0, help="liters per fill")
+    parser.add_argument("--rate", type=float, default=4.0, help="sample rate in Hz")
+    parser.add_argument("--step", type=float, default=0.01, help="totalizer resolution in liters")
+    parser.add_argument("--noise", type=float, default=0.005, help="flow rate noise, as a share of the full flow")
+    parser.add_argument("--jitter", type=float, default=0.2, help="sample time jitter, as a share of the sample period")
+    parser.add_argument("--seeds", type=int, default=5, help="traces per flow rate")
+    parser.add_argument("--traces", type=Path, nargs="*", help="replay these CSV traces instead of recording")
+    parser.add_argument("--save", type=Path, help="folder to save the recorded traces to")
+    parser.add_argument("--repeats", type=int, default=20, help="replays per trace for the cost")
+    args = parser.parse_args(argv)
+
+    traces: dict[str, list[list[Reading]]] = {}
+    if args.traces:
+        for path in args.traces:
+            traces[path.name] = [load_trace(path)]
+    else:
+        for flow_lph in args.flows:
+            label = f"{flow_lph:.0f} L/h"
+            traces[label] = [
+                record_trace(flow_lph, args.liters, args.rate, args.step, args.noise, args.jitter, seed)
+                for seed in range(args.seeds)
+            ]
+            if args.save:
+                args.save.mkdir(parents=True, exist_ok=True)
+                for seed, trace in enumerate(traces[label]):
+                    save_trace(args.save / f"trace_{flow_lph:.0f}_{seed}.csv", trace)
+
+    names = ("max", "totalizer", "integrator", "kalman")
+    results = []
+    print(f"{'trace':>10} {'estimate':>10} {'bias ml':>8} {'|err| ml':>9} {'max ml':>7} {'final ml':>9} {'in bounds':>10} {'µs/update':>10}")
+    for label, group in traces.items():
+        for name in names:
+            rows = [accuracy(name, trace, args.step) for trace in group]
+            row = {
+                "trace": label,
+                "estimate": name,
+                "bias_ml": statistics.fmean(r["bias_ml"] for r in rows),
+                "mean_abs_ml": statistics.fmean(r["mean_abs_ml"] for r in rows),
+                "max_abs_ml": max(r["max_abs_ml"] for r in rows),
+                "final_ml": statistics.fmean(r["final_ml"] for r in rows),
+                "coverage": statistics.fmean(r["coverage"] for r in rows) if name == "kalman" else None,
+                "us_per_update": statistics.fmean(cost_us(name, trace, args.step, args.repeats) for trace in group),
+            }
+            results.append(row)
+            coverage = f"{row['coverage']:10.0%}" if row["coverage"] is not None else f"{'-':>10}"
+            print(
+                f"{label:>10} {name:>10} {row['bias_ml']:+8.2f} {row['mean_abs_ml']:9.2f} {row['max_abs_ml']:7.1f} "
+                f"{row['final_ml']:+9.2f} {coverage} {row['us_per_update']:10.2f}"
+            )
+    return results
+
+
+if __name__ == "__main__":
+    main()
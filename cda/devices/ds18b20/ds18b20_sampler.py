@@ -0,0 +1,216 @@
+"""
+Background acquisition of DS18B20 temperatures.
+
+A conversion takes up to 750 ms at 12 bits, and reading a sensor blocks until it
+is done. The sampler reads the sensors in its own thread and keeps the latest
+sample of each, so control loops can use it without waiting for a conversion.
+
+Where the kernel supports it, the sampler:
+- sets the resolution of the sensors, as fewer bits convert faster
+- starts one conversion on every sensor of a bus master through therm_bulk_read,
+  instead of one conversion after the other
+- reads the temperature attribute instead of the full w1_slave file
+"""
+from __future__ import annotations
+
+import glob
+import os
+import threading
+import time
+from typing import Callable, NamedTuple
+
+from devices.ds18b20 import ds18b20_reader
+from devices.ds18b20.ds18b20_reader import DS18B20Error, DS18B20Reader, conversion_seconds
+
+
+class TemperatureSample(NamedTuple):
+    temp_c: float
+    # Monotonic time of the reading
+    timestamp: float
+    # Counts the samples of the sensor, so a consumer can tell a new sample from an old one
+    sequence: int
+
+
+class DS18B20Sampler:
+    """Reads DS18B20 sensors in a background thread and keeps the latest sample of each."""
+
+    def __init__(
+        self,
+        sensor_ids: list[str | None] | None = None,
+        resolution: int | None = None,
+        interval: float = 0.1,
+        bulk: bool | None = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """
+        :param sensor_ids: Sensors to sample, where None stands for the first sensor found.
+        :param resolution: Resolution in bits to set on the sensors, or None to keep theirs.
+        :param interval: Minimum seconds between two rounds of reads.
+        :param bulk: Convert all sensors at once through therm_bulk_read. None to do so
+            when several sensors are sampled and the bus master supports it.
+        :param clock: Time source of the sample timestamps.
+        """
+        self.resolution = resolution
+        self.interval = interval
+        self.bulk = bulk
+        self._clock = clock
+        # Readers by the sensor id they were asked for, None until the sensor is found
+        self._readers: dict[str | None, DS18B20Reader | None] = {}
+        self._samples: dict[str | None, TemperatureSample] = {}
+        self._errors: dict[str | None, DS18B20Error] = {}
+        self._bulk_files: list[str] | None = None
+        self._condition = threading.Condition()
+        self._stopping = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.rounds = 0
+        self.bulk_conversions = 0
+        for sensor_id in sensor_ids or [None]:
+            self.add_sensor(sensor_id)
+
+    def add_sensor(self, sensor_id: str | None) -> None:
+        """Sample *sensor_id* too, from the next round on."""
+        with self._condition:
+            self._readers.setdefault(sensor_id, None)
+
+    def start(self) -> "DS18B20Sampler":
+        if self._thread is None:
+            # A new event, so a thread that is still finishing a read after stop() does not resume
+            self._stopping = threading.Event()
+            self._thread = threading.Thread(target=self._run, args=(self._stopping,), name="ds18b20-sampler", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: float | None = 2.0) -> None:
+        """Stop sampling, waiting up to *timeout* seconds for a read in progress to finish."""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        with self._condition:
+            self._condition.notify_all()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def latest(self, sensor_id: str | None = None) -> TemperatureSample | None:
+        """The latest sample of *sensor_id*, or None if it has not been read yet. Never blocks."""
+        with self._condition:
+            return self._samples.get(sensor_id)
+
+    def error(self, sensor_id: str | None = None) -> DS18B20Error | None:
+        """The error of the last read of *sensor_id*, or None if it succeeded."""
+        with self._condition:
+            return self._errors.get(sensor_id)
+
+    def wait_for_sample(self, sensor_id: str | None = None, after: int = -1, timeout: float | None = None) -> TemperatureSample | None:
+        """Block until *sensor_id* has a sample newer than sequence *after*. Returns None on timeout."""
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self._newer(sensor_id, after) or self._stopping.is_set(),
+                timeout,
+            )
+            sample = self._samples.get(sensor_id)
+            return sample if self._newer(sensor_id, after) else None
+
+    def sample_once(self) -> None:
+        """Read every sensor once, with a bulk conversion first where possible."""
+        readers = self._resolve()
+        if self._use_bulk(readers):
+            self._convert_bulk(readers)
+        for sensor_id, reader in readers.items():
+            if reader is None:
+                continue
+            try:
+                temp_c = reader.read_temp_c()
+            except DS18B20Error as exc:
+                with self._condition:
+                    self._errors[sensor_id] = exc
+                continue
+            with self._condition:
+                previous = self._samples.get(sensor_id)
+                sequence = previous.sequence + 1 if previous else 0
+                self._samples[sensor_id] = TemperatureSample(temp_c, self._clock(), sequence)
+                self._errors.pop(sensor_id, None)
+                self._condition.notify_all()
+        self.rounds += 1
+
+    def _newer(self, sensor_id: str | None, after: int) -> bool:
+        sample = self._samples.get(sensor_id)
+        return sample is not None and sample.sequence > after
+
+    def _resolve(self) -> dict[str | None, DS18B20Reader | None]:
+        # Look for sensors that were not found yet, they may have been plugged in since
+        with self._condition:
+            missing = [sensor_id for sensor_id, reader in self._readers.items() if reader is None]
+        for sensor_id in missing:
+            try:
+                reader = DS18B20Reader(sensor_id)
+            except DS18B20Error as exc:
+                with self._condition:
+                    self._errors[sensor_id] = exc
+                continue
+            if self.resolution is not None and reader.read_resolution() != self.resolution:
+                try:
+                    reader.set_resolution(self.resolution)
+                except DS18B20Error as exc:
+                    print(f"Could not set the resolution of {reader.sensor_id}: {exc}")
+            with self._condition:
+                self._readers[sensor_id] = reader
+        with self._condition:
+            return dict(self._readers)
+
+    def _use_bulk(self, readers: dict[str | None, DS18B20Reader | None]) -> bool:
+        if self.bulk is False:
+            return False
+        if self._bulk_files is None:
+            self._bulk_files = glob.glob(os.path.join(ds18b20_reader.BASE_DIR, "w1_bus_master*", "therm_bulk_read"))
+        found = [reader for reader in readers.values() if reader is not None]
+        if not self._bulk_files or not found:
+            return False
+        # The temperature attribute returns the result of the bulk conversion, w1_slave may start a new one
+        if not all(os.path.exists(reader.temperature_file) for reader in found):
+            return False
+        return self.bulk or len(found) > 1
+
+    def _convert_bulk(self, readers: dict[str | None, DS18B20Reader | None]) -> None:
+        try:
+            for path in self._bulk_files:
+                with open(path, "w", encoding="ascii") as fh:
+                    fh.write("trigger")
+        except OSError as exc:
+            # Fall back to one conversion per read
+            print(f"Bulk conversion failed, reading the sensors one by one: {exc}")
+            self._bulk_files = []
+            return
+        self.bulk_conversions += 1
+
+        # The master reports -1 while a conversion is in progress
+        resolutions = [reader.read_resolution() or 12 for reader in readers.values() if reader is not None]
+        longest = conversion_seconds(max(resolutions))
+        deadline = self._clock() + 2 * longest
+        while self._bulk_in_progress() and self._clock() < deadline:
+            if self._stopping.wait(longest / 10):
+                return
+
+    def _bulk_in_progress(self) -> bool:
+        for path in self._bulk_files:
+            try:
+                with open(path, encoding="ascii") as fh:
+                    if fh.read().strip() == "-1":
+                        return True
+            except OSError:
+                return False
+        return False
+
+    def _run(self, stopping: threading.Event) -> None:
+        while not stopping.is_set():
+            started = self._clock()
+            try:
+                self.sample_once()
+            except Exception as exc:
+                # Keep sampling, the consumers notice when samples get old
+                print(f"Temperature sampling failed: {exc}")
+            stopping.wait(max(0.0, self.interval - (self._clock() - started)))
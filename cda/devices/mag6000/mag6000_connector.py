@@ -1,23 +1,38 @@
-import time
 import os
-import minimalmodbus
 import serial
+from devices.mag6000.rs485_bus import PRIORITY_CONTROL, attach_bus, detach_bus
+
 
 class Mag6000Connector:
-    def __init__(self):
+    def __init__(self, slave_address: int | None = None, open_attempts: int | None = None):
+        """
+        :param slave_address: Modbus address of the flow gauge, defaults to FLOW_GAUGE_ADDRESS or 1.
+        :param open_attempts: Attempts to open the serial port before serial.SerialException is raised,
+            or None to wait until the adapter is plugged in.
+        """
         # Initialize the connector with a port and slave address.
         self.port = os.getenv("FLOW_GAUGE_PORT")
-        self.slave_address = 1
-        self.instrument = None
-        self._initialize_instrument()
+        self.slave_address = slave_address if slave_address is not None else int(os.getenv("FLOW_GAUGE_ADDRESS", "1"))
+        # Serial settings default to the Siemens instructions, but can be overridden to match the Modbus module
+        self.baudrate = int(os.getenv("FLOW_GAUGE_BAUDRATE", "19200"))
+        self.parity = os.getenv("FLOW_GAUGE_PARITY", serial.PARITY_EVEN)
+        # Flow gauges of several lines can share one RS485 bus, which owns the serial port
+        # and runs the transactions of all of them one at a time
+        self.bus = attach_bus(self.port, self.baudrate, self.parity)
+        try:
+            self.instrument = self.bus.instrument(self.slave_address, open_attempts)
+        except Exception:
+            detach_bus(self.bus)
+            raise
+
+    def transaction(self, priority: int = PRIORITY_CONTROL):
+        """Hold the bus for one transaction with the flow gauge, see Rs485Bus.transaction."""
+        return self.bus.transaction(self.slave_address, priority)
 
     def close(self):
-        # Close the serial connection if it is ope
+        # Close the serial port if no other connector uses it
         if self.instrument is not None:
-            try:
-                self.instrument.serial.close()
-            except Exception as e:
-                print("Error closing instrument:", e)
+            detach_bus(self.bus)
             self.instrument = None
 
     def __enter__(self):
@@ -25,28 +40,3 @@ class Mag6000Connector:
 
     def __exit__(self, exc_type, exc_value, traceback):
         self.close()
-
-    def _initialize_instrument(self):
-        # Wait until the device file is accessible
-        while not os.path.exists(self.port):
-            print(f"Waiting for {self.port} to be accessible...")
-            time.sleep(1)
-
-        # Set up the serial connection with the correct settings
-        minimalmodbus.MODE_RTU = 'rtu'
-        while True:
-            try:
-                # Settings as per the Siemens instructions
-                self.instrument = minimalmodbus.Instrument(self.port, self.slave_address)
-                self.instrument.address = self.slave_address
-                self.instrument.serial.baudrate = 19200
-                self.instrument.serial.interframe_space = 3.5
-                self.instrument.serial.timeout = 2  # seconds
-                self.instrument.serial.parity = serial.PARITY_EVEN
-                self.instrument.serial.stopbits = 1
-                self.instrument.serial.bytesize = 8
-                return
-            except OSError as e:
-                print("Error initializing instrument:", e)
-                print("Retrying after 2 seconds...")
-                time.sleep(2)
\ No newline at end of file
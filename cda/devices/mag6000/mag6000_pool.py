@@ -0,0 +1,244 @@
+"""
+Long-lived connections to the flow gauges, kept warm between lots.
+
+The pool opens the connector of a flow gauge on first use and keeps it, so the
+serial port stays open and a lot starts reading the moment it is handed its
+connector. A background thread probes each gauge that is not in use with a
+one-register read at diagnostic priority. A gauge is warm while it answers
+its probes. After failed probes, it is probed again with a growing delay, and
+the serial port is reopened, such as after the USB adapter was unplugged.
+The pool tries to open the serial port once per probe or lease, so a missing
+adapter counts as a failed probe instead of blocking the pool.
+The pool also keeps the time from the start of each fill to its first sample.
+"""
+from __future__ import annotations
+
+import statistics
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator
+
+from devices.mag6000.mag6000_connector import Mag6000Connector
+from devices.mag6000.rs485_bus import PRIORITY_DIAGNOSTIC
+
+# Register read by the probe, the first register of the flow rate
+PROBE_REGISTER = 3002
+
+
+def open_connector(slave_address: int) -> Mag6000Connector:
+    """The connector of *slave_address*, raising serial.SerialException if the port cannot be opened at once."""
+    return Mag6000Connector(slave_address, open_attempts=1)
+
+
+class GaugeHealth:
+    """Probe results of one flow gauge."""
+
+    def __init__(self) -> None:
+        self.warm = False
+        self.probes = 0
+        self.failures = 0
+        # Failed probes since the last one that succeeded
+        self.consecutive_failures = 0
+        self.reopens = 0
+        self.last_probe_ms: float | None = None
+        # When the gauge is probed next, on the clock of the pool
+        self.next_probe = 0.0
+        # Leases of the gauge that are running, it is not probed while in use
+        self.leases = 0
+        # Seconds from the start of each fill to its first sample
+        self.first_samples: list[float] = []
+
+    def summary(self) -> dict:
+        return {
+            "warm": self.warm,
+            "probes": self.probes,
+            "failures": self.failures,
+            "reopens": self.reopens,
+            "last_probe_ms": self.last_probe_ms,
+            "first_sample_mean_ms": statistics.fmean(self.first_samples) * 1000 if self.first_samples else None,
+            "first_sample_max_ms": max(self.first_samples) * 1000 if self.first_samples else None,
+        }
+
+
+class Mag6000Pool:
+    """
+    One Mag6000Connector per flow gauge, kept open for the lifetime of the program.
+
+    Usage:
+        pool = Mag6000Pool()
+        pool.start([1, 2])
+        with pool.lease(1) as connector:
+            Mag6000Reader(connector).read_snapshot()
+        pool.close()
+    """
+
+    def __init__(
+        self,
+        probe_interval: float = 10.0,
+        min_backoff: float = 0.5,
+        max_backoff: float = 30.0,
+        reopen_after: int = 2,
+        connect: Callable[[int], Mag6000Connector] = open_connector,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """
+        :param probe_interval: Seconds between the probes of a gauge that answers.
+        :param min_backoff: Seconds until the probe after a failed one, doubled after each further failure.
+        :param max_backoff: Most seconds between the probes of a gauge that does not answer.
+        :param reopen_after: Failed probes in a row after which the serial port is reopened.
+        :param connect: Creates the connector of a slave address, which opens the bus.
+            Should raise rather than wait if the bus cannot be opened, as the pool backs off by itself.
+        :param clock: Monotonic clock in seconds.
+        """
+        if probe_interval <= 0 or min_backoff <= 0 or max_backoff < min_backoff:
+            raise ValueError("expected probe_interval > 0 and 0 < min_backoff <= max_backoff")
+        self.probe_interval = probe_interval
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.reopen_after = reopen_after
+        self._connect = connect
+        self._clock = clock
+        self._connectors: dict[int, Mag6000Connector] = {}
+        self._health: dict[int, GaugeHealth] = {}
+        self._lock = threading.Lock()
+        # Held while a connector is created, as creating it opens the port
+        self._open_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def add(self, slave_addresses) -> None:
+        """Probe the gauges of *slave_addresses*, which opens them on the first probe."""
+        with self._lock:
+            for address in slave_addresses:
+                self._health.setdefault(address, GaugeHealth())
+
+    def start(self, slave_addresses) -> None:
+        """Open the gauges of *slave_addresses* and probe them in the background."""
+        self.add(slave_addresses)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="mag6000-pool", daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        """Stop probing and close the connectors."""
+        self._stop.set()
+        if self._thread is not None:
+            # A probe may be waiting for a gauge to answer
+            self._thread.join(timeout=5)
+            self._thread = None
+        with self._lock:
+            connectors = list(self._connectors.values())
+            self._connectors = {}
+        for connector in connectors:
+            connector.close()
+
+    def connector(self, slave_address: int) -> Mag6000Connector:
+        """The connector of *slave_address*, opened on first use. Raises if the port cannot be opened."""
+        with self._lock:
+            connector = self._connectors.get(slave_address)
+        if connector is not None:
+            return connector
+        with self._open_lock:
+            # Another thread may have opened it meanwhile
+            connector = self._connectors.get(slave_address)
+            if connector is None:
+                connector = self._connect(slave_address)
+                with self._lock:
+                    self._connectors[slave_address] = connector
+                    self._health.setdefault(slave_address, GaugeHealth())
+        return connector
+
+    @contextmanager
+    def lease(self, slave_address: int) -> Iterator[Mag6000Connector]:
+        """
+        Use the connector of *slave_address*, which is not probed meanwhile. It stays open afterwards.
+        Raises serial.SerialException if the port cannot be opened, which fails the lot.
+        """
+        connector = self.connector(slave_address)
+        with self._lock:
+            self._health[slave_address].leases += 1
+        try:
+            yield connector
+        finally:
+            with self._lock:
+                health = self._health[slave_address]
+                health.leases -= 1
+                # The lot has just used the gauge, so it needs no probe for a while
+                health.next_probe = self._clock() + self.probe_interval
+
+    def is_warm(self, slave_address: int) -> bool:
+        """True if the gauge answered its last probe."""
+        with self._lock:
+            health = self._health.get(slave_address)
+            return health is not None and health.warm
+
+    def record_first_sample(self, slave_address: int, seconds: float) -> None:
+        """Keep the time from the start of a fill on *slave_address* to its first sample."""
+        with self._lock:
+            self._health.setdefault(slave_address, GaugeHealth()).first_samples.append(seconds)
+
+    def probe(self, slave_address: int) -> bool:
+        """Read one register of the gauge, reopening the port after failures. Returns True if it answered."""
+        started = self._clock()
+        try:
+            connector = self.connector(slave_address)
+            with connector.transaction(PRIORITY_DIAGNOSTIC):
+                connector.instrument.read_registers(PROBE_REGISTER, 1)
+            ok = True
+        except Exception as e:
+            print(f"Flow gauge {slave_address} did not answer its probe: {e}")
+            ok = False
+        now = self._clock()
+        with self._lock:
+            health = self._health.setdefault(slave_address, GaugeHealth())
+            health.probes += 1
+            health.last_probe_ms = (now - started) * 1000
+            health.warm = ok
+            if ok:
+                health.consecutive_failures = 0
+                health.next_probe = now + self.probe_interval
+                return True
+            health.failures += 1
+            health.consecutive_failures += 1
+            failures = health.consecutive_failures
+            health.next_probe = now + min(self.min_backoff * 2 ** (failures - 1), self.max_backoff)
+            reopen = failures % self.reopen_after == 0 and slave_address in self._connectors
+        if reopen:
+            self._reopen(slave_address)
+        return False
+
+    def check(self) -> float:
+        """Probe the gauges that are due and not in use. Returns the seconds until the next one is due."""
+        with self._lock:
+            now = self._clock()
+            due = [address for address, health in self._health.items() if not health.leases and health.next_probe <= now]
+        for address in due:
+            if self._stop.is_set():
+                break
+            self.probe(address)
+        with self._lock:
+            waiting = [health.next_probe for health in self._health.values() if not health.leases]
+        if not waiting:
+            return self.probe_interval
+        return max(min(waiting) - self._clock(), 0.0)
+
+    def summary(self) -> dict[int, dict]:
+        """The health of every gauge, by slave address."""
+        with self._lock:
+            return {address: health.summary() for address, health in sorted(self._health.items())}
+
+    def _reopen(self, slave_address: int) -> None:
+        connector = self._connectors[slave_address]
+        try:
+            connector.bus.reopen()
+            print(f"Reopened {connector.bus.port}")
+        except Exception as e:
+            print(f"Could not reopen {connector.bus.port}: {e}")
+        with self._lock:
+            self._health[slave_address].reopens += 1
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            delay = self.check()
+            self._stop.wait(delay)
@@ -1,17 +1,83 @@
 import struct
+import time
+from contextlib import contextmanager
 import minimalmodbus
+from devices.mag6000.mag6000_registers import REGISTER_MAP, SNAPSHOT_BLOCK, Mag6000Snapshot
+from devices.mag6000.rs485_bus import PRIORITY_CONTROL
+from functions.metrics import REGISTRY
+
+# Time on the bus of each transaction, without the wait for the bus, by the registers read
+MODBUS_SECONDS = REGISTRY.histogram("cda_modbus_transaction_seconds", "Time of a Modbus transaction with a flow gauge", ("registers",))
+MODBUS_ERRORS = REGISTRY.counter("cda_modbus_errors_total", "Failed Modbus transactions with a flow gauge", ("registers",))
+
+
+def _registers(start: int, count: int) -> str:
+    return f"{start}-{start + count - 1}"
+
+
+@contextmanager
+def _timed(registers: str):
+    # Entered inside the transaction, so the time waiting for the bus is left out
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        MODBUS_ERRORS.labels(registers).inc()
+        raise
+    finally:
+        MODBUS_SECONDS.labels(registers).observe(time.perf_counter() - started)
+
 
 class Mag6000Reader:
-    def __init__(self, connector):
+    def __init__(self, connector, priority: int = PRIORITY_CONTROL):
         # Initializes the reader with an instance of Mag6000Connector.
         self.connector = connector
+        # Priority of the reads on the shared bus, control loops go ahead of diagnostics
+        self.priority = priority
+        # Set if the device refuses block reads, in which case each field is read on its own
+        self.block_reads_supported = True
+
+    def read_snapshot(self) -> Mag6000Snapshot | None:
+        """
+        Reads every field of the register map (registers 3002 to 3017) in a single
+        Modbus transaction, using function code 3.
+        Returns a Mag6000Snapshot, or None if the read fails.
+        """
+        if not self.block_reads_supported:
+            return self._read_snapshot_per_field()
+        try:
+            with self.connector.transaction(self.priority), _timed(_registers(SNAPSHOT_BLOCK.start, SNAPSHOT_BLOCK.count)):
+                registers = self.connector.instrument.read_registers(SNAPSHOT_BLOCK.start, SNAPSHOT_BLOCK.count)
+        except minimalmodbus.IllegalRequestError as e:
+            # The device does not allow reading the registers between the fields
+            print("Block read refused, reading fields separately:", e)
+            self.block_reads_supported = False
+            return self._read_snapshot_per_field()
+        except Exception as e:
+            print("Error reading register block:", e)
+            return None
+        return Mag6000Snapshot(*SNAPSHOT_BLOCK.decode(registers), time.monotonic())
+
+    def _read_snapshot_per_field(self) -> Mag6000Snapshot | None:
+        # Fallback with one transaction per field of the register map
+        values = []
+        for field in REGISTER_MAP:
+            try:
+                with self.connector.transaction(self.priority), _timed(_registers(field.address, field.count)):
+                    registers = self.connector.instrument.read_registers(field.address, field.count)
+            except Exception as e:
+                print(f"Error reading {field.name}:", e)
+                return None
+            values.append(struct.unpack(f">{field.fmt}", struct.pack(f">{field.count}H", *registers))[0] * field.scale)
+        return Mag6000Snapshot(*values, time.monotonic())
 
     def read_flow_rate(self) -> float:
         # Reads the flow rate from register 3002 using function code 3
         # Returns the flow rate in liters per hour
         try:
             # Read a float value (assumed to be in m^3/s) from register 3002
-            flow_value = self.connector.instrument.read_float(3002, byteorder=minimalmodbus.BYTEORDER_BIG)
+            with self.connector.transaction(self.priority), _timed("3002-3003"):
+                flow_value = self.connector.instrument.read_float(3002, byteorder=minimalmodbus.BYTEORDER_BIG)
         except Exception as e:
             print("Error reading flow rate:", e)
             return 0.0
@@ -28,7 +94,8 @@ class Mag6000Reader:
         """
         try:
             # Read 4 registers (8 bytes) starting at address 3014
-            registers = self.connector.instrument.read_registers(3014, 4)
+            with self.connector.transaction(self.priority), _timed("3014-3017"):
+                registers = self.connector.instrument.read_registers(3014, 4)
         except Exception as e:
             print("Error reading totalizer registers:", e)
             return 0.0
@@ -0,0 +1,77 @@
+"""
+Register map of the MAG 6000 Modbus RTU module.
+
+The fields are declared once here, and compiled into a single struct.Struct
+that decodes a whole block of registers in one call. Registers between the
+declared fields are read along with the block, but not decoded.
+"""
+from __future__ import annotations
+
+import struct
+from typing import NamedTuple
+
+
+class RegisterField(NamedTuple):
+    # Name of the field in Mag6000Snapshot
+    name: str
+    # First holding register of the field
+    address: int
+    # struct format character of the big-endian value, "f" (2 registers) or "d" (4 registers)
+    fmt: str
+    # Factor converting the raw value to the unit used by the code
+    scale: float = 1.0
+
+    @property
+    def count(self) -> int:
+        return struct.calcsize(f">{self.fmt}") // 2
+
+
+# Fields read on every sample, in register order
+REGISTER_MAP: tuple[RegisterField, ...] = (
+    # Absolute volume flow in m³/s, converted to liters per hour (1 m³/s = 3600000 L/h)
+    RegisterField("flow_rate_lph", 3002, "f", 3600000.0),
+    # Totalizer 1, as a double that already represents liters
+    RegisterField("totalizer_liters", 3014, "d", 1.0),
+)
+
+
+class Mag6000Snapshot(NamedTuple):
+    """All fields of the register map, read in a single Modbus transaction."""
+    flow_rate_lph: float
+    totalizer_liters: float
+    # time.monotonic() when the response was received
+    timestamp: float
+
+
+class RegisterBlock:
+    """A contiguous block of registers covering a register map, with a precompiled decoder."""
+
+    def __init__(self, fields: tuple[RegisterField, ...] = REGISTER_MAP) -> None:
+        self.fields = tuple(sorted(fields, key=lambda field: field.address))
+        self.start = self.fields[0].address
+        self.count = self.fields[-1].address + self.fields[-1].count - self.start
+
+        # Build one format for the whole block, skipping registers between fields with pad bytes
+        fmt = ">"
+        position = self.start
+        for field in self.fields:
+            if field.address < position:
+                raise ValueError(f"Register field {field.name} overlaps the previous field")
+            fmt += "x" * (2 * (field.address - position)) + field.fmt
+            position = field.address + field.count
+        self._words = struct.Struct(f">{self.count}H")
+        self._decoder = struct.Struct(fmt)
+        self._scales = tuple(field.scale for field in self.fields)
+
+    def decode(self, registers: list[int]) -> tuple[float, ...]:
+        """Decode the register words of the block into scaled field values, in register order."""
+        raw = self._decoder.unpack(self._words.pack(*registers))
+        return tuple(value * scale for value, scale in zip(raw, self._scales))
+
+
+# The block used by Mag6000Reader.read_snapshot, registers 3002 to 3017
+SNAPSHOT_BLOCK = RegisterBlock(REGISTER_MAP)
+
+# The decoded values are passed to Mag6000Snapshot by position, so the names must line up
+if tuple(field.name for field in SNAPSHOT_BLOCK.fields) != Mag6000Snapshot._fields[:-1]:
+    raise ImportError("REGISTER_MAP does not match the fields of Mag6000Snapshot")
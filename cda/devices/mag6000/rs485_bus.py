@@ -0,0 +1,266 @@
+"""
+One RS485 bus with Modbus RTU slaves, shared by every reader on the port.
+
+The bus owns the serial port, and runs one transaction at a time. Readers
+queue for the bus with a priority, so the reads of the control loops go ahead
+of diagnostic reads, and readers of the same priority are served in the order
+they arrived. Between two frames, the bus keeps the line silent for the
+Modbus interframe time of 3.5 characters. The time each slave waited for the
+bus and the time of its transactions are kept per slave address.
+"""
+from __future__ import annotations
+
+import heapq
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator
+
+import minimalmodbus
+import serial
+
+# Reads of the filling loop, which decide when the pump is switched off
+PRIORITY_CONTROL = 0
+# Reads that can wait, such as status and diagnostics
+PRIORITY_DIAGNOSTIC = 10
+
+# Seconds between attempts to open the serial port, doubled after each failure up to the maximum
+OPEN_BACKOFF = 0.5
+MAX_OPEN_BACKOFF = 10.0
+
+
+def interframe_seconds(baudrate: int) -> float:
+    """Silent time between Modbus RTU frames: 3.5 characters of 11 bits, and at least 1.75 ms above 19200 baud."""
+    if baudrate > 19200:
+        return 0.00175
+    return 3.5 * 11 / baudrate
+
+
+class SlaveStats:
+    """Bus statistics of one slave address."""
+
+    def __init__(self) -> None:
+        self.transactions = 0
+        self.errors = 0
+        # Time spent queueing for the bus, including the interframe time
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        # Time from sending the request to the end of the response
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def summary(self) -> dict:
+        return {
+            "transactions": self.transactions,
+            "errors": self.errors,
+            "mean_wait_ms": self.total_wait / self.transactions * 1000 if self.transactions else 0.0,
+            "max_wait_ms": self.max_wait * 1000,
+            "mean_latency_ms": self.total_latency / self.transactions * 1000 if self.transactions else 0.0,
+            "max_latency_ms": self.max_latency * 1000,
+        }
+
+
+class Rs485Bus:
+    """
+    Serializes the Modbus transactions of all slaves on one serial port.
+
+    Usage:
+        bus = attach_bus(port)
+        instrument = bus.instrument(2)
+        with bus.transaction(2):
+            instrument.read_registers(3002, 16)
+        detach_bus(bus)
+    """
+
+    def __init__(
+        self,
+        port: str,
+        baudrate: int = 19200,
+        parity: str = serial.PARITY_EVEN,
+        timeout: float = 2.0,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        """
+        :param port: The serial port of the RS485 adapter.
+        :param baudrate: Baud rate of the bus, which sets the interframe time.
+        :param parity: Parity of the bus.
+        :param timeout: Seconds to wait for a response.
+        :param clock: Monotonic clock in seconds.
+        :param sleep: Sleep function, used to keep the interframe time.
+        """
+        self.port = port
+        self.baudrate = baudrate
+        self.parity = parity
+        self.timeout = timeout
+        self.interframe_seconds = interframe_seconds(baudrate)
+        self.serial: serial.Serial | None = None
+        self._clock = clock
+        self._sleep = sleep
+        # Queue of (priority, arrival) tickets waiting for the bus
+        self._condition = threading.Condition()
+        self._waiting: list[tuple[int, int]] = []
+        self._arrivals = itertools.count()
+        self._busy = False
+        # When the last frame ended, the next one must wait for the interframe time after it
+        self._last_frame_end = float("-inf")
+        self._stats: dict[int, SlaveStats] = {}
+
+    def open(self, attempts: int | None = None) -> None:
+        """
+        Open the serial port, waiting until the adapter is plugged in, with a growing delay between attempts.
+        Raises serial.SerialException after *attempts* failed attempts, or keeps trying if None.
+        """
+        if self.serial is not None:
+            return
+        delay = OPEN_BACKOFF
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                # Wait until the device file is accessible
+                if not os.path.exists(self.port):
+                    raise serial.SerialException(f"{self.port} is not accessible")
+                # Settings as per the Siemens instructions
+                self.serial = serial.Serial(
+                    port=self.port,
+                    baudrate=self.baudrate,
+                    parity=self.parity,
+                    bytesize=8,
+                    stopbits=1,
+                    timeout=self.timeout,
+                )
+                return
+            except (OSError, serial.SerialException) as e:
+                print("Error opening serial port:", e)
+                if attempts is not None and attempt >= attempts:
+                    raise serial.SerialException(f"Could not open {self.port}: {e}") from e
+                print(f"Retrying after {delay:g} seconds...")
+                self._sleep(delay)
+                delay = min(delay * 2, MAX_OPEN_BACKOFF)
+
+    def reopen(self) -> None:
+        """
+        Close the serial port and open it again, such as after the adapter was unplugged.
+        The instruments of the bus keep working, as the same serial object is opened again.
+        Raises serial.SerialException if the port cannot be opened.
+        """
+        if self.serial is None:
+            self.open(attempts=1)
+            return
+        with self.transaction(None, PRIORITY_DIAGNOSTIC, record=False):
+            try:
+                self.serial.close()
+            except Exception as e:
+                print("Error closing serial port:", e)
+            try:
+                self.serial.open()
+            except (OSError, serial.SerialException) as e:
+                raise serial.SerialException(f"Could not reopen {self.port}: {e}") from e
+
+    def close(self) -> None:
+        """Close the serial port."""
+        if self.serial is None:
+            return
+        with self.transaction(None, PRIORITY_DIAGNOSTIC, record=False):
+            try:
+                self.serial.close()
+            except Exception as e:
+                print("Error closing serial port:", e)
+            self.serial = None
+
+    def instrument(self, slave_address: int, attempts: int | None = None) -> minimalmodbus.Instrument:
+        """
+        A Modbus instrument for *slave_address* on this bus. Its transactions must run in transaction().
+        Opens the port first if needed, see open() for *attempts*.
+        """
+        self.open(attempts)
+        return minimalmodbus.Instrument(self.serial, slave_address, mode=minimalmodbus.MODE_RTU)
+
+    @contextmanager
+    def transaction(self, slave_address: int | None, priority: int = PRIORITY_CONTROL, record: bool = True) -> Iterator[None]:
+        """
+        Hold the bus for one transaction with *slave_address*. Lower priorities go first.
+        Exceptions raised in the transaction are counted as errors of the slave.
+        """
+        queued = self._clock()
+        with self._condition:
+            ticket = (priority, next(self._arrivals))
+            heapq.heappush(self._waiting, ticket)
+            while self._busy or self._waiting[0] != ticket:
+                self._condition.wait()
+            heapq.heappop(self._waiting)
+            self._busy = True
+        try:
+            # Keep the line silent between the frames
+            silence = self._last_frame_end + self.interframe_seconds - self._clock()
+            if silence > 0:
+                self._sleep(silence)
+            started = self._clock()
+            failed = True
+            try:
+                yield
+                failed = False
+            finally:
+                ended = self._clock()
+                self._last_frame_end = ended
+                if record:
+                    self._record(slave_address, started - queued, ended - started, failed)
+        finally:
+            with self._condition:
+                self._busy = False
+                self._condition.notify_all()
+
+    def _record(self, slave_address: int | None, wait: float, latency: float, failed: bool) -> None:
+        # Only the thread holding the bus records, so no lock is needed
+        stats = self._stats.setdefault(slave_address, SlaveStats())
+        stats.transactions += 1
+        stats.errors += failed
+        stats.total_wait += wait
+        stats.max_wait = max(stats.max_wait, wait)
+        stats.total_latency += latency
+        stats.max_latency = max(stats.max_latency, latency)
+
+    def reset_stats(self) -> None:
+        """Start the statistics of every slave from zero."""
+        self._stats = {}
+
+    def stats(self, slave_address: int) -> SlaveStats:
+        """The statistics of *slave_address*."""
+        return self._stats.setdefault(slave_address, SlaveStats())
+
+    def summary(self) -> dict[int, dict]:
+        """The statistics of every slave that was read, by address."""
+        return {address: stats.summary() for address, stats in sorted(self._stats.items())}
+
+
+# One bus per serial port, closed when the last connector using it is closed
+_buses: dict[str, Rs485Bus] = {}
+_bus_users: dict[str, int] = {}
+_registry_lock = threading.Lock()
+
+
+def attach_bus(port: str, baudrate: int = 19200, parity: str = serial.PARITY_EVEN) -> Rs485Bus:
+    """The bus on *port*, created on first use. Every call must be matched by detach_bus()."""
+    with _registry_lock:
+        bus = _buses.get(port)
+        if bus is None:
+            bus = _buses[port] = Rs485Bus(port, baudrate, parity)
+        elif bus.serial is None:
+            # Closed by its last user, so it opens again with the settings given now
+            bus.baudrate = baudrate
+            bus.parity = parity
+            bus.interframe_seconds = interframe_seconds(baudrate)
+        _bus_users[port] = _bus_users.get(port, 0) + 1
+        return bus
+
+
+def detach_bus(bus: Rs485Bus) -> None:
+    """Stop using *bus*, closing its serial port if no one else uses it. Its statistics are kept."""
+    with _registry_lock:
+        _bus_users[bus.port] -= 1
+        # Closed under the registry lock, so a new user cannot get the bus while it closes
+        if _bus_users[bus.port] == 0:
+            bus.close()
@@ -1,26 +1,46 @@
-import RPi.GPIO as GPIO
+from devices.relay.relay_manager import relay_manager
+from functions.structured_log import get_logger
+
+log = get_logger(__name__)
+
+
+def emergency_off(pins) -> None:
+    """
+    Switch the relays on *pins* off right away, from any thread, and keep them off until
+    reset_interlock(). Calling it again for pins that are already off does no harm.
+    """
+    # The pins stay off until the interlock is reset, whatever the control loops ask for,
+    # so a stop does not depend on a loop that may be blocked in a read
+    relay_manager().emergency_off(pins)
+    log.warning("EMERGENCY STOP: relays off", pins=sorted(pins))
+
+
+def reset_interlock(pins) -> None:
+    """Allow the relays on *pins* to be switched on again after an emergency stop."""
+    relay_manager().reset_interlock(pins)
+
+
+def is_tripped(pin: int) -> bool:
+    """Whether the relay on *pin* is held off by an emergency stop."""
+    return relay_manager().is_tripped(pin)
+
 
 """Controls a relay using GPIO pins on a Raspberry Pi."""
 class RelayController:
     def __init__(self, relay_pin: int = 17):
         self.relay_pin = relay_pin
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setup(self.relay_pin, GPIO.OUT)
-        # Ensure relay is off initially
-        GPIO.output(self.relay_pin, GPIO.LOW)
+        # The manager sets the pin up on first use only, a relay that is already on stays on
+        self._manager = relay_manager()
+        self._manager.setup([self.relay_pin])
 
 
     def toggle_relay(self, on: bool):
-        """Turns the relay on or off."""
-        if on:
-            # If the relay is on, disable it
-            GPIO.output(self.relay_pin, GPIO.HIGH)
-            print("Relay ON GPIO pin" . format(self.relay_pin))
-        else:
-            # If the relay is off, enable it
-            GPIO.output(self.relay_pin, GPIO.LOW)  # Deactivate SSR
-            self.cleanup()
-            print("Relay OFF GPIO pin" . format(self.relay_pin))
+        """Turns the relay on or off. The relay stays off while an emergency stop holds its pin."""
+        # The manager skips the write if the relay is already in that state
+        if not self._manager.set(self.relay_pin, on):
+            return
+        log.debug(f"Relay {'ON' if on else 'OFF'}", pin=self.relay_pin)
 
     def cleanup(self):
-        GPIO.cleanup()
\ No newline at end of file
+        # Only release this pin, other lines may still be using their relays
+        self._manager.release([self.relay_pin])
@@ -0,0 +1,220 @@
+"""
+One owner for the GPIO pins of all relays in the process.
+
+The manager sets the numbering mode once and each pin up once, as an output
+that starts low. It remembers the level of every pin, so a write that would
+not change it is skipped, and switches several pins in one GPIO call under
+its lock, so no other thread sees only some of them switched. It also holds
+the interlock of emergency stops, and counts the switches of each pin with
+the time they took and how long the relay was on.
+
+Usage:
+    relays = relay_manager()
+    relays.set(18, True)
+    relays.all_off()
+"""
+from __future__ import annotations
+
+import threading
+import time
+from typing import Callable, Iterable
+
+import RPi.GPIO as GPIO
+
+from functions.structured_log import get_logger
+
+log = get_logger(__name__)
+
+
+class RelayStats:
+    """Switching statistics of one relay pin."""
+
+    def __init__(self) -> None:
+        self.switches_on = 0
+        self.switches_off = 0
+        # Writes skipped because the pin already had the level asked for
+        self.skipped = 0
+        self.emergency_offs = 0
+        self.total_write = 0.0
+        self.max_write = 0.0
+        self.total_on = 0.0
+        # When the relay was last switched on, while it is on
+        self.on_since: float | None = None
+
+    def summary(self, now: float) -> dict:
+        switches = self.switches_on + self.switches_off
+        on = self.total_on + (now - self.on_since if self.on_since is not None else 0.0)
+        return {
+            "switches_on": self.switches_on,
+            "switches_off": self.switches_off,
+            "skipped": self.skipped,
+            "emergency_offs": self.emergency_offs,
+            "mean_write_us": self.total_write / switches * 1e6 if switches else 0.0,
+            "max_write_us": self.max_write * 1e6,
+            "on_seconds": on,
+        }
+
+
+class RelayManager:
+    """The pins of the relays, their cached levels and the emergency stop interlock."""
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic) -> None:
+        """
+        :param clock: Monotonic clock in seconds, for the on time of the relays.
+        """
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._mode_set = False
+        # Level of each pin set up as an output, True for on
+        self._levels: dict[int, bool] = {}
+        # Pins switched off by an emergency stop, held off until the interlock is reset
+        self._tripped: set[int] = set()
+        self._stats: dict[int, RelayStats] = {}
+
+    def setup(self, pins: Iterable[int]) -> None:
+        """Set *pins* up as outputs with the relays off, unless they already are."""
+        with self._lock:
+            self._setup([pin for pin in pins if pin not in self._levels])
+
+    def set(self, pin: int, on: bool) -> bool:
+        """
+        Switch the relay on *pin*, skipping the write if it is already in that state.
+        Returns False if it is held off by an emergency stop.
+        """
+        return self.set_many([pin], on)
+
+    def set_many(self, pins: Iterable[int], on: bool) -> bool:
+        """
+        Switch the relays on *pins* together, in one GPIO write.
+        Returns False, switching none of them, if any is held off by an emergency stop.
+        """
+        pins = list(pins)
+        with self._lock:
+            if on:
+                held = [pin for pin in pins if pin in self._tripped]
+                if held:
+                    log.warning("Relays held off by an emergency stop", pins=held)
+                    return False
+            self._setup([pin for pin in pins if pin not in self._levels])
+            changed = [pin for pin in pins if self._levels[pin] != on]
+            for pin in pins:
+                if pin not in changed:
+                    self._stats_of(pin).skipped += 1
+            self._write(changed, on)
+            return True
+
+    def all_off(self) -> None:
+        """Switch every relay off in one GPIO write."""
+        with self._lock:
+            self._write([pin for pin, on in self._levels.items() if on], False)
+
+    def emergency_off(self, pins: Iterable[int]) -> None:
+        """
+        Switch the relays on *pins* off right away, from any thread, and keep them off until
+        reset_interlock(). The pins are written even if they are known to be off.
+        """
+        pins = list(pins)
+        with self._lock:
+            self._tripped.update(pins)
+            self._setup([pin for pin in pins if pin not in self._levels])
+            self._write(pins, False)
+            for pin in pins:
+                self._stats_of(pin).emergency_offs += 1
+
+    def reset_interlock(self, pins: Iterable[int]) -> None:
+        """Allow the relays on *pins* to be switched on again after an emergency stop."""
+        with self._lock:
+            self._tripped.difference_update(pins)
+
+    def is_tripped(self, pin: int) -> bool:
+        """Whether the relay on *pin* is held off by an emergency stop."""
+        with self._lock:
+            return pin in self._tripped
+
+    def is_on(self, pin: int) -> bool:
+        """Whether the relay on *pin* was last switched on."""
+        with self._lock:
+            return self._levels.get(pin, False)
+
+    def release(self, pins: Iterable[int] | None = None) -> None:
+        """Return *pins*, or all pins, to inputs, which switches their relays off, and forget them."""
+        with self._lock:
+            pins = list(self._levels) if pins is None else [pin for pin in pins if pin in self._levels]
+            now = self._clock()
+            for pin in pins:
+                self._stopped_on(pin, now)
+                del self._levels[pin]
+            if pins:
+                GPIO.cleanup(pins)
+            if not self._levels:
+                # Set the mode again on the next setup, the GPIO module may have been reset meanwhile
+                self._mode_set = False
+
+    def stats(self, pin: int) -> RelayStats:
+        """The switching statistics of *pin*."""
+        with self._lock:
+            return self._stats_of(pin)
+
+    def summary(self) -> dict[int, dict]:
+        """The switching statistics of every pin, by pin."""
+        with self._lock:
+            now = self._clock()
+            return {pin: stats.summary(now) for pin, stats in sorted(self._stats.items())}
+
+    def _setup(self, pins: list[int]) -> None:
+        # Runs under the lock
+        if not pins:
+            return
+        if not self._mode_set:
+            GPIO.setmode(GPIO.BCM)
+            self._mode_set = True
+        for pin in pins:
+            GPIO.setup(pin, GPIO.OUT, initial=GPIO.LOW)
+            self._levels[pin] = False
+
+    def _write(self, pins: list[int], on: bool) -> None:
+        # Runs under the lock
+        if not pins:
+            return
+        previous = {pin: self._levels[pin] for pin in pins}
+        started = self._clock()
+        try:
+            GPIO.output(pins, GPIO.HIGH if on else GPIO.LOW)
+        except RuntimeError:
+            # The pins were released behind the manager's back, so set them up again
+            self._mode_set = False
+            self._setup(pins)
+            GPIO.output(pins, GPIO.HIGH if on else GPIO.LOW)
+        ended = self._clock()
+        for pin in pins:
+            stats = self._stats_of(pin)
+            stats.total_write += ended - started
+            stats.max_write = max(stats.max_write, ended - started)
+            if previous[pin] == on:
+                # Written again by an emergency stop, not switched
+                continue
+            if on:
+                stats.switches_on += 1
+                stats.on_since = ended
+            else:
+                stats.switches_off += 1
+                self._stopped_on(pin, ended)
+            self._levels[pin] = on
+
+    def _stopped_on(self, pin: int, now: float) -> None:
+        stats = self._stats_of(pin)
+        if stats.on_since is not None:
+            stats.total_on += now - stats.on_since
+            stats.on_since = None
+
+    def _stats_of(self, pin: int) -> RelayStats:
+        return self._stats.setdefault(pin, RelayStats())
+
+
+# The manager of this process, shared by every RelayController
+_manager = RelayManager()
+
+
+def relay_manager() -> RelayManager:
+    """The relay manager of this process."""
+    return _manager
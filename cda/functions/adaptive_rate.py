@@ -0,0 +1,51 @@
+from __future__ import annotations
+
+
+class AdaptiveRate:
+    """
+    Chooses the sample rate of a control loop from how soon the target is reached.
+
+    From the distance to the target and its rate of change, the time until the
+    target is estimated, and the rate is set so that *samples_to_target* samples
+    fall within it. Far from the target, or without progress, the loop samples
+    at *min_hz*, saving bus time, CPU and progress messages. Close to the target,
+    it samples at up to *max_hz*, so the cutoff comes soon after the target is
+    crossed. The rate is stateless, so one instance can serve several loops.
+    """
+
+    def __init__(self, min_hz: float = 1.0, max_hz: float = 20.0, samples_to_target: float = 5.0) -> None:
+        """
+        :param min_hz: Lowest sample rate, used far from the target.
+        :param max_hz: Highest sample rate, used close to the target.
+        :param samples_to_target: Samples to take in the time left until the target.
+        """
+        if min_hz <= 0 or max_hz < min_hz:
+            raise ValueError("expected 0 < min_hz <= max_hz")
+        if samples_to_target <= 0:
+            raise ValueError("samples_to_target must be positive")
+        self.min_hz = min_hz
+        self.max_hz = max_hz
+        self.samples_to_target = samples_to_target
+
+    def rate_hz(self, remaining: float, rate_of_change: float) -> float:
+        """
+        The sample rate for *remaining* units to the target, approached at *rate_of_change* units per second.
+        """
+        if remaining <= 0:
+            return self.max_hz
+        if rate_of_change <= 0:
+            return self.min_hz
+        # Seconds until the target at the current rate of change
+        seconds_left = remaining / rate_of_change
+        return min(max(self.samples_to_target / seconds_left, self.min_hz), self.max_hz)
+
+    @classmethod
+    def parse(cls, text: str) -> AdaptiveRate:
+        """Parse "min,max" or "min,max,samples", as given in the .env file."""
+        try:
+            values = [float(value) for value in text.split(",")]
+        except ValueError:
+            raise ValueError(f"Invalid adaptive rate {text!r}, expected min,max in Hz") from None
+        if len(values) not in (2, 3):
+            raise ValueError(f"Invalid adaptive rate {text!r}, expected min,max in Hz")
+        return cls(*values)
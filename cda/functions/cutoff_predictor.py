@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+
+class CutoffPredictor:
+    """
+    Predicts how much water still arrives after the pump is switched off, so FlowMonitor can switch it off early.
+
+    After the decision to stop, water keeps flowing for the loop latency (the age
+    of the flow sample, and the time until the relay opens), and the pump then
+    coasts down. With a first-order coast-down, the volume that follows is the
+    flow at switch-off times a coast time. The coast time is fitted to the final
+    totalizer readings of past lots, so it also covers relay and pump delays
+    that are not measured directly.
+    """
+
+    def __init__(self, coast_seconds: float = 0.5, learning_rate: float = 0.3, max_coast_seconds: float = 30.0) -> None:
+        """
+        :param coast_seconds: Coast time to assume until one has been fitted.
+        :param learning_rate: Weight of the latest lot in the fitted coast time.
+        :param max_coast_seconds: Fitted coast times above this are ignored as measurement errors.
+        """
+        self.coast_seconds = coast_seconds
+        self.learning_rate = learning_rate
+        self.max_coast_seconds = max_coast_seconds
+        self.lots_learned = 0
+        # Volume, flow rate and latency when the pump was last switched off
+        self._cutoff: tuple[float, float, float] | None = None
+
+    def remaining_liters(self, flow_lph: float, latency: float) -> float:
+        """Volume that still arrives if the pump is switched off now, at *flow_lph* measured *latency* seconds ago."""
+        return max(flow_lph, 0.0) / 3600.0 * (latency + self.coast_seconds)
+
+    def cutoff_delay(self, volume: float, flow_lph: float, target_liters: float, latency: float, period: float) -> float | None:
+        """
+        Seconds from now until the pump should be switched off, or None if that is after the next sample,
+        one *period* from now. Switching off between two samples keeps the error small at full pump speed.
+        """
+        flow_lps = max(flow_lph, 0.0) / 3600.0
+        missing = target_liters - volume - self.remaining_liters(flow_lph, latency)
+        if missing <= 0:
+            return 0.0
+        if flow_lps <= 0:
+            return None
+        delay = missing / flow_lps
+        return delay if delay < period else None
+
+    def record_cutoff(self, volume: float, flow_lph: float, latency: float) -> None:
+        """Remember the state at switch-off, to learn from the final volume."""
+        self._cutoff = (volume, flow_lph, latency)
+
+    def learn(self, final_volume: float) -> float | None:
+        """Fit the coast time to the *final_volume* of the lot. Returns the coast time of this lot, or None."""
+        if self._cutoff is None:
+            return None
+        volume, flow_lph, latency = self._cutoff
+        self._cutoff = None
+        if flow_lph <= 0:
+            return None
+        # The totalizer steps can make the measured coast slightly negative
+        coast = max(0.0, (final_volume - volume) / (flow_lph / 3600.0) - latency)
+        if coast > self.max_coast_seconds:
+            return None
+        if self.lots_learned:
+            self.coast_seconds += self.learning_rate * (coast - self.coast_seconds)
+        else:
+            self.coast_seconds = coast
+        self.lots_learned += 1
+        return coast
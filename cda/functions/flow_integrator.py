@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+from collections import deque
+
+
+class FlowIntegrator:
+    """
+    Integrates flow rate samples into a volume, using constant memory per sample.
+
+    The volume is integrated with the trapezoidal rule over the actual sample
+    timestamps, so uneven sample intervals are accounted for. Optionally, the
+    last `window` samples are kept in a ring buffer to provide a smoothed flow rate.
+    """
+
+    def __init__(self, window: int = 1) -> None:
+        """
+        :param window: Number of samples in the smoothing window. 1 disables smoothing.
+        """
+        if window < 1:
+            raise ValueError("window must be at least 1")
+        self.window = window
+        self.volume_liters = 0.0
+        self.samples = 0
+        self._last_flow: float | None = None
+        self._last_timestamp: float | None = None
+        # Ring buffer and running sum for the smoothed flow rate
+        self._buffer: deque[float] = deque(maxlen=window)
+        self._buffer_sum = 0.0
+
+    def add(self, flow_lph: float, timestamp: float) -> float:
+        """
+        Add a flow rate sample in liters per hour, taken at *timestamp* seconds.
+        Returns the integrated volume in liters.
+        """
+        if self._last_timestamp is not None:
+            elapsed = timestamp - self._last_timestamp
+            # Ignore samples that are not newer than the previous one
+            if elapsed <= 0:
+                return self.volume_liters
+            # Area of the trapezoid between the two samples, converting L/h to L/s
+            self.volume_liters += (self._last_flow + flow_lph) / 2.0 / 3600.0 * elapsed
+        self._last_flow = flow_lph
+        self._last_timestamp = timestamp
+        self.samples += 1
+
+        # Update the smoothing window, removing the oldest sample from the running sum
+        if len(self._buffer) == self.window:
+            self._buffer_sum -= self._buffer[0]
+        self._buffer.append(flow_lph)
+        self._buffer_sum += flow_lph
+        # Recompute the sum once per window, so floating point errors cannot accumulate
+        if self.samples % self.window == 0:
+            self._buffer_sum = sum(self._buffer)
+        return self.volume_liters
+
+    @property
+    def flow_lph(self) -> float:
+        """The latest flow rate, averaged over the smoothing window."""
+        if not self._buffer:
+            return 0.0
+        return self._buffer_sum / len(self._buffer)
+
+    @property
+    def last_flow_lph(self) -> float:
+        """The latest raw flow rate sample."""
+        return self._last_flow or 0.0
+
+    def reset(self) -> None:
+        """Start a new integration from zero."""
+        self.volume_liters = 0.0
+        self.samples = 0
+        self._last_flow = None
+        self._last_timestamp = None
+        self._buffer.clear()
+        self._buffer_sum = 0.0
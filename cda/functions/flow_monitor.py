@@ -1,10 +1,18 @@
 import time
 from devices.mag6000.mag6000_reader import Mag6000Reader
 from devices.relay.relay_controller import RelayController
+from functions.adaptive_rate import AdaptiveRate
+from functions.cutoff_predictor import CutoffPredictor
+from functions.flow_integrator import FlowIntegrator
+from functions.periodic_scheduler import PeriodicScheduler
+from functions.structured_log import get_logger
+from functions.volume_estimator import VolumeEstimator
 from mqtt.mqtt_publisher import mqtt_publisher
 
+log = get_logger(__name__)
+
 class FlowMonitor:
-    def __init__(self, target_liters: float, connector, pump_relay_pin: int = 18, publisher: mqtt_publisher = None, stop_event=None):
+    def __init__(self, target_liters: float, connector, pump_relay_pin: int = 18, publisher: mqtt_publisher = None, stop_event=None, flow_window: int = 4, sample_rate_hz: float = 4.0, cutoff_predictor: CutoffPredictor | None = None, coast_timeout: float = 5.0, volume_estimator: VolumeEstimator | None = None, adaptive_rate: AdaptiveRate | None = None):
         """
         Initializes the flow monitor.
 
@@ -12,6 +20,14 @@ class FlowMonitor:
         :param connector: An instance of Mag6000Connector.
         :param pump_relay_pin: The GPIO pin for the pump relay.
         :param publisher: An instance of mqtt_publisher for publishing temperature progress.
+        :param flow_window: Number of samples the reported flow rate is averaged over.
+        :param sample_rate_hz: How many times per second the flow is sampled.
+        :param cutoff_predictor: Switches the pump off early by the predicted coast volume,
+            or None to switch it off 50 ml before the target.
+        :param coast_timeout: With a cutoff predictor, how long to wait for the flow to stop for the final volume.
+        :param volume_estimator: Fuses the totalizer and the flow rate into the volume,
+            or None to take the larger of the two.
+        :param adaptive_rate: Samples faster as the cutoff comes closer, or None to sample at sample_rate_hz throughout.
         """
         self.publisher = publisher
         self.target_liters = target_liters
@@ -20,6 +36,19 @@ class FlowMonitor:
         self.reader = Mag6000Reader(connector) # Instantiate the reader that will be used for reading values.
         self.pump_controller = RelayController(pump_relay_pin) # Initialize the relay controller for the pump
         self._stop_event = stop_event
+        self.integrator = FlowIntegrator(window=flow_window) # Integrates the flow rate into a volume
+        self.sample_rate_hz = sample_rate_hz
+        self.scheduler: PeriodicScheduler | None = None # Paces the monitoring loop, created for each run
+        self.cutoff_predictor = cutoff_predictor
+        self.coast_timeout = coast_timeout
+        self.volume_estimator = volume_estimator
+        self.adaptive_rate = adaptive_rate
+        # Final volume minus the target of the last run, or None if it did not complete
+        self.cutoff_error: float | None = None
+        # Monotonic time of the first sample of the last run, the baseline totalizer read
+        self.first_sample_at: float | None = None
+        # Every record of the run carries its target
+        self.log = log.bind(target_liters=target_liters)
 
     def run(self) -> float | None:
         """
@@ -30,85 +59,151 @@ class FlowMonitor:
 
         # Get the baseline and target totalizer values via the reader
         started = False
+        self.cutoff_error = None
         baseline_total = self.reader.read_totalizer()
-        volume_moved = 0.0
-        prev_timestamp = time.time()
-        recorded_flow_rates = []
+        self.first_sample_at = time.monotonic()
+        self.integrator.reset()
 
         # Start the pump
-        print("START PUMP")
+        self.log.info("START PUMP")
         self.pump_controller.toggle_relay(True)
-
-        last_flow_time = time.time()
-        # Wait for the flow to start
+        # The flow is zero when the pump starts, so integrate from there
+        self.integrator.add(0.0, time.monotonic())
+        if self.volume_estimator is not None:
+            self.volume_estimator.reset(time.monotonic())
+
+        last_flow_time = time.monotonic()
+        # Wait for the flow to start, checking at the same rate as the monitoring loop
+        start_scheduler = PeriodicScheduler(self.sample_rate_hz, self._stop_event)
         while not started:
+            # Stop the pump if a stop signal arrives before the flow has started
+            if not start_scheduler.wait():
+                self.pump_controller.toggle_relay(False)
+                return None
             current_total = self.reader.read_totalizer()
             # If the totalizer has moved, we can assume that the flow has started
             if current_total > baseline_total:
                 started = True
-                last_flow_time = time.time()
-                print("Flow has started")
+                last_flow_time = time.monotonic()
+                self.log.info("Flow has started")
             # If the totalizer has not moved for 10 seconds, abort
-            elif time.time() - last_flow_time > 10:
-                print("ERROR: No flow detected for 10 seconds after starting the pump. Aborting execution.")
+            elif time.monotonic() - last_flow_time > 10:
+                self.log.error("No flow detected for 10 seconds after starting the pump. Aborting execution.")
                 self.pump_controller.toggle_relay(False)
                 return None
-            time.sleep(0.1)
+
+        # Totalizer relative to baseline, which is kept if a read fails
+        current_total = 0.0
 
         # Main monitoring loop
+        self.scheduler = PeriodicScheduler(self.sample_rate_hz, self._stop_event, name="flow")
+        # Log the progress and the no-flow warning once per second of ticks, not on every tick
+        every = max(1, round(self.sample_rate_hz))
         while started:
-            # Check for stop signal
-            if self._stop_event and self._stop_event.is_set():
+            # Wait for the next sample, and check for stop signal
+            if not self.scheduler.wait():
                 self.pump_controller.toggle_relay(False)
                 return None
 
-            current_timestamp = time.time()
-            elapsed_time = current_timestamp - prev_timestamp
-            prev_timestamp = current_timestamp
-
-            flow_rate = self.reader.read_flow_rate()
-
-            # Append current flow rate to the array and average it
-            recorded_flow_rates.append(flow_rate)
-            average_flow_rate = sum(recorded_flow_rates) / len(recorded_flow_rates)
-
-            # Update the total volume moved using the current flow rate (convert L/h to L/s)
-            volume_moved += (average_flow_rate / 3600.0) * elapsed_time
+            current_timestamp = time.monotonic()
+            # Age of the flow sample when the pump is switched, the read is taken as halfway through
+            latency = 0.0
 
-            # Read the current totalizer value relative to baseline
-            current_total = self.reader.read_totalizer() - baseline_total
-
-            # The sensor totalizer updates in jumps, which may lag behind actual flow.
-            # Meanwhile, the instantaneous flow rate provides continuous data that is integrated over time.
-            # By taking the maximum of the totalizer reading (adjusted to baseline) and the integrated flow,
-            # we have a better chance of getting the actual newest volume.
-            highest_volume = max(current_total, volume_moved)
-
-            print(f"Progress: {highest_volume:.2f} out of {self.target_liters:.2f} liters passed")
+            # Read flow rate and totalizer in a single Modbus transaction
+            snapshot = self.reader.read_snapshot()
+            if snapshot is None:
+                # Treat a failed read as no flow, and keep the previous totalizer value
+                flow_rate = 0.0
+                volume_moved = self.integrator.volume_liters
+            else:
+                flow_rate = snapshot.flow_rate_lph
+                # Integrate the flow rate over the time since the previous sample
+                volume_moved = self.integrator.add(flow_rate, snapshot.timestamp)
+                # Read the current totalizer value relative to baseline
+                current_total = snapshot.totalizer_liters - baseline_total
+                latency = time.monotonic() - (current_timestamp + snapshot.timestamp) / 2
+                if self.volume_estimator is not None:
+                    self.volume_estimator.update(snapshot.timestamp, flow_rate, current_total)
+
+            if self.volume_estimator is not None:
+                # The estimator weighs the totalizer steps against the integrated flow
+                estimate = self.volume_estimator.estimate()
+                highest_volume = estimate.volume_liters
+                bounds = {"lower_liters": estimate.lower_liters, "upper_liters": estimate.upper_liters}
+            else:
+                # The sensor totalizer updates in jumps, which may lag behind actual flow.
+                # Meanwhile, the instantaneous flow rate provides continuous data that is integrated over time.
+                # By taking the maximum of the totalizer reading (adjusted to baseline) and the integrated flow,
+                # we have a better chance of getting the actual newest volume.
+                highest_volume = max(current_total, volume_moved)
+                bounds = {}
+            self.log.info("Progress", every=every, liters=highest_volume, flow_lph=self.integrator.flow_lph, **bounds)
             # Publish the current volume to MQTT
             self.publisher.publish_flow_progress(highest_volume)
 
             # Check if the flow rate is above the threshold of water moving
             if flow_rate > self.flow_threshold:
-                print(f"Flow going at {flow_rate:.2f} l/h")
                 last_flow_time = current_timestamp  # update the last time flow was detected
             else:
                 # If the flow rate is below the threshold, check if we have been waiting for 10 seconds without flow
-                print("ERROR SIGNAL: No flow detected. Waiting 10 seconds before aborting.")
+                self.log.warning("No flow detected. Waiting 10 seconds before aborting.", every=every)
                 # If we have not seen flow for 10 seconds, stop the pump
                 if last_flow_time is not None and (current_timestamp - last_flow_time > 10):
-                    print("ERROR: No flow detected for more than 10 seconds. Aborting.")
+                    self.log.error("No flow detected for more than 10 seconds. Aborting.")
                     self.pump_controller.toggle_relay(False)
                     return None
 
+            if self.adaptive_rate is not None:
+                # Volume still to go until the pump is switched off, and sample faster as it gets less
+                if self.cutoff_predictor is not None:
+                    remaining = self.target_liters - highest_volume - self.cutoff_predictor.remaining_liters(flow_rate, latency)
+                else:
+                    remaining = self.target_liters - 0.05 - highest_volume
+                self.scheduler.rate_hz = self.adaptive_rate.rate_hz(remaining, flow_rate / 3600.0)
+
+            if self.cutoff_predictor is not None:
+                # Switch off early, by the volume that still arrives once the pump is off
+                delay = self.cutoff_predictor.cutoff_delay(highest_volume, flow_rate, self.target_liters, latency, self.scheduler.period)
+                if delay is not None:
+                    # The target is reached before the next sample, so switch off in between
+                    if delay > 0:
+                        time.sleep(delay)
+                        highest_volume += flow_rate / 3600.0 * delay
+                    self.pump_controller.toggle_relay(False)
+                    self.log.info("FINISHED: Predicted to reach the target.", liters=highest_volume)
+                    self.cutoff_predictor.record_cutoff(highest_volume, flow_rate, latency)
+                    measured = self.volume_estimator.volume_liters if self.volume_estimator is not None else max(current_total, volume_moved)
+                    final_volume = self._wait_for_coast(baseline_total, measured)
+                    self.cutoff_predictor.learn(final_volume)
+                    self.log.info("Coast", coast_seconds=self.cutoff_predictor.coast_seconds, liters=final_volume)
+                    self.cutoff_error = final_volume - self.target_liters
+                    return final_volume
+
             # Check if the target volume has been reached, within a tolerance of 50ml
-            if highest_volume >= self.target_liters - 0.05:
+            elif highest_volume >= self.target_liters - 0.05:
                 # Turn off the pump, and return the volume moved
                 self.pump_controller.toggle_relay(False)
-                print("FINISHED: Target reached.")
+                self.log.info("FINISHED: Target reached.", liters=highest_volume)
+                self.cutoff_error = highest_volume - self.target_liters
                 return highest_volume
 
-            time.sleep(0.25)
-
         # Return false if execution fails
-        return None
\ No newline at end of file
+        return None
+
+    def _wait_for_coast(self, baseline_total: float, volume: float) -> float:
+        """Wait until the flow has stopped after the pump is switched off, and return the final volume."""
+        deadline = time.monotonic() + self.coast_timeout
+        # The stop event is not passed on, as the pump is already off
+        scheduler = PeriodicScheduler(self.sample_rate_hz)
+        while time.monotonic() < deadline:
+            scheduler.wait()
+            snapshot = self.reader.read_snapshot()
+            if snapshot is None:
+                continue
+            if self.volume_estimator is not None:
+                volume = self.volume_estimator.update(snapshot.timestamp, snapshot.flow_rate_lph, snapshot.totalizer_liters - baseline_total).volume_liters
+            else:
+                volume = max(volume, snapshot.totalizer_liters - baseline_total, self.integrator.add(snapshot.flow_rate_lph, snapshot.timestamp))
+            if snapshot.flow_rate_lph <= self.flow_threshold:
+                break
+        return volume
\ No newline at end of file
@@ -1,64 +1,156 @@
 import time
+
 from devices.relay.relay_controller import RelayController
-from devices.ds18b20.ds18b20_reader import DS18B20Reader, DS18B20Error
+from devices.ds18b20.ds18b20_reader import DS18B20Error
+from devices.ds18b20.ds18b20_sampler import DS18B20Sampler
+from functions.adaptive_rate import AdaptiveRate
+from functions.heater_control import BangBangController, HeaterController
+from functions.periodic_scheduler import PeriodicScheduler
+from functions.structured_log import get_logger
 from mqtt.mqtt_publisher import mqtt_publisher
 
+log = get_logger(__name__)
+
 class Heater:
-    def __init__(self, target_temperature=100, kettle_relay_pin: int = 17, publisher: mqtt_publisher = None, stop_event=None):
+    def __init__(self, target_temperature=100, kettle_relay_pin: int = 17, publisher: mqtt_publisher = None, stop_event=None, sample_rate_hz: float = 10.0, sensor_id: str | None = None, sampler: DS18B20Sampler | None = None, max_sample_age: float = 5.0, controller: HeaterController | None = None, hold_seconds: float = 0.0, adaptive_rate: AdaptiveRate | None = None):
         """
         Initializes the heater.
         :param target_temperature: The target temperature in Celsius.
         :param kettle_relay_pin: The GPIO pin for the kettle relay.
         :param publisher: An instance of mqtt_publisher for publishing temperature progress.
+        :param sample_rate_hz: How many times per second the temperature is checked.
+        :param sensor_id: The DS18B20 sensor of the kettle, or None for the first sensor found.
+        :param sampler: Background sampler that reads the sensor, or None to start one for this run.
+        :param max_sample_age: Seconds without a new temperature sample before heating stops.
+            Older samples, and those taken before the run started, are not used.
+        :param controller: Decides when the relay is on, or None to heat until the target is reached.
+        :param hold_seconds: How long to keep the temperature at the target once it is reached.
+        :param adaptive_rate: Checks the temperature more often as the target comes closer,
+            or None to check at sample_rate_hz throughout.
         """
         self.publisher = publisher
         self._stop_event = stop_event
         self.target_temperature = target_temperature
         self.relay_controller = RelayController(kettle_relay_pin)
-        self.temp_sensor = DS18B20Reader()
+        self.sensor_id = sensor_id
+        # The sensor is read in the background, so the loop never waits for a conversion
+        self._owns_sampler = sampler is None
+        self.sampler = sampler or DS18B20Sampler([sensor_id])
+        self.sampler.add_sensor(sensor_id)
+        self.max_sample_age = max_sample_age
+        self.controller = controller or BangBangController()
+        self.hold_seconds = hold_seconds
+        # Number of times the relay was switched during the run, the relay wears with each switch
+        self.switch_count = 0
         self.is_heating = False
+        self.sample_rate_hz = sample_rate_hz
+        self.scheduler: PeriodicScheduler | None = None # Paces the heating loop, created for each run
+        self.adaptive_rate = adaptive_rate
+        # Final temperature minus the target of the last run, or None if it did not complete
+        self.cutoff_error: float | None = None
+        # Every record of the run carries its target
+        self.log = log.bind(target_c=target_temperature)
 
     def run(self) -> float | None:
         # Start the heater
-        print("START HEATER")
+        self.log.info("START HEATER")
         self.relay_controller.toggle_relay(True)
         self.is_heating = True
+        self.scheduler = PeriodicScheduler(self.sample_rate_hz, self._stop_event, name="heat")
+        if self._owns_sampler:
+            self.sampler.start()
+        # Sequence of the last sample used, and when it was taken
+        last_sequence = -1
+        started = last_sample_time = time.monotonic()
+        relay_on = True
+        self.switch_count = 0
+        # When the target was first reached
+        reached_at = None
+        self.cutoff_error = None
+        # Previous temperature, and how fast it rises in °C per second
+        last_temp = None
+        slope = 0.0
+        self.controller.start(self.target_temperature, last_sample_time)
+        # Log the temperature once per second of ticks, not on every tick
+        every = max(1, round(self.sample_rate_hz))
 
         try:
             while self.is_heating:
-                # Check for stop signal
-                if self._stop_event and self._stop_event.is_set():
-                    print("Batch stopped by user.")
+                # Wait for the next sample, and check for stop signal
+                if not self.scheduler.wait():
+                    self.log.info("Batch stopped by user.")
                     # Stop the heater and return none
                     self.is_heating = False
                     self.relay_controller.toggle_relay(False)
                     return None
 
-                # Read the current temperature
-                current_temp = self.temp_sensor.read_temp_c()
-                print(f"Current temperature: {current_temp:.2f} °C")
+                # Take the latest temperature sample, and wait for the next tick if there is no new one.
+                # A shared sampler keeps the last good sample after failed reads, so samples taken
+                # before this run or too long ago are not used
+                sample = self.sampler.latest(self.sensor_id)
+                if (
+                    sample is None
+                    or sample.sequence == last_sequence
+                    or sample.timestamp < started
+                    or time.monotonic() - sample.timestamp > self.max_sample_age
+                ):
+                    self._check_sample_age(last_sample_time)
+                    continue
+                last_sequence = sample.sequence
+                last_sample_time = sample.timestamp
+                current_temp = sample.temp_c
+                self.log.info("Current temperature", every=every, temp_c=current_temp, relay_on=relay_on)
                 # Publish the current temperature to MQTT
                 self.publisher.publish_temp_progress(current_temp)
 
+                if self.adaptive_rate is not None:
+                    if last_temp is not None and sample.timestamp > last_temp[1]:
+                        # Smooth the rise, the sensor reports in steps
+                        rise = (current_temp - last_temp[0]) / (sample.timestamp - last_temp[1])
+                        slope += 0.3 * (rise - slope)
+                    last_temp = (current_temp, sample.timestamp)
+                    self.scheduler.rate_hz = self.adaptive_rate.rate_hz(self.target_temperature - current_temp, slope)
+
                 # Check if the current temperature is equal to orabove the target temperature
-                if current_temp >= self.target_temperature:
-                    print("Target temperature reached. Stopping heater.")
+                if reached_at is None and current_temp >= self.target_temperature:
+                    reached_at = sample.timestamp
+                if reached_at is not None and sample.timestamp - reached_at >= self.hold_seconds:
+                    self.log.info("Target temperature reached. Stopping heater.", temp_c=current_temp)
                     # Stop the heater
-                    self.relay_controller.toggle_relay(False)
+                    if relay_on:
+                        self.relay_controller.toggle_relay(False)
+                        self.switch_count += 1
                     self.is_heating = False
                 else:
-                    # If the target temperature is not reached, keep heating
-                    print("Heating...")
-                    # Check temperature every 0.1 seconds
-                    time.sleep(0.1)
+                    # Let the controller decide whether to keep heating
+                    heating = self.controller.update(current_temp, sample.timestamp)
+                    if heating != relay_on:
+                        self.relay_controller.toggle_relay(heating)
+                        self.switch_count += 1
+                        relay_on = heating
+                    self.log.debug("Heating..." if heating else "Coasting...", temp_c=current_temp)
 
             # Done - return the current temperature
-            return self.temp_sensor.read_temp_c()
+            final_temp = self.sampler.latest(self.sensor_id).temp_c
+            self.cutoff_error = final_temp - self.target_temperature
+            return final_temp
 
         # If the temperature sensor fails, stop heating
         except DS18B20Error as exc:
-            print(f"Error reading temperature: {exc}")
+            self.log.error("Error reading temperature", error=str(exc))
             # Stop the heater and return none
             self.relay_controller.toggle_relay(False)
             self.is_heating = False
             return None
+
+        finally:
+            self.controller.finish(time.monotonic())
+            if self._owns_sampler:
+                # Do not wait for a conversion in progress, the thread ends after it
+                self.sampler.stop(timeout=0)
+
+    def _check_sample_age(self, last_sample_time: float):
+        """Raise DS18B20Error if the sensor has not delivered a sample for too long."""
+        if time.monotonic() - last_sample_time > self.max_sample_age:
+            error = self.sampler.error(self.sensor_id)
+            raise DS18B20Error(str(error) if error else "No new temperature sample.")
@@ -0,0 +1,242 @@
+"""
+Controllers that decide when the kettle relay is on.
+
+Heater feeds each new temperature sample to its controller, and switches the
+relay to what the controller returns. The kettle element keeps heating the
+water after the relay opens, and the sensor lags behind the water, so a
+controller that only switches off at the target overshoots it.
+
+- BangBangController: on below the target, off at the target. The original behavior.
+- PidController: time-proportioning PID, the relay is on for a share of each cycle.
+- PredictiveController: switches off early, by the temperature rise that a
+  first-order-plus-dead-time model of the kettle predicts after switch-off.
+"""
+from __future__ import annotations
+
+from collections import deque
+
+
+class HeaterController:
+    """Base class of the controllers. Subclasses implement update()."""
+
+    name = ""
+
+    def start(self, target_c: float, now: float) -> None:
+        """Called when the heater starts, with the relay switched on."""
+        self.target_c = target_c
+
+    def update(self, temp_c: float, now: float) -> bool:
+        """Return True to keep the relay on, given a new temperature sample taken at *now* seconds."""
+        raise NotImplementedError
+
+    def finish(self, now: float) -> None:
+        """Called when the heater stops, successful or not."""
+
+
+class BangBangController(HeaterController):
+    """Keeps the relay on until the target is reached."""
+
+    name = "bang-bang"
+
+    def update(self, temp_c: float, now: float) -> bool:
+        return temp_c < self.target_c
+
+
+class PidController(HeaterController):
+    """
+    Time-proportioning PID controller.
+
+    The PID output is a duty cycle between 0 and 1. The relay is on for that
+    share of each cycle, which keeps the number of switches down to two per
+    cycle at most. The derivative acts on the measurement, over the whole last
+    cycle, which smooths out the steps of the sensor. The integral only
+    accumulates while the output is not saturated.
+    """
+
+    name = "pid"
+
+    def __init__(
+        self,
+        kp: float = 0.15,
+        ki: float = 0.002,
+        kd: float = 1.0,
+        cycle_seconds: float = 2.0,
+        min_switch_seconds: float = 0.2,
+    ) -> None:
+        """
+        :param kp: Duty cycle per °C below the target.
+        :param ki: Duty cycle per °C·s below the target.
+        :param kd: Duty cycle per °C/s rise of the temperature, subtracted.
+        :param cycle_seconds: Length of one on/off cycle.
+        :param min_switch_seconds: Duty cycles shorter than this, on or off, are rounded away.
+        """
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.cycle_seconds = cycle_seconds
+        self.min_switch_seconds = min_switch_seconds
+        self.duty = 1.0
+
+    def start(self, target_c: float, now: float) -> None:
+        super().start(target_c, now)
+        self._integral = 0.0
+        self._last: tuple[float, float] | None = None
+        self._cycle_start = now
+        # First sample of the cycle, for the rate of change over the cycle
+        self._cycle_first: tuple[float, float] | None = None
+        self.duty = 1.0
+
+    def update(self, temp_c: float, now: float) -> bool:
+        error = self.target_c - temp_c
+        # Only integrate while the output can still follow
+        if self._last is not None and 0.0 < self.duty < 1.0:
+            self._integral += error * (now - self._last[0])
+        self._last = (now, temp_c)
+        if self._cycle_first is None:
+            self._cycle_first = (now, temp_c)
+
+        # Start a new cycle with the latest duty
+        if now - self._cycle_start >= self.cycle_seconds:
+            first_time, first_temp = self._cycle_first
+            rate = (temp_c - first_temp) / (now - first_time) if now > first_time else 0.0
+            self._cycle_start = now
+            self._cycle_first = (now, temp_c)
+            output = self.kp * error + self.ki * self._integral - self.kd * rate
+            self.duty = min(1.0, max(0.0, output))
+        on_seconds = self.duty * self.cycle_seconds
+        if on_seconds < self.min_switch_seconds:
+            return False
+        if self.cycle_seconds - on_seconds < self.min_switch_seconds:
+            return True
+        return now - self._cycle_start < on_seconds
+
+
+class PredictiveController(HeaterController):
+    """
+    Switches the relay off when the temperature predicted after switch-off reaches the target.
+
+    The kettle is modelled as first order plus dead time: while heating, the
+    sensor rises at a steady slope once the dead time and the time constant of
+    the element and sensor have passed. After switch-off, the temperature keeps
+    rising by about slope × (dead time + time constant), the lag.
+
+    The slope is measured during the lot, as it depends on the amount of water.
+    The dead time and time constant are properties of the kettle. They are
+    identified from the step response at the start of each lot: the dead time
+    is the delay until the first rise, and the asymptote of the rising
+    temperature crosses the starting temperature one lag after switch-on. The
+    lags of past lots are averaged, so the controller improves from lot to lot.
+    """
+
+    name = "predictive"
+
+    def __init__(
+        self,
+        lag_seconds: float = 5.0,
+        window_seconds: float = 4.0,
+        learning_rate: float = 0.5,
+        aim_above_c: float = 0.2,
+        band_c: float = 0.3,
+    ) -> None:
+        """
+        :param lag_seconds: Lag to assume until one has been identified.
+        :param window_seconds: Samples over which the slope is measured.
+        :param learning_rate: Weight of the latest lot in the lag average.
+        :param aim_above_c: Aim this far above the target, so the slow end of the rise still reaches it.
+        :param band_c: Switch back on when the predicted temperature is this far below the target.
+        """
+        self.lag_seconds = lag_seconds
+        self.window_seconds = window_seconds
+        self.learning_rate = learning_rate
+        self.aim_above_c = aim_above_c
+        self.band_c = band_c
+        # Identified from past lots
+        self.dead_time: float | None = None
+        self.time_constant: float | None = None
+        self.lots_learned = 0
+
+    def start(self, target_c: float, now: float) -> None:
+        super().start(target_c, now)
+        self._on_since = now
+        self._relay_on = True
+        # Still heating from the first switch-on, so the samples are a clean step response
+        self._step = True
+        self._start_temp: float | None = None
+        self._first_rise: float | None = None
+        self._lot_lag: float | None = None
+        self._samples: deque[tuple[float, float]] = deque()
+
+    def slope(self) -> float | None:
+        """Least-squares slope of the samples in the window in °C/s, or None without enough samples."""
+        if len(self._samples) < 3 or self._samples[-1][0] - self._samples[0][0] < self.window_seconds / 2:
+            return None
+        count = len(self._samples)
+        mean_t = sum(t for t, _ in self._samples) / count
+        mean_c = sum(c for _, c in self._samples) / count
+        spread = sum((t - mean_t) ** 2 for t, _ in self._samples)
+        if spread == 0:
+            return None
+        return sum((t - mean_t) * (c - mean_c) for t, c in self._samples) / spread
+
+    @property
+    def lag(self) -> float:
+        """Lag used for the prediction: from past lots, else from this lot, else the initial guess."""
+        if self.lots_learned:
+            return self.lag_seconds
+        return self._lot_lag if self._lot_lag is not None else self.lag_seconds
+
+    def update(self, temp_c: float, now: float) -> bool:
+        self._samples.append((now, temp_c))
+        while now - self._samples[0][0] > self.window_seconds:
+            self._samples.popleft()
+        if self._start_temp is None:
+            self._start_temp = temp_c
+        # Two steps of the 12-bit sensor, to not mistake noise for the first rise
+        if self._first_rise is None and temp_c >= self._start_temp + 0.125:
+            self._first_rise = now
+
+        slope = self.slope()
+        if slope is None:
+            return self._relay_on
+        rising_long_enough = self._first_rise is not None and now - self._first_rise >= self.window_seconds
+        if self._step and slope > 0 and rising_long_enough:
+            # Where the asymptote crosses the starting temperature
+            self._lot_lag = (now - self._on_since) - (temp_c - self._start_temp) / slope
+
+        predicted = temp_c + max(slope, 0.0) * self.lag
+        aim = self.target_c + self.aim_above_c
+        if self._relay_on and predicted >= aim:
+            self._relay_on = False
+            self._step = False
+        elif not self._relay_on and predicted < aim - self.band_c:
+            self._relay_on = True
+        return self._relay_on
+
+    def finish(self, now: float) -> None:
+        if self._lot_lag is None or self._first_rise is None:
+            return
+        dead_time = self._first_rise - self._on_since
+        if self._lot_lag <= dead_time:
+            return
+        if self.lots_learned:
+            self.lag_seconds += self.learning_rate * (self._lot_lag - self.lag_seconds)
+        else:
+            self.lag_seconds = self._lot_lag
+        self.lots_learned += 1
+        self.dead_time = dead_time if self.dead_time is None else self.dead_time + self.learning_rate * (dead_time - self.dead_time)
+        self.time_constant = max(0.0, self.lag_seconds - self.dead_time)
+
+
+CONTROLLERS = {
+    BangBangController.name: BangBangController,
+    PidController.name: PidController,
+    PredictiveController.name: PredictiveController,
+}
+
+
+def make_controller(name: str) -> HeaterController:
+    """Create the controller called *name*. Raises ValueError for an unknown name."""
+    try:
+        return CONTROLLERS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown heater control {name!r}, expected one of {', '.join(CONTROLLERS)}") from None
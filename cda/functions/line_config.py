@@ -0,0 +1,102 @@
+"""
+Hardware of each filling line driven by this CDA.
+
+A line has its own pump and kettle relays, flow gauge and temperature sensor.
+The flow gauges of all lines share the RS485 bus on FLOW_GAUGE_PORT, each with
+its own Modbus address. Lines are configured in the environment:
+
+    LINES=1,2
+    LINE_1_PUMP_RELAY_PIN=18
+    LINE_1_KETTLE_RELAY_PIN=17
+    LINE_1_FLOW_GAUGE_ADDRESS=1
+    LINE_1_TEMP_SENSOR_ID=28-000000000001
+    LINE_2_...
+
+Without LINES, the single line of PUMP_RELAY_PIN and KETTLE_RELAY_PIN is used
+for every order, whatever its line number.
+
+A line with a separate fill vessel and heat vessel also has a transfer relay,
+which moves the water of a filled lot into the heat vessel. Such a line is
+pipelined: the next lot fills while the last one heats.
+
+    LINE_1_TRANSFER_RELAY_PIN=27
+    LINE_1_TRANSFER_SECONDS=20
+"""
+from __future__ import annotations
+
+import os
+from typing import Mapping, NamedTuple
+
+
+class LineConfig(NamedTuple):
+    # Line number of the orders, or None for the single line that takes every order
+    line: int | None
+    pump_relay_pin: int
+    kettle_relay_pin: int
+    flow_gauge_address: int = 1
+    # DS18B20 sensor of the kettle, or None for the first sensor found
+    temp_sensor_id: str | None = None
+    # Relay that moves the water from the fill vessel into the kettle, or None if the pump fills the kettle
+    transfer_relay_pin: int | None = None
+    # How long the transfer relay stays on
+    transfer_seconds: float = 0.0
+
+    @property
+    def pipelined(self) -> bool:
+        """True if the line has a separate fill vessel, so the next lot can fill while the last one heats."""
+        return self.transfer_relay_pin is not None
+
+    @property
+    def relay_pins(self) -> list[int]:
+        pins = [self.pump_relay_pin, self.kettle_relay_pin]
+        if self.transfer_relay_pin is not None:
+            pins.append(self.transfer_relay_pin)
+        return pins
+
+
+def _optional_int(value: str | None) -> int | None:
+    return int(value) if value else None
+
+
+def load_line_configs(environ: Mapping[str, str] = os.environ) -> dict[int | None, LineConfig]:
+    """Read the lines from the environment, by line number. Raises ValueError for missing settings."""
+    lines = environ.get("LINES", "").strip()
+    if not lines:
+        return {None: LineConfig(
+            line=None,
+            pump_relay_pin=int(environ["PUMP_RELAY_PIN"]),
+            kettle_relay_pin=int(environ["KETTLE_RELAY_PIN"]),
+            flow_gauge_address=int(environ.get("FLOW_GAUGE_ADDRESS", "1")),
+            temp_sensor_id=environ.get("TEMP_SENSOR_ID") or None,
+            transfer_relay_pin=_optional_int(environ.get("TRANSFER_RELAY_PIN")),
+            transfer_seconds=float(environ.get("TRANSFER_SECONDS", "0")),
+        )}
+
+    configs: dict[int | None, LineConfig] = {}
+    for value in lines.split(","):
+        line = int(value)
+        prefix = f"LINE_{line}_"
+        try:
+            configs[line] = LineConfig(
+                line=line,
+                pump_relay_pin=int(environ[prefix + "PUMP_RELAY_PIN"]),
+                kettle_relay_pin=int(environ[prefix + "KETTLE_RELAY_PIN"]),
+                flow_gauge_address=int(environ.get(prefix + "FLOW_GAUGE_ADDRESS", str(line))),
+                temp_sensor_id=environ.get(prefix + "TEMP_SENSOR_ID") or None,
+                transfer_relay_pin=_optional_int(environ.get(prefix + "TRANSFER_RELAY_PIN")),
+                transfer_seconds=float(environ.get(prefix + "TRANSFER_SECONDS", "0")),
+            )
+        except KeyError as exc:
+            raise ValueError(f"Missing setting {exc.args[0]} for line {line}") from exc
+
+    # Two lines must not share a relay or a flow gauge
+    pins = [pin for config in configs.values() for pin in config.relay_pins]
+    if len(set(pins)) != len(pins):
+        raise ValueError("Each line needs its own relay pins")
+    addresses = [config.flow_gauge_address for config in configs.values()]
+    if len(set(addresses)) != len(addresses):
+        raise ValueError("Each line needs its own flow gauge address")
+    sensors = [config.temp_sensor_id for config in configs.values()]
+    if len(configs) > 1 and (None in sensors or len(set(sensors)) != len(sensors)):
+        raise ValueError("Each line needs its own LINE_<n>_TEMP_SENSOR_ID")
+    return configs
@@ -0,0 +1,255 @@
+"""
+Runs the lots of several lines at the same time.
+
+Each configured line has a worker thread with its own queue of orders, so a lot
+on one line never waits for a lot on another line. Orders for a busy line wait
+in that line's queue, by priority, and in the order they arrived within a priority.
+
+A pipelined line, with a separate fill vessel and heat vessel, has two workers.
+The fill worker fills a lot, waits until the heat vessel is free, transfers the
+water and hands the lot to the heat worker. It then fills the next lot while
+the heat worker heats the last one.
+"""
+from __future__ import annotations
+
+import itertools
+import threading
+from queue import PriorityQueue, Queue
+from typing import TYPE_CHECKING, Callable
+
+from functions.line_config import LineConfig
+
+if TYPE_CHECKING:
+    # Only for annotations, so the scheduler can be used without the device code
+    from functions.lot_runner import Lot, LotRunner
+
+# Put in a queue to stop its worker
+_STOP = object()
+
+
+class LineScheduler:
+    """Hands orders to the worker of their line."""
+
+    def __init__(
+        self,
+        configs: dict[int | None, LineConfig],
+        run_lot: Callable[[LineConfig, dict], None],
+        stages: LotRunner | None = None,
+    ) -> None:
+        """
+        :param configs: The lines by line number, as returned by load_line_configs().
+        :param run_lot: Runs one order on a line, called from the worker thread of the line.
+        :param stages: Runs the stages of a lot on pipelined lines, or None to run every line with run_lot.
+        """
+        self.configs = configs
+        self._run_lot = run_lot
+        self._stages = stages
+        # Orders waiting for their line, as (priority, arrival, order)
+        self._queues: dict[int | None, PriorityQueue] = {line: PriorityQueue() for line in configs}
+        self._arrivals = itertools.count()
+        # Lots filled and transferred, waiting for the heat worker of a pipelined line
+        self._handoffs: dict[int | None, Queue] = {line: Queue() for line in configs if self.pipelined(line)}
+        # Taken by a lot from its transfer into the heat vessel until it has been heated
+        self._vessels = {line: threading.Semaphore(1) for line in self._handoffs}
+        # The running orders of each line, by stage
+        self._busy: dict[int | None, dict[str, dict]] = {line: {} for line in configs}
+        self._lock = threading.Lock()
+        self._threads: list[threading.Thread] = []
+        self.completed = 0
+
+    def pipelined(self, line: int | None) -> bool:
+        """True if the next lot of *line* fills while the last one heats."""
+        return self._stages is not None and self.configs[line].pipelined
+
+    def start(self) -> None:
+        for line in self.configs:
+            if self.pipelined(line):
+                workers = [(self._fill_worker, f"line-{line}-fill"), (self._heat_worker, f"line-{line}-heat")]
+            else:
+                workers = [(self._worker, f"line-{line}")]
+            for target, name in workers:
+                thread = threading.Thread(target=target, args=(line,), name=name, daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def config_for(self, order: dict) -> LineConfig | None:
+        """The line that runs *order*, or None if its line is not configured."""
+        if None in self.configs:
+            return self.configs[None]
+        try:
+            return self.configs.get(int(order["line"]))
+        except (TypeError, ValueError):
+            return None
+
+    def submit(self, order: dict, priority: int = 0) -> bool:
+        """
+        Queue *order* on its line, ahead of waiting orders with a higher *priority*.
+        Returns False if the line is not configured here.
+        """
+        config = self.config_for(order)
+        if config is None:
+            return False
+        self._queues[config.line].put((priority, next(self._arrivals), order))
+        return True
+
+    def busy_lines(self) -> dict[int | None, str]:
+        """The lot numbers of the lots running right now, by line. A pipelined line shows its oldest lot."""
+        with self._lock:
+            return {
+                line: (stages.get("heat") or stages.get("run") or stages["fill"])["lot_number"]
+                for line, stages in self._busy.items()
+                if stages
+            }
+
+    def busy_lots(self) -> dict[str, tuple[int | None, str]]:
+        """The line and stage of the lots running right now, by lot number."""
+        with self._lock:
+            return {
+                order["lot_number"]: (line, stage)
+                for line, stages in self._busy.items()
+                for stage, order in stages.items()
+            }
+
+    def load(self, order: dict) -> int:
+        """
+        Number of orders that would start before *order* on its line: the waiting ones, and the running one.
+        On a pipelined line, only a lot in the fill vessel counts, as the next lot can fill while the last one heats.
+        """
+        config = self.config_for(order)
+        if config is None:
+            return 0
+        with self._lock:
+            stages = self._busy[config.line]
+            running = int("run" in stages or "fill" in stages)
+        return self._queues[config.line].qsize() + running
+
+    def pending(self) -> int:
+        """Number of orders waiting for their line."""
+        return sum(queue.qsize() for queue in self._queues.values())
+
+    def wait_idle(self, timeout: float | None = None) -> bool:
+        """Block until every queued order has finished. Returns False on timeout."""
+        finished = threading.Event()
+
+        def _wait():
+            # Orders leave the queue of a pipelined line once they are handed to its heat worker
+            for queue in [*self._queues.values(), *self._handoffs.values()]:
+                queue.join()
+            finished.set()
+
+        threading.Thread(target=_wait, daemon=True).start()
+        return finished.wait(timeout)
+
+    def shutdown(self, timeout: float | None = None) -> None:
+        """
+        Stop the workers, waiting up to *timeout* seconds for each running lot to end.
+        Orders that have not started are discarded.
+        """
+        for queue in self._queues.values():
+            while not queue.empty():
+                queue.get_nowait()
+                queue.task_done()
+            # The fill worker of a pipelined line passes it on to the heat worker
+            queue.put((float("-inf"), next(self._arrivals), _STOP))
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _worker(self, line: int | None) -> None:
+        config = self.configs[line]
+        queue = self._queues[line]
+        while True:
+            _, _, order = queue.get()
+            try:
+                if order is _STOP:
+                    return
+                self._set_busy(line, "run", order)
+                try:
+                    self._run_lot(config, order)
+                except Exception as exc:
+                    # run_lot reports its own errors, this only keeps the worker alive
+                    print(f"Line {line}: lot {order.get('lot_number')} failed: {exc}")
+                finally:
+                    self._set_busy(line, "run", None, completed=True)
+            finally:
+                queue.task_done()
+
+    def _set_busy(self, line: int | None, stage: str, order: dict | None, completed: bool = False) -> None:
+        with self._lock:
+            if order is None:
+                self._busy[line].pop(stage, None)
+            else:
+                self._busy[line][stage] = order
+            if completed:
+                self.completed += 1
+
+    def _fill_worker(self, line: int | None) -> None:
+        config = self.configs[line]
+        queue = self._queues[line]
+        handoff = self._handoffs[line]
+        while True:
+            _, _, order = queue.get()
+            try:
+                if order is _STOP:
+                    handoff.put(_STOP)
+                    return
+                self._set_busy(line, "fill", order)
+                lot = None
+                try:
+                    lot = self._fill(config, order)
+                except Exception as exc:
+                    print(f"Line {line}: lot {order.get('lot_number')} failed: {exc}")
+                finally:
+                    # A lot that does not reach the heat vessel is done
+                    self._set_busy(line, "fill", None, completed=lot is None)
+                if lot is not None:
+                    handoff.put(lot)
+            finally:
+                queue.task_done()
+
+    def _fill(self, config: LineConfig, order: dict) -> Lot | None:
+        """Fill and transfer one lot. Returns the lot once it is in the heat vessel, else None."""
+        stages = self._stages
+        vessel = self._vessels[config.line]
+        lot = stages.begin(config, order)
+        transferred = False
+        try:
+            if not stages.fill(lot):
+                return None
+            # Wait for the last lot to leave the heat vessel, unless this lot is stopped meanwhile
+            while not vessel.acquire(timeout=0.1):
+                if lot.stop_event.is_set():
+                    stages.abort(lot, "Stopped while waiting for the heat vessel")
+                    return None
+            try:
+                transferred = stages.transfer(lot)
+            finally:
+                if not transferred:
+                    vessel.release()
+            return lot if transferred else None
+        except Exception as exc:
+            stages.fail(lot, exc)
+            return None
+        finally:
+            if not transferred:
+                stages.end(lot)
+
+    def _heat_worker(self, line: int | None) -> None:
+        handoff = self._handoffs[line]
+        while True:
+            lot = handoff.get()
+            try:
+                if lot is _STOP:
+                    return
+                self._set_busy(line, "heat", lot.order)
+                try:
+                    self._stages.heat(lot)
+                except Exception as exc:
+                    self._stages.fail(lot, exc)
+                finally:
+                    self._stages.end(lot)
+                    # The heat vessel is free for the next lot
+                    self._vessels[line].release()
+                    self._set_busy(line, "heat", None, completed=True)
+            finally:
+                handoff.task_done()
@@ -0,0 +1,320 @@
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+from devices.mag6000.mag6000_connector import Mag6000Connector
+from devices.mag6000.mag6000_pool import Mag6000Pool
+from devices.ds18b20.ds18b20_sampler import DS18B20Sampler
+from devices.relay.relay_controller import RelayController, emergency_off, reset_interlock
+from functions.adaptive_rate import AdaptiveRate
+from functions.cutoff_predictor import CutoffPredictor
+from functions.flow_monitor import FlowMonitor
+from functions.heater import Heater
+from functions.heater_control import HeaterController, make_controller
+from functions.line_config import LineConfig
+from functions.metrics import PHASE_BUCKETS, REGISTRY
+from functions.structured_log import get_logger
+from functions.volume_estimator import VolumeEstimator
+from mqtt.device_status import DeviceStatusPublisher
+from mqtt.mqtt_publisher import mqtt_publisher
+from mqtt.stop_router import StopRouter
+
+log = get_logger(__name__)
+
+
+# Duration of each stage of the lots, and how the lots ended
+LOT_PHASE_SECONDS = REGISTRY.histogram("cda_lot_phase_seconds", "Duration of a stage of a lot", ("phase",), PHASE_BUCKETS)
+LOTS_TOTAL = REGISTRY.counter("cda_lots_total", "Lots that ended, by result", ("result",))
+
+
+def _phase(name: str):
+    """Time a stage of a lot, into its report and the phase metric."""
+    def decorate(stage):
+        @functools.wraps(stage)
+        def timed(self, lot):
+            started = time.monotonic()
+            try:
+                return stage(self, lot)
+            finally:
+                seconds = time.monotonic() - started
+                lot.report[f"{name}_seconds"] = seconds
+                LOT_PHASE_SECONDS.labels(name).observe(seconds)
+        return timed
+    return decorate
+
+
+def deactivate_line(publisher):
+    """Stops the current process."""
+    publisher.publish_error("interrupted")
+
+
+class Lot:
+    """State of one lot while it moves through the stages of its line."""
+
+    def __init__(self, config: LineConfig, order: dict, stop_event, publisher: mqtt_publisher):
+        self.config = config
+        self.order = order
+        self.lot_id = order["lot_number"]
+        self.stop_event = stop_event
+        self.publisher = publisher
+        # Sample counts and cutoff errors of the stages, reported when the lot ends
+        self.report: dict = {}
+        # Relay pins of the stage that is running, switched off right away by an emergency stop
+        self.relay_pins: tuple[int, ...] = ()
+        self.emergency_stopped = False
+        self.lock = threading.Lock()
+
+
+class LotRunner:
+    """
+    Runs a single lot on a line: filling with FlowMonitor, then heating with Heater.
+    Safe to use from several line workers at once, as all state of a lot is kept in its Lot.
+
+    run() goes through every stage of a lot in one go. A pipelined line calls the stages
+    itself, from two threads, so the next lot fills while the last one heats:
+    begin(), fill() and transfer() for the fill vessel, then heat() for the heat vessel,
+    and end() once the lot is done, whatever the outcome.
+
+    A stop request switches the relays of the running stage off from the MQTT thread, with
+    emergency_stop(), and the control loop of the stage then only has to notice the stop event.
+    """
+
+    def __init__(
+        self,
+        connector,
+        status_publisher: DeviceStatusPublisher,
+        stop_router: StopRouter,
+        *,
+        flow_sample_rate_hz: float = 4.0,
+        temp_sample_rate_hz: float = 10.0,
+        temp_sampler: DS18B20Sampler | None = None,
+        heater_control: str = "bang-bang",
+        flow_cutoff: str = "fixed",
+        volume_estimate: str = "max",
+        totalizer_step_liters: float = 0.01,
+        flow_adaptive_rate: AdaptiveRate | None = None,
+        temp_adaptive_rate: AdaptiveRate | None = None,
+        gauge_pool: Mag6000Pool | None = None,
+        heater_hold_seconds: float = 0.0,
+    ):
+        """
+        :param connector: The MQTT connector used for the lot's messages.
+        :param status_publisher: Publishes the status of the device.
+        :param stop_router: Provides the stop event of each lot.
+            The settings after it are keyword-only, as many of them share a type.
+        :param flow_sample_rate_hz: Sample rate of the filling loop.
+        :param temp_sample_rate_hz: Sample rate of the heating loop.
+        :param temp_sampler: Reads the temperature sensors of all lines in the background,
+            or None to start a sampler for each heating stage.
+        :param heater_control: Name of the heater controller, see functions.heater_control.
+        :param flow_cutoff: "fixed" to switch the pump off 50 ml before the target, or "predictive"
+            to switch it off early by the coast volume learned from past lots.
+        :param volume_estimate: "max" to take the larger of the totalizer and the integrated flow as the volume,
+            or "kalman" to fuse them with functions.volume_estimator.
+        :param totalizer_step_liters: Resolution of the totalizer of the flow gauges, for the kalman estimate.
+        :param flow_adaptive_rate: Bounds of the sample rate of the filling loop as the target comes closer,
+            or None to sample at flow_sample_rate_hz throughout.
+        :param temp_adaptive_rate: Likewise for the heating loop.
+        :param gauge_pool: Keeps the connectors of the flow gauges open between lots,
+            or None to connect to the flow gauge for each filling stage.
+        :param heater_hold_seconds: How long the heater keeps the temperature at the target once it is reached.
+        """
+        self._connector = connector
+        self._status_publisher = status_publisher
+        self._stop_router = stop_router
+        self.flow_sample_rate_hz = flow_sample_rate_hz
+        self.temp_sample_rate_hz = temp_sample_rate_hz
+        self.temp_sampler = temp_sampler
+        # Fail early on an unknown name
+        make_controller(heater_control)
+        self.heater_control = heater_control
+        # One controller per line, so what it learns about a kettle carries over to the next lot
+        self._controllers: dict[int | None, HeaterController] = {}
+        if flow_cutoff not in ("fixed", "predictive"):
+            raise ValueError(f"Unknown flow cutoff {flow_cutoff!r}, expected fixed or predictive")
+        self.flow_cutoff = flow_cutoff
+        # Likewise for what the cutoff predictor learns about a pump
+        self._cutoff_predictors: dict[int | None, CutoffPredictor] = {}
+        if volume_estimate not in ("max", "kalman"):
+            raise ValueError(f"Unknown volume estimate {volume_estimate!r}, expected max or kalman")
+        self.volume_estimate = volume_estimate
+        self.totalizer_step_liters = totalizer_step_liters
+        self.flow_adaptive_rate = flow_adaptive_rate
+        self.temp_adaptive_rate = temp_adaptive_rate
+        self.gauge_pool = gauge_pool
+        self.heater_hold_seconds = heater_hold_seconds
+
+    def run(self, config: LineConfig, order: dict) -> bool:
+        """Run *order* on the line of *config*. Returns True if the lot was completed."""
+        lot = self.begin(config, order)
+        try:
+            return self.fill(lot) and self.transfer(lot) and self.heat(lot)
+        except Exception as exc:
+            self.fail(lot, exc)
+            return False
+        finally:
+            self.end(lot)
+
+    def begin(self, config: LineConfig, order: dict) -> Lot:
+        """Mark the lot as running and watch for its stop signal."""
+        lot_id = order["lot_number"]
+        self._status_publisher.mark_occupied(lot_id, config.line)
+
+        publisher = mqtt_publisher(self._connector, lot_id, order["line"])
+        lot = Lot(config, order, None, publisher)
+        # Set up stop event for this lot, a stop request switches its relays off before setting it
+        lot.stop_event = self._stop_router.watch(lot_id, on_stop=lambda: self.emergency_stop(lot))
+        log.info("Received request", lot=lot_id, liters=order["liters"], temperature_c=order["temperature"], line=order["line"])
+        return lot
+
+    def emergency_stop(self, lot: Lot) -> None:
+        """Switch the relays of the running stage of *lot* off, and keep every later stage from switching its relays on."""
+        with lot.lock:
+            lot.emergency_stopped = True
+            if lot.relay_pins:
+                emergency_off(lot.relay_pins)
+
+    @contextmanager
+    def _relays(self, lot: Lot, *pins: int):
+        # Make the relays of a stage known to emergency_stop() while the stage runs
+        with lot.lock:
+            lot.relay_pins = pins
+            if lot.emergency_stopped:
+                # Stopped before the stage started, so its relays must not come on at all
+                emergency_off(pins)
+        try:
+            yield
+        finally:
+            with lot.lock:
+                lot.relay_pins = ()
+            # The control loop has switched the relays off by now, so they can be used by the next lot
+            reset_interlock(pins)
+
+    @_phase("fill")
+    def fill(self, lot: Lot) -> bool:
+        """Pump the liters of the lot. Returns False if the lot was stopped."""
+        config = lot.config
+        fill_started = time.monotonic()
+        with self._flow_gauge(config.flow_gauge_address) as connector, self._relays(lot, config.pump_relay_pin):
+            log.debug("Connected to sensor", lot=lot.lot_id, address=config.flow_gauge_address)
+            monitor = FlowMonitor(
+                target_liters=lot.order["liters"],
+                connector=connector,
+                pump_relay_pin=config.pump_relay_pin,
+                publisher=lot.publisher,
+                stop_event=lot.stop_event,
+                sample_rate_hz=self.flow_sample_rate_hz,
+                cutoff_predictor=self.cutoff_predictor_for(config.line),
+                volume_estimator=VolumeEstimator(self.totalizer_step_liters) if self.volume_estimate == "kalman" else None,
+                adaptive_rate=self.flow_adaptive_rate,
+            )
+            final_liters = monitor.run()
+            if monitor.scheduler is not None:
+                log.info("Flow sampling", lot=lot.lot_id, **monitor.scheduler.stats.summary())
+                lot.report["flow_samples"] = monitor.scheduler.stats.ticks
+            lot.report["flow_cutoff_error_liters"] = monitor.cutoff_error
+            if monitor.first_sample_at is not None:
+                # Includes opening the serial port, unless the pool keeps it open
+                first_sample = monitor.first_sample_at - fill_started
+                lot.report["flow_time_to_first_sample_s"] = first_sample
+                if self.gauge_pool is not None:
+                    self.gauge_pool.record_first_sample(config.flow_gauge_address, first_sample)
+            # Wait and latency of each flow gauge on the shared bus, since the start
+            log.info("Flow gauge bus", lot=lot.lot_id, slaves=connector.bus.summary())
+
+        if final_liters is None:
+            self.abort(lot, "Flow interrupted")
+            return False
+        lot.publisher.publish_flow_final(final_liters)
+        return True
+
+    def _flow_gauge(self, slave_address: int):
+        # The pool lends its open connector, otherwise the connector is opened for this stage and closed after it
+        if self.gauge_pool is not None:
+            return self.gauge_pool.lease(slave_address)
+        return Mag6000Connector(slave_address)
+
+    @_phase("transfer")
+    def transfer(self, lot: Lot) -> bool:
+        """
+        Move the water from the fill vessel into the kettle, on lines that have a transfer relay.
+        Returns False if the lot was stopped during the transfer.
+        """
+        config = lot.config
+        if config.transfer_relay_pin is None:
+            return True
+        with self._relays(lot, config.transfer_relay_pin):
+            relay = RelayController(config.transfer_relay_pin)
+            relay.toggle_relay(True)
+            try:
+                # Returns True as soon as the lot is stopped
+                stopped = lot.stop_event.wait(config.transfer_seconds)
+            finally:
+                relay.toggle_relay(False)
+        if stopped:
+            self.abort(lot, "Transfer interrupted")
+            return False
+        return True
+
+    @_phase("heat")
+    def heat(self, lot: Lot) -> bool:
+        """Heat the kettle to the temperature of the lot. Returns True if the lot was completed."""
+        config = lot.config
+        heater = Heater(
+            target_temperature=lot.order["temperature"],
+            kettle_relay_pin=config.kettle_relay_pin,
+            publisher=lot.publisher,
+            stop_event=lot.stop_event,
+            sample_rate_hz=self.temp_sample_rate_hz,
+            sensor_id=config.temp_sensor_id,
+            sampler=self.temp_sampler,
+            controller=self.controller_for(config.line),
+            hold_seconds=self.heater_hold_seconds,
+            adaptive_rate=self.temp_adaptive_rate,
+        )
+        with self._relays(lot, config.kettle_relay_pin):
+            final_temp = heater.run()
+        log.info("Temperature sampling", lot=lot.lot_id, relay_switches=heater.switch_count, **heater.scheduler.stats.summary())
+        lot.report["temp_samples"] = heater.scheduler.stats.ticks
+        lot.report["temp_cutoff_error_c"] = heater.cutoff_error
+
+        if final_temp is None:
+            self.abort(lot, "Heater interrupted")
+            return False
+        lot.publisher.publish_temp_final(final_temp)
+        self._status_publisher.mark_available(config.line, lot.lot_id)
+        LOTS_TOTAL.labels("completed").inc()
+        return True
+
+    def controller_for(self, line: int | None) -> HeaterController:
+        """The heater controller of *line*, created on first use."""
+        if line not in self._controllers:
+            self._controllers[line] = make_controller(self.heater_control)
+        return self._controllers[line]
+
+    def cutoff_predictor_for(self, line: int | None) -> CutoffPredictor | None:
+        """The cutoff predictor of the pump of *line*, or None with a fixed cutoff."""
+        if self.flow_cutoff != "predictive":
+            return None
+        if line not in self._cutoff_predictors:
+            self._cutoff_predictors[line] = CutoffPredictor()
+        return self._cutoff_predictors[line]
+
+    def abort(self, lot: Lot, reason: str) -> None:
+        """Report that the lot was stopped before it was completed."""
+        deactivate_line(lot.publisher)
+        log.warning(reason, lot=lot.lot_id, line=lot.config.line)
+        self._status_publisher.mark_error(reason, lot.config.line, lot.lot_id)
+        LOTS_TOTAL.labels("aborted").inc()
+
+    def fail(self, lot: Lot, exc: Exception) -> None:
+        """Report an error of any stage of the lot."""
+        lot.publisher.publish_error(str(exc))
+        self._status_publisher.mark_available(lot.config.line, lot.lot_id)
+        LOTS_TOTAL.labels("failed").inc()
+
+    def end(self, lot: Lot) -> None:
+        # The lot has ended, so stop signals for it are no longer needed
+        self._stop_router.release(lot.lot_id)
+        log.info("Lot report", lot=lot.lot_id, **lot.report)
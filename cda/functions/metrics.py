@@ -0,0 +1,284 @@
+"""
+Counters, gauges and histograms of the CDA, kept in memory and exported on request.
+
+Each instrumented module creates its metrics once, at import, in the registry
+of the process. Recording a sample takes a lock and a few additions, so it can
+run in the control loops. The registry renders its metrics in the Prometheus
+text format, for the endpoint in functions.metrics_endpoint, and as a JSON
+summary with estimated quantiles, for mqtt.metrics_publisher.
+
+Usage:
+    MODBUS_SECONDS = REGISTRY.histogram("cda_modbus_transaction_seconds", "Modbus transaction time", ("register",))
+    MODBUS_SECONDS.labels("3014-3017").observe(0.012)
+"""
+from __future__ import annotations
+
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+# Upper bounds in seconds of the buckets for device reads, publishes and control-loop ticks
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# Upper bounds in seconds of the buckets for the stages of a lot
+PHASE_BUCKETS = (1.0, 5.0, 15.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1200.0, 1800.0, 3600.0)
+
+
+class CounterValue:
+    """A counter of one combination of label values."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+    def summary(self) -> dict:
+        return {"value": self.value}
+
+
+class GaugeValue:
+    """A gauge of one combination of label values."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.inc(-amount)
+
+    def summary(self) -> dict:
+        return {"value": self.value}
+
+
+class HistogramValue:
+    """A histogram of one combination of label values."""
+
+    def __init__(self, bounds: tuple[float, ...]) -> None:
+        self._lock = threading.Lock()
+        self.bounds = bounds
+        # Samples in each bucket, not cumulative, with the last one for samples above every bound
+        self.bucket_counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        # The bucket of a sample is the first whose upper bound is not below it
+        index = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.bucket_counts[index] += 1
+            self.count += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        """Observe the seconds the block takes."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    def quantile(self, q: float) -> float:
+        """Estimate the *q* quantile, interpolating within its bucket like Prometheus does."""
+        with self._lock:
+            counts = list(self.bucket_counts)
+            count = self.count
+            largest = self.max
+        if not count:
+            return math.nan
+        rank = q * count
+        seen = 0
+        for index, bucket_count in enumerate(counts):
+            if seen + bucket_count >= rank and bucket_count:
+                if index == len(self.bounds):
+                    # Above every bound, the largest sample is the best estimate
+                    return largest
+                lower = self.bounds[index - 1] if index else 0.0
+                upper = min(self.bounds[index], largest)
+                return lower + (upper - lower) * max(rank - seen, 0.0) / bucket_count
+            seen += bucket_count
+        return largest
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "max": self.max,
+            "p50": self.quantile(0.5) if self.count else None,
+            "p95": self.quantile(0.95) if self.count else None,
+        }
+
+
+class Metric:
+    """A named metric, with one value for each combination of its label values."""
+
+    kind = ""
+
+    def __init__(self, name: str, help: str, label_names: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self._values: dict[tuple[str, ...], CounterValue | GaugeValue | HistogramValue] = {}
+        # The values by the label values as given, such as numbers, so a lookup needs no conversion
+        self._given: dict[tuple, CounterValue | GaugeValue | HistogramValue] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *label_values):
+        """The value of the given label values, created on first use."""
+        value = self._given.get(label_values)
+        if value is None:
+            key = tuple(str(label) for label in label_values)
+            if len(key) != len(self.label_names):
+                raise ValueError(f"{self.name} expects the labels {self.label_names}, got {key}")
+            with self._lock:
+                value = self._values.setdefault(key, self._new_value())
+                self._given[label_values] = value
+        return value
+
+    def values(self) -> list[tuple[dict[str, str], CounterValue | GaugeValue | HistogramValue]]:
+        """The labels and value of every combination that was used."""
+        with self._lock:
+            items = list(self._values.items())
+        return [(dict(zip(self.label_names, key)), value) for key, value in items]
+
+    def _new_value(self):
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0) -> None:
+        """Increment the counter of a metric without labels."""
+        self.labels().inc(amount)
+
+    def _new_value(self) -> CounterValue:
+        return CounterValue()
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float) -> None:
+        """Set the gauge of a metric without labels."""
+        self.labels().set(value)
+
+    def _new_value(self) -> GaugeValue:
+        return GaugeValue()
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, label_names: tuple[str, ...] = (), buckets: tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        super().__init__(name, help, label_names)
+        if list(buckets) != sorted(buckets):
+            raise ValueError(f"The buckets of {name} must be in increasing order")
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float) -> None:
+        """Observe a sample of a metric without labels."""
+        self.labels().observe(value)
+
+    def _new_value(self) -> HistogramValue:
+        return HistogramValue(self.buckets)
+
+
+class MetricsRegistry:
+    """The metrics of a process, by name."""
+
+    def __init__(self) -> None:
+        self._metrics: dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help: str, label_names: tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, help, label_names))
+
+    def gauge(self, name: str, help: str, label_names: tuple[str, ...] = ()) -> Gauge:
+        return self._register(Gauge(name, help, label_names))
+
+    def histogram(self, name: str, help: str, label_names: tuple[str, ...] = (), buckets: tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, label_names, buckets))
+
+    def _register(self, metric: Metric):
+        # A module imported again, such as in tests, gets the metric it registered before
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is None:
+                self._metrics[metric.name] = metric
+                return metric
+        if type(existing) is not type(metric) or existing.label_names != metric.label_names:
+            raise ValueError(f"Metric {metric.name} is already registered with other labels or type")
+        return existing
+
+    def metrics(self) -> list[Metric]:
+        with self._lock:
+            return sorted(self._metrics.values(), key=lambda metric: metric.name)
+
+    def summary(self) -> dict[str, list[dict]]:
+        """Every value of every metric, with histograms as count, sum, max and estimated quantiles."""
+        return {
+            metric.name: [{"labels": labels, **value.summary()} for labels, value in metric.values()]
+            for metric in self.metrics()
+            if metric.values()
+        }
+
+    def prometheus_text(self) -> str:
+        """The metrics in the Prometheus text exposition format, version 0.0.4."""
+        lines = []
+        for metric in self.metrics():
+            lines.append(f"# HELP {metric.name} {_escape_help(metric.help)}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for labels, value in metric.values():
+                if isinstance(value, HistogramValue):
+                    with value._lock:
+                        counts = list(value.bucket_counts)
+                        count, total = value.count, value.sum
+                    cumulative = 0
+                    for bound, bucket_count in zip((*value.bounds, math.inf), counts):
+                        cumulative += bucket_count
+                        lines.append(f"{metric.name}_bucket{_labels({**labels, 'le': _number(bound)})} {cumulative}")
+                    lines.append(f"{metric.name}_sum{_labels(labels)} {_number(total)}")
+                    lines.append(f"{metric.name}_count{_labels(labels)} {count}")
+                else:
+                    lines.append(f"{metric.name}{_labels(labels)} {_number(value.value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _escape_help(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _number(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+# The metrics of this process, shared by every instrumented module
+REGISTRY = MetricsRegistry()
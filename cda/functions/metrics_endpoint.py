@@ -0,0 +1,63 @@
+"""
+HTTP endpoint that serves the metrics registry in the Prometheus text format.
+
+Usage:
+    endpoint = MetricsEndpoint(port=9108).start()
+    # curl http://localhost:9108/metrics
+    endpoint.stop()
+"""
+from __future__ import annotations
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from functions.metrics import REGISTRY, MetricsRegistry
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class MetricsEndpoint:
+    """Serves GET /metrics from a background thread."""
+
+    def __init__(self, registry: MetricsRegistry = REGISTRY, port: int = 9108, host: str = "127.0.0.1") -> None:
+        """
+        :param registry: The metrics to serve.
+        :param port: TCP port to listen on, 0 for any free port.
+        :param host: Address to listen on, 0.0.0.0 to let another machine scrape the device.
+        """
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.prometheus_text().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # Scrapes would otherwise print a line each
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread: threading.Thread | None = None
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def start(self) -> "MetricsEndpoint":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="metrics-endpoint", daemon=True)
+        self._thread.start()
+        print(f"Metrics: serving http://{self._server.server_address[0]}:{self.port}/metrics")
+        return self
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._server.server_close()
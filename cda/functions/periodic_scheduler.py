@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+import math
+import threading
+import time
+from typing import Callable
+
+from functions.metrics import REGISTRY
+
+# Time of the work of each tick, from the end of one wait to the start of the next, by loop
+TICK_SECONDS = REGISTRY.histogram("cda_control_tick_seconds", "Work time of a tick of a control loop", ("loop",))
+TICK_OVERRUNS = REGISTRY.counter("cda_control_missed_deadlines_total", "Ticks of a control loop that overran their deadline", ("loop",))
+
+
+class SchedulerStats:
+    """Timing statistics of a PeriodicScheduler."""
+
+    def __init__(self) -> None:
+        self.ticks = 0
+        # Ticks where the work took longer than the period, so the deadline had passed
+        self.missed_deadlines = 0
+        # Whole periods that passed without a tick because of overruns
+        self.skipped_ticks = 0
+        self.max_overrun = 0.0
+        # How late the scheduler woke up compared to the deadline
+        self.max_wakeup_delay = 0.0
+        self.total_wakeup_delay = 0.0
+
+    def summary(self) -> dict:
+        return {
+            "ticks": self.ticks,
+            "missed_deadlines": self.missed_deadlines,
+            "skipped_ticks": self.skipped_ticks,
+            "max_overrun_ms": self.max_overrun * 1000,
+            "max_wakeup_delay_ms": self.max_wakeup_delay * 1000,
+            "mean_wakeup_delay_ms": self.total_wakeup_delay / self.ticks * 1000 if self.ticks else 0.0,
+        }
+
+
+class PeriodicScheduler:
+    """
+    Paces a control loop at a fixed rate, using deadlines on a monotonic clock.
+
+    Deadlines are spaced exactly one period apart, so the time spent on device
+    reads does not add up to drift. When a tick overruns its deadline, the next
+    tick starts right away and the schedule continues from there, rather than
+    running the missed ticks back to back. The overrun is recorded in the stats.
+
+    Usage:
+        scheduler = PeriodicScheduler(4.0, stop_event)
+        while scheduler.wait():
+            ...  # one tick of work
+    """
+
+    def __init__(
+        self,
+        rate_hz: float,
+        stop_event: threading.Event | None = None,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+        name: str | None = None,
+    ) -> None:
+        """
+        :param rate_hz: Target number of ticks per second.
+        :param stop_event: If given, waiting ends early when the event is set.
+        :param clock: Monotonic clock in seconds.
+        :param sleep: Sleep function, used when there is no stop event.
+        :param name: Name of the loop in the tick metrics, or None to leave the loop out of them.
+        """
+        self.period = 1.0 / rate_hz
+        self.stats = SchedulerStats()
+        self._stop_event = stop_event
+        self._clock = clock
+        self._sleep = sleep
+        self._deadline: float | None = None
+        self._tick_seconds = TICK_SECONDS.labels(name) if name is not None else None
+        self._overruns = TICK_OVERRUNS.labels(name) if name is not None else None
+        # When the last wait returned, so the next one knows how long the tick worked
+        self._woke: float | None = None
+
+    @property
+    def rate_hz(self) -> float:
+        return 1.0 / self.period
+
+    @rate_hz.setter
+    def rate_hz(self, rate_hz: float) -> None:
+        """Change the rate. The next deadline will be one new period after the previous one."""
+        self.period = 1.0 / rate_hz
+
+    def start(self) -> None:
+        """Start the schedule, with the first deadline now."""
+        self._deadline = self._clock()
+
+    def wait(self) -> bool:
+        """
+        Wait for the next deadline. The first call returns immediately.
+        Returns False if the stop event was set, otherwise True.
+        """
+        if self._deadline is None:
+            self.start()
+        else:
+            now = self._clock()
+            if self._tick_seconds is not None and self._woke is not None:
+                self._tick_seconds.observe(now - self._woke)
+            self._deadline += self.period
+            if now > self._deadline:
+                # The tick overran: start the next tick right away, and continue
+                # the schedule from now instead of running the missed ticks back to back
+                overrun = now - self._deadline
+                self.stats.missed_deadlines += 1
+                if self._overruns is not None:
+                    self._overruns.inc()
+                self.stats.max_overrun = max(self.stats.max_overrun, overrun)
+                self.stats.skipped_ticks += math.floor(overrun / self.period)
+                self._deadline = now
+            else:
+                self._sleep_until(self._deadline)
+
+        # Record how late we woke up compared to the deadline
+        self._woke = self._clock()
+        delay = max(0.0, self._woke - self._deadline)
+        self.stats.ticks += 1
+        self.stats.total_wakeup_delay += delay
+        self.stats.max_wakeup_delay = max(self.stats.max_wakeup_delay, delay)
+        return not (self._stop_event is not None and self._stop_event.is_set())
+
+    def _sleep_until(self, deadline: float) -> None:
+        remaining = deadline - self._clock()
+        if remaining <= 0:
+            return
+        if self._stop_event is not None:
+            # Wake up immediately if a stop is requested
+            self._stop_event.wait(remaining)
+        else:
+            self._sleep(remaining)
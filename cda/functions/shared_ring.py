@@ -0,0 +1,151 @@
+"""
+A ring buffer of byte records in shared memory, from one process to another.
+
+The producer copies each record into a multiprocessing.shared_memory block
+and posts a semaphore; it never waits for the consumer, so a record that does
+not fit is refused and counted instead. The consumer waits on the semaphore
+and copies the next record out. Each post covers exactly one record, and the
+post and the wait order the memory, so the consumer never sees a record that
+is only partly written.
+
+The block starts with the bytes written and the bytes read since it was
+created, each only ever increased by one side, followed by the records, each
+a 4-byte length and its data, wrapping around the end of the block.
+
+Usage:
+    ring = SharedRing.create(1 << 20)
+    ring.put(b"sample")              # in the producer
+    record = ring.get(timeout=0.1)   # in the consumer, which got the ring as a Process argument
+"""
+from __future__ import annotations
+
+import multiprocessing
+import struct
+import threading
+from multiprocessing import shared_memory
+
+# Bytes written and bytes read, by the producer and the consumer
+_HEADER = struct.Struct("<QQ")
+_LENGTH = struct.Struct("<I")
+
+
+class RingStats:
+    """What the producer put into a ring."""
+
+    def __init__(self) -> None:
+        self.records = 0
+        self.bytes = 0
+        # Records refused because the ring was full
+        self.dropped = 0
+        self.max_used = 0
+
+    def summary(self) -> dict:
+        return {
+            "records": self.records,
+            "bytes": self.bytes,
+            "dropped": self.dropped,
+            "max_used_bytes": self.max_used,
+        }
+
+
+class SharedRing:
+    """
+    Records from one producer process to one consumer process. Threads of the producer
+    may put at once, but only one thread of the consumer may get.
+    """
+
+    def __init__(self, memory: shared_memory.SharedMemory, available, owner: bool) -> None:
+        self._memory = memory
+        self._buffer = memory.buf
+        # Posted once for each record put, so the consumer can wait for the next one
+        self._available = available
+        self._owner = owner
+        self.capacity = memory.size - _HEADER.size
+        self.stats = RingStats()
+        self._put_lock = threading.Lock()
+
+    @classmethod
+    def create(cls, capacity: int, context=None) -> SharedRing:
+        """A new ring holding *capacity* bytes of records, each with 4 bytes for its length."""
+        context = context or multiprocessing
+        memory = shared_memory.SharedMemory(create=True, size=_HEADER.size + capacity)
+        _HEADER.pack_into(memory.buf, 0, 0, 0)
+        return cls(memory, context.Semaphore(0), owner=True)
+
+    @property
+    def name(self) -> str:
+        return self._memory.name
+
+    def __getstate__(self):
+        # Only passed to a process as it is started, which attaches to the same block and semaphore
+        return self._memory.name, self._available
+
+    def __setstate__(self, state) -> None:
+        name, available = state
+        self.__init__(shared_memory.SharedMemory(name=name), available, owner=False)
+
+    @property
+    def used(self) -> int:
+        """Bytes of records put and not yet taken."""
+        written, read = _HEADER.unpack_from(self._buffer, 0)
+        return written - read
+
+    def put(self, record: bytes) -> bool:
+        """Copy *record* into the ring without waiting. Returns False if it did not fit."""
+        size = _LENGTH.size + len(record)
+        with self._put_lock:
+            written, read = _HEADER.unpack_from(self._buffer, 0)
+            used = written - read + size
+            if used > self.capacity:
+                self.stats.dropped += 1
+                return False
+            self._copy_in(written, _LENGTH.pack(len(record)))
+            self._copy_in(written + _LENGTH.size, record)
+            struct.pack_into("<Q", self._buffer, 0, written + size)
+            self.stats.records += 1
+            self.stats.bytes += len(record)
+            self.stats.max_used = max(self.stats.max_used, used)
+            # Posted after the record is complete, it is what the consumer waits for
+            self._available.release()
+        return True
+
+    def get(self, timeout: float | None = None) -> bytes | None:
+        """The next record, waiting up to *timeout* seconds for one. Returns None if none was put."""
+        if not self._available.acquire(timeout=timeout):
+            return None
+        read = _HEADER.unpack_from(self._buffer, 0)[1]
+        length = _LENGTH.unpack(self._copy_out(read, _LENGTH.size))[0]
+        record = self._copy_out(read + _LENGTH.size, length)
+        # The space is given back only once the record is copied out
+        struct.pack_into("<Q", self._buffer, 8, read + _LENGTH.size + length)
+        return record
+
+    def drain(self) -> list[bytes]:
+        """The records put so far, without waiting."""
+        records = []
+        while (record := self.get(timeout=0)) is not None:
+            records.append(record)
+        return records
+
+    def _copy_in(self, offset: int, data: bytes) -> None:
+        start = _HEADER.size + offset % self.capacity
+        first = min(len(data), _HEADER.size + self.capacity - start)
+        self._buffer[start:start + first] = data[:first]
+        if first < len(data):
+            # Wraps around the end of the block
+            self._buffer[_HEADER.size:_HEADER.size + len(data) - first] = data[first:]
+
+    def _copy_out(self, offset: int, length: int) -> bytes:
+        start = _HEADER.size + offset % self.capacity
+        first = min(length, _HEADER.size + self.capacity - start)
+        data = bytes(self._buffer[start:start + first])
+        if first < length:
+            data += bytes(self._buffer[_HEADER.size:_HEADER.size + length - first])
+        return data
+
+    def close(self) -> None:
+        """Detach from the block, and free it if this ring created it."""
+        self._buffer = None
+        self._memory.close()
+        if self._owner:
+            self._memory.unlink()
@@ -0,0 +1,237 @@
+"""
+Logging that never makes a control loop wait for stdout.
+
+Records carry key/value fields next to their message, and go through a
+bounded queue to a listener thread, which formats them and writes them out.
+When the queue is full, such as while the Docker log driver stalls, records
+are dropped and counted instead of blocking the caller. A rate limit keeps a
+message that repeats, such as an error on every tick, from flooding the
+queue, and a loop can log only every n-th tick of a message.
+
+Usage:
+    log = get_logger(__name__)
+    log.info("Progress", every=4, liters=1.25, target_liters=5.0)
+
+    listener = setup_logging("INFO")
+    ...
+    listener.stop()
+"""
+from __future__ import annotations
+
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+from typing import Any, Callable, TextIO
+
+from functions.metrics import REGISTRY
+
+LOG_DROPPED = REGISTRY.counter("cda_log_dropped_total", "Log records dropped because the log queue was full")
+LOG_SUPPRESSED = REGISTRY.counter("cda_log_suppressed_total", "Log records held back by the rate limit")
+
+# Keyword arguments that the logging module takes itself, every other one is a field of the record
+_LOGGING_KWARGS = ("exc_info", "stack_info", "stacklevel", "extra")
+
+
+class StructuredLogger(logging.LoggerAdapter):
+    """
+    A logger that takes the fields of a record as keyword arguments.
+    With every=n, only the first of each n calls with the same message is logged.
+    """
+
+    def __init__(self, logger: logging.Logger, fields: dict[str, Any] | None = None) -> None:
+        super().__init__(logger, fields or {})
+        # Calls of each sampled message, by message
+        self._calls: dict[str, int] = {}
+
+    def bind(self, **fields) -> "StructuredLogger":
+        """A logger that adds *fields* to every record, with its own sampling counts."""
+        return StructuredLogger(self.logger, {**self.extra, **fields})
+
+    def log(self, level: int, msg: str, *args, every: int = 1, **kwargs) -> None:
+        if every > 1:
+            calls = self._calls.get(msg, 0)
+            self._calls[msg] = calls + 1
+            if calls % every:
+                return
+        if not self.isEnabledFor(level):
+            return
+        options = {key: kwargs.pop(key) for key in _LOGGING_KWARGS if key in kwargs}
+        extra = options.pop("extra", None) or {}
+        # Fields of the logger first, so the fields of the call win
+        extra["fields"] = {**self.extra, **kwargs}
+        self.logger.log(level, msg, *args, extra=extra, stacklevel=options.pop("stacklevel", 1) + 1, **options)
+
+    def debug(self, msg, *args, **kwargs):
+        self.log(logging.DEBUG, msg, *args, **kwargs)
+
+    def info(self, msg, *args, **kwargs):
+        self.log(logging.INFO, msg, *args, **kwargs)
+
+    def warning(self, msg, *args, **kwargs):
+        self.log(logging.WARNING, msg, *args, **kwargs)
+
+    def error(self, msg, *args, **kwargs):
+        self.log(logging.ERROR, msg, *args, **kwargs)
+
+    def exception(self, msg, *args, exc_info=True, **kwargs):
+        self.log(logging.ERROR, msg, *args, exc_info=exc_info, **kwargs)
+
+    def critical(self, msg, *args, **kwargs):
+        self.log(logging.CRITICAL, msg, *args, **kwargs)
+
+
+def get_logger(name: str, **fields) -> StructuredLogger:
+    """The structured logger of *name*, such as __name__ of the module, with *fields* on every record."""
+    return StructuredLogger(logging.getLogger(name), fields)
+
+
+def _value(value: Any) -> str:
+    if isinstance(value, float):
+        return f"{value:.6g}"
+    text = str(value)
+    # Quote values that would not read back as one token
+    return json.dumps(text, ensure_ascii=False) if not text or any(c in text for c in ' ="\n') else text
+
+
+class KeyValueFormatter(logging.Formatter):
+    """Formats a record as its time, level, logger and message, followed by its fields as key=value."""
+
+    def __init__(self) -> None:
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            # The traceback of an exception, if any, stays on the lines after the fields
+            first, newline, rest = line.partition("\n")
+            line = first + " " + " ".join(f"{key}={_value(value)}" for key, value in fields.items()) + newline + rest
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as one JSON object per line, for log collectors."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **getattr(record, "fields", {}),
+        }
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str, ensure_ascii=False)
+
+
+FORMATTERS: dict[str, Callable[[], logging.Formatter]] = {"text": KeyValueFormatter, "json": JsonFormatter}
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets each message through at most *per_second* times per second, with bursts of up to *burst*.
+    The next record of a message after some were held back gets a `suppressed` field with their number.
+    """
+
+    def __init__(self, per_second: float = 10.0, burst: int = 20, clock: Callable[[], float] = time.monotonic) -> None:
+        super().__init__()
+        self.per_second = per_second
+        self.burst = burst
+        self._clock = clock
+        # Tokens, time of the last refill and records held back, by logger and message
+        self._buckets: dict[tuple[str, str], list] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = (record.name, record.msg if isinstance(record.msg, str) else str(record.msg))
+        now = self._clock()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [float(self.burst), now, 0]
+            tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.per_second)
+            bucket[1] = now
+            if tokens < 1.0:
+                bucket[0] = tokens
+                bucket[2] += 1
+                LOG_SUPPRESSED.inc()
+                return False
+            bucket[0] = tokens - 1.0
+            suppressed, bucket[2] = bucket[2], 0
+        if suppressed:
+            record.fields = {**getattr(record, "fields", {}), "suppressed": suppressed}
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Puts records on a bounded queue without waiting, and drops them when it is full."""
+
+    def __init__(self, log_queue: queue.Queue) -> None:
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The listener runs in this process, so the record is formatted there, not in the control loop
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            LOG_DROPPED.inc()
+
+
+class LogListener:
+    """The thread that writes the queued records, returned by setup_logging()."""
+
+    def __init__(self, handler: DroppingQueueHandler, listener: logging.handlers.QueueListener) -> None:
+        self.handler = handler
+        self._listener = listener
+
+    @property
+    def dropped(self) -> int:
+        return self.handler.dropped
+
+    def stop(self) -> None:
+        """Write the records still queued, and stop the thread."""
+        self._listener.stop()
+        logging.getLogger().removeHandler(self.handler)
+
+
+def setup_logging(
+    level: str | int = "INFO",
+    fmt: str = "text",
+    queue_size: int = 10000,
+    per_second: float = 10.0,
+    burst: int = 20,
+    stream: TextIO | None = None,
+) -> LogListener:
+    """
+    Send the records of every logger through a bounded queue to a thread that writes them to *stream*.
+
+    :param level: Least level that is logged, such as DEBUG or INFO.
+    :param fmt: "text" for key=value lines, or "json" for one JSON object per line.
+    :param queue_size: Records waiting to be written before new ones are dropped.
+    :param per_second: Rate limit of each message.
+    :param burst: Records of a message let through at once before the rate limit applies.
+    :param stream: Where the records are written, stdout by default.
+    """
+    if fmt not in FORMATTERS:
+        raise ValueError(f"Unknown log format {fmt!r}, expected text or json")
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(FORMATTERS[fmt]())
+    log_queue: queue.Queue = queue.Queue(queue_size)
+    handler = DroppingQueueHandler(log_queue)
+    handler.addFilter(RateLimitFilter(per_second, burst))
+    root = logging.getLogger()
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+    root.addHandler(handler)
+    listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    listener.start()
+    return LogListener(handler, listener)
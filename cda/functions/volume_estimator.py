@@ -0,0 +1,158 @@
+from __future__ import annotations
+
+import math
+from typing import NamedTuple
+
+
+class VolumeEstimate(NamedTuple):
+    """Estimated volume since the start of the fill, with uncertainty bounds."""
+    volume_liters: float
+    # Standard deviation of the volume estimate
+    std_liters: float
+    # Bounds at the confidence of the estimator, narrowed to what the totalizer allows
+    lower_liters: float
+    upper_liters: float
+    flow_lph: float
+    timestamp: float
+
+
+class VolumeEstimator:
+    """
+    Kalman filter that fuses the totalizer and the flow rate of the MAG 6000 into one volume estimate.
+
+    The flow rate (register 3002) is integrated between samples, which follows
+    the volume closely but drifts with the noise of the readings and the shape
+    of the flow between them. The totalizer (register 3014) does not drift, but
+    only moves in steps of its resolution, and the fill starts at an unknown
+    point within a step. The state is therefore the volume since the start and
+    the offset of the start within its totalizer step. Each time the totalizer
+    moves to a new step, the volume has just crossed a step boundary, which
+    places the volume plus the offset within the volume moved since the previous
+    sample. Readings where the totalizer did not move repeat what is already
+    known, so they only bound the estimate.
+
+    The filter is scalar arithmetic on a 2x2 covariance, so an update costs a
+    few microseconds and needs no extra packages.
+    """
+
+    def __init__(
+        self,
+        totalizer_step_liters: float = 0.01,
+        flow_noise_lph: float = 5.0,
+        integration_error: float = 0.1,
+        confidence: float = 2.0,
+    ) -> None:
+        """
+        :param totalizer_step_liters: Resolution of the totalizer.
+        :param flow_noise_lph: Standard deviation of the noise on the flow rate readings.
+        :param integration_error: Error of the integrated volume between two samples, as a share
+            of the change of the flow rate times the sample interval. Covers the flow
+            changing between the samples, mostly when the pump spins up or coasts down.
+        :param confidence: Width of the uncertainty bounds in standard deviations.
+        """
+        if totalizer_step_liters < 0:
+            raise ValueError("totalizer_step_liters must not be negative")
+        if flow_noise_lph < 0 or integration_error < 0:
+            raise ValueError("flow_noise_lph and integration_error must not be negative")
+        self.totalizer_step_liters = totalizer_step_liters
+        self.flow_noise_lph = flow_noise_lph
+        self.integration_error = integration_error
+        self.confidence = confidence
+        self.reset()
+
+    def reset(self, timestamp: float | None = None) -> None:
+        """Start a new fill at *timestamp*, with no volume moved and the pump standing still."""
+        step = self.totalizer_step_liters
+        self._volume = 0.0
+        # Start within the totalizer step of the baseline, uniform over the step
+        self._offset = step / 2
+        self._p_vv = 0.0
+        self._p_vo = 0.0
+        self._p_oo = step * step / 12
+        self._flow_lph = 0.0
+        self._timestamp = timestamp
+        # Last totalizer reading, relative to the baseline
+        self._totalizer = 0.0
+        # Volume moved since the totalizer was last read
+        self._moved = 0.0
+        self.updates = 0
+
+    def _predict(self, timestamp: float, flow_lph: float) -> None:
+        # Integrate the flow up to *timestamp*, and grow the uncertainty by the integration error
+        if self._timestamp is None:
+            self._timestamp = timestamp
+            self._flow_lph = flow_lph
+            return
+        dt = timestamp - self._timestamp
+        # Ignore samples that are not newer than the state
+        if dt <= 0:
+            return
+        # Area of the trapezoid between the two samples, converting L/h to L/s
+        moved = (self._flow_lph + flow_lph) / 2.0 / 3600.0 * dt
+        self._volume += moved
+        self._moved += moved
+        noise = self.flow_noise_lph / 3600.0 * dt
+        shape = self.integration_error * abs(flow_lph - self._flow_lph) / 3600.0 * dt
+        self._p_vv += noise * noise + shape * shape
+        self._flow_lph = flow_lph
+        self._timestamp = timestamp
+
+    def _correct(self, measured: float, variance: float) -> None:
+        # Kalman update with a measurement of the volume plus the offset, H = [1, 1]
+        p_vv, p_vo, p_oo = self._p_vv, self._p_vo, self._p_oo
+        s = p_vv + 2 * p_vo + p_oo + variance
+        residual = measured - self._volume - self._offset
+        if s <= 0:
+            # Everything is known exactly, so the measurement is the volume
+            self._volume += residual
+            return
+        gain_v = (p_vv + p_vo) / s
+        gain_o = (p_vo + p_oo) / s
+        self._volume += gain_v * residual
+        self._offset += gain_o * residual
+        # P = (I - K H) P
+        self._p_vv = p_vv - gain_v * (p_vv + p_vo)
+        self._p_vo = p_vo - gain_v * (p_vo + p_oo)
+        self._p_oo = p_oo - gain_o * (p_vo + p_oo)
+
+    def update(self, timestamp: float, flow_lph: float | None = None, totalizer_liters: float | None = None) -> VolumeEstimate:
+        """
+        Add a reading taken at *timestamp* seconds. Either value may be None if it was not read.
+
+        :param flow_lph: The flow rate in liters per hour. Without it, the last flow rate is assumed.
+        :param totalizer_liters: The totalizer relative to the baseline reading at the start of the fill.
+        """
+        self._predict(timestamp, self._flow_lph if flow_lph is None else flow_lph)
+        step = self.totalizer_step_liters
+        if totalizer_liters is not None:
+            if totalizer_liters != self._totalizer:
+                # The volume crossed the step boundary of this reading since the previous one
+                width = min(step, self._moved)
+                self._correct(totalizer_liters + width / 2, width * width / 12)
+                self._totalizer = totalizer_liters
+            self._moved = 0.0
+            # The start and the reading are both within a step, so the volume is within a step of the reading
+            self._volume = min(max(self._volume, totalizer_liters - step), totalizer_liters + step)
+            self._offset = min(max(self._offset, 0.0), step)
+        self.updates += 1
+        return self.estimate()
+
+    def estimate(self) -> VolumeEstimate:
+        """The current estimate."""
+        std = math.sqrt(max(self._p_vv, 0.0))
+        step = self.totalizer_step_liters
+        lower = max(self._volume - self.confidence * std, self._totalizer - step, 0.0)
+        upper = min(self._volume + self.confidence * std, self._totalizer + self._moved + step)
+        return VolumeEstimate(
+            self._volume,
+            std,
+            min(lower, self._volume),
+            max(upper, self._volume),
+            self._flow_lph,
+            self._timestamp or 0.0,
+        )
+
+    @property
+    def volume_liters(self) -> float:
+        """The estimated volume at the latest reading."""
+        return self._volume
@@ -1,57 +1,174 @@
 import os
 from dotenv import load_dotenv
-from devices.mag6000.mag6000_connector import Mag6000Connector
-from devices.relay.relay_controller import RelayController
-from functions.flow_monitor import FlowMonitor
-from functions.heater import Heater
+from devices.ds18b20.ds18b20_sampler import DS18B20Sampler
+from devices.mag6000.mag6000_pool import Mag6000Pool
+from devices.relay.relay_manager import relay_manager
+from functions.adaptive_rate import AdaptiveRate
+from functions.line_config import load_line_configs
+from functions.line_scheduler import LineScheduler
+from functions.lot_runner import LotRunner
+from functions.metrics_endpoint import MetricsEndpoint
+from functions.structured_log import setup_logging
 import signal
 from functions.serial_num import get_serial
 from mqtt.mqtt_connector import mqtt_connector
+from mqtt.mqtt_process import MqttProcess
 from mqtt.mqtt_watcher import mqtt_watcher
-from mqtt.mqtt_publisher import mqtt_publisher
+from mqtt.order_admission import OrderAdmission
 from mqtt.device_status import DeviceStatusPublisher
-import threading
-import json
+from mqtt.metrics_publisher import MetricsPublisher
+from mqtt.outbox import MessageOutbox
+from mqtt.stop_router import STOP_TOPIC, StopRouter
 
 # Get the device ID from the serial number
 load_dotenv()
 MQTT_DOMAIN = os.getenv("MQTT_DOMAIN")
 DEVICE_ID = get_serial()
 
-def deactivate_line(publisher):
-    """Stops the current process."""
-    publisher.publish_error("interrupted")
-
-
 def _shutdown_handler(signum, frame):
     """Monitor keyboard interrupts and shutdown signals."""
     raise KeyboardInterrupt
 
 
 def main():
-    # GPIO pins
-    kettle_relay_pin = int(os.getenv("KETTLE_RELAY_PIN"))
-    pump_relay_pin = int(os.getenv("PUMP_RELAY_PIN"))
+    # Log records are written by a background thread, so the control loops never wait for stdout
+    log_listener = setup_logging(
+        os.getenv("LOG_LEVEL", "INFO"),
+        os.getenv("LOG_FORMAT", "text"),
+        per_second=float(os.getenv("LOG_RATE_LIMIT_PER_SECOND", "10")),
+    )
+
+    # GPIO pins, flow gauge and temperature sensor of each line
+    line_configs = load_line_configs()
+    # Set the relay pins of all lines up once, with every relay off
+    relay_manager().setup(pin for config in line_configs.values() for pin in config.relay_pins)
+
+    # Sample rates of the control loops
+    flow_sample_rate = float(os.getenv("FLOW_SAMPLE_RATE_HZ", "4"))
+    temp_sample_rate = float(os.getenv("TEMP_SAMPLE_RATE_HZ", "10"))
+    # How the heater decides when the kettle relay is on
+    heater_control = os.getenv("HEATER_CONTROL", "bang-bang")
+    # How long the temperature is kept at the target before the lot is completed
+    heater_hold_seconds = float(os.getenv("HEATER_HOLD_SECONDS", "0"))
+    # When the pump is switched off before the target
+    flow_cutoff = os.getenv("FLOW_CUTOFF", "fixed")
+    # How the volume is taken from the flow gauge readings
+    volume_estimate = os.getenv("FLOW_VOLUME_ESTIMATE", "max")
+    totalizer_step = float(os.getenv("FLOW_TOTALIZER_STEP_LITERS", "0.01"))
+    # Optional sample rate bounds, to sample faster as the target comes closer
+    flow_adaptive_rate = AdaptiveRate.parse(os.environ["FLOW_ADAPTIVE_RATE_HZ"]) if os.getenv("FLOW_ADAPTIVE_RATE_HZ") else None
+    temp_adaptive_rate = AdaptiveRate.parse(os.environ["TEMP_ADAPTIVE_RATE_HZ"]) if os.getenv("TEMP_ADAPTIVE_RATE_HZ") else None
+    # Orders waiting for a line before new ones are rejected, and how long lot numbers are remembered
+    order_max_pending = int(os.getenv("ORDER_MAX_PENDING", "10"))
+    order_dedup_seconds = float(os.getenv("ORDER_DEDUP_SECONDS", "3600"))
+    # Optional shared subscription, so each order of a fleet of devices runs on one of them
+    share_group = os.getenv("MQTT_SHARE_GROUP") or None
+    # Seconds between the metrics messages, 0 to not publish them, and the port of the Prometheus endpoint
+    metrics_interval = float(os.getenv("METRICS_INTERVAL_SECONDS", "60"))
+    metrics_port = os.getenv("METRICS_PORT")
+    # Keep the flow gauges connected between lots and probe them, or connect for each lot
+    gauge_pool = None
+    if os.getenv("FLOW_GAUGE_POOL", "true").lower() == "true":
+        gauge_pool = Mag6000Pool(probe_interval=float(os.getenv("FLOW_GAUGE_PROBE_SECONDS", "10")))
+
+    # Reads the temperature sensors of all lines in the background
+    temp_resolution = os.getenv("TEMP_SENSOR_RESOLUTION")
+    temp_sampler = DS18B20Sampler(
+        [config.temp_sensor_id for config in line_configs.values()],
+        resolution=int(temp_resolution) if temp_resolution else None,
+    )
 
     # Register SIGTERM, to cancel execution on termination
     signal.signal(signal.SIGTERM, _shutdown_handler)
 
     print(MQTT_DOMAIN)
 
-    # MQTT connection
-    mqtt = mqtt_connector(MQTT_DOMAIN)
+    # Optional disk-backed outbox, which keeps messages through broker outages
+    outbox_path = os.getenv("MQTT_OUTBOX_PATH")
+    outbox_max_bytes = int(float(os.getenv("MQTT_OUTBOX_MAX_MB", "64")) * 1024 * 1024)
+
+    # MQTT connection, by default over wss on port 443 with a clean session
+    mqtt_port = os.getenv("MQTT_PORT")
+    persistent_session = os.getenv("MQTT_PERSISTENT_SESSION", "false").lower() == "true"
+    mqtt_options = dict(
+        mode=os.getenv("MQTT_TRANSPORT", "websockets"),
+        port=int(mqtt_port) if mqtt_port else None,
+        protocol=os.getenv("MQTT_PROTOCOL", "3.1.1"),
+        # A persistent session is found again by the client id, so it is derived from the device
+        client_id=f"cda-{DEVICE_ID}" if persistent_session else "",
+        persistent_session=persistent_session,
+        keepalive=int(os.getenv("MQTT_KEEPALIVE", "10")),
+        max_inflight=int(os.getenv("MQTT_MAX_INFLIGHT", "20")),
+        max_queued=int(os.getenv("MQTT_MAX_QUEUED", "0")),
+        ca_file=os.getenv("MQTT_CA_FILE") or None,
+    )
+    # Optionally run the network stack in a process of its own, so MQTT traffic does not delay the control loops
+    mqtt_process = os.getenv("MQTT_PROCESS", "false").lower() == "true"
+    if mqtt_process:
+        mqtt = MqttProcess(
+            MQTT_DOMAIN,
+            ring_bytes=int(os.getenv("MQTT_PROCESS_RING_KB", "1024")) * 1024,
+            outbox_path=outbox_path or None,
+            outbox_max_bytes=outbox_max_bytes,
+            **mqtt_options,
+        )
+    else:
+        outbox = MessageOutbox(outbox_path, max_bytes=outbox_max_bytes) if outbox_path else None
+        mqtt = mqtt_connector(MQTT_DOMAIN, outbox, **mqtt_options)
     status_publisher = DeviceStatusPublisher(mqtt, DEVICE_ID)
     status_publisher.configure_lwt()
     # When connected, instantly mark as online
     mqtt.register_on_connect(status_publisher.mark_online)
     mqtt.connect()
 
+    # Publish the metrics next to the status, and serve them to a local Prometheus
+    metrics_publisher = MetricsPublisher(mqtt, DEVICE_ID, interval=metrics_interval).start() if metrics_interval > 0 else None
+    metrics_endpoint = MetricsEndpoint(port=int(metrics_port), host=os.getenv("METRICS_HOST", "127.0.0.1")).start() if metrics_port else None
+
     # Subscribe to stop signals
-    STOP_TOPIC = "request/process/stop"
     mqtt.subscribe(STOP_TOPIC, qos=1)
 
-    # Set up watcher → listens for new requests
-    watcher = mqtt_watcher(mqtt)
+    # Routes stop signals to the stop event of the running lot, in a fleet also to the other devices
+    stop_router = StopRouter(mqtt, forward_topic=STOP_TOPIC if share_group else None)
+
+    # Runs the lots, each line in its own thread
+    temp_sampler.start()
+    if gauge_pool is not None:
+        gauge_pool.start(config.flow_gauge_address for config in line_configs.values())
+    runner = LotRunner(
+        mqtt,
+        status_publisher,
+        stop_router,
+        flow_sample_rate_hz=flow_sample_rate,
+        temp_sample_rate_hz=temp_sample_rate,
+        temp_sampler=temp_sampler,
+        heater_control=heater_control,
+        flow_cutoff=flow_cutoff,
+        volume_estimate=volume_estimate,
+        totalizer_step_liters=totalizer_step,
+        flow_adaptive_rate=flow_adaptive_rate,
+        temp_adaptive_rate=temp_adaptive_rate,
+        gauge_pool=gauge_pool,
+        heater_hold_seconds=heater_hold_seconds,
+    )
+    # Pipelined lines fill the next lot while the last one heats
+    scheduler = LineScheduler(line_configs, runner.run, stages=runner)
+    scheduler.start()
+
+    # Set up watcher → listens for new requests, and acknowledges or rejects each one
+    admission = OrderAdmission(
+        mqtt,
+        order_max_pending,
+        order_dedup_seconds,
+        backlog=scheduler.pending,
+        has_line=lambda order: scheduler.config_for(order) is not None,
+    )
+    watcher = mqtt_watcher(
+        mqtt,
+        admission,
+        share_group=share_group,
+        line_busy=lambda order: scheduler.load(order) > 0,
+    )
 
     try:
         while True:
@@ -59,91 +176,45 @@ def main():
             # IDLE: wait until we have both litres and temperature
             # ------------------------------------------------------
             order = watcher.wait_for_order()
-            liters_to_add = order["liters"]
-            target_temp = order["temperature"]
-            line = order["line"]
-            lot_id = order["lot_number"]
-            status_publisher.mark_occupied(lot_id)
-
-            # Set up stop event for this lot
-            stop_event = threading.Event()
-
-            def _on_stop_signal(client, userdata, msg):
-                try:
-                    payload = json.loads(msg.payload.decode())
-                    if payload.get("lot_number") == lot_id:
-                        print(f"Stop signal received for lot {lot_id}")
-                        stop_event.set()
-                except json.JSONDecodeError:
-                    pass
-
-            # Register stop callback
-            mqtt.register_callback(_on_stop_signal)
-
-            publisher = mqtt_publisher(mqtt, lot_id, line)
-            print(f"Received request → {liters_to_add} L at {target_temp} °C")
-
-            try:
-                # ------------------ Filling phase -----------------
-                with Mag6000Connector() as connector:
-                    print("[DEBUG] Connected to sensor")
-                    monitor = FlowMonitor(
-                        target_liters=liters_to_add,
-                        connector=connector,
-                        pump_relay_pin=pump_relay_pin,
-                        publisher=publisher,
-                        stop_event=stop_event,
-                    )
-                    final_liters = monitor.run()
-
-                if final_liters is not None:
-                    publisher.publish_flow_final(final_liters)
-                else:
-                    deactivate_line(publisher)
-                    print("Flow interrupted")
-                    status_publisher.mark_error("Flow interrupted")
-                    continue
-
-                # ------------------ Heating phase -----------------
-                heater = Heater(
-                    target_temperature=target_temp,
-                    kettle_relay_pin=kettle_relay_pin,
-                    publisher=publisher,
-                    stop_event=stop_event,
-                )
-                final_temp = heater.run()
-
-                if final_temp is not None:
-                    publisher.publish_temp_final(final_temp)
-                    status_publisher.mark_available()
-                else:
-                    deactivate_line(publisher)
-                    print("Heater interrupted")
-                    status_publisher.mark_error("Heater interrupted")
-                    continue
-
-
-            except Exception as exc:
-                # Capture *any* error from filling/heating
-                publisher.publish_error(str(exc))
-                status_publisher.mark_available()
+            # Hand the order to its line, lots on other lines keep running meanwhile
+            if not scheduler.submit(order, order["priority"]):
+                print(f"Line {order['line']} is not configured on this device")
+                status_publisher.mark_error(f"Line {order['line']} is not configured")
 
     except KeyboardInterrupt:
         print("Operation interrupted by user. Shutting down.")
 
     finally:
+        # Stop the running lots, and wait briefly for them to turn off their relays
+        stop_router.stop_all()
+        scheduler.shutdown(timeout=5)
+        temp_sampler.stop()
+        if gauge_pool is not None:
+            print(f"Flow gauges: {gauge_pool.summary()}")
+            gauge_pool.close()
+        if metrics_publisher is not None:
+            metrics_publisher.stop()
+        if metrics_endpoint is not None:
+            metrics_endpoint.stop()
         status_publisher.mark_offline()
-        # Ensure pump is off
-        pump_relay_controller = RelayController(pump_relay_pin)
-        pump_relay_controller.toggle_relay(False)
-        print("Turned off pump.")
-
-        # Ensure heater is off
-        heater_relay_controller = RelayController(kettle_relay_pin)
-        heater_relay_controller.toggle_relay(False)
-        print("Turned off heater.")
+        # Ensure the pumps, heaters and transfers of all lines are off, in one write
+        relays = relay_manager()
+        relays.set_many([pin for config in line_configs.values() for pin in config.relay_pins], False)
+        print("Turned off pumps, heaters and transfers.")
+        print(f"Relays: {relays.summary()}")
+        relays.release()
+
+        # Send or store the last messages before exiting
+        mqtt.flush_outbox()
+        if mqtt_process:
+            print(f"MQTT process ring: {mqtt.stats()}")
+            mqtt.disconnect()
 
         print("Finished turning off.")
+        if log_listener.dropped:
+            print(f"Log records dropped: {log_listener.dropped}")
+        # Write the log records still queued
+        log_listener.stop()
 
 
 if __name__ == "__main__":
@@ -1,16 +1,54 @@
 import json
+import threading
 
 STATUS_TOPIC_TEMPLATE = "devices/{device_id}/status"
 
+# Payloads without variable fields are serialized once
+OFFLINE_PAYLOAD = json.dumps({"status": "offline"})
+AVAILABLE_PAYLOAD = json.dumps({"status": "available"})
+
 class DeviceStatusPublisher:
     """
     Publishes availability and occupation status for a given device_id.
+    When several lots run at once, on different lines or in the stages of a pipelined
+    line, the device stays occupied until the last lot is done, and the occupied
+    status lists the line of each running lot.
     """
 
     def __init__(self, connector, device_id: str):
         self._connector = connector
         self._device_id = device_id
         self._status_topic = STATUS_TOPIC_TEMPLATE.format(device_id=device_id)
+        # Line numbers of the running lots, by lot number
+        self._lots: dict[str, int] = {}
+        # Keeps the status messages of concurrent lines in order
+        self._lock = threading.Lock()
+
+    def _publish(self, payload: str):
+        self._connector.publish(
+            self._status_topic,
+            payload,
+            qos=1,
+            retain=True
+        )
+
+    def _occupied_payload(self, lot_number: str) -> str:
+        data = {"status": "occupied", "lot_number": lot_number}
+        if self._lots:
+            data["lots"] = dict(self._lots)
+        return json.dumps(data)
+
+    def _idle_payload(self) -> str:
+        # Still occupied while any other lot is running
+        if self._lots:
+            return self._occupied_payload(next(reversed(self._lots)))
+        return AVAILABLE_PAYLOAD
+
+    def _forget(self, line: int | None, lot_number: str | None):
+        if lot_number is not None:
+            self._lots.pop(lot_number, None)
+        elif line is not None:
+            self._lots = {lot: lot_line for lot, lot_line in self._lots.items() if lot_line != line}
 
     def configure_lwt(self):
         """
@@ -19,52 +57,55 @@ class DeviceStatusPublisher:
         """
         self._connector._client.will_set(
             self._status_topic,
-            json.dumps({"status": "offline"}),
+            OFFLINE_PAYLOAD,
             qos=1,
             retain=True
         )
 
     def mark_online(self):
         """Publish 'available' when the device comes online."""
-        self._connector.publish(
-            self._status_topic,
-            json.dumps({"status": "available"}),
-            qos=1,
-            retain=True
-        )
+        with self._lock:
+            self._publish(self._idle_payload())
 
     def mark_offline(self):
         """Publish 'offline' on graceful shutdown."""
         self._connector.publish(
             self._status_topic,
-            json.dumps({"status": "offline"}),
+            OFFLINE_PAYLOAD,
             qos=1,
             retain=True
         )
 
-    def mark_occupied(self, lot_number: str):
-        """Publish 'occupied' and include the lot_number."""
-        self._connector.publish(
-            self._status_topic,
-            json.dumps({"status": "occupied", "lot_number": lot_number}),
-            qos=1,
-            retain=True
-        )
+    def mark_occupied(self, lot_number: str, line: int | None = None):
+        """Publish 'occupied' and include the lot_number, and the lines of all running lots."""
+        with self._lock:
+            if line is not None:
+                self._lots[lot_number] = line
+            self._publish(self._occupied_payload(lot_number))
 
-    def mark_error(self, error_message: str):
-        """Publish 'error' with an error message."""
-        self._connector.publish(
-            self._status_topic,
-            json.dumps({"status": "error", "error_message": error_message}),
-            qos=1,
-            retain=True
-        )
+    def mark_error(self, error_message: str, line: int | None = None, lot_number: str | None = None):
+        """
+        Publish 'error' with an error message, and the line and lot it happened on.
+        While lots of other lines are still running, 'occupied' is published again after it,
+        so the retained status does not say error while they run.
+        """
+        data = {"status": "error", "error_message": error_message}
+        with self._lock:
+            if line is not None:
+                self._forget(line, lot_number)
+                data["line"] = line
+                if lot_number is not None:
+                    data["lot_number"] = lot_number
+            self._publish(json.dumps(data))
+            if self._lots:
+                self._publish(self._idle_payload())
 
-    def mark_available(self):
-        """Publish 'available' when the device finishes processing."""
-        self._connector.publish(
-            self._status_topic,
-            json.dumps({"status": "available"}),
-            qos=1,
-            retain=True
-        )
+    def mark_available(self, line: int | None = None, lot_number: str | None = None):
+        """
+        Publish 'available' when the device finishes processing, or 'occupied' while other lots are running.
+        With a line, the lot_number (or every lot of the line) is no longer running.
+        """
+        with self._lock:
+            if line is not None:
+                self._forget(line, lot_number)
+            self._publish(self._idle_payload())
@@ -0,0 +1,63 @@
+import json
+import threading
+import time
+
+from functions.metrics import REGISTRY, MetricsRegistry
+
+METRICS_TOPIC_TEMPLATE = "devices/{device_id}/metrics"
+
+
+class MetricsPublisher:
+    """
+    Publishes a summary of the metrics registry for a given device_id at a fixed interval,
+    next to the status that DeviceStatusPublisher keeps on devices/{device_id}/status.
+    Histograms are sent as count, sum, max and estimated p50 and p95, in seconds.
+    """
+
+    def __init__(self, connector, device_id: str, registry: MetricsRegistry = REGISTRY, interval: float = 60.0):
+        """
+        :param connector: The MQTT connector to publish with.
+        :param device_id: Device id in the topic.
+        :param registry: The metrics to publish.
+        :param interval: Seconds between the messages.
+        """
+        if interval <= 0:
+            raise ValueError("The metrics interval must be positive")
+        self._connector = connector
+        self._device_id = device_id
+        self._registry = registry
+        self._interval = interval
+        self._metrics_topic = METRICS_TOPIC_TEMPLATE.format(device_id=device_id)
+        self._stop_event = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def publish_now(self):
+        """Publish the current metrics. Not retained, as they are out of date by the next message."""
+        payload = {
+            "device": self._device_id,
+            "timestamp": time.time(),
+            "interval": self._interval,
+            "metrics": self._registry.summary(),
+        }
+        self._connector.publish(self._metrics_topic, json.dumps(payload), qos=0, retain=False)
+
+    def start(self):
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="metrics-publisher", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop publishing, after a last message with the metrics up to now."""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+            self.publish_now()
+
+    def _run(self):
+        while not self._stop_event.wait(self._interval):
+            try:
+                self.publish_now()
+            except Exception as e:
+                print(f"Publishing the metrics failed: {e}")
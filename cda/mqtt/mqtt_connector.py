@@ -1,63 +1,173 @@
 from __future__ import annotations
 import threading
-from typing import Callable, List, Any
+import time
+from typing import Any, Callable, NamedTuple
 import paho.mqtt.client as mqtt
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
 import ssl
 
+from functions.metrics import REGISTRY
+from mqtt.outbox import MessageOutbox, OutboxForwarder
+from mqtt.topic_dispatcher import CallbackHandle, TopicDispatcher
+
+class TransportMode(NamedTuple):
+    """How the connector reaches the broker."""
+
+    transport: str
+    port: int
+    tls: bool
+
+
+TRANSPORT_MODES = {
+    # MQTT in WebSocket frames over TLS, through the HTTPS port of the server
+    "websockets": TransportMode("websockets", 443, True),
+    # MQTT over TLS, without the WebSocket framing
+    "tls": TransportMode("tcp", 8883, True),
+    # Plain MQTT, for a broker on the internal network or a local mosquitto
+    "tcp": TransportMode("tcp", 1883, False),
+    # WebSockets without TLS, for a broker on the internal network behind a WebSocket listener
+    "ws": TransportMode("websockets", 80, False),
+}
+
+PROTOCOLS = {"3.1.1": mqtt.MQTTv311, "5": mqtt.MQTTv5}
+
+# From handing a message to paho to its PUBACK, or to being written to the socket for QoS 0
+PUBLISH_ACK_SECONDS = REGISTRY.histogram("cda_mqtt_publish_ack_seconds", "Time from publish to PUBACK of an MQTT message", ("qos",))
+INFLIGHT_MESSAGES = REGISTRY.gauge("cda_mqtt_inflight_messages", "MQTT messages handed to paho and not yet acknowledged")
+
+
 class mqtt_connector:
 
     def __init__(
         self,
         broker_url: str,
+        outbox: MessageOutbox | None = None,
+        mode: str = "websockets",
+        port: int | None = None,
+        protocol: str = "3.1.1",
+        client_id: str = "",
+        persistent_session: bool = False,
+        session_expiry: int = 3600,
+        keepalive: int = 10,
+        max_inflight: int = 20,
+        max_queued: int = 0,
+        reconnect_delay: tuple[int, int] = (1, 120),
+        ca_file: str | None = None,
     ) -> None:
+        """
+        :param broker_url: Domain of the MQTT broker.
+        :param outbox: Optional disk-backed queue, which keeps outgoing messages through broker outages.
+        :param mode: How the broker is reached, one of TRANSPORT_MODES.
+        :param port: Port of the broker, or None for the port of the mode.
+        :param protocol: MQTT version, "3.1.1" or "5".
+        :param client_id: Client id, which must be stable for a persistent session. Empty for a random id.
+        :param persistent_session: Keep the subscriptions and unacknowledged QoS 1 messages at the broker
+            while disconnected, so they are delivered after reconnecting.
+        :param session_expiry: Seconds the broker keeps a persistent session, with MQTT 5.
+        :param keepalive: Seconds between pings while idle.
+        :param max_inflight: QoS 1 messages sent without waiting for their PUBACK.
+        :param max_queued: Messages paho queues beyond the in-flight window, 0 for no limit.
+        :param reconnect_delay: Least and most seconds between reconnects, doubled after each failure.
+        :param ca_file: CA certificate of the broker for TLS, or None for the system certificates.
+        """
         print(f"MQTT: Initialising connector for {broker_url}")
+        if mode not in TRANSPORT_MODES:
+            raise ValueError(f"Unknown MQTT transport mode {mode!r}, expected one of {', '.join(TRANSPORT_MODES)}")
+        if protocol not in PROTOCOLS:
+            raise ValueError(f"Unknown MQTT protocol {protocol!r}, expected 3.1.1 or 5")
+        if persistent_session and not client_id:
+            raise ValueError("A persistent session needs a client_id")
+        transport = TRANSPORT_MODES[mode]
 
         # Connection parameters for MQTT broker
         self._host = broker_url
-        self._port = 443
-        self._path = "/"
+        self._port = port or transport.port
+        self._path = "/" if transport.transport == "websockets" else None
+        self._tls = transport.tls
+        self._keepalive = keepalive
+        self._protocol = PROTOCOLS[protocol]
+        self._persistent_session = persistent_session
+        self._session_expiry = session_expiry
 
         # Track subscriptions to re-subscribe after reconnects
         self._subscriptions: list[tuple[str, int]] = []
 
         # Instantiate MQTT client with provided options
-        self._client = mqtt.Client(
-            clean_session=True,  # Start with a clean session (no persistent session)
-            transport="websockets",  # Use WebSockets transport for MQTT
-        )
+        if self._protocol == mqtt.MQTTv5:
+            # MQTT 5 sets the session with clean_start and the session expiry when connecting
+            self._client = mqtt.Client(client_id=client_id, protocol=self._protocol, transport=transport.transport)
+        else:
+            self._client = mqtt.Client(
+                client_id=client_id,
+                clean_session=not persistent_session,  # A clean session forgets the QoS 1 state on each reconnect
+                transport=transport.transport,
+            )
         # Use TLS for secure connection
-        self._client.tls_set_context(ssl.create_default_context())
+        if transport.tls:
+            self._client.tls_set_context(ssl.create_default_context(cafile=ca_file))
+        # Messages in flight and queued, and the backoff between reconnects
+        self._client.max_inflight_messages_set(max_inflight)
+        self._client.max_queued_messages_set(max_queued)
+        self._client.reconnect_delay_set(*reconnect_delay)
 
         # Assign handlers for MQTT events
         self._client.on_connect = self._on_connect
+        self._client.on_disconnect = self._on_disconnect
         self._client.on_message = self._on_message
 
+        # With an outbox, messages are stored first and forwarded by a background thread
+        self._outbox = outbox
+        self._forwarder: OutboxForwarder | None = None
+        if outbox is not None:
+            self._forwarder = OutboxForwarder(outbox, self._send)
+        self._client.on_publish = self._on_publish
+        # When each message not yet acknowledged was handed to paho, and its QoS, by message id
+        self._unacked: dict[int, tuple[float, int]] = {}
+        # Acknowledgements that arrived before publish() returned the message id
+        self._early_acks: dict[int, float] = {}
+        self._unacked_lock = threading.Lock()
+
         # Event to signal when connection is established
         self._connected_event = threading.Event()
-        self._external_callbacks: List[  # List of callbacks for incoming messages
-            Callable[[mqtt.Client, Any, mqtt.MQTTMessage], None]
-        ] = []
+        # Callbacks for incoming messages, by topic filter
+        self._dispatcher = TopicDispatcher()
         # List of callbacks to run on connection
         self._connect_callbacks: list[Callable[[], None]] = []
 
     def connect(self) -> None:
-        """Open the broker connection and start the background loop."""
-        print(f"MQTT: Connecting to {self._host}:{self._port} over {'wss' if self._port == 443 else 'ws'}{self._path}")
+        """Open the broker connection and start the background loop, which reconnects with backoff."""
+        if self._path:
+            print(f"MQTT: Connecting to {self._host}:{self._port} over {'wss' if self._tls else 'ws'}{self._path}")
+        else:
+            print(f"MQTT: Connecting to {self._host}:{self._port} over {'mqtts' if self._tls else 'mqtt'}")
 
         # If a WebSocket path is specified
         if self._path:
             # Set WebSocket options on client - this is required for the connection
             self._client.ws_set_options(path=self._path)
 
-        # Initiate connection to broker with keepalive
-        self._client.connect(self._host, self._port, keepalive=10)
+        # Start forwarding stored messages, which waits for the connection
+        if self._forwarder is not None:
+            self._forwarder.start()
+
+        # Connected by the network loop, which also retries the first connection with backoff
+        if self._protocol == mqtt.MQTTv5:
+            properties = Properties(PacketTypes.CONNECT)
+            properties.SessionExpiryInterval = self._session_expiry if self._persistent_session else 0
+            self._client.connect_async(
+                self._host, self._port, keepalive=self._keepalive,
+                clean_start=not self._persistent_session, properties=properties,
+            )
+        else:
+            self._client.connect_async(self._host, self._port, keepalive=self._keepalive)
         # Start network loop in background thread
         self._client.loop_start()
 
         # Wait for on_connect event with timeout
         if not self._connected_event.wait(timeout=5):
             # Warn if no connection ack received, due to the broker being unreachable
-            print("MQTT: No CONNACK received within 5 s – check broker reachability")
+            print("MQTT: No CONNACK received within 5 s – check broker reachability")
 
     def disconnect(self) -> None:
         """Gracefully stop the network loop and disconnect."""
@@ -65,6 +175,10 @@ class mqtt_connector:
         # Stop the network loop and disconnect from the broker
         self._client.loop_stop()
         self._client.disconnect()
+        # Commit what is still stored, it is sent after the next start
+        if self._forwarder is not None:
+            self._forwarder.stop()
+            self._outbox.close()
 
     def subscribe(self, topic: str, qos: int = 1) -> None:
         """Subscribe to a topic."""
@@ -80,25 +194,79 @@ class mqtt_connector:
         payload: str, # Payload message to send
         qos: int = 1, # MQTT QoS level: 0=at most once, 1=at least once, 2=exactly once
         retain: bool = True, # Whether the message should be retained by the broker
-    ) -> None:
-        """Publish a payload to *topic*."""
-        self._client.publish(topic, payload, qos=qos, retain=retain)
+    ) -> mqtt.MQTTMessageInfo | None:
+        """Publish a payload to *topic*. Returns paho's message info, or None when the message went to the outbox."""
+        if self._forwarder is not None:
+            # Stored on disk, the forwarder sends it in order once connected
+            self._outbox.append(topic, payload, qos, retain)
+            self._forwarder.notify()
+            return None
+        return self._publish_timed(topic, payload, qos, retain)
+
+    def _send(self, topic: str, payload: bytes, qos: int, retain: bool) -> int | None:
+        """Hand a stored message to paho, and return its message id if it was accepted."""
+        info = self._publish_timed(topic, payload, qos, retain)
+        return info.mid if info.rc == mqtt.MQTT_ERR_SUCCESS else None
+
+    def _publish_timed(self, topic: str, payload, qos: int, retain: bool) -> mqtt.MQTTMessageInfo:
+        """Hand a message to paho, and time it until it is acknowledged."""
+        started = time.perf_counter()
+        info = self._client.publish(topic, payload, qos=qos, retain=retain)
+        # While disconnected, paho keeps QoS 1 and 2 messages to send after reconnecting, and drops QoS 0
+        if info.rc != mqtt.MQTT_ERR_SUCCESS and not (info.rc == mqtt.MQTT_ERR_NO_CONN and qos > 0):
+            return info
+        # Our lock is not held around publish(), as paho calls on_publish holding its own lock
+        with self._unacked_lock:
+            acked = self._early_acks.pop(info.mid, None)
+            if acked is None:
+                self._unacked[info.mid] = (started, qos)
+            INFLIGHT_MESSAGES.set(len(self._unacked))
+        if acked is not None:
+            PUBLISH_ACK_SECONDS.labels(qos).observe(acked - started)
+        return info
+
+    def flush_outbox(self, timeout: float = 2.0) -> None:
+        """Wait up to *timeout* seconds for the outbox to drain, and commit what remains to disk."""
+        if self._outbox is None:
+            return
+        deadline = time.monotonic() + timeout
+        while self._outbox.depth and self._connected_event.is_set() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self._outbox.sync()
+        if self._outbox.depth:
+            print(f"MQTT: {self._outbox.depth} messages left in the outbox")
+
+    def outbox_stats(self) -> dict | None:
+        """Queue depth, drain rate and counters of the outbox, if one is used."""
+        return None if self._forwarder is None else self._forwarder.stats()
 
     def register_callback(
-        self, callback: Callable[[mqtt.Client, Any, mqtt.MQTTMessage], None]
-    ) -> None:
-        """Register a function to receive *all* incoming MQTT messages."""
-        self._external_callbacks.append(callback)
+        self, topic_filter: str, callback: Callable[[mqtt.Client, Any, mqtt.MQTTMessage], None]
+    ) -> CallbackHandle:
+        """
+        Register a function to receive incoming MQTT messages on topics matching *topic_filter*,
+        which may contain the `+` and `#` wildcards. Returns a handle for unregister_callback().
+        """
+        return self._dispatcher.add(topic_filter, callback)
+
+    def unregister_callback(self, handle: CallbackHandle) -> None:
+        """Stop calling a function registered with register_callback()."""
+        self._dispatcher.remove(handle)
 
     def register_on_connect(self, callback: Callable[[], None]) -> None:
         """Register a function to call when MQTT connection is established."""
         self._connect_callbacks.append(callback)
 
-    def _on_connect(self, client, userdata, flags, rc):
-        """Handles when the client connects to the broker."""
-        print(f"MQTT: connection established")
+    def _on_connect(self, client, userdata, flags, rc, properties=None):
+        """Handles when the client connects to the broker. MQTT 5 also passes the CONNACK properties."""
+        # With a persistent session, the broker kept the subscriptions and the QoS 1 messages
+        session_present = flags.get("session present") if isinstance(flags, dict) else getattr(flags, "session_present", False)
+        print(f"MQTT: connection established{' (session resumed)' if session_present else ''}")
         # Signal that connection event occurred
         self._connected_event.set()
+        # Replay the messages stored while disconnected
+        if self._forwarder is not None:
+            self._forwarder.on_connect()
         # Re-subscribe to any topics after reconnect
         for topic, qos in self._subscriptions:
             self._client.subscribe((topic, qos))
@@ -111,11 +279,30 @@ class mqtt_connector:
             except Exception as e:
                 print(f"On-connect callback failed: {e}")
 
+    def _on_disconnect(self, client, userdata, rc, properties=None):
+        """Handles when the connection to the broker is lost."""
+        print(f"MQTT: disconnected (rc={rc})")
+        self._connected_event.clear()
+        # Stop forwarding, the stored messages are kept until the next connection
+        if self._forwarder is not None:
+            self._forwarder.on_disconnect()
+            print(f"MQTT: {self._outbox.depth} messages stored in the outbox")
+
+    def _on_publish(self, client, userdata, mid, *args):
+        """Handles when paho has delivered a message (PUBACK for QoS 1). Newer paho versions pass more arguments."""
+        acked = time.perf_counter()
+        with self._unacked_lock:
+            sent = self._unacked.pop(mid, None)
+            if sent is None:
+                self._early_acks[mid] = acked
+            INFLIGHT_MESSAGES.set(len(self._unacked))
+        if sent is not None:
+            started, qos = sent
+            PUBLISH_ACK_SECONDS.labels(qos).observe(acked - started)
+        if self._forwarder is not None:
+            self._forwarder.on_publish(mid)
+
     def _on_message(self, client, userdata, msg):
         """Handles when a message is received on a subscribed topic."""
-        # Check with external callbacks
-        for cb in self._external_callbacks:
-            try:
-                cb(client, userdata, msg)
-            except Exception as e:
-                print(f"External MQTT callback failed: {e}")
+        # Only the callbacks registered for matching topic filters are called
+        self._dispatcher.dispatch(client, userdata, msg)
@@ -0,0 +1,287 @@
+"""
+Runs the MQTT connection in a process of its own, apart from the control loops.
+
+In one process, paho's network thread, the TLS and WebSocket framing and the
+outbox compete with the flow and heat loops for the GIL, so a burst of MQTT
+traffic delays their ticks. MqttProcess has the interface of mqtt_connector,
+but only copies each published message into a shared-memory ring; a network
+process takes them from there and publishes them with a real connector.
+Incoming messages, such as orders and stop signals, come back through a pipe
+and are dispatched to the registered callbacks by a thread of the control
+process, as paho's network thread would. Subscriptions, the Last Will,
+connecting and flushing go to the network process through the same pipe.
+
+Usage:
+    mqtt = MqttProcess(MQTT_DOMAIN, mode="tcp")
+    mqtt.register_callback("request/process", on_order)
+    mqtt.connect()
+    mqtt.subscribe("request/process")
+    mqtt.publish("sensor/flow_gauge/progress", payload)
+    ...
+    mqtt.flush_outbox()
+    mqtt.disconnect()
+"""
+from __future__ import annotations
+
+import multiprocessing
+import signal
+import struct
+import threading
+from typing import Any, Callable, NamedTuple
+
+from functions.metrics import REGISTRY
+from functions.shared_ring import SharedRing
+from functions.structured_log import get_logger
+from mqtt.mqtt_connector import mqtt_connector
+from mqtt.outbox import MessageOutbox
+from mqtt.topic_dispatcher import CallbackHandle, TopicDispatcher
+
+log = get_logger(__name__)
+
+RING_DROPPED = REGISTRY.counter("cda_mqtt_ring_dropped_total", "MQTT messages dropped because the ring to the network process was full")
+
+# Topic length, QoS and retain flag of a published message, followed by the topic and the payload
+_PUBLISH = struct.Struct("<HB?")
+# How often the network process checks for commands while no messages are published
+COMMAND_POLL_SECONDS = 0.05
+
+
+class RelayedMessage(NamedTuple):
+    """An incoming message, relayed by the network process. Has the attributes of paho's MQTTMessage that the callbacks use."""
+
+    topic: str
+    payload: bytes
+    qos: int
+    retain: bool
+
+
+def network_connector(broker_url: str, outbox_path: str | None = None, outbox_max_bytes: int = 64 * 1024 * 1024, **options) -> mqtt_connector:
+    """The connector of the network process, with the outbox opened there."""
+    outbox = MessageOutbox(outbox_path, max_bytes=outbox_max_bytes) if outbox_path else None
+    return mqtt_connector(broker_url, outbox, **options)
+
+
+def _pack(topic: str, payload, qos: int, retain: bool) -> bytes:
+    if isinstance(payload, str):
+        payload = payload.encode()
+    topic_bytes = topic.encode()
+    return _PUBLISH.pack(len(topic_bytes), qos, retain) + topic_bytes + (payload or b"")
+
+
+def _unpack(record: bytes) -> tuple[str, bytes, int, bool]:
+    topic_length, qos, retain = _PUBLISH.unpack_from(record)
+    start = _PUBLISH.size + topic_length
+    return record[_PUBLISH.size:start].decode(), record[start:], qos, retain
+
+
+class _RemoteClient:
+    """Stands in for the paho client, whose Last Will is set before connecting."""
+
+    def __init__(self, process: MqttProcess) -> None:
+        self._process = process
+
+    def will_set(self, topic, payload=None, qos=0, retain=False, properties=None):
+        self._process._command("will", topic, payload, qos, retain, properties)
+
+
+class MqttProcess:
+    def __init__(
+        self,
+        broker_url: str,
+        ring_bytes: int = 1024 * 1024,
+        connector_factory: Callable[..., Any] = network_connector,
+        start_method: str = "spawn",
+        **options,
+    ) -> None:
+        """
+        Starts the network process, which connects once connect() is called.
+
+        :param broker_url: Domain of the MQTT broker.
+        :param ring_bytes: Size of the ring of published messages. Messages that do not fit are dropped.
+        :param connector_factory: Creates the connector in the network process, from broker_url and options.
+            Must be a module-level function, as it is passed to the new process.
+        :param start_method: How the process is started. A spawned process does not inherit the threads and locks
+            of this one.
+        :param options: Options of network_connector(), such as mode, client_id and outbox_path.
+        """
+        context = multiprocessing.get_context(start_method)
+        self._ring = SharedRing.create(ring_bytes, context)
+        self._conn, child_conn = context.Pipe()
+        self._send_lock = threading.Lock()
+        self._client = _RemoteClient(self)
+        # Callbacks for incoming messages, by topic filter, and on each connection
+        self._dispatcher = TopicDispatcher()
+        self._connect_callbacks: list[Callable[[], None]] = []
+        self._connected_event = threading.Event()
+        self._flushed_event = threading.Event()
+
+        self._process = context.Process(
+            target=_serve,
+            args=(self._ring, child_conn, connector_factory, broker_url, options),
+            name="mqtt-network",
+            daemon=True,
+        )
+        self._process.start()
+        # The network process holds the other end now, so a closed pipe means it has ended
+        child_conn.close()
+        self._receiver = threading.Thread(target=self._receive, name="mqtt-relay", daemon=True)
+        self._receiver.start()
+
+    def _command(self, *command) -> bool:
+        """Send a command to the network process. Returns False if it has ended."""
+        try:
+            with self._send_lock:
+                self._conn.send(command)
+        except OSError:
+            log.error("MQTT network process has ended", command=command[0], exitcode=self._process.exitcode)
+            return False
+        return True
+
+    def connect(self) -> None:
+        """Connect the network process to the broker, and wait briefly for the connection."""
+        if self._command("connect") and not self._connected_event.wait(timeout=5):
+            print("MQTT: No CONNACK received within 5 s – check broker reachability")
+
+    def disconnect(self, timeout: float = 5.0) -> None:
+        """Publish the messages still in the ring, disconnect and end the network process."""
+        if self._conn.closed:
+            return
+        self._command("stop")
+        self._process.join(timeout)
+        if self._process.is_alive():
+            print("MQTT: network process did not stop, terminating it")
+            self._process.terminate()
+            self._process.join()
+        self._receiver.join(timeout)
+        self._conn.close()
+        self._ring.close()
+
+    def subscribe(self, topic: str, qos: int = 1) -> None:
+        """Subscribe to a topic, the network process subscribes again after reconnects."""
+        self._command("subscribe", topic, qos)
+
+    def publish(self, topic: str, payload, qos: int = 1, retain: bool = True) -> None:
+        """Hand a message to the network process without waiting. It is dropped if the ring is full."""
+        if not self._ring.put(_pack(topic, payload, qos, retain)):
+            RING_DROPPED.inc()
+            log.warning("MQTT ring full, message dropped", topic=topic, ring_bytes=self._ring.capacity)
+
+    def flush_outbox(self, timeout: float = 2.0) -> None:
+        """Wait up to *timeout* seconds for the published messages to leave the network process."""
+        self._flushed_event.clear()
+        # The network process first publishes what is in the ring, then drains its outbox
+        if self._command("flush", timeout):
+            self._flushed_event.wait(timeout + 1.0)
+
+    def outbox_stats(self) -> dict | None:
+        """The outbox is in the network process, its stats are not available here."""
+        return None
+
+    def stats(self) -> dict:
+        """Messages put into the ring, dropped because it was full, and its largest fill level."""
+        return {**self._ring.stats.summary(), "capacity_bytes": self._ring.capacity}
+
+    def register_callback(self, topic_filter: str, callback: Callable[[Any, Any, Any], None]) -> CallbackHandle:
+        """
+        Register a function to receive incoming MQTT messages on topics matching *topic_filter*,
+        which may contain the `+` and `#` wildcards. Returns a handle for unregister_callback().
+        """
+        return self._dispatcher.add(topic_filter, callback)
+
+    def unregister_callback(self, handle: CallbackHandle) -> None:
+        """Stop calling a function registered with register_callback()."""
+        self._dispatcher.remove(handle)
+
+    def register_on_connect(self, callback: Callable[[], None]) -> None:
+        """Register a function to call when MQTT connection is established."""
+        self._connect_callbacks.append(callback)
+
+    def _receive(self) -> None:
+        """Dispatch what the network process sends, until it ends."""
+        while True:
+            try:
+                event, *args = self._conn.recv()
+            except (EOFError, OSError):
+                return
+            if event == "message":
+                self._dispatcher.dispatch(None, None, RelayedMessage(*args))
+            elif event == "connected":
+                self._connected_event.set()
+                for cb in self._connect_callbacks:
+                    try:
+                        cb()
+                    except Exception as e:
+                        print(f"On-connect callback failed: {e}")
+            elif event == "flushed":
+                self._flushed_event.set()
+            elif event == "stopped":
+                return
+
+
+def _serve(ring: SharedRing, conn, connector_factory: Callable[..., Any], broker_url: str, options: dict) -> None:
+    """Main function of the network process: publish what arrives in the ring, and run the commands from the pipe."""
+    # The control process decides when to stop, so the network process publishes the last messages
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    send_lock = threading.Lock()
+
+    def send(*event) -> None:
+        with send_lock:
+            try:
+                conn.send(event)
+            except OSError:
+                # The control process has ended
+                pass
+
+    connector = connector_factory(broker_url, **options)
+    # Every incoming message goes to the control process, which has the callbacks
+    connector.register_callback("#", lambda client, userdata, msg: send("message", msg.topic, msg.payload, msg.qos, bool(msg.retain)))
+    connector.register_on_connect(lambda: send("connected"))
+
+    def publish(record: bytes) -> None:
+        connector.publish(*_unpack(record))
+
+    def run(taken: bytes | None, command: str, *args) -> bool:
+        """
+        Run a command of the control process. Returns False once it is time to stop.
+        *taken* is the record already taken from the ring and not yet published, if any.
+        """
+        if command in ("flush", "stop"):
+            # Messages published before the command was sent go first, in the order they were put
+            for record in ([taken] if taken is not None else []) + ring.drain():
+                publish(record)
+        if command == "connect":
+            connector.connect()
+        elif command == "subscribe":
+            connector.subscribe(*args)
+        elif command == "will":
+            topic, payload, qos, retain, properties = args
+            connector._client.will_set(topic, payload, qos=qos, retain=retain, properties=properties)
+        elif command == "flush":
+            connector.flush_outbox(*args)
+            send("flushed")
+        return command != "stop"
+
+    try:
+        running = True
+        while running:
+            record = ring.get(timeout=COMMAND_POLL_SECONDS)
+            # Commands sent before the record was put are in the pipe by now, so a subscription comes first
+            while running and conn.poll():
+                try:
+                    command = conn.recv()
+                except EOFError:
+                    # The control process has ended without stopping this one
+                    command = ("stop",)
+                if command[0] in ("flush", "stop"):
+                    # Published by the command, ahead of the rest of the ring
+                    running, record = run(record, *command), None
+                else:
+                    running = run(None, *command)
+            if record is not None:
+                publish(record)
+    finally:
+        connector.disconnect()
+        send("stopped")
+        conn.close()
+        ring.close()
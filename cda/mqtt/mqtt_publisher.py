@@ -1,48 +1,120 @@
 from mqtt.mqtt_connector import mqtt_connector
-import json
+from mqtt.payload_codec import JsonCodec
+from mqtt.telemetry_policy import TelemetryPolicy, TelemetryThrottle
+import time
 
 FLOW_PROGRESS_TOPIC = "sensor/flow_gauge/progress"
 TEMP_PROGRESS_TOPIC = "sensor/temp_sensor/progress"
 FLOW_FINAL_TOPIC = "sensor/flow_gauge/final"
 TEMP_FINAL_TOPIC = "sensor/temp_sensor/final"
 
+# Topics with batching enabled publish JSON arrays on this sub-topic instead. The app only
+# understands single objects, so batching is meant for deployments that only log to Telegraf.
+BATCH_TOPIC_SUFFIX = JsonCodec.batch_topic_suffix
+
+# Default rate control for progress messages. The loops sample at 4-10 Hz, which is
+# more than the app and database need, so send changes at most twice per second,
+# and at least every 5 seconds.
+DEFAULT_PROGRESS_POLICIES = {
+    FLOW_PROGRESS_TOPIC: TelemetryPolicy(deadband=0.01, min_interval=0.5, max_interval=5.0),
+    TEMP_PROGRESS_TOPIC: TelemetryPolicy(deadband=0.1, min_interval=0.5, max_interval=5.0),
+}
+
 class mqtt_publisher:
     """
     Helper that publishes progress and final results including lot_id and line number.
     """
 
-    def __init__(self, connector: mqtt_connector, lot_id: str, line: int) -> None:
+    def __init__(
+        self,
+        connector: mqtt_connector,
+        lot_id: str,
+        line: int,
+        policies: dict | None = None,
+        codecs: dict | None = None,
+    ) -> None:
+        """
+        :param connector: The MQTT connector to publish through.
+        :param lot_id: The lot number included in every message.
+        :param line: The line number included in every message.
+        :param policies: TelemetryPolicy per progress topic, defaults to DEFAULT_PROGRESS_POLICIES.
+        :param codecs: Codec class per topic, such as StructCodec. Other topics use JsonCodec.
+        """
         self._connector = connector
         self._lot_id = lot_id
         self._line = line
+        policies = DEFAULT_PROGRESS_POLICIES if policies is None else policies
+        self._throttles = {topic: TelemetryThrottle(policy) for topic, policy in policies.items()}
+        # Every payload carries the same lot_number, line and device, which the codecs serialize once
+        constants = {"lot_number": lot_id, "line": line, "device": "pi"}
+        self._json = JsonCodec(constants)
+        self._codecs = {topic: codec(constants) for topic, codec in (codecs or {}).items()}
 
     def _publish(self, topic: str, data: dict) -> None:
         """
-        Send `data` as JSON on *topic* (with the retain flag set).
+        Send `data` on *topic* (with the retain flag set), with the codec of the topic.
         All payloads carry `lot_id`, `line`, and `device="pi".
         """
-        data |= {"lot_number": self._lot_id, "line": self._line, "device": "pi"}
-        self._connector.publish(topic, json.dumps(data), qos=1, retain=True)
+        codec = self._codecs.get(topic, self._json)
+        self._connector.publish(topic + codec.topic_suffix, codec.encode(data), qos=1, retain=True)
+
+    def _publish_progress(self, topic: str, value: float, data: dict) -> None:
+        """Send a progress sample, subject to the telemetry policy of *topic*."""
+        throttle = self._throttles.get(topic)
+        if throttle is None:
+            self._publish(topic, data)
+            return
+        if throttle.policy.batch_size > 1 or topic in self._codecs:
+            # Samples in a batch arrive together, so each carries the time it was taken
+            data["timestamp"] = time.time()
+        samples = throttle.offer(value, data, time.monotonic())
+        if samples:
+            self._send_samples(topic, throttle, samples)
+
+    def _send_samples(self, topic: str, throttle: TelemetryThrottle, samples: list[dict]) -> None:
+        policy = throttle.policy
+        codec = self._codecs.get(topic, self._json)
+        if policy.batch_size > 1:
+            # For JSON, an array of samples, which Telegraf's JSON parser splits into one metric per sample
+            payload = codec.encode_batch(samples)
+            topic += codec.batch_topic_suffix
+        else:
+            payload = codec.encode(samples[-1])
+            topic += codec.topic_suffix
+        self._connector.publish(topic, payload, qos=policy.qos, retain=policy.retain)
+
+    def flush(self, topic: str | None = None) -> None:
+        """Send any progress samples held back by the telemetry policy, for one or all topics."""
+        for throttle_topic, throttle in self._throttles.items():
+            if topic is None or topic == throttle_topic:
+                samples = throttle.flush()
+                if samples:
+                    self._send_samples(throttle_topic, throttle, samples)
 
     def publish_flow_progress(self, liters: float) -> None:
         """Send an in‑progress update from flow gauge."""
-        self._publish(FLOW_PROGRESS_TOPIC, {"liters": liters})
+        self._publish_progress(FLOW_PROGRESS_TOPIC, liters, {"liters": liters})
 
     def publish_flow_final(self, liters: float) -> None:
         """Send the final total reading from the flow gauge."""
+        self.flush(FLOW_PROGRESS_TOPIC)
         self._publish(FLOW_FINAL_TOPIC, {"liters": liters})
         print("Publishing final results L" + str(liters))
 
     def publish_temp_progress(self, temperature: float) -> None:
         """Send an in‑progress update from the temperature sensor."""
-        self._publish(TEMP_PROGRESS_TOPIC, {"temperature": temperature})
+        self._publish_progress(TEMP_PROGRESS_TOPIC, temperature, {"temperature": temperature})
 
     def publish_temp_final(self, temperature: float) -> None:
         """Send the final temperature from the temperature sensor."""
+        self.flush(TEMP_PROGRESS_TOPIC)
         self._publish(TEMP_FINAL_TOPIC, {"temperature": temperature})
         print("Publishing final results at °C" + str(temperature))
 
     def publish_error(self, message: str) -> None:
         """Broadcast an error message on the progress topics."""
-        self._publish(FLOW_PROGRESS_TOPIC, {"error": message})
-        self._publish(TEMP_PROGRESS_TOPIC, {"error": message})
+        # Send held back progress first, so the error is the last message on each topic
+        self.flush()
+        # Errors are text, so they are always sent as JSON
+        for topic in (FLOW_PROGRESS_TOPIC, TEMP_PROGRESS_TOPIC):
+            self._connector.publish(topic, self._json.encode({"error": message}), qos=1, retain=True)
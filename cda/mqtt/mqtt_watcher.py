@@ -4,13 +4,25 @@ Listens for a single *combined* order that includes:
     • temperature   – target temperature
     • line          – which filling line to use
 
-Orders are expected as JSON on the topic  `request/process`.
+Orders are expected as JSON on the topic  `request/process`, binary payloads
+from mqtt.payload_codec are accepted as well. With an OrderAdmission, duplicate
+and retained orders are rejected, the backlog is bounded, and every order is
+acknowledged to its sender.
+
+In a fleet of devices, each device joins the MQTT shared subscription
+`$share/<group>/request/process`, so the broker hands each order to one device
+of the group, in turn. A device whose line is busy hands the order back to the
+group, by publishing it again with its "handoffs" counted, so it runs on a
+device that can start it right away. After *max_handoffs*, the device that
+has the order keeps it.
 """
 import json
 from queue import Queue
-from typing import Dict
+from typing import Callable, Dict, Optional
 
 from mqtt.mqtt_connector import mqtt_connector
+from mqtt.order_admission import OrderAdmission
+from mqtt.payload_codec import decode_payload
 
 REQUEST_TOPIC = "request/process"
 
@@ -18,25 +30,73 @@ REQUEST_TOPIC = "request/process"
 class mqtt_watcher:
     """Waits for incoming orders and hands them back as dictionaries."""
 
-    def __init__(self, connector: mqtt_connector):
+    def __init__(
+        self,
+        connector: mqtt_connector,
+        admission: Optional[OrderAdmission] = None,
+        share_group: Optional[str] = None,
+        line_busy: Optional[Callable[[Dict], bool]] = None,
+        max_handoffs: int = 3,
+    ):
+        """
+        :param connector: The MQTT connector to receive orders with.
+        :param admission: Decides which orders are taken on, or None to take on every valid order.
+        :param share_group: Name of the shared subscription of the fleet, or None to receive every order.
+        :param line_busy: Returns True if the line of an order cannot start it right away,
+            so it is handed back to the fleet.
+        :param max_handoffs: Times an order is handed back before a busy device keeps it.
+        """
         self._connector = connector
+        self._admission = admission
+        self._line_busy = line_busy if share_group else None
+        self.max_handoffs = max_handoffs
         self._orders: Queue[Dict] = Queue()
+        self.handed_back = 0
 
         # Subscribe once – this topic carries the entire order
-        self._connector.subscribe(REQUEST_TOPIC, qos=1)
-        self._connector.register_callback(self._on_message)
+        topic = f"$share/{share_group}/{REQUEST_TOPIC}" if share_group else REQUEST_TOPIC
+        self._connector.subscribe(topic, qos=1)
+        # Messages of a shared subscription arrive with the topic they were published on
+        self._connector.register_callback(REQUEST_TOPIC, self._on_message)
 
     def _on_message(self, client, userdata, msg):
-        if msg.topic != REQUEST_TOPIC:
-            return
         try:
-            order = json.loads(msg.payload.decode())
-        except json.JSONDecodeError:
+            order = decode_payload(msg.payload)
+        except ValueError:
+            return
+        if not isinstance(order, dict):
+            return
+
+        # Basic schema validation, stop requests on this topic have no order fields
+        if not all(k in order for k in ("liters", "temperature", "line")):
+            return
+        if self._hand_back(order, msg.retain):
             return
+        if self._admission is not None:
+            # Orders handed over but not yet taken by wait_for_order() count towards the backlog
+            admission = self._admission.admit(order, retained=msg.retain, queued=self._orders.qsize())
+            if not admission.accepted:
+                print(f"Rejected order for lot {order.get('lot_number')}: {admission.reason}")
+                return
+        self._orders.put(order)
 
-        # Basic schema validation
-        if all(k in order for k in ("liters", "temperature", "line")):
-            self._orders.put(order)
+    def _hand_back(self, order: Dict, retained: bool) -> bool:
+        # Publish the order to the fleet again if another device can start it sooner. Returns True if it was.
+        if self._line_busy is None or retained:
+            return False
+        handoffs = order.get("handoffs", 0)
+        if not isinstance(handoffs, int) or handoffs >= self.max_handoffs:
+            return False
+        # A duplicate is rejected here, another device would not know it ran already
+        if self._admission is not None and self._admission.seen(order.get("lot_number")):
+            return False
+        if self._orders.empty() and not self._line_busy(order):
+            return False
+        order["handoffs"] = handoffs + 1
+        self._connector.publish(REQUEST_TOPIC, json.dumps(order), qos=1, retain=False)
+        self.handed_back += 1
+        print(f"Line busy, handed order for lot {order.get('lot_number')} back to the fleet")
+        return True
 
     def wait_for_order(self) -> Dict:
         """Block until the next valid order arrives."""
@@ -0,0 +1,149 @@
+"""
+Decides which incoming orders the device takes on.
+
+An order is admitted once per lot number: a redelivery of the same lot, such as
+a QoS 1 duplicate after a reconnect, is rejected as long as the lot number is
+remembered, for *dedup_seconds* after it was admitted. Retained orders are
+rejected, as they were sent before the device subscribed and may have run
+already. When *max_pending* orders are waiting for a line, new orders are
+rejected instead of growing a backlog, and the sender can send them again
+later. Each order gets an optional "priority" from 0 (first) to 9, 5 by default.
+
+Every decision is sent back to the sender as an acknowledgement on ACK_TOPIC,
+with the lot number and, for a rejected order, the reason.
+"""
+from __future__ import annotations
+
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, NamedTuple
+
+ACK_TOPIC = "request/process/ack"
+
+# Lower priorities start first
+HIGHEST_PRIORITY = 0
+DEFAULT_PRIORITY = 5
+LOWEST_PRIORITY = 9
+
+
+class Admission(NamedTuple):
+    """The decision on one order."""
+
+    accepted: bool
+    # Why the order was rejected, or None
+    reason: str | None
+    # Priority of the order, lower starts first
+    priority: int
+
+
+class OrderAdmission:
+    """
+    Admits or rejects orders, and publishes the acknowledgements.
+
+    Usage:
+        admission = OrderAdmission(connector, max_pending=10, backlog=scheduler.pending)
+        if admission.admit(order, retained=msg.retain).accepted:
+            queue.put(order)
+    """
+
+    def __init__(
+        self,
+        connector,
+        max_pending: int = 10,
+        dedup_seconds: float = 3600.0,
+        backlog: Callable[[], int] | None = None,
+        has_line: Callable[[dict], bool] | None = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """
+        :param connector: The MQTT connector the acknowledgements are sent with.
+        :param max_pending: Orders that may wait for a line before new ones are rejected.
+        :param dedup_seconds: How long a lot number is remembered after it was admitted.
+        :param backlog: Returns the number of admitted orders that have not started yet.
+        :param has_line: Returns False for orders whose line is not configured on this device.
+        :param clock: Monotonic clock in seconds.
+        """
+        if max_pending < 1:
+            raise ValueError("max_pending must be at least 1")
+        if dedup_seconds < 0:
+            raise ValueError("dedup_seconds must not be negative")
+        self._connector = connector
+        self.max_pending = max_pending
+        self.dedup_seconds = dedup_seconds
+        self._backlog = backlog or (lambda: 0)
+        self._has_line = has_line or (lambda order: True)
+        self._clock = clock
+        # When each admitted lot number is forgotten, oldest first
+        self._seen: OrderedDict[str, float] = OrderedDict()
+        self._lock = threading.Lock()
+        self.accepted = 0
+        self.rejected = 0
+
+    def admit(self, order: dict, retained: bool = False, queued: int = 0) -> Admission:
+        """
+        Decide on *order*, remember its lot number if it is admitted, and acknowledge it.
+        The priority of an admitted order is stored in its "priority" field.
+
+        :param order: The order, with the fields liters, temperature and line.
+        :param retained: True if the broker delivered the order as a retained message.
+        :param queued: Admitted orders not yet counted by the backlog.
+        """
+        with self._lock:
+            admission = self._decide(order, retained, queued)
+            if admission.accepted:
+                order["priority"] = admission.priority
+                self._seen[str(order["lot_number"])] = self._clock() + self.dedup_seconds
+                self.accepted += 1
+            else:
+                self.rejected += 1
+        self._acknowledge(order, admission)
+        return admission
+
+    def seen(self, lot_number) -> bool:
+        """Whether *lot_number* was admitted recently enough to be rejected as a duplicate."""
+        with self._lock:
+            self._forget_expired()
+            return str(lot_number) in self._seen
+
+    def _decide(self, order: dict, retained: bool, queued: int) -> Admission:
+        priority = order.get("priority", DEFAULT_PRIORITY)
+        # bool is an int, but not a priority
+        if isinstance(priority, bool) or not isinstance(priority, int) or not HIGHEST_PRIORITY <= priority <= LOWEST_PRIORITY:
+            return Admission(False, "invalid priority", DEFAULT_PRIORITY)
+        if not isinstance(order.get("lot_number"), (str, int)):
+            return Admission(False, "missing lot_number", priority)
+        if retained:
+            return Admission(False, "retained", priority)
+        if not self._has_line(order):
+            return Admission(False, "unknown line", priority)
+        self._forget_expired()
+        if str(order["lot_number"]) in self._seen:
+            return Admission(False, "duplicate", priority)
+        if self._backlog() + queued >= self.max_pending:
+            return Admission(False, "queue full", priority)
+        return Admission(True, None, priority)
+
+    def _forget_expired(self) -> None:
+        # Every lot is remembered equally long, so the oldest expire first
+        now = self._clock()
+        while self._seen and next(iter(self._seen.values())) <= now:
+            self._seen.popitem(last=False)
+
+    def _acknowledge(self, order: dict, admission: Admission) -> None:
+        payload = {
+            "lot_number": order.get("lot_number"),
+            "line": order.get("line"),
+            "status": "accepted" if admission.accepted else "rejected",
+        }
+        if admission.reason is not None:
+            payload["reason"] = admission.reason
+        # Not retained, a later sender must not read an old decision
+        self._connector.publish(ACK_TOPIC, json.dumps(payload), qos=1, retain=False)
+
+    def __len__(self) -> int:
+        """Number of lot numbers remembered."""
+        with self._lock:
+            self._forget_expired()
+            return len(self._seen)
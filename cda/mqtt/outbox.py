@@ -0,0 +1,372 @@
+"""
+Disk-backed store-and-forward queue for outgoing MQTT messages.
+
+Every message is first stored in a MessageOutbox, an SQLite database in WAL
+mode on the Pi's storage, and an OutboxForwarder hands the stored messages to
+paho in order while the broker is connected:
+    • messages are removed once paho reports them published (PUBACK for QoS 1)
+    • the forwarder thread writes the stored and removed messages to the
+      database and commits them, and with them fsyncs, batched by count and by
+      time. Storing or removing a message only takes a short in-memory lock, so
+      neither a control loop nor paho's network thread waits for a commit.
+    • the database is bounded in size, the oldest messages are dropped first
+    • after a reconnect, everything still stored is replayed in order, with a
+      window of messages in flight at a time
+
+Delivery is at least once. A message that was in flight when the link dropped
+can arrive twice after the replay. Messages not yet committed are lost on a
+power loss, as with any batched commit.
+"""
+from __future__ import annotations
+
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    topic TEXT NOT NULL,
+    payload BLOB NOT NULL,
+    qos INTEGER NOT NULL,
+    retain INTEGER NOT NULL
+)
+"""
+
+
+class MessageOutbox:
+    """Ordered, size-bounded message queue in an SQLite database."""
+
+    def __init__(
+        self,
+        path: str,
+        max_bytes: int = 64 * 1024 * 1024,
+        sync_batch: int = 50,
+        sync_interval: float = 1.0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """
+        :param path: Database file, or ":memory:" for tests.
+        :param max_bytes: Limit of stored topics and payloads, older messages are dropped beyond it.
+        :param sync_batch: Commit after this many changes, on the next sync(force=False).
+        :param sync_interval: Commit changes that are older than this many seconds, on the next sync(force=False).
+        :param clock: Time source for the commit interval.
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.sync_batch = sync_batch
+        self.sync_interval = sync_interval
+        self._clock = clock
+        # Held briefly by append() and remove(), for the queue in memory
+        self._lock = threading.Lock()
+        # Held while the database is written and committed, never by append() or remove()
+        self._db_lock = threading.Lock()
+
+        # Autocommit mode, transactions are started and committed explicitly to batch the fsyncs
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # In WAL mode, FULL syncs the log on every commit, which makes committed messages survive power loss
+        self._db.execute("PRAGMA synchronous=FULL")
+        self._db.execute(_SCHEMA)
+
+        # Size of every stored message by id, in order, so removing and dropping needs no query
+        self._sizes: OrderedDict[int, int] = OrderedDict(
+            self._db.execute("SELECT id, LENGTH(topic) + LENGTH(payload) FROM outbox ORDER BY id")
+        )
+        last_id = self._db.execute("SELECT seq FROM sqlite_sequence WHERE name = 'outbox'").fetchone()
+        self._next_id = max([last_id[0] if last_id else 0, *self._sizes.keys()]) + 1
+        # Messages stored and ids removed since the database was last written
+        self._inserts: list[tuple[int, str, bytes, int, int]] = []
+        self._deletes: list[int] = []
+
+        self.depth = len(self._sizes)
+        self.size_bytes = sum(self._sizes.values())
+        self.appended = 0
+        self.removed = 0
+        self.dropped = 0
+        self.syncs = 0
+        self._unsynced = 0
+        self._first_unsynced: float | None = None
+
+    def _changed(self) -> None:
+        if self._first_unsynced is None:
+            self._first_unsynced = self._clock()
+        self._unsynced += 1
+
+    def sync_due(self) -> bool:
+        """Whether enough changes are pending, or old enough, to be committed."""
+        return self._unsynced >= self.sync_batch or (
+            self._first_unsynced is not None and self._clock() - self._first_unsynced >= self.sync_interval
+        )
+
+    def append(self, topic: str, payload: str | bytes, qos: int = 1, retain: bool = True) -> int:
+        """
+        Store a message, and return its id. The message is written and committed to disk
+        later by sync(), so the caller never waits for the database.
+        """
+        if isinstance(payload, str):
+            payload = payload.encode()
+        size = len(topic.encode()) + len(payload)
+        with self._lock:
+            row_id = self._next_id
+            self._next_id += 1
+            self._inserts.append((row_id, topic, payload, qos, int(retain)))
+            self._sizes[row_id] = size
+            self._changed()
+            self.appended += 1
+            self.depth += 1
+            self.size_bytes += size
+            if self.size_bytes > self.max_bytes:
+                self._drop_oldest()
+            return row_id
+
+    def _drop_oldest(self) -> None:
+        # Always keep the newest message
+        while self.size_bytes > self.max_bytes and self.depth > 1:
+            row_id, size = self._sizes.popitem(last=False)
+            self._deletes.append(row_id)
+            self.size_bytes -= size
+            self.depth -= 1
+            self.dropped += 1
+
+    def peek(self, after_id: int = 0, limit: int = 100) -> list[tuple[int, str, bytes, int, bool]]:
+        """The oldest stored messages after *after_id*, as (id, topic, payload, qos, retain)."""
+        with self._db_lock:
+            self._write()
+            rows = self._db.execute(
+                "SELECT id, topic, payload, qos, retain FROM outbox WHERE id > ? ORDER BY id LIMIT ?",
+                (after_id, limit),
+            ).fetchall()
+        return [(row_id, topic, payload, qos, bool(retain)) for row_id, topic, payload, qos, retain in rows]
+
+    def remove(self, row_ids: list[int]) -> None:
+        """Forget messages that have been delivered. They are deleted from disk later by sync()."""
+        if not row_ids:
+            return
+        with self._lock:
+            for row_id in row_ids:
+                size = self._sizes.pop(row_id, None)
+                # Messages may already have been dropped to make room
+                if size is None:
+                    continue
+                self._deletes.append(row_id)
+                self._changed()
+                self.depth -= 1
+                self.size_bytes -= size
+                self.removed += 1
+
+    def _write(self) -> None:
+        """Write the messages stored and removed since the last call, in the open transaction."""
+        with self._lock:
+            inserts, self._inserts = self._inserts, []
+            deletes, self._deletes = self._deletes, []
+        if not inserts and not deletes:
+            return
+        if not self._db.in_transaction:
+            self._db.execute("BEGIN")
+        # Inserted first, as a message may be removed before it was written
+        self._db.executemany("INSERT INTO outbox (id, topic, payload, qos, retain) VALUES (?, ?, ?, ?, ?)", inserts)
+        self._db.executemany("DELETE FROM outbox WHERE id = ?", [(row_id,) for row_id in deletes])
+
+    def _sync(self) -> None:
+        with self._lock:
+            self._unsynced = 0
+            self._first_unsynced = None
+        self._write()
+        if self._db.in_transaction:
+            self._db.execute("COMMIT")
+            self.syncs += 1
+
+    def sync(self, force: bool = True) -> None:
+        """
+        Write and commit pending changes, or only when they are due if *force* is False.
+        Called by the forwarder thread, and when flushing or closing.
+        """
+        with self._db_lock:
+            if force or self.sync_due():
+                self._sync()
+
+    def close(self) -> None:
+        with self._db_lock:
+            self._sync()
+            self._db.close()
+
+    def stats(self) -> dict:
+        return {
+            "depth": self.depth,
+            "size_bytes": self.size_bytes,
+            "appended": self.appended,
+            "removed": self.removed,
+            "dropped": self.dropped,
+            "syncs": self.syncs,
+        }
+
+
+class OutboxForwarder:
+    """
+    Background thread that sends the messages of a MessageOutbox while connected.
+    The owner reports the connection state with on_connect()/on_disconnect(),
+    and completed publishes with on_publish().
+    """
+
+    def __init__(
+        self,
+        outbox: MessageOutbox,
+        send: Callable[[str, bytes, int, bool], int | None],
+        window: int = 20,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """
+        :param outbox: The stored messages.
+        :param send: Publishes a message and returns its message id, or None if it could not be sent.
+        :param window: Maximum number of messages in flight.
+        :param clock: Time source for the drain rate.
+        """
+        self._outbox = outbox
+        self._send = send
+        self._window = window
+        self._clock = clock
+        self._cond = threading.Condition()
+        self._connected = False
+        self._stopped = False
+        self._pending = True
+        # Bumped on every connection change, so sends from an older connection are not tracked
+        self._generation = 0
+        # Highest message id handed to send() on this connection
+        self._cursor = 0
+        # Message id from send() → outbox id, for messages waiting for on_publish()
+        self._inflight: dict[int, int] = {}
+        # Message ids that were acknowledged before send() returned
+        self._early_acks: set[int] = set()
+        self._thread: threading.Thread | None = None
+
+        self.forwarded = 0
+        self.replayed = 0
+        self.last_drain_rate: float | None = None
+        self._replay_started: float | None = None
+        self._replay_depth = 0
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="mqtt-outbox", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+        self._outbox.sync()
+
+    def notify(self) -> None:
+        """Wake the forwarder after a message was stored."""
+        with self._cond:
+            self._pending = True
+            self._cond.notify()
+
+    def on_connect(self) -> None:
+        with self._cond:
+            self._connected = True
+            self._generation += 1
+            # Replay everything still stored, including what was in flight on the old connection
+            self._cursor = 0
+            self._inflight.clear()
+            self._early_acks.clear()
+            self._pending = True
+            if self._outbox.depth:
+                self._replay_started = self._clock()
+                self._replay_depth = self._outbox.depth
+            self._cond.notify()
+
+    def on_disconnect(self) -> None:
+        with self._cond:
+            self._connected = False
+            self._generation += 1
+            self._inflight.clear()
+            self._early_acks.clear()
+
+    def on_publish(self, mid: int) -> None:
+        with self._cond:
+            row_id = self._inflight.pop(mid, None)
+            if row_id is None:
+                self._early_acks.add(mid)
+                return
+            self._cond.notify()
+        self._outbox.remove([row_id])
+        self._check_replay_done()
+
+    @property
+    def inflight(self) -> int:
+        return len(self._inflight)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._stopped and not (
+                    self._connected and self._pending and len(self._inflight) < self._window
+                ):
+                    # Wake up regularly, and on new messages, to commit changes that are due
+                    if not self._cond.wait(timeout=self._outbox.sync_interval) or self._outbox.sync_due():
+                        break
+                if self._stopped:
+                    return
+                ready = self._connected and self._pending and len(self._inflight) < self._window
+                generation = self._generation
+                cursor = self._cursor
+                free = self._window - len(self._inflight)
+                if ready:
+                    # Cleared before reading, so messages stored meanwhile set it again
+                    self._pending = False
+
+            self._outbox.sync(force=False)
+            if not ready:
+                continue
+
+            rows = self._outbox.peek(cursor, free)
+            if len(rows) == free:
+                with self._cond:
+                    self._pending = True
+            if not rows:
+                self._check_replay_done()
+                continue
+            for row_id, topic, payload, qos, retain in rows:
+                mid = self._send(topic, payload, qos, retain)
+                acked = False
+                with self._cond:
+                    if generation != self._generation:
+                        break
+                    if mid is None:
+                        # Not connected after all, wait for on_connect() to replay
+                        self._connected = False
+                        break
+                    self._cursor = row_id
+                    self.forwarded += 1
+                    if mid in self._early_acks:
+                        self._early_acks.discard(mid)
+                        acked = True
+                    else:
+                        self._inflight[mid] = row_id
+                if acked:
+                    self._outbox.remove([row_id])
+                    self._check_replay_done()
+
+    def _check_replay_done(self) -> None:
+        with self._cond:
+            if self._replay_started is None or self._inflight or self._outbox.depth:
+                return
+            elapsed = self._clock() - self._replay_started
+            self.replayed += self._replay_depth
+            self.last_drain_rate = self._replay_depth / elapsed if elapsed > 0 else None
+            rate = f"{self.last_drain_rate:.0f} msg/s" if self.last_drain_rate else "instantly"
+            print(f"MQTT: replayed {self._replay_depth} stored messages in {elapsed:.2f} s ({rate})")
+            self._replay_started = None
+
+    def stats(self) -> dict:
+        return self._outbox.stats() | {
+            "inflight": len(self._inflight),
+            "forwarded": self.forwarded,
+            "replayed": self.replayed,
+            "drain_rate": self.last_drain_rate,
+        }
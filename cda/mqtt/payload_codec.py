@@ -0,0 +1,145 @@
+"""
+Payload codecs for MQTT messages.
+
+A codec is created with the constant fields of a publisher (lot_number, line and
+device), and encodes the variable fields of each message around them:
+    • JsonCodec    – the same JSON as json.dumps(data | constants), but with the
+                     constant fragment serialized once, and floats formatted directly
+    • StructCodec  – compact fixed-layout binary records for high-rate topics
+
+Binary messages are published on a sub-topic (`/bin`), so JSON consumers such as
+Telegraf and the controller app never receive them. decode_payload() reads both
+formats, telling them apart by the binary magic bytes.
+"""
+from __future__ import annotations
+
+import json
+import struct
+import time
+
+# Binary format, all big-endian:
+#   header  magic "P6", version, lot number length, lot number, line, device length, device, record count
+#   record  timestamp (float64), field count, then per field: field id, value (float64)
+MAGIC = b"P6"
+VERSION = 1
+_HEADER = struct.Struct(">2sBB")
+_LINE = struct.Struct(">HB")
+_COUNT = struct.Struct(">H")
+_RECORD = struct.Struct(">dB")
+_FIELD = struct.Struct(">Bd")
+
+# Numeric fields that can be carried in binary records
+FIELD_IDS = {"liters": 1, "temperature": 2, "priority": 3}
+FIELD_NAMES = {field_id: name for name, field_id in FIELD_IDS.items()}
+
+
+class JsonCodec:
+    """JSON with pre-serialized constant fields."""
+
+    topic_suffix = ""
+    batch_topic_suffix = "/batch"
+
+    def __init__(self, constants: dict) -> None:
+        # Serialize the constants once, without the braces, as the closing part of every object
+        self._constants = [json.dumps(constants)[1:-1]] if constants else []
+        self._keys: dict[str, str] = {}
+
+    def _key(self, key: str) -> str:
+        # Cache the serialized `"key": ` fragment of each field name
+        fragment = self._keys.get(key)
+        if fragment is None:
+            fragment = self._keys[key] = json.dumps(key) + ": "
+        return fragment
+
+    def _object(self, data: dict) -> str:
+        parts = []
+        for key, value in data.items():
+            # Finite floats are formatted like json.dumps does, without going through the encoder
+            if type(value) is float and value - value == 0.0:
+                parts.append(self._key(key) + float.__repr__(value))
+            else:
+                parts.append(self._key(key) + json.dumps(value))
+        return "{" + ", ".join(parts + self._constants) + "}"
+
+    def encode(self, data: dict) -> str:
+        """Encode one message, equal to json.dumps(data | constants)."""
+        return self._object(data)
+
+    def encode_batch(self, samples: list[dict]) -> str:
+        """Encode several messages as a JSON array."""
+        return "[" + ", ".join(self._object(sample) for sample in samples) + "]"
+
+
+class StructCodec:
+    """Compact binary records of numeric fields."""
+
+    topic_suffix = "/bin"
+    batch_topic_suffix = "/bin"
+
+    def __init__(self, constants: dict) -> None:
+        # The header only depends on the constants, so build it once
+        lot = str(constants.get("lot_number", "")).encode()
+        device = str(constants.get("device", "")).encode()
+        self._header = (
+            _HEADER.pack(MAGIC, VERSION, len(lot)) + lot
+            + _LINE.pack(int(constants.get("line", 0)), len(device)) + device
+        )
+
+    def _record(self, data: dict) -> bytes:
+        fields = [(FIELD_IDS[key], float(value)) for key, value in data.items() if key != "timestamp"]
+        record = _RECORD.pack(data.get("timestamp", time.time()), len(fields))
+        return record + b"".join(_FIELD.pack(field_id, value) for field_id, value in fields)
+
+    def encode(self, data: dict) -> bytes:
+        """Encode one message. All fields must be numeric and listed in FIELD_IDS."""
+        return self._header + _COUNT.pack(1) + self._record(data)
+
+    def encode_batch(self, samples: list[dict]) -> bytes:
+        """Encode several messages with a shared header."""
+        return self._header + _COUNT.pack(len(samples)) + b"".join(self._record(sample) for sample in samples)
+
+
+def decode_struct(payload: bytes) -> list[dict]:
+    """Decode a binary payload into one dictionary per record."""
+    magic, version, lot_length = _HEADER.unpack_from(payload, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not a supported binary payload")
+    offset = _HEADER.size
+    lot = payload[offset:offset + lot_length].decode()
+    offset += lot_length
+    line, device_length = _LINE.unpack_from(payload, offset)
+    offset += _LINE.size
+    device = payload[offset:offset + device_length].decode()
+    offset += device_length
+    (count,) = _COUNT.unpack_from(payload, offset)
+    offset += _COUNT.size
+
+    messages = []
+    for _ in range(count):
+        timestamp, field_count = _RECORD.unpack_from(payload, offset)
+        offset += _RECORD.size
+        message = {}
+        for _ in range(field_count):
+            field_id, value = _FIELD.unpack_from(payload, offset)
+            offset += _FIELD.size
+            message[FIELD_NAMES.get(field_id, str(field_id))] = value
+        message |= {"lot_number": lot, "line": line, "device": device, "timestamp": timestamp}
+        messages.append(message)
+    return messages
+
+
+def decode_payload(payload: bytes | str):
+    """
+    Decode a JSON or binary payload.
+    Returns what the JSON contains, or a dictionary (one record) or list (several records)
+    for binary payloads. Raises ValueError if the payload is neither.
+    """
+    if isinstance(payload, (bytes, bytearray)) and payload[:2] == MAGIC:
+        try:
+            messages = decode_struct(bytes(payload))
+        except (struct.error, UnicodeDecodeError) as exc:
+            raise ValueError(f"Malformed binary payload: {exc}") from exc
+        return messages[0] if len(messages) == 1 else messages
+    if isinstance(payload, (bytes, bytearray)):
+        payload = payload.decode()
+    return json.loads(payload)
@@ -0,0 +1,118 @@
+"""
+Routes stop requests to the lot they are meant for.
+
+A single callback is registered for the stop topics, and looks up the stop event
+of the lot number in the message. Lots are added with watch() when they start,
+and removed with release() when they end, so nothing is left behind per lot.
+A lot can also give an on_stop callback, which runs in the MQTT thread before
+the event is set, to switch its actuators off without waiting for its control
+loop to notice the event.
+
+In a fleet, the order topic is a shared subscription, so a stop request sent on
+it reaches a single device, which may not run the lot. Such a device forwards
+the request on the stop topic, which every device subscribes to.
+"""
+from __future__ import annotations
+
+import threading
+from typing import Callable
+
+from mqtt.payload_codec import decode_payload
+
+STOP_TOPIC = "request/process/stop"
+# The controller app sends stop requests on the order topic
+REQUEST_TOPIC = "request/process"
+
+
+class StopRouter:
+    """Sets the stop event of a running lot when a stop request for it arrives."""
+
+    def __init__(
+        self,
+        connector,
+        topics: tuple[str, ...] = (STOP_TOPIC, REQUEST_TOPIC),
+        forward_topic: str | None = None,
+    ) -> None:
+        """
+        :param connector: The MQTT connector to receive stop requests through.
+        :param topics: Topics that carry stop requests.
+        :param forward_topic: Topic to forward stop requests for lots that do not run here,
+            or None to ignore them. Requests that arrived on this topic are never forwarded.
+        """
+        self._connector = connector
+        self._forward_topic = forward_topic
+        self._events: dict[str, threading.Event] = {}
+        self._on_stop: dict[str, Callable[[], None]] = {}
+        self._lock = threading.Lock()
+        self._handles = [connector.register_callback(topic, self._on_message) for topic in topics]
+
+    def watch(self, lot_id: str, on_stop: Callable[[], None] | None = None) -> threading.Event:
+        """
+        Return the stop event of *lot_id*, which is set when a stop request for it arrives.
+        *on_stop* is called first, from the thread that received the request.
+        """
+        with self._lock:
+            event = self._events.get(lot_id)
+            if event is None:
+                event = self._events[lot_id] = threading.Event()
+            if on_stop is not None:
+                self._on_stop[lot_id] = on_stop
+        return event
+
+    def release(self, lot_id: str) -> None:
+        """Forget *lot_id* after the lot has ended."""
+        with self._lock:
+            self._events.pop(lot_id, None)
+            self._on_stop.pop(lot_id, None)
+
+    def stop_all(self) -> None:
+        """Set the stop event of every running lot, such as on shutdown."""
+        with self._lock:
+            lot_ids = list(self._events)
+        for lot_id in lot_ids:
+            self._stop(lot_id)
+
+    def close(self) -> None:
+        """Unregister the callbacks."""
+        for handle in self._handles:
+            self._connector.unregister_callback(handle)
+        self._handles = []
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    def _on_message(self, client, userdata, msg) -> None:
+        try:
+            payload = decode_payload(msg.payload)
+        except ValueError:
+            return
+        if not isinstance(payload, dict):
+            return
+        lot_id = payload.get("lot_number")
+        if not isinstance(lot_id, (str, int)):
+            return
+        if "liters" in payload:
+            # Orders share the topic and carry a lot number, but are not stop requests. A redelivered
+            # order of a running lot is rejected as a duplicate by the admission, and must not stop the lot
+            return
+        if self._stop(lot_id):
+            print(f"Stop signal received for lot {lot_id}")
+        elif self._forward_topic is not None and msg.topic != self._forward_topic:
+            self._connector.publish(self._forward_topic, msg.payload, qos=1, retain=False)
+            print(f"Forwarded stop signal for lot {lot_id} to the fleet")
+
+    def _stop(self, lot_id) -> bool:
+        # Switch the actuators of the lot off, then tell its control loops. Returns False for unknown lots.
+        with self._lock:
+            event = self._events.get(lot_id)
+            on_stop = self._on_stop.get(lot_id)
+        if event is None:
+            return False
+        if on_stop is not None:
+            try:
+                on_stop()
+            except Exception as exc:
+                # The event must still be set, so the control loops stop the lot
+                print(f"Error in the stop handler of lot {lot_id}: {exc}")
+        event.set()
+        return True
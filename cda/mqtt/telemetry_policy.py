@@ -0,0 +1,80 @@
+"""
+Rate control for high-rate progress telemetry.
+
+A TelemetryPolicy describes how often a topic may be published, and a
+TelemetryThrottle applies it to the samples of one topic:
+    • deadband      – samples that changed less than this since the last accepted
+                      sample are dropped
+    • min_interval  – messages are sent at most this often, newer samples replace
+                      older ones in the meantime
+    • max_interval  – a sample is sent at least this often, even inside the deadband
+    • batch_size    – up to this many samples are sent together as a JSON array
+    • qos / retain  – MQTT flags for the progress messages
+"""
+from __future__ import annotations
+
+from collections import deque
+from typing import NamedTuple
+
+
+class TelemetryPolicy(NamedTuple):
+    deadband: float = 0.0
+    min_interval: float = 0.0
+    max_interval: float | None = None
+    batch_size: int = 1
+    qos: int = 1
+    retain: bool = True
+
+
+# Sends every sample as its own message, like publishing without a policy
+PASSTHROUGH = TelemetryPolicy()
+
+
+class TelemetryThrottle:
+    """Applies a TelemetryPolicy to the samples of a single topic."""
+
+    def __init__(self, policy: TelemetryPolicy) -> None:
+        if policy.batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        self.policy = policy
+        self.offered = 0
+        self.sent = 0
+        self._last_value: float | None = None
+        self._last_publish: float | None = None
+        # Samples waiting to be sent, the oldest are dropped when it is full
+        self._pending: deque[dict] = deque(maxlen=policy.batch_size)
+
+    def offer(self, value: float, sample: dict, now: float) -> list[dict] | None:
+        """
+        Offer a new *sample* with the tracked *value*, taken at *now* seconds.
+        Returns the samples to publish now, or None if nothing should be sent.
+        """
+        self.offered += 1
+        policy = self.policy
+        since_publish = None if self._last_publish is None else now - self._last_publish
+        overdue = policy.max_interval is not None and (since_publish is None or since_publish >= policy.max_interval)
+
+        # Drop samples inside the deadband, unless nothing has been sent for too long
+        changed = self._last_value is None or abs(value - self._last_value) >= policy.deadband
+        if changed or overdue:
+            self._last_value = value
+            self._pending.append(sample)
+
+        if not self._pending:
+            return None
+        # Hold the samples until the minimum interval has passed
+        if since_publish is not None and since_publish < policy.min_interval:
+            return None
+        # When batching, wait for a full batch unless a message is overdue
+        if len(self._pending) < policy.batch_size and not overdue and since_publish is not None:
+            return None
+        self._last_publish = now
+        return self.flush()
+
+    def flush(self) -> list[dict]:
+        """Return and forget all samples waiting to be sent."""
+        samples = list(self._pending)
+        self._pending.clear()
+        if samples:
+            self.sent += 1
+        return samples
@@ -0,0 +1,174 @@
+"""
+Routes incoming MQTT messages to the callbacks registered for matching topic filters.
+
+Filters follow the MQTT syntax:
+    • `+`  matches exactly one topic level, such as `sensor/+/progress`
+    • `#`  matches any number of levels, and must be the last level
+Wildcards at the first level do not match topics starting with `$`, such as `$SYS/...`.
+
+The filters are kept in a tree with one node per topic level, so the cost of a
+message depends on the number of levels and matching filters, not on the number
+of registered callbacks. The matches of recent topics are cached until the
+registrations change.
+"""
+from __future__ import annotations
+
+import threading
+from typing import Any, Callable
+
+MessageCallback = Callable[[Any, Any, Any], None]
+
+# Number of topics whose matches are cached
+CACHE_SIZE = 256
+
+
+class CallbackHandle:
+    """Returned by TopicDispatcher.add(), used to remove the callback again."""
+
+    __slots__ = ("topic_filter", "callback", "order")
+
+    def __init__(self, topic_filter: str, callback: MessageCallback, order: int = 0) -> None:
+        self.topic_filter = topic_filter
+        self.callback = callback
+        # Registration order, callbacks of matching filters are called in this order
+        self.order = order
+
+    def __repr__(self) -> str:
+        return f"CallbackHandle({self.topic_filter!r}, {self.callback!r})"
+
+
+class _Node:
+    __slots__ = ("children", "handles", "multi_level")
+
+    def __init__(self) -> None:
+        self.children: dict[str, _Node] = {}
+        # Callbacks for filters ending at this level
+        self.handles: list[CallbackHandle] = []
+        # Callbacks for filters ending with `#` after this level
+        self.multi_level: list[CallbackHandle] = []
+
+    def is_empty(self) -> bool:
+        return not (self.children or self.handles or self.multi_level)
+
+
+def validate_filter(topic_filter: str) -> list[str]:
+    """Split a topic filter into levels, raising ValueError if it is not valid."""
+    if not topic_filter:
+        raise ValueError("Topic filter must not be empty")
+    levels = topic_filter.split("/")
+    for index, level in enumerate(levels):
+        if "#" in level and (level != "#" or index != len(levels) - 1):
+            raise ValueError(f"'#' must be the whole last level of the filter: {topic_filter}")
+        if "+" in level and level != "+":
+            raise ValueError(f"'+' must be a whole level of the filter: {topic_filter}")
+    return levels
+
+
+class TopicDispatcher:
+    """Topic filter → callbacks, with wildcard matching."""
+
+    def __init__(self) -> None:
+        self._root = _Node()
+        self._lock = threading.Lock()
+        self._count = 0
+        self._registered = 0
+        self._cache: dict[str, list[CallbackHandle]] = {}
+
+    def __len__(self) -> int:
+        return self._count
+
+    def add(self, topic_filter: str, callback: MessageCallback) -> CallbackHandle:
+        """Call *callback* for messages matching *topic_filter*, until the handle is removed."""
+        levels = validate_filter(topic_filter)
+        with self._lock:
+            self._registered += 1
+            handle = CallbackHandle(topic_filter, callback, self._registered)
+            node = self._root
+            for level in levels[:-1]:
+                node = node.children.setdefault(level, _Node())
+            if levels[-1] == "#":
+                node.multi_level.append(handle)
+            else:
+                node = node.children.setdefault(levels[-1], _Node())
+                node.handles.append(handle)
+            self._count += 1
+            self._cache.clear()
+        return handle
+
+    def remove(self, handle: CallbackHandle) -> bool:
+        """Remove a registered callback. Returns False if it was already removed."""
+        levels = handle.topic_filter.split("/")
+        with self._lock:
+            path = [self._root]
+            for level in levels[:-1] if levels[-1] == "#" else levels:
+                node = path[-1].children.get(level)
+                if node is None:
+                    return False
+                path.append(node)
+            node = path[-1]
+            attribute = "multi_level" if levels[-1] == "#" else "handles"
+            handles = getattr(node, attribute)
+            if handle not in handles:
+                return False
+            setattr(node, attribute, [h for h in handles if h is not handle])
+            self._count -= 1
+            self._cache.clear()
+
+            # Prune the levels that no longer lead to any callback
+            keys = levels[:len(path) - 1]
+            for parent, key in zip(reversed(path[:-1]), reversed(keys)):
+                if not parent.children[key].is_empty():
+                    break
+                del parent.children[key]
+        return True
+
+    def match(self, topic: str) -> list[CallbackHandle]:
+        """The handles of all filters matching *topic*."""
+        with self._lock:
+            matched = self._cache.get(topic)
+            if matched is None:
+                matched = self._match(topic)
+                if len(self._cache) >= CACHE_SIZE:
+                    self._cache.clear()
+                self._cache[topic] = matched
+        return matched
+
+    def _match(self, topic: str) -> list[CallbackHandle]:
+        # Walk the tree level by level, following the exact level and the `+` wildcard
+        levels = topic.split("/")
+        matched: list[CallbackHandle] = []
+        nodes = [self._root]
+        for index, level in enumerate(levels):
+            next_nodes = []
+            for node in nodes:
+                # Wildcards at the first level do not match $-topics
+                wildcards = not (index == 0 and level.startswith("$"))
+                if wildcards:
+                    matched.extend(node.multi_level)
+                child = node.children.get(level)
+                if child is not None:
+                    next_nodes.append(child)
+                if wildcards:
+                    child = node.children.get("+")
+                    if child is not None:
+                        next_nodes.append(child)
+            nodes = next_nodes
+            if not nodes:
+                break
+        for node in nodes:
+            matched.extend(node.handles)
+            # `a/#` also matches the parent level `a`
+            matched.extend(node.multi_level)
+        if len(matched) > 1:
+            matched.sort(key=lambda handle: handle.order)
+        return matched
+
+    def dispatch(self, client, userdata, msg) -> int:
+        """Call the callbacks matching the topic of *msg*, and return how many were called."""
+        handles = self.match(msg.topic)
+        for handle in handles:
+            try:
+                handle.callback(client, userdata, msg)
+            except Exception as e:
+                print(f"MQTT callback for {handle.topic_filter} failed: {e}")
+        return len(handles)
@@ -0,0 +1,99 @@
+"""
+In-memory MQTT broker that connects several FakeMqttConnectors, for fleet tests and benchmarks.
+
+Messages are delivered from a background thread, in the order they were
+published, like a broker delivers to its clients. Shared subscriptions of the
+form `$share/<group>/<filter>` are supported as by mosquitto: each message that
+matches the filter goes to one member of the group, in turn. Retained messages
+are not kept.
+"""
+from __future__ import annotations
+
+import itertools
+import threading
+from queue import Queue
+
+from mqtt.topic_dispatcher import TopicDispatcher
+from simulation.fake_mqtt import FakeMessage, FakeMqttConnector
+
+# Put in the queue to stop the delivery thread
+_STOP = object()
+
+
+class FakeBroker:
+    """
+    Usage:
+        with FakeBroker() as broker:
+            device = FakeMqttConnector(broker)
+            device.subscribe("$share/cda/request/process")
+            FakeMqttConnector(broker).publish("request/process", payload)
+            broker.flush()
+    """
+
+    def __init__(self) -> None:
+        self._dispatcher = TopicDispatcher()
+        # Members of each shared subscription, by (group, filter)
+        self._groups: dict[tuple[str, str], list[FakeMqttConnector]] = {}
+        self._turns: dict[tuple[str, str], itertools.count] = {}
+        self._lock = threading.Lock()
+        self._queue: Queue = Queue()
+        self._thread: threading.Thread | None = None
+        self.delivered = 0
+
+    def start(self) -> FakeBroker:
+        self._thread = threading.Thread(target=self._deliver, name="fake-broker", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self) -> FakeBroker:
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.stop()
+
+    def subscribe(self, client: FakeMqttConnector, topic_filter: str) -> None:
+        """Deliver the messages matching *topic_filter* to *client*."""
+        if not topic_filter.startswith("$share/"):
+            self._dispatcher.add(topic_filter, lambda c, u, msg: client.deliver(msg.topic, msg.payload, msg.qos))
+            return
+        _, group, shared_filter = topic_filter.split("/", 2)
+        key = (group, shared_filter)
+        with self._lock:
+            members = self._groups.get(key)
+            if members is None:
+                members = self._groups[key] = []
+                self._turns[key] = itertools.count()
+                self._dispatcher.add(shared_filter, lambda c, u, msg: self._deliver_shared(key, msg))
+            if client not in members:
+                members.append(client)
+
+    def publish(self, topic: str, payload: bytes, qos: int = 1) -> None:
+        """Queue a message for the subscribers of *topic*."""
+        self._queue.put(FakeMessage(topic, payload, qos))
+
+    def flush(self) -> None:
+        """Block until every message published so far, and every message published meanwhile, is delivered."""
+        self._queue.join()
+
+    def _deliver_shared(self, key: tuple[str, str], msg) -> None:
+        # Round robin over the members of the group
+        with self._lock:
+            members = self._groups[key]
+            member = members[next(self._turns[key]) % len(members)]
+        member.deliver(msg.topic, msg.payload, msg.qos)
+
+    def _deliver(self) -> None:
+        while True:
+            msg = self._queue.get()
+            try:
+                if msg is _STOP:
+                    return
+                self.delivered += self._dispatcher.dispatch(None, None, msg)
+            finally:
+                self._queue.task_done()
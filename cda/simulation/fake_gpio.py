@@ -0,0 +1,133 @@
+"""
+Stand-in for the RPi.GPIO module, so the relay code can run without a Raspberry Pi.
+
+Call install() before anything imports devices.relay.relay_controller. After that,
+`import RPi.GPIO as GPIO` resolves to this module. Pin writes are kept in memory,
+and listeners can be attached to pins to drive the physics models in simulation.rig.
+"""
+from __future__ import annotations
+
+import sys
+import threading
+import types
+from typing import Callable, Dict, List
+
+# Constants mirroring RPi.GPIO
+BCM = 11
+BOARD = 10
+OUT = 0
+IN = 1
+HIGH = 1
+LOW = 0
+
+_lock = threading.RLock()
+_mode: int | None = None
+# Pins that have been set up as outputs, and their current level
+_outputs: Dict[int, int] = {}
+# Listeners called with (pin, level) whenever the level of a pin changes
+_listeners: Dict[int, List[Callable[[int, int], None]]] = {}
+# Counters for the number of calls, used by tests and benchmarks
+call_counts: Dict[str, int] = {"setmode": 0, "setup": 0, "output": 0, "cleanup": 0}
+
+
+def install() -> None:
+    """Register this module as RPi.GPIO in sys.modules."""
+    package = sys.modules.get("RPi")
+    if package is None or getattr(package, "GPIO", None) is not sys.modules[__name__]:
+        package = types.ModuleType("RPi")
+        package.GPIO = sys.modules[__name__]
+        sys.modules["RPi"] = package
+    sys.modules["RPi.GPIO"] = sys.modules[__name__]
+
+
+def reset() -> None:
+    """Forget all pin state, listeners and call counts."""
+    global _mode
+    with _lock:
+        _mode = None
+        _outputs.clear()
+        _listeners.clear()
+        for key in call_counts:
+            call_counts[key] = 0
+
+
+def add_listener(pin: int, callback: Callable[[int, int], None]) -> None:
+    """Call *callback* with (pin, level) whenever the level of *pin* changes."""
+    with _lock:
+        _listeners.setdefault(pin, []).append(callback)
+
+
+def level(pin: int) -> int:
+    """Return the current output level of *pin* (LOW if it is not set up)."""
+    with _lock:
+        return _outputs.get(pin, LOW)
+
+
+def setwarnings(flag: bool) -> None:
+    pass
+
+
+def setmode(mode: int) -> None:
+    global _mode
+    with _lock:
+        call_counts["setmode"] += 1
+        _mode = mode
+
+
+def getmode() -> int | None:
+    return _mode
+
+
+def setup(channel, direction: int, initial: int = LOW) -> None:
+    with _lock:
+        call_counts["setup"] += 1
+        if _mode is None:
+            raise RuntimeError("Please set pin numbering mode using GPIO.setmode(GPIO.BOARD) or GPIO.setmode(GPIO.BCM)")
+        for pin in _as_list(channel):
+            if direction == OUT:
+                _set_level(pin, initial)
+            else:
+                _set_level(pin, LOW)
+                _outputs.pop(pin, None)
+
+
+def output(channel, value) -> None:
+    with _lock:
+        call_counts["output"] += 1
+        pins = _as_list(channel)
+        values = _as_list(value) if isinstance(value, (list, tuple)) else [value] * len(pins)
+        for pin, pin_value in zip(pins, values):
+            # Like the real library, refuse to write to a pin that is not an output
+            if pin not in _outputs:
+                raise RuntimeError("The GPIO channel has not been set up as an OUTPUT")
+            _set_level(pin, HIGH if pin_value else LOW)
+
+
+def input(channel: int) -> int:
+    return level(channel)
+
+
+def cleanup(channel=None) -> None:
+    """Return pins to inputs, which de-energizes every relay connected to them."""
+    global _mode
+    with _lock:
+        call_counts["cleanup"] += 1
+        pins = list(_outputs) if channel is None else _as_list(channel)
+        for pin in pins:
+            _set_level(pin, LOW)
+            _outputs.pop(pin, None)
+        if channel is None:
+            _mode = None
+
+
+def _as_list(channel) -> list:
+    return list(channel) if isinstance(channel, (list, tuple)) else [channel]
+
+
+def _set_level(pin: int, value: int) -> None:
+    # Store the new level and notify listeners if it changed
+    previous = _outputs.get(pin, LOW)
+    _outputs[pin] = value
+    if previous != value:
+        for callback in _listeners.get(pin, []):
+            callback(pin, value)
@@ -0,0 +1,112 @@
+"""
+In-memory stand-in for mqtt_connector, for tests and benchmarks without a broker.
+
+Published messages are recorded, and incoming messages can be injected with
+deliver(), which calls the registered callbacks like paho's network thread does.
+Connectors given a FakeBroker also exchange their messages through it.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Callable
+
+from mqtt.topic_dispatcher import CallbackHandle, TopicDispatcher
+
+if TYPE_CHECKING:
+    from simulation.fake_broker import FakeBroker
+
+
+class FakeMessage:
+    """Mimics paho.mqtt.client.MQTTMessage."""
+
+    def __init__(self, topic: str, payload: bytes, qos: int = 1, retain: bool = False) -> None:
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.retain = retain
+
+
+class FakeWill:
+    """Records the Last Will set through the `_client` attribute."""
+
+    def __init__(self) -> None:
+        self.will = None
+
+    def will_set(self, topic, payload=None, qos=0, retain=False, properties=None):
+        self.will = (topic, payload, qos, retain)
+
+
+class FakeMqttConnector:
+    def __init__(self, broker: FakeBroker | None = None) -> None:
+        self._broker = broker
+        # List of (monotonic timestamp, topic, payload, qos, retain)
+        self.published: list[tuple[float, str, Any, int, bool]] = []
+        self.subscriptions: list[tuple[str, int]] = []
+        self._client = FakeWill()
+        self._dispatcher = TopicDispatcher()
+        self._connect_callbacks: list[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    def connect(self) -> None:
+        for callback in self._connect_callbacks:
+            callback()
+
+    def disconnect(self) -> None:
+        pass
+
+    def subscribe(self, topic: str, qos: int = 1) -> None:
+        self.subscriptions.append((topic, qos))
+        if self._broker is not None:
+            self._broker.subscribe(self, topic)
+
+    def publish(self, topic: str, payload, qos: int = 1, retain: bool = True) -> None:
+        with self._lock:
+            self.published.append((time.monotonic(), topic, payload, qos, retain))
+        if self._broker is not None:
+            self._broker.publish(topic, payload.encode() if isinstance(payload, str) else payload, qos)
+
+    def flush_outbox(self, timeout: float = 2.0) -> None:
+        """Wait until the broker has delivered the messages published so far."""
+        if self._broker is not None:
+            self._broker.flush()
+
+    def register_callback(self, topic_filter: str, callback: Callable) -> CallbackHandle:
+        return self._dispatcher.add(topic_filter, callback)
+
+    def unregister_callback(self, handle: CallbackHandle) -> None:
+        self._dispatcher.remove(handle)
+
+    def register_on_connect(self, callback: Callable[[], None]) -> None:
+        self._connect_callbacks.append(callback)
+
+    def deliver(self, topic: str, payload: bytes | str, qos: int = 1, retain: bool = False) -> None:
+        """Simulate an incoming message on *topic*."""
+        if isinstance(payload, str):
+            payload = payload.encode()
+        self._dispatcher.dispatch(None, None, FakeMessage(topic, payload, qos, retain))
+
+    def messages(self, topic: str) -> list:
+        """Payloads published on *topic*, oldest first."""
+        with self._lock:
+            return [payload for _, published_topic, payload, _, _ in self.published if published_topic == topic]
+
+
+def loopback_connector(broker_url: str = "", subscribe_delay: float = 0.0, **options) -> FakeMqttConnector:
+    """
+    A connector with a broker of its own, which delivers what it publishes to its own subscriptions.
+    Created in the network process of MqttProcess by tests and benchmarks, instead of a real connection.
+    With a *subscribe_delay*, each subscription holds the network process busy for that many seconds first.
+    """
+    from simulation.fake_broker import FakeBroker
+
+    connector = FakeMqttConnector(FakeBroker().start())
+    if subscribe_delay:
+        subscribe = connector.subscribe
+
+        def slow_subscribe(topic: str, qos: int = 1) -> None:
+            time.sleep(subscribe_delay)
+            subscribe(topic, qos)
+
+        connector.subscribe = slow_subscribe
+    return connector
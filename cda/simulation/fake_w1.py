@@ -0,0 +1,88 @@
+"""
+Fake 1-Wire sysfs tree for DS18B20 sensors.
+
+The tree mirrors /sys/bus/w1/devices: one `28-xxxxxxxxxxxx` folder per sensor,
+each containing a `w1_slave` file in the format the kernel driver produces, and
+the `temperature` and `resolution` files of newer kernels. The bus master folder
+has a `therm_bulk_read` file. Conversions are instant here, so it always reads
+as done.
+"""
+from __future__ import annotations
+
+import os
+import shutil
+import tempfile
+
+
+class FakeW1Bus:
+    def __init__(self, base_dir: str | None = None) -> None:
+        # Use a temporary folder unless a location is given
+        self._owns_dir = base_dir is None
+        self.base_dir = base_dir or tempfile.mkdtemp(prefix="w1_devices_")
+        self.sensors: list[str] = []
+        self.master_dir = os.path.join(self.base_dir, "w1_bus_master1")
+        os.makedirs(self.master_dir, exist_ok=True)
+        self._write(self.bulk_read_file, "0\n")
+
+    @property
+    def bulk_read_file(self) -> str:
+        return os.path.join(self.master_dir, "therm_bulk_read")
+
+    def add_sensor(self, sensor_id: str = "28-000000000001", temp_c: float = 20.0) -> str:
+        """Create a sensor folder and write an initial reading."""
+        os.makedirs(os.path.join(self.base_dir, sensor_id), exist_ok=True)
+        self._write(os.path.join(self.base_dir, sensor_id, "resolution"), "12\n")
+        self.sensors.append(sensor_id)
+        self.set_temperature(sensor_id, temp_c)
+        return sensor_id
+
+    def set_temperature(self, sensor_id: str, temp_c: float, crc_ok: bool = True) -> None:
+        """Write a reading to the sensor's w1_slave and temperature files, in steps of its resolution."""
+        # The sensor reports in 1/16 °C steps at 12 bits, and each bit less doubles the step
+        step = 0.0625 * 2 ** (12 - self.resolution(sensor_id))
+        temp_c = round(temp_c / step) * step
+        millidegrees = int(round(temp_c * 1000))
+        # Raw scratchpad bytes, in 1/16 °C steps
+        raw = int(round(temp_c * 16)) & 0xFFFF
+        scratchpad = f"{raw & 0xFF:02x} {raw >> 8:02x} 4b 46 7f ff 0c 10 1c"
+        content = (
+            f"{scratchpad} : crc=1c {'YES' if crc_ok else 'NO'}\n"
+            f"{scratchpad} t={millidegrees}\n"
+        )
+        self._write(os.path.join(self.base_dir, sensor_id, "w1_slave"), content)
+        # The kernel fails reads of the temperature file on a CRC error, an empty file fails to parse instead
+        self._write(os.path.join(self.base_dir, sensor_id, "temperature"), f"{millidegrees}\n" if crc_ok else "")
+
+    def resolution(self, sensor_id: str) -> int:
+        """The resolution in bits that was set on the sensor."""
+        try:
+            with open(os.path.join(self.base_dir, sensor_id, "resolution"), encoding="ascii") as fh:
+                return int(fh.read().strip())
+        except (OSError, ValueError):
+            return 12
+
+    def bulk_triggered(self) -> bool:
+        """True if a bulk conversion was started since the last call."""
+        with open(self.bulk_read_file, encoding="ascii") as fh:
+            triggered = fh.read().strip() == "trigger"
+        self._write(self.bulk_read_file, "0\n")
+        return triggered
+
+    def remove_sensor(self, sensor_id: str) -> None:
+        """Remove a sensor, as if it was unplugged."""
+        shutil.rmtree(os.path.join(self.base_dir, sensor_id), ignore_errors=True)
+        if sensor_id in self.sensors:
+            self.sensors.remove(sensor_id)
+
+    def close(self) -> None:
+        """Delete the tree if it was created by this instance."""
+        if self._owns_dir:
+            shutil.rmtree(self.base_dir, ignore_errors=True)
+
+    @staticmethod
+    def _write(path: str, content: str) -> None:
+        # Write to a temporary file and rename it, so readers never see a partial file
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="ascii") as fh:
+            fh.write(content)
+        os.replace(tmp_path, path)
@@ -0,0 +1,84 @@
+"""
+A CDA device without hardware, wired like main() for fleet tests and benchmarks.
+
+Orders go through the watcher, its admission and the line scheduler as on a
+real device, but each lot only waits for *lot_seconds*, or until it is stopped.
+The devices of a fleet share an MQTT broker, a FakeBroker or a local mosquitto.
+"""
+from __future__ import annotations
+
+import threading
+import time
+
+from functions.line_config import LineConfig
+from functions.line_scheduler import LineScheduler
+from mqtt.mqtt_watcher import mqtt_watcher
+from mqtt.order_admission import OrderAdmission
+from mqtt.stop_router import STOP_TOPIC, StopRouter
+
+
+class SimulatedDevice:
+    def __init__(
+        self,
+        connector,
+        name: str,
+        share_group: str | None = "cda",
+        lot_seconds: float = 0.1,
+        lines: tuple[int, ...] = (1,),
+        max_pending: int = 10,
+    ) -> None:
+        """
+        :param connector: The MQTT connector of the device, subscribed to STOP_TOPIC here.
+        :param name: Name of the device, recorded with each lot it runs.
+        :param share_group: Shared subscription of the fleet, or None to receive every order.
+        :param lot_seconds: How long each lot takes.
+        :param lines: Line numbers of the device.
+        :param max_pending: Orders that may wait for a line, see OrderAdmission.
+        """
+        self.name = name
+        self.lot_seconds = lot_seconds
+        # (device name, lot number, start, end) of each lot that ran, shared by all devices if set
+        self.lots: list[tuple[str, str, float, float]] = []
+        configs = {line: LineConfig(line, 2 * line, 2 * line + 1) for line in lines}
+        connector.subscribe(STOP_TOPIC, qos=1)
+        self.stop_router = StopRouter(connector, forward_topic=STOP_TOPIC if share_group else None)
+        self.scheduler = LineScheduler(configs, self._run_lot)
+        self.admission = OrderAdmission(
+            connector,
+            max_pending,
+            backlog=self.scheduler.pending,
+            has_line=lambda order: self.scheduler.config_for(order) is not None,
+        )
+        self.watcher = mqtt_watcher(
+            connector,
+            self.admission,
+            share_group=share_group,
+            line_busy=lambda order: self.scheduler.load(order) > 0,
+        )
+        self._lock = threading.Lock()
+
+    def start(self) -> SimulatedDevice:
+        self.scheduler.start()
+        # Hands the orders to the lines, like the loop of main()
+        threading.Thread(target=self._dispatch, name=f"{self.name}-orders", daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.stop_router.stop_all()
+        self.scheduler.shutdown(timeout=1)
+
+    def _dispatch(self) -> None:
+        while True:
+            order = self.watcher.wait_for_order()
+            self.scheduler.submit(order, order["priority"])
+
+    def _run_lot(self, config: LineConfig, order: dict) -> None:
+        lot_id = order["lot_number"]
+        stop_event = self.stop_router.watch(lot_id)
+        started = time.monotonic()
+        try:
+            stop_event.wait(self.lot_seconds)
+        finally:
+            self.stop_router.release(lot_id)
+        with self._lock:
+            self.lots.append((self.name, lot_id, started, time.monotonic()))
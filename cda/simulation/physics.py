@@ -0,0 +1,153 @@
+"""
+Simple physics models of the pump and kettle used by the simulated rig.
+
+Both models are advanced explicitly with step(dt), so they can run in real time
+inside simulation.rig, or in simulated time inside benchmarks.
+"""
+from __future__ import annotations
+
+import math
+from collections import deque
+
+
+class PumpModel:
+    """
+    Pump feeding water through the flow meter.
+
+    The flow follows a first-order response when the pump starts, and coasts
+    down with its own time constant after it is switched off.
+    """
+
+    def __init__(
+        self,
+        max_flow_lph: float = 720.0,
+        spin_up_tau: float = 0.3,
+        coast_tau: float = 0.5,
+        totalizer_step_liters: float = 0.01,
+    ) -> None:
+        """
+        :param max_flow_lph: Flow rate in liters per hour when running at full speed.
+        :param spin_up_tau: Time constant in seconds for the pump to spin up.
+        :param coast_tau: Time constant in seconds for the flow to stop after switch-off.
+        :param totalizer_step_liters: Resolution of the totalizer, which updates in jumps.
+        """
+        self.max_flow_lph = max_flow_lph
+        self.spin_up_tau = spin_up_tau
+        self.coast_tau = coast_tau
+        self.totalizer_step_liters = totalizer_step_liters
+        self.running = False
+        self.flow_lph = 0.0
+        self.total_liters = 0.0
+
+    def set_running(self, running: bool) -> None:
+        self.running = running
+
+    def step(self, dt: float) -> None:
+        """Advance the model by *dt* seconds."""
+        if dt <= 0:
+            return
+        target = self.max_flow_lph if self.running else 0.0
+        tau = self.spin_up_tau if self.running else self.coast_tau
+        previous = self.flow_lph
+        self.flow_lph = target + (previous - target) * math.exp(-dt / tau)
+        # Stop completely once the flow is negligible
+        if not self.running and self.flow_lph < 1e-3:
+            self.flow_lph = 0.0
+        # Integrate the volume with the average flow over the step (L/h to L/s)
+        self.total_liters += (previous + self.flow_lph) / 2.0 / 3600.0 * dt
+
+    @property
+    def totalizer_liters(self) -> float:
+        """The totalizer as the meter reports it, rounded down to its resolution."""
+        if self.totalizer_step_liters <= 0:
+            return self.total_liters
+        return math.floor(self.total_liters / self.totalizer_step_liters) * self.totalizer_step_liters
+
+
+class KettleModel:
+    """
+    Kettle with a heating element, the water and a temperature sensor.
+
+    The element has its own heat capacity, so heat keeps flowing into the water
+    after the relay opens. Together with the sensor lag and dead time, this
+    gives the overshoot seen on the real kettle.
+    """
+
+    WATER_HEAT_CAPACITY = 4186.0  # J/(kg·K)
+
+    def __init__(
+        self,
+        power_w: float = 2000.0,
+        ambient_c: float = 20.0,
+        water_liters: float = 0.1,
+        element_capacity: float = 400.0,
+        element_coupling: float = 60.0,
+        loss_coefficient: float = 2.0,
+        sensor_tau: float = 2.0,
+        dead_time: float = 1.0,
+    ) -> None:
+        """
+        :param power_w: Heating power in watts when the relay is on.
+        :param ambient_c: Ambient temperature in °C.
+        :param water_liters: Water in the kettle when the simulation starts.
+        :param element_capacity: Heat capacity of the element in J/K.
+        :param element_coupling: Heat transfer from element to water in W/K.
+        :param loss_coefficient: Heat loss from water to ambient in W/K.
+        :param sensor_tau: Time constant of the temperature sensor in seconds.
+        :param dead_time: Transport delay in seconds before the sensor sees a change.
+        """
+        self.power_w = power_w
+        self.ambient_c = ambient_c
+        self.element_capacity = element_capacity
+        self.element_coupling = element_coupling
+        self.loss_coefficient = loss_coefficient
+        self.sensor_tau = sensor_tau
+        self.dead_time = dead_time
+        self.heating = False
+        self.water_liters = water_liters
+        self.water_c = ambient_c
+        self.element_c = ambient_c
+        self.sensor_c = ambient_c
+        self.peak_water_c = ambient_c
+        self.elapsed = 0.0
+        # Water temperature history, used to delay what the sensor sees
+        self._history: deque[tuple[float, float]] = deque()
+
+    def set_heating(self, heating: bool) -> None:
+        self.heating = heating
+
+    def add_water(self, liters: float, temp_c: float | None = None) -> None:
+        """Mix *liters* of water at *temp_c* (ambient if None) into the kettle."""
+        if liters <= 0:
+            return
+        temp_c = self.ambient_c if temp_c is None else temp_c
+        total = self.water_liters + liters
+        self.water_c = (self.water_c * self.water_liters + temp_c * liters) / total
+        self.water_liters = total
+
+    def drain(self, residual_liters: float = 0.1) -> None:
+        """Empty the kettle and let everything return to ambient."""
+        self.water_liters = residual_liters
+        self.water_c = self.element_c = self.sensor_c = self.peak_water_c = self.ambient_c
+        self._history.clear()
+
+    def step(self, dt: float) -> None:
+        """Advance the model by *dt* seconds."""
+        if dt <= 0:
+            return
+        water_capacity = max(self.water_liters, 0.01) * self.WATER_HEAT_CAPACITY
+        to_water = self.element_coupling * (self.element_c - self.water_c)
+        to_ambient = self.loss_coefficient * (self.water_c - self.ambient_c)
+        heat_in = self.power_w if self.heating else 0.0
+        self.element_c += (heat_in - to_water) / self.element_capacity * dt
+        self.water_c += (to_water - to_ambient) / water_capacity * dt
+        self.peak_water_c = max(self.peak_water_c, self.water_c)
+        self.elapsed += dt
+
+        # The sensor follows the water temperature from dead_time seconds ago
+        self._history.append((self.elapsed, self.water_c))
+        delayed = self._history[0][1]
+        while self._history and self._history[0][0] <= self.elapsed - self.dead_time:
+            delayed = self._history.popleft()[1]
+        alpha = 1.0 - math.exp(-dt / self.sensor_tau) if self.sensor_tau > 0 else 1.0
+        self.sensor_c += (delayed - self.sensor_c) * alpha
@@ -0,0 +1,91 @@
+"""
+The program running lots on a simulated rig, for tests of whole lots.
+
+SimulatedPlant wires the lines of a SimulatedRig to the lot handling as main()
+does: a LineConfig for each line, a FakeMqttConnector in place of the broker,
+a StopRouter, a LotRunner and a LineScheduler. Orders are submitted to its
+scheduler, and stop signals delivered through its connector.
+
+Usage:
+    rig = SimulatedRig(pump=fast_pump(), kettle=fast_kettle(), time_scale=2.0).start()
+    plant = SimulatedPlant(rig).start()
+    plant.scheduler.submit({"liters": 0.5, "temperature": 40.0, "line": 1, "lot_number": "A"})
+    wait_for(lambda: plant.scheduler.completed == 1)
+    plant.stop()
+    rig.stop()
+"""
+from __future__ import annotations
+
+import time
+from typing import Callable
+
+# The rig installs the fake GPIO module, so it must be imported before the device code
+from simulation.rig import SimulatedRig
+from simulation.fake_mqtt import FakeMqttConnector
+from simulation.physics import KettleModel, PumpModel
+
+from functions.line_config import LineConfig
+from functions.line_scheduler import LineScheduler
+from functions.lot_runner import LotRunner
+from mqtt.device_status import DeviceStatusPublisher
+from mqtt.stop_router import StopRouter
+
+
+def fast_pump() -> PumpModel:
+    """A pump that fills half a liter in about a second."""
+    return PumpModel(max_flow_lph=1800.0)
+
+
+def fast_kettle() -> KettleModel:
+    """A kettle that heats a lot in seconds, with little lag."""
+    return KettleModel(power_w=4000.0, dead_time=0.2, sensor_tau=0.3)
+
+
+def wait_for(condition: Callable[[], bool], timeout: float = 30.0, interval: float = 0.01) -> bool:
+    """Wait up to *timeout* seconds for *condition* to be true, and return it."""
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(interval)
+    return condition()
+
+
+def line_configs(rig: SimulatedRig, transfer_seconds: float = 1.0) -> dict[int, LineConfig]:
+    """The configs of the lines of *rig*, numbered from 1 in the order they were added."""
+    return {
+        number: LineConfig(
+            number,
+            line.pump_relay_pin,
+            line.kettle_relay_pin,
+            line.meter.address,
+            line.sensor_id,
+            transfer_relay_pin=line.transfer_relay_pin,
+            transfer_seconds=transfer_seconds if line.transfer_relay_pin is not None else 0.0,
+        )
+        for number, line in enumerate(rig.lines, start=1)
+    }
+
+
+class SimulatedPlant:
+    def __init__(self, rig: SimulatedRig, device_id: str = "pi", **runner_options) -> None:
+        """
+        :param rig: The started rig, each of its lines becomes a line of the plant.
+        :param device_id: Device id of the status messages.
+        :param runner_options: Settings of the LotRunner, such as heater_control.
+        """
+        self.rig = rig
+        self.configs = line_configs(rig)
+        self.mqtt = FakeMqttConnector()
+        self.status_publisher = DeviceStatusPublisher(self.mqtt, device_id)
+        self.stop_router = StopRouter(self.mqtt)
+        self.runner = LotRunner(self.mqtt, self.status_publisher, self.stop_router, **runner_options)
+        # Lines with a transfer relay are pipelined, the others run each lot with runner.run
+        self.scheduler = LineScheduler(self.configs, self.runner.run, stages=self.runner)
+
+    def start(self) -> SimulatedPlant:
+        self.scheduler.start()
+        return self
+
+    def stop(self) -> None:
+        """Stop the running lots and the line threads."""
+        self.stop_router.stop_all()
+        self.scheduler.shutdown(timeout=5)
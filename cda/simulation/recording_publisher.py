@@ -0,0 +1,36 @@
+"""
+Drop-in replacement for mqtt_publisher that records what would have been published.
+
+Every progress call is made once per control-loop tick, so the timestamps also
+give the tick timing of FlowMonitor and Heater.
+"""
+from __future__ import annotations
+
+import time
+
+
+class RecordingPublisher:
+    def __init__(self, lot_id: str = "sim", line: int = 1) -> None:
+        self.lot_id = lot_id
+        self.line = line
+        # Lists of (monotonic timestamp, value)
+        self.flow_progress: list[tuple[float, float]] = []
+        self.temp_progress: list[tuple[float, float]] = []
+        self.flow_final: float | None = None
+        self.temp_final: float | None = None
+        self.errors: list[str] = []
+
+    def publish_flow_progress(self, liters: float) -> None:
+        self.flow_progress.append((time.monotonic(), liters))
+
+    def publish_flow_final(self, liters: float) -> None:
+        self.flow_final = liters
+
+    def publish_temp_progress(self, temperature: float) -> None:
+        self.temp_progress.append((time.monotonic(), temperature))
+
+    def publish_temp_final(self, temperature: float) -> None:
+        self.temp_final = temperature
+
+    def publish_error(self, message: str) -> None:
+        self.errors.append(message)
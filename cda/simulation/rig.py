@@ -0,0 +1,267 @@
+"""
+A complete simulated line: pump, flow meter, kettle, temperature sensor and relays.
+More lines can be added with add_line(), sharing the same RS485 bus and 1-Wire tree.
+A line with a transfer relay pumps into a fill vessel instead of the kettle, and
+the transfer relay moves the water on into the kettle.
+
+The rig installs the fake GPIO module, serves a virtual MAG 6000 on a pty,
+writes the kettle temperature into a fake 1-Wire tree, and steps the physics
+models in a background thread. The unmodified FlowMonitor and Heater can then
+run against it, exactly like main() runs them on the Raspberry Pi.
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+
+from simulation import fake_gpio
+from simulation.fake_w1 import FakeW1Bus
+from simulation.physics import KettleModel, PumpModel
+from simulation.virtual_mag6000 import Mag6000Slave, VirtualModbusBus
+
+# Install the fake GPIO module before the relay controller is imported
+fake_gpio.install()
+
+from devices.ds18b20 import ds18b20_reader  # noqa: E402
+from devices.relay.relay_manager import relay_manager  # noqa: E402
+
+
+class SimulatedLine:
+    """Pump, kettle, flow meter and temperature sensor of one line of the rig."""
+
+    def __init__(
+        self,
+        pump_relay_pin: int,
+        kettle_relay_pin: int,
+        pump: PumpModel,
+        kettle: KettleModel,
+        meter: Mag6000Slave,
+        sensor_id: str,
+        transfer_relay_pin: int | None = None,
+        transfer_lph: float = 3600.0,
+    ) -> None:
+        self.pump_relay_pin = pump_relay_pin
+        self.kettle_relay_pin = kettle_relay_pin
+        self.pump = pump
+        self.kettle = kettle
+        self.meter = meter
+        self.sensor_id = sensor_id
+        self.transfer_relay_pin = transfer_relay_pin
+        self.transfer_lph = transfer_lph
+        self.transferring = False
+        # Water in the fill vessel, on lines with a transfer relay
+        self.fill_liters = 0.0
+
+    def set_transferring(self, transferring: bool) -> None:
+        self.transferring = transferring
+
+    def step(self, dt: float) -> None:
+        before = self.pump.total_liters
+        self.pump.step(dt)
+        if self.transfer_relay_pin is None:
+            # Pumped water ends up in the kettle
+            self.kettle.add_water(self.pump.total_liters - before)
+        else:
+            # Pumped water ends up in the fill vessel, and moves on while the transfer relay is on
+            self.fill_liters += self.pump.total_liters - before
+            if self.transferring:
+                moved = min(self.fill_liters, self.transfer_lph / 3600.0 * dt)
+                self.fill_liters -= moved
+                self.kettle.add_water(moved)
+        self.kettle.step(dt)
+
+    def snapshot(self) -> dict:
+        return {
+            "pump_running": self.pump.running,
+            "flow_lph": self.pump.flow_lph,
+            "total_liters": self.pump.total_liters,
+            "kettle_heating": self.kettle.heating,
+            "water_liters": self.kettle.water_liters,
+            "water_c": self.kettle.water_c,
+            "peak_water_c": self.kettle.peak_water_c,
+            "sensor_c": self.kettle.sensor_c,
+            "fill_liters": self.fill_liters,
+        }
+
+    def settled(self) -> bool:
+        pump_settled = not self.pump.running and self.pump.flow_lph == 0.0 and not self.transferring
+        kettle_settled = not self.kettle.heating and (
+            self.kettle.water_c < self.kettle.peak_water_c
+            or self.kettle.element_c <= self.kettle.water_c
+        )
+        return pump_settled and kettle_settled
+
+
+class SimulatedRig:
+    def __init__(
+        self,
+        pump_relay_pin: int = 18,
+        kettle_relay_pin: int = 17,
+        pump: PumpModel | None = None,
+        kettle: KettleModel | None = None,
+        slave_address: int = 1,
+        transfer_relay_pin: int | None = None,
+        baudrate: int | None = None,
+        time_scale: float = 1.0,
+        step_interval: float = 0.005,
+    ) -> None:
+        """
+        :param pump_relay_pin: GPIO pin that switches the pump.
+        :param kettle_relay_pin: GPIO pin that switches the kettle.
+        :param pump: Pump model, or None for the default model.
+        :param kettle: Kettle model, or None for the default model.
+        :param slave_address: Modbus address of the virtual flow meter.
+        :param transfer_relay_pin: GPIO pin that moves water from a fill vessel into the kettle, or None for no fill vessel.
+        :param baudrate: Baud rate to emulate on the virtual bus, or None for no delay.
+        :param time_scale: Simulated seconds per real second, to speed up long lots.
+        :param step_interval: Real seconds between physics steps.
+        """
+        self.time_scale = time_scale
+        self.step_interval = step_interval
+        self.lock = threading.Lock()
+        self.bus = VirtualModbusBus(baudrate=baudrate)
+        self.w1 = FakeW1Bus()
+        self.lines: list[SimulatedLine] = []
+        self._started = False
+        self.sim_time = 0.0
+        # The first line, also available through the attributes of the rig
+        line = self.add_line(pump_relay_pin, kettle_relay_pin, slave_address, pump, kettle, transfer_relay_pin)
+        self.pump_relay_pin = line.pump_relay_pin
+        self.kettle_relay_pin = line.kettle_relay_pin
+        self.pump = line.pump
+        self.kettle = line.kettle
+        self.meter = line.meter
+        self.sensor_id = line.sensor_id
+        self._running = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._saved_env: dict[str, str | None] = {}
+        self._saved_base_dir = ds18b20_reader.BASE_DIR
+
+    def add_line(
+        self,
+        pump_relay_pin: int,
+        kettle_relay_pin: int,
+        slave_address: int,
+        pump: PumpModel | None = None,
+        kettle: KettleModel | None = None,
+        transfer_relay_pin: int | None = None,
+        transfer_lph: float = 3600.0,
+    ) -> SimulatedLine:
+        """
+        Add a line with its own relays, flow meter address and temperature sensor.
+        With a transfer relay, the line has a fill vessel that empties into the kettle at transfer_lph.
+        """
+        pump = pump or PumpModel()
+        kettle = kettle or KettleModel()
+        meter = self.bus.attach(Mag6000Slave(pump, slave_address, self.lock))
+        sensor_id = self.w1.add_sensor(f"28-{len(self.lines) + 1:012x}", temp_c=kettle.sensor_c)
+        line = SimulatedLine(pump_relay_pin, kettle_relay_pin, pump, kettle, meter, sensor_id, transfer_relay_pin, transfer_lph)
+        with self.lock:
+            self.lines.append(line)
+        if self._started:
+            self._add_listeners(line)
+        return line
+
+    def _add_listeners(self, line: SimulatedLine) -> None:
+        # Let the relays drive the physics models
+        fake_gpio.add_listener(line.pump_relay_pin, lambda pin, level: line.pump.set_running(level == fake_gpio.HIGH))
+        fake_gpio.add_listener(line.kettle_relay_pin, lambda pin, level: line.kettle.set_heating(level == fake_gpio.HIGH))
+        if line.transfer_relay_pin is not None:
+            fake_gpio.add_listener(line.transfer_relay_pin, lambda pin, level: line.set_transferring(level == fake_gpio.HIGH))
+
+    def start(self) -> "SimulatedRig":
+        # Point the device code at the simulated hardware
+        port = self.bus.start()
+        self._saved_env = {key: os.environ.get(key) for key in ("FLOW_GAUGE_PORT", "FLOW_GAUGE_PARITY")}
+        os.environ["FLOW_GAUGE_PORT"] = port
+        # Linux ptys do not accept parity settings, and parity has no meaning on them anyway
+        os.environ["FLOW_GAUGE_PARITY"] = "N"
+        ds18b20_reader.BASE_DIR = self.w1.base_dir
+
+        for line in self.lines:
+            self._add_listeners(line)
+        self._started = True
+
+        self._running.set()
+        self._thread = threading.Thread(target=self._run_physics, name="simulated-rig", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._running.clear()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+            self._thread = None
+        self._started = False
+        self.bus.stop()
+        self.w1.close()
+        ds18b20_reader.BASE_DIR = self._saved_base_dir
+        for key, value in self._saved_env.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+        # Forget the pins of the relay manager together with the fake GPIO state
+        relay_manager().release()
+        fake_gpio.reset()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def new_lot(self, index: int = 0) -> None:
+        """Empty the kettle and let the pump come to rest before the next lot."""
+        with self.lock:
+            line = self.lines[index]
+            line.kettle.drain()
+            line.pump.flow_lph = 0.0
+
+    def drain_kettle(self, index: int = 0) -> None:
+        """Empty the kettle only, so a pipelined line can keep filling the next lot."""
+        with self.lock:
+            self.lines[index].kettle.drain()
+
+    def snapshot(self, index: int = 0) -> dict:
+        """Return the true state of a line, as opposed to what the sensors report."""
+        with self.lock:
+            return {"sim_time": self.sim_time} | self.lines[index].snapshot()
+
+    def settle(self, max_seconds: float = 600.0, dt: float = 0.01) -> dict:
+        """
+        Fast-forward the physics until the pump has stopped and the kettle temperature
+        has peaked, without waiting in real time. Only call this once the control code
+        is finished, as the sensors are not updated while fast-forwarding.
+        Returns the final snapshot of the first line.
+        """
+        with self.lock:
+            elapsed = 0.0
+            while elapsed < max_seconds:
+                if all(line.settled() for line in self.lines):
+                    break
+                for line in self.lines:
+                    line.step(dt)
+                self.sim_time += dt
+                elapsed += dt
+        return self.snapshot()
+
+    def _run_physics(self) -> None:
+        last = time.monotonic()
+        last_sensor_write = 0.0
+        while self._running.is_set():
+            time.sleep(self.step_interval)
+            now = time.monotonic()
+            dt = (now - last) * self.time_scale
+            last = now
+            with self.lock:
+                for line in self.lines:
+                    line.step(dt)
+                self.sim_time += dt
+                sensors = [(line.sensor_id, line.kettle.sensor_c) for line in self.lines]
+            # The fake tree rounds to the resolution of the sensor, updated at most every 50 ms here
+            if now - last_sensor_write >= 0.05:
+                for sensor_id, sensor_c in sensors:
+                    self.w1.set_temperature(sensor_id, sensor_c)
+                last_sensor_write = now
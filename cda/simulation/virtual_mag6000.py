@@ -0,0 +1,199 @@
+"""
+Virtual MAG 6000 flow meter, served as a Modbus RTU slave over a pseudo terminal.
+
+VirtualModbusBus opens a pty pair and answers requests written to the slave end,
+so minimalmodbus and pyserial can use the pty path exactly like /dev/ttyUSB0.
+Mag6000Slave serves the holding registers from a PumpModel.
+"""
+from __future__ import annotations
+
+import os
+import select
+import struct
+import threading
+import time
+import tty
+from typing import Callable, Dict, List
+
+from simulation.physics import PumpModel
+
+# Holding registers served by the slave
+FLOW_RATE_REGISTER = 3002  # float32, m³/s
+TOTALIZER_REGISTER = 3014  # float64, liters
+FIRST_REGISTER = 3000
+LAST_REGISTER = 3031
+
+READ_HOLDING_REGISTERS = 0x03
+ILLEGAL_FUNCTION = 0x01
+ILLEGAL_DATA_ADDRESS = 0x02
+
+
+def _build_crc_table() -> List[int]:
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+_CRC_TABLE = _build_crc_table()
+
+
+def crc16(data: bytes) -> bytes:
+    """Modbus RTU CRC, little-endian as sent on the wire."""
+    crc = 0xFFFF
+    for byte in data:
+        crc = (crc >> 8) ^ _CRC_TABLE[(crc ^ byte) & 0xFF]
+    return struct.pack("<H", crc)
+
+
+class Mag6000Slave:
+    """Register bank of a single MAG 6000, backed by a pump model."""
+
+    def __init__(self, pump: PumpModel, address: int = 1, lock: threading.Lock | None = None) -> None:
+        """
+        :param pump: The pump model providing flow rate and totalizer.
+        :param address: Modbus slave address.
+        :param lock: Lock shared with whatever steps the pump model.
+        """
+        self.pump = pump
+        self.address = address
+        self.lock = lock or threading.Lock()
+        self.requests_served = 0
+
+    def read_registers(self, start: int, count: int) -> List[int] | None:
+        """Return *count* register words from *start*, or None for an illegal address."""
+        if count < 1 or start < FIRST_REGISTER or start + count - 1 > LAST_REGISTER:
+            return None
+        with self.lock:
+            flow_m3s = self.pump.flow_lph / 3600000.0
+            total = self.pump.totalizer_liters
+        # Lay out the register map as raw bytes, then cut out the requested words
+        block = bytearray(2 * (LAST_REGISTER - FIRST_REGISTER + 1))
+        struct.pack_into(">f", block, 2 * (FLOW_RATE_REGISTER - FIRST_REGISTER), flow_m3s)
+        struct.pack_into(">d", block, 2 * (TOTALIZER_REGISTER - FIRST_REGISTER), total)
+        offset = 2 * (start - FIRST_REGISTER)
+        self.requests_served += 1
+        return list(struct.unpack(f">{count}H", block[offset:offset + 2 * count]))
+
+
+class VirtualModbusBus:
+    """
+    RS485 bus stand-in with any number of slaves attached.
+
+    If *baudrate* is given, the bus delays each response by the time the
+    request and response frames would take on the wire, plus the 3.5 character
+    interframe gap, so timing comparisons are representative of the real bus.
+    """
+
+    def __init__(self, baudrate: int | None = None, turnaround: float = 0.0) -> None:
+        """
+        :param baudrate: Baud rate to emulate, or None to answer immediately.
+        :param turnaround: Extra processing time in seconds before each response.
+        """
+        self.baudrate = baudrate
+        self.turnaround = turnaround
+        self.slaves: Dict[int, Mag6000Slave] = {}
+        self.transactions = 0
+        # Optional hook called with each request frame, mainly for tests
+        self.on_request: Callable[[bytes], None] | None = None
+        self._master_fd: int | None = None
+        self._slave_fd: int | None = None
+        self.port: str | None = None
+        self._thread: threading.Thread | None = None
+        self._running = threading.Event()
+
+    def attach(self, slave: Mag6000Slave) -> Mag6000Slave:
+        self.slaves[slave.address] = slave
+        return slave
+
+    def char_time(self) -> float:
+        """Time for one character: start bit, 8 data bits, parity and stop bit."""
+        return 11.0 / self.baudrate if self.baudrate else 0.0
+
+    def start(self) -> str:
+        """Open the pty and start answering requests. Returns the port path."""
+        self._master_fd, self._slave_fd = os.openpty()
+        # Raw mode, so the line discipline does not echo or translate bytes
+        tty.setraw(self._slave_fd)
+        self.port = os.ttyname(self._slave_fd)
+        self._running.set()
+        self._thread = threading.Thread(target=self._serve, name="virtual-mag6000", daemon=True)
+        self._thread.start()
+        return self.port
+
+    def stop(self) -> None:
+        self._running.clear()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+            self._thread = None
+        for fd in (self._master_fd, self._slave_fd):
+            if fd is not None:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+        self._master_fd = self._slave_fd = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _serve(self) -> None:
+        buffer = b""
+        while self._running.is_set():
+            try:
+                readable, _, _ = select.select([self._master_fd], [], [], 0.05)
+                if not readable:
+                    # A silent period ends any partial frame
+                    buffer = b""
+                    continue
+                buffer += os.read(self._master_fd, 256)
+            except OSError:
+                return
+            # All supported requests are 8 bytes long
+            while len(buffer) >= 8:
+                frame, buffer = buffer[:8], buffer[8:]
+                response = self._handle(frame)
+                if response is not None:
+                    self._respond(frame, response)
+
+    def _handle(self, frame: bytes) -> bytes | None:
+        # Drop frames with a bad CRC, as a real slave would
+        if crc16(frame[:6]) != frame[6:8]:
+            return None
+        if self.on_request is not None:
+            self.on_request(frame)
+        address, function = frame[0], frame[1]
+        slave = self.slaves.get(address)
+        if slave is None:
+            return None
+        if function != READ_HOLDING_REGISTERS:
+            return self._exception(address, function, ILLEGAL_FUNCTION)
+        start, count = struct.unpack(">HH", frame[2:6])
+        words = slave.read_registers(start, count)
+        if words is None:
+            return self._exception(address, function, ILLEGAL_DATA_ADDRESS)
+        body = struct.pack(f">BBB{count}H", address, function, 2 * count, *words)
+        return body + crc16(body)
+
+    @staticmethod
+    def _exception(address: int, function: int, code: int) -> bytes:
+        body = bytes((address, function | 0x80, code))
+        return body + crc16(body)
+
+    def _respond(self, request: bytes, response: bytes) -> None:
+        # Emulate the time on the wire for the request, the gap and the response
+        delay = self.turnaround + self.char_time() * (len(request) + 3.5 + len(response))
+        if delay > 0:
+            time.sleep(delay)
+        self.transactions += 1
+        try:
+            os.write(self._master_fd, response)
+        except OSError:
+            pass
@@ -0,0 +1,145 @@
+import os
+import threading
+import time
+import unittest
+from unittest import mock
+
+from simulation import fake_gpio
+from simulation.fake_w1 import FakeW1Bus
+
+# Install the fake GPIO module before the heater imports the relay controller
+fake_gpio.install()
+
+from devices.ds18b20 import ds18b20_reader  # noqa: E402
+from devices.ds18b20.ds18b20_reader import DS18B20Reader, conversion_seconds  # noqa: E402
+from devices.ds18b20.ds18b20_sampler import DS18B20Sampler  # noqa: E402
+from devices.relay.relay_manager import relay_manager  # noqa: E402
+from functions.heater import Heater  # noqa: E402
+
+
+class FakeW1TestCase(unittest.TestCase):
+    def setUp(self):
+        self.w1 = FakeW1Bus()
+        self.saved_base_dir = ds18b20_reader.BASE_DIR
+        ds18b20_reader.BASE_DIR = self.w1.base_dir
+        self.first = self.w1.add_sensor("28-000000000001", temp_c=21.5)
+
+    def tearDown(self):
+        ds18b20_reader.BASE_DIR = self.saved_base_dir
+        self.w1.close()
+        relay_manager().release()
+        fake_gpio.reset()
+
+
+class ReaderTest(FakeW1TestCase):
+    def test_reads_the_temperature_attribute(self):
+        reader = DS18B20Reader(self.first)
+        os.remove(reader.device_file)
+        self.assertEqual(reader.read_temp_c(), 21.5)
+
+    def test_falls_back_to_w1_slave(self):
+        reader = DS18B20Reader(self.first)
+        os.remove(reader.temperature_file)
+        self.assertEqual(reader.read_temp_c(), 21.5)
+
+    def test_resolution(self):
+        reader = DS18B20Reader(self.first)
+        reader.set_resolution(9)
+        self.assertEqual(reader.read_resolution(), 9)
+        self.w1.set_temperature(self.first, 21.8)
+        self.assertEqual(reader.read_temp_c(), 22.0)
+        with self.assertRaises(ValueError):
+            reader.set_resolution(8)
+        self.assertAlmostEqual(conversion_seconds(12), 0.75)
+
+
+class SamplerTest(FakeW1TestCase):
+    def test_latest_sample(self):
+        sampler = DS18B20Sampler([self.first])
+        self.assertIsNone(sampler.latest(self.first))
+        sampler.sample_once()
+        first = sampler.latest(self.first)
+        self.assertEqual(first.temp_c, 21.5)
+
+        self.w1.set_temperature(self.first, 30.0)
+        sampler.sample_once()
+        self.assertEqual(sampler.latest(self.first).temp_c, 30.0)
+        self.assertEqual(sampler.latest(self.first).sequence, first.sequence + 1)
+
+    def test_first_sensor_found(self):
+        sampler = DS18B20Sampler()
+        sampler.sample_once()
+        self.assertEqual(sampler.latest().temp_c, 21.5)
+
+    def test_sets_the_resolution(self):
+        DS18B20Sampler([self.first], resolution=10).sample_once()
+        self.assertEqual(self.w1.resolution(self.first), 10)
+
+    def test_bulk_conversion_with_several_sensors(self):
+        second = self.w1.add_sensor("28-000000000002", temp_c=40.0)
+        sampler = DS18B20Sampler([self.first, second])
+        sampler.sample_once()
+        self.assertTrue(self.w1.bulk_triggered())
+        self.assertEqual(sampler.bulk_conversions, 1)
+        self.assertEqual(sampler.latest(second).temp_c, 40.0)
+
+        # A single sensor gains nothing from a bulk conversion
+        single = DS18B20Sampler([self.first])
+        single.sample_once()
+        self.assertFalse(self.w1.bulk_triggered())
+
+    def test_missing_sensor_is_found_later(self):
+        sampler = DS18B20Sampler(["28-000000000009"])
+        sampler.sample_once()
+        self.assertIsNone(sampler.latest("28-000000000009"))
+        self.assertIsNotNone(sampler.error("28-000000000009"))
+
+        self.w1.add_sensor("28-000000000009", temp_c=50.0)
+        sampler.sample_once()
+        self.assertEqual(sampler.latest("28-000000000009").temp_c, 50.0)
+        self.assertIsNone(sampler.error("28-000000000009"))
+
+    def test_background_thread(self):
+        with DS18B20Sampler([self.first], interval=0.01) as sampler:
+            sample = sampler.wait_for_sample(self.first, timeout=1)
+            self.assertIsNotNone(sample)
+            self.assertIsNotNone(sampler.wait_for_sample(self.first, after=sample.sequence, timeout=1))
+
+
+class HeaterSamplingTest(FakeW1TestCase):
+    def test_stop_is_not_delayed_by_a_conversion(self):
+        # A 12-bit conversion blocks the read for 750 ms
+        def slow_read(reader):
+            time.sleep(0.75)
+            return 21.5
+
+        stop_event = threading.Event()
+        publisher = mock.Mock()
+        heater = Heater(target_temperature=90, kettle_relay_pin=17, publisher=publisher, stop_event=stop_event, sensor_id=self.first)
+        with mock.patch.object(DS18B20Reader, "read_temp_c", slow_read):
+            threading.Timer(0.2, stop_event.set).start()
+            started = time.monotonic()
+            self.assertIsNone(heater.run())
+            self.assertLess(time.monotonic() - started, 0.5)
+        self.assertEqual(fake_gpio.level(17), fake_gpio.LOW)
+
+    def test_stale_sensor_stops_heating(self):
+        publisher = mock.Mock()
+        heater = Heater(target_temperature=90, kettle_relay_pin=17, publisher=publisher, sensor_id="28-000000000009", max_sample_age=0.3)
+        self.assertIsNone(heater.run())
+        self.assertEqual(fake_gpio.level(17), fake_gpio.LOW)
+
+    def test_sample_from_before_the_run_is_not_used(self):
+        # A shared sampler read the sensor above the target before the run, and reads none since
+        self.w1.set_temperature(self.first, 95.0)
+        sampler = DS18B20Sampler([self.first])
+        sampler.sample_once()
+        publisher = mock.Mock()
+        heater = Heater(target_temperature=90, kettle_relay_pin=17, publisher=publisher, sensor_id=self.first, sampler=sampler, max_sample_age=0.3)
+        self.assertIsNone(heater.run())
+        publisher.publish_temp_progress.assert_not_called()
+        self.assertEqual(fake_gpio.level(17), fake_gpio.LOW)
+
+
+if __name__ == "__main__":
+    unittest.main()
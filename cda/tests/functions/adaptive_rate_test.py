@@ -0,0 +1,33 @@
+import unittest
+
+from functions.adaptive_rate import AdaptiveRate
+
+
+class AdaptiveRateTest(unittest.TestCase):
+    def test_scales_with_time_to_target(self):
+        rate = AdaptiveRate(min_hz=1.0, max_hz=20.0, samples_to_target=10.0)
+        # 2 seconds to go leaves time for 10 samples at 5 Hz
+        self.assertAlmostEqual(rate.rate_hz(1.0, 0.5), 5.0)
+        # Twice as fast a rise needs twice the rate
+        self.assertAlmostEqual(rate.rate_hz(1.0, 1.0), 10.0)
+
+    def test_bounds(self):
+        rate = AdaptiveRate(min_hz=1.0, max_hz=20.0)
+        self.assertEqual(rate.rate_hz(100.0, 0.5), 1.0)
+        self.assertEqual(rate.rate_hz(0.01, 0.5), 20.0)
+        # Past the target, and without progress
+        self.assertEqual(rate.rate_hz(-0.1, 0.5), 20.0)
+        self.assertEqual(rate.rate_hz(1.0, 0.0), 1.0)
+        self.assertEqual(rate.rate_hz(1.0, -0.2), 1.0)
+
+    def test_parse(self):
+        rate = AdaptiveRate.parse("2,10")
+        self.assertEqual((rate.min_hz, rate.max_hz, rate.samples_to_target), (2.0, 10.0, 5.0))
+        self.assertEqual(AdaptiveRate.parse("1, 20, 5").samples_to_target, 5.0)
+        for text in ("5", "a,b", "1,2,3,4", "10,2", "0,5"):
+            with self.subTest(text=text), self.assertRaises(ValueError):
+                AdaptiveRate.parse(text)
+
+
+if __name__ == "__main__":
+    unittest.main()
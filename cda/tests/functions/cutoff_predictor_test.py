@@ -0,0 +1,76 @@
+import unittest
+
+from functions.cutoff_predictor import CutoffPredictor
+from simulation.physics import PumpModel
+
+
+def fill(predictor, target=1.0, flow_lph=3600.0, period=0.25, latency=0.05, dt=0.001):
+    """Fill like FlowMonitor does, in simulated time. Returns the delivered volume."""
+    pump = PumpModel(max_flow_lph=flow_lph, totalizer_step_liters=0.0)
+    pump.set_running(True)
+    now = 0.0
+    next_sample = period
+    while pump.running:
+        pump.step(dt)
+        now += dt
+        if now < next_sample:
+            continue
+        next_sample += period
+        # The sample is *latency* seconds old when the decision is made
+        volume = pump.total_liters - pump.flow_lph / 3600.0 * latency
+        delay = predictor.cutoff_delay(volume, pump.flow_lph, target, latency, period)
+        if delay is None:
+            continue
+        for _ in range(int((latency + delay) / dt)):
+            pump.step(dt)
+        predictor.record_cutoff(volume + pump.flow_lph / 3600.0 * delay, pump.flow_lph, latency)
+        pump.set_running(False)
+    # Coast down
+    for _ in range(int(10 / dt)):
+        pump.step(dt)
+    predictor.learn(pump.total_liters)
+    return pump.total_liters
+
+
+class CutoffPredictorTest(unittest.TestCase):
+    def test_cutoff_delay(self):
+        predictor = CutoffPredictor(coast_seconds=0.5)
+        # 1 L/s with 0.5 s of coast and no latency: 0.5 L still to come
+        self.assertIsNone(predictor.cutoff_delay(0.2, 3600.0, 1.0, 0.0, 0.25))
+        self.assertAlmostEqual(predictor.cutoff_delay(0.4, 3600.0, 1.0, 0.0, 0.25), 0.1)
+        self.assertEqual(predictor.cutoff_delay(0.6, 3600.0, 1.0, 0.0, 0.25), 0.0)
+        # Without flow there is nothing to predict
+        self.assertIsNone(predictor.cutoff_delay(0.2, 0.0, 1.0, 0.0, 0.25))
+
+    def test_learns_the_coast_time(self):
+        predictor = CutoffPredictor(coast_seconds=0.0)
+        predictor.record_cutoff(1.0, 3600.0, 0.1)
+        # 0.4 L after switch-off at 1 L/s, of which 0.1 s of latency
+        self.assertAlmostEqual(predictor.learn(1.4), 0.3)
+        self.assertAlmostEqual(predictor.coast_seconds, 0.3)
+        predictor.record_cutoff(1.0, 3600.0, 0.1)
+        predictor.learn(1.6)
+        self.assertAlmostEqual(predictor.coast_seconds, 0.3 + 0.3 * 0.2)
+        self.assertEqual(predictor.lots_learned, 2)
+
+    def test_ignores_impossible_coast_times(self):
+        predictor = CutoffPredictor(coast_seconds=0.5)
+        predictor.record_cutoff(1.0, 36.0, 0.0)
+        self.assertIsNone(predictor.learn(2.0))
+        self.assertEqual(predictor.coast_seconds, 0.5)
+        # Nothing to learn from without a cutoff
+        self.assertIsNone(predictor.learn(2.0))
+
+    def test_hits_the_target_at_full_speed(self):
+        predictor = CutoffPredictor(coast_seconds=0.0)
+        first = fill(predictor)
+        for _ in range(3):
+            delivered = fill(predictor)
+        # The first lot overshoots by the coast volume, later lots do not
+        self.assertGreater(first - 1.0, 0.3)
+        self.assertAlmostEqual(delivered, 1.0, delta=0.02)
+        self.assertAlmostEqual(predictor.coast_seconds, 0.5, delta=0.05)
+
+
+if __name__ == "__main__":
+    unittest.main()
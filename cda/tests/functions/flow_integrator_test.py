@@ -0,0 +1,58 @@
+import unittest
+
+from functions.flow_integrator import FlowIntegrator
+
+
+class FlowIntegratorTest(unittest.TestCase):
+    def test_constant_flow(self):
+        integrator = FlowIntegrator()
+        # 3600 L/h is one liter per second
+        for second in range(11):
+            integrator.add(3600.0, float(second))
+        self.assertAlmostEqual(integrator.volume_liters, 10.0)
+
+    def test_trapezoid_over_uneven_intervals(self):
+        integrator = FlowIntegrator()
+        # A linear ramp from 0 to 3600 L/h over 2 seconds, sampled unevenly
+        for timestamp in (0.0, 0.3, 1.1, 2.0):
+            integrator.add(1800.0 * timestamp, timestamp)
+        self.assertAlmostEqual(integrator.volume_liters, 1.0)
+
+    def test_ignores_stale_samples(self):
+        integrator = FlowIntegrator()
+        integrator.add(3600.0, 1.0)
+        integrator.add(3600.0, 2.0)
+        integrator.add(3600.0, 2.0)
+        integrator.add(3600.0, 1.5)
+        self.assertAlmostEqual(integrator.volume_liters, 1.0)
+        self.assertEqual(integrator.samples, 2)
+
+    def test_smoothing_window(self):
+        integrator = FlowIntegrator(window=3)
+        for timestamp, flow in enumerate((100.0, 200.0, 300.0, 400.0)):
+            integrator.add(flow, float(timestamp))
+        self.assertAlmostEqual(integrator.flow_lph, 300.0)
+        self.assertEqual(integrator.last_flow_lph, 400.0)
+
+    def test_memory_does_not_grow(self):
+        integrator = FlowIntegrator(window=4)
+        for tick in range(10000):
+            integrator.add(500.0, tick * 0.25)
+        self.assertEqual(len(integrator._buffer), 4)
+        self.assertAlmostEqual(integrator.volume_liters, 500.0 / 3600.0 * 9999 * 0.25)
+
+    def test_reset(self):
+        integrator = FlowIntegrator()
+        integrator.add(3600.0, 0.0)
+        integrator.add(3600.0, 1.0)
+        integrator.reset()
+        integrator.add(3600.0, 5.0)
+        self.assertEqual(integrator.volume_liters, 0.0)
+
+    def test_invalid_window(self):
+        with self.assertRaises(ValueError):
+            FlowIntegrator(window=0)
+
+
+if __name__ == "__main__":
+    unittest.main()
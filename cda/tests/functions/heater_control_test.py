@@ -0,0 +1,92 @@
+import unittest
+
+from functions.heater_control import (
+    BangBangController,
+    PidController,
+    PredictiveController,
+    make_controller,
+)
+from simulation.physics import KettleModel
+
+
+def heat(controller, target=40.0, liters=0.5, dt=0.1, max_seconds=300.0):
+    """Heat a simulated kettle like Heater.run does, in simulated time. Returns (seconds, overshoot, switches)."""
+    kettle = KettleModel()
+    kettle.add_water(liters - kettle.water_liters)
+    controller.start(target, 0.0)
+    kettle.set_heating(True)
+    relay_on = True
+    switches = 0
+    now = 0.0
+    while now < max_seconds:
+        kettle.step(dt)
+        now += dt
+        # The sensor reports in 1/16 °C steps
+        temp_c = round(kettle.sensor_c * 16) / 16
+        if temp_c >= target:
+            switches += relay_on
+            kettle.set_heating(False)
+            break
+        heating = controller.update(temp_c, now)
+        if heating != relay_on:
+            switches += 1
+            relay_on = heating
+            kettle.set_heating(heating)
+    controller.finish(now)
+    reached = now
+    # Let the water temperature peak
+    for _ in range(int(120 / dt)):
+        kettle.step(dt)
+    return reached, kettle.peak_water_c - target, switches
+
+
+class HeaterControlTest(unittest.TestCase):
+    def test_bang_bang_overshoots(self):
+        seconds, overshoot, switches = heat(BangBangController())
+        self.assertLess(seconds, 300)
+        self.assertGreater(overshoot, 3.0)
+        self.assertEqual(switches, 1)
+
+    def test_predictive_cuts_overshoot(self):
+        bang_seconds, bang_overshoot, _ = heat(BangBangController())
+        controller = PredictiveController()
+        for _ in range(3):
+            seconds, overshoot, switches = heat(controller)
+        self.assertLess(overshoot, bang_overshoot / 2)
+        self.assertLess(seconds, bang_seconds * 1.25)
+        self.assertLessEqual(switches, 3)
+
+    def test_predictive_learns_the_kettle(self):
+        controller = PredictiveController(lag_seconds=1.0)
+        heat(controller)
+        heat(controller, liters=1.0)
+        self.assertEqual(controller.lots_learned, 2)
+        # The simulated kettle has a dead time of 1 s, and several seconds of lag from the element and sensor
+        self.assertGreater(controller.dead_time, 1.0)
+        self.assertGreater(controller.time_constant, 1.0)
+        self.assertAlmostEqual(controller.lag_seconds, controller.dead_time + controller.time_constant)
+        self.assertGreater(controller.lag_seconds, 5.0)
+
+    def test_pid_reaches_target_with_less_overshoot(self):
+        _, bang_overshoot, _ = heat(BangBangController())
+        seconds, overshoot, switches = heat(PidController())
+        self.assertLess(seconds, 300)
+        self.assertLess(overshoot, bang_overshoot / 2)
+        self.assertGreater(switches, 1)
+
+    def test_pid_duty_cycle(self):
+        controller = PidController(kp=0.1, ki=0.0, kd=0.0, cycle_seconds=2.0)
+        controller.start(40.0, 0.0)
+        # 5 °C below the target gives half the cycle on, from the second cycle on
+        states = [controller.update(35.0, now / 10) for now in range(20, 40)]
+        self.assertEqual(controller.duty, 0.5)
+        self.assertEqual(states, [True] * 10 + [False] * 10)
+
+    def test_make_controller(self):
+        self.assertIsInstance(make_controller("predictive"), PredictiveController)
+        with self.assertRaises(ValueError):
+            make_controller("fuzzy")
+
+
+if __name__ == "__main__":
+    unittest.main()
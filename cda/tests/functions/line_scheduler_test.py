@@ -0,0 +1,146 @@
+import json
+import threading
+import time
+import unittest
+
+from functions.line_config import LineConfig, load_line_configs
+from functions.line_scheduler import LineScheduler
+from mqtt.device_status import DeviceStatusPublisher
+from simulation.fake_mqtt import FakeMqttConnector
+
+
+def order(line, lot_number):
+    return {"liters": 1.0, "temperature": 40.0, "line": line, "lot_number": lot_number}
+
+
+class LineConfigTest(unittest.TestCase):
+    def test_single_line_from_legacy_settings(self):
+        configs = load_line_configs({"PUMP_RELAY_PIN": "18", "KETTLE_RELAY_PIN": "17"})
+        self.assertEqual(configs, {None: LineConfig(None, 18, 17, 1, None)})
+
+    def test_several_lines(self):
+        configs = load_line_configs({
+            "LINES": "1, 2",
+            "LINE_1_PUMP_RELAY_PIN": "18", "LINE_1_KETTLE_RELAY_PIN": "17", "LINE_1_TEMP_SENSOR_ID": "28-a",
+            "LINE_2_PUMP_RELAY_PIN": "23", "LINE_2_KETTLE_RELAY_PIN": "24", "LINE_2_TEMP_SENSOR_ID": "28-b",
+        })
+        self.assertEqual(configs[2], LineConfig(2, 23, 24, 2, "28-b"))
+
+    def test_pipelined_line(self):
+        configs = load_line_configs({
+            "PUMP_RELAY_PIN": "18", "KETTLE_RELAY_PIN": "17",
+            "TRANSFER_RELAY_PIN": "27", "TRANSFER_SECONDS": "20",
+        })
+        self.assertTrue(configs[None].pipelined)
+        self.assertEqual(configs[None].transfer_seconds, 20.0)
+        self.assertFalse(load_line_configs({"PUMP_RELAY_PIN": "18", "KETTLE_RELAY_PIN": "17"})[None].pipelined)
+
+    def test_shared_hardware_is_rejected(self):
+        settings = {
+            "LINES": "1,2",
+            "LINE_1_PUMP_RELAY_PIN": "18", "LINE_1_KETTLE_RELAY_PIN": "17", "LINE_1_TEMP_SENSOR_ID": "28-a",
+            "LINE_2_PUMP_RELAY_PIN": "18", "LINE_2_KETTLE_RELAY_PIN": "24", "LINE_2_TEMP_SENSOR_ID": "28-b",
+        }
+        with self.assertRaises(ValueError):
+            load_line_configs(settings)
+        with self.assertRaises(ValueError):
+            load_line_configs({"LINES": "1", "LINE_1_PUMP_RELAY_PIN": "18"})
+        settings["LINE_2_PUMP_RELAY_PIN"] = "23"
+        settings["LINE_1_TRANSFER_RELAY_PIN"] = "24"
+        with self.assertRaises(ValueError):
+            load_line_configs(settings)
+
+
+class LineSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.configs = {1: LineConfig(1, 18, 17), 2: LineConfig(2, 23, 24, 2)}
+        self.started: list[tuple[int, str, float]] = []
+        self.release = threading.Event()
+        self.scheduler = LineScheduler(self.configs, self.run_lot)
+        self.scheduler.start()
+
+    def tearDown(self):
+        self.release.set()
+        self.scheduler.shutdown(timeout=1)
+
+    def run_lot(self, config, order):
+        self.started.append((config.line, order["lot_number"], time.monotonic()))
+        self.release.wait(1)
+
+    def test_lines_run_concurrently(self):
+        self.assertTrue(self.scheduler.submit(order(1, "A")))
+        self.assertTrue(self.scheduler.submit(order(2, "B")))
+        deadline = time.monotonic() + 1
+        while len(self.started) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.scheduler.busy_lines(), {1: "A", 2: "B"})
+
+    def test_orders_for_a_busy_line_wait(self):
+        self.scheduler.submit(order(1, "A"))
+        self.scheduler.submit(order(1, "C"))
+        time.sleep(0.05)
+        self.assertEqual([lot for _, lot, _ in self.started], ["A"])
+        self.assertEqual(self.scheduler.pending(), 1)
+
+        self.release.set()
+        self.assertTrue(self.scheduler.wait_idle(timeout=1))
+        self.assertEqual([lot for _, lot, _ in self.started], ["A", "C"])
+        self.assertEqual(self.scheduler.completed, 2)
+
+    def test_waiting_orders_start_by_priority(self):
+        self.scheduler.submit(order(1, "A"))
+        time.sleep(0.05)
+        self.scheduler.submit(order(1, "B"), priority=5)
+        self.scheduler.submit(order(1, "C"), priority=5)
+        self.scheduler.submit(order(1, "D"), priority=0)
+        self.release.set()
+        self.assertTrue(self.scheduler.wait_idle(timeout=1))
+        self.assertEqual([lot for _, lot, _ in self.started], ["A", "D", "B", "C"])
+
+    def test_unknown_line_is_rejected(self):
+        self.assertFalse(self.scheduler.submit(order(3, "X")))
+        self.assertFalse(self.scheduler.submit(order("one", "X")))
+
+
+class LineStatusTest(unittest.TestCase):
+    def test_device_is_occupied_until_the_last_line_is_done(self):
+        connector = FakeMqttConnector()
+        status = DeviceStatusPublisher(connector, "pi-1")
+        status.mark_occupied("A", 1)
+        status.mark_occupied("B", 2)
+        status.mark_available(1)
+        status.mark_available(2)
+
+        messages = [json.loads(payload) for payload in connector.messages("devices/pi-1/status")]
+        self.assertEqual(messages[1], {"status": "occupied", "lot_number": "B", "lots": {"A": 1, "B": 2}})
+        self.assertEqual(messages[2], {"status": "occupied", "lot_number": "B", "lots": {"B": 2}})
+        self.assertEqual(messages[3], {"status": "available"})
+
+    def test_error_of_one_line_keeps_the_device_occupied(self):
+        connector = FakeMqttConnector()
+        status = DeviceStatusPublisher(connector, "pi-1")
+        status.mark_occupied("A", 1)
+        status.mark_occupied("B", 2)
+        status.mark_error("Flow interrupted", 1, "A")
+        status.mark_error("Heater interrupted", 2, "B")
+
+        messages = [json.loads(payload) for payload in connector.messages("devices/pi-1/status")]
+        self.assertEqual(messages[2], {"status": "error", "error_message": "Flow interrupted", "line": 1, "lot_number": "A"})
+        # The retained status is occupied again while the lot of the other line runs
+        self.assertEqual(messages[3], {"status": "occupied", "lot_number": "B", "lots": {"B": 2}})
+        # The error of the last lot stays
+        self.assertEqual(messages[4:], [{"status": "error", "error_message": "Heater interrupted", "line": 2, "lot_number": "B"}])
+
+    def test_single_line_payloads_are_unchanged(self):
+        connector = FakeMqttConnector()
+        status = DeviceStatusPublisher(connector, "pi-1")
+        status.mark_occupied("A")
+        status.mark_available()
+        self.assertEqual(
+            connector.messages("devices/pi-1/status"),
+            [json.dumps({"status": "occupied", "lot_number": "A"}), json.dumps({"status": "available"})],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
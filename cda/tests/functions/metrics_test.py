@@ -0,0 +1,96 @@
+import math
+import unittest
+
+from functions.metrics import MetricsRegistry
+from functions.periodic_scheduler import TICK_SECONDS, PeriodicScheduler
+
+
+class HistogramTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = MetricsRegistry()
+        self.histogram = self.registry.histogram("read_seconds", "Read time", ("sensor",), buckets=(0.01, 0.1, 1.0))
+
+    def test_buckets_include_their_upper_bound(self):
+        value = self.histogram.labels("a")
+        for sample in (0.005, 0.01, 0.05, 0.5, 2.0):
+            value.observe(sample)
+        self.assertEqual(value.bucket_counts, [2, 1, 1, 1])
+        self.assertEqual((value.count, value.max), (5, 2.0))
+        self.assertAlmostEqual(value.sum, 2.565)
+
+    def test_quantiles(self):
+        value = self.histogram.labels("a")
+        self.assertTrue(math.isnan(value.quantile(0.5)))
+        for _ in range(90):
+            value.observe(0.05)
+        for _ in range(10):
+            value.observe(0.5)
+        # Interpolated within the bucket from 0.01 to 0.1
+        self.assertAlmostEqual(value.quantile(0.5), 0.01 + 0.09 * 50 / 90)
+        # but not past the largest sample
+        self.assertGreater(value.quantile(0.95), 0.1)
+        self.assertAlmostEqual(value.quantile(1.0), 0.5)
+        value.observe(3.0)
+        self.assertEqual(value.quantile(1.0), 3.0)
+
+    def test_labels_are_checked(self):
+        with self.assertRaises(ValueError):
+            self.histogram.labels("a", "b")
+
+    def test_registering_again_returns_the_metric(self):
+        self.assertIs(self.registry.histogram("read_seconds", "Read time", ("sensor",)), self.histogram)
+        with self.assertRaises(ValueError):
+            self.registry.counter("read_seconds", "Read time", ("sensor",))
+
+
+class ExportTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = MetricsRegistry()
+        self.registry.counter("lots_total", "Lots", ("result",)).labels("completed").inc(2)
+        self.registry.gauge("inflight", "In flight").set(3)
+        histogram = self.registry.histogram("tick_seconds", "Tick time", ("loop",), buckets=(0.01, 0.1))
+        histogram.labels("flow").observe(0.005)
+        histogram.labels("flow").observe(0.05)
+        # Never used, so not exported as a value
+        self.registry.counter("unused_total", "Unused")
+
+    def test_prometheus_text(self):
+        text = self.registry.prometheus_text()
+        self.assertIn("# TYPE tick_seconds histogram\n", text)
+        self.assertIn('tick_seconds_bucket{loop="flow",le="0.01"} 1\n', text)
+        self.assertIn('tick_seconds_bucket{loop="flow",le="0.1"} 2\n', text)
+        self.assertIn('tick_seconds_bucket{loop="flow",le="+Inf"} 2\n', text)
+        self.assertIn('tick_seconds_count{loop="flow"} 2\n', text)
+        self.assertIn('lots_total{result="completed"} 2.0\n', text)
+        self.assertIn("inflight 3.0\n", text)
+        self.assertIn("# TYPE unused_total counter\n", text)
+
+    def test_label_values_are_escaped(self):
+        self.registry.counter("errors_total", "Errors", ("sensor",)).labels('28-"x"\n').inc()
+        self.assertIn('errors_total{sensor="28-\\"x\\"\\n"} 1.0', self.registry.prometheus_text())
+
+    def test_summary(self):
+        summary = self.registry.summary()
+        self.assertNotIn("unused_total", summary)
+        self.assertEqual(summary["lots_total"], [{"labels": {"result": "completed"}, "value": 2.0}])
+        tick = summary["tick_seconds"][0]
+        self.assertEqual((tick["labels"], tick["count"], tick["max"]), ({"loop": "flow"}, 2, 0.05))
+        self.assertIsNotNone(tick["p95"])
+
+
+class TickMetricTest(unittest.TestCase):
+    def test_observes_the_work_of_each_tick(self):
+        now = [0.0]
+        scheduler = PeriodicScheduler(10.0, clock=lambda: now[0], sleep=lambda seconds: now.__setitem__(0, now[0] + seconds), name="metrics-test")
+        ticks = TICK_SECONDS.labels("metrics-test")
+        count = ticks.count
+        scheduler.wait()
+        for work in (0.02, 0.03):
+            now[0] += work
+            scheduler.wait()
+        self.assertEqual(ticks.count - count, 2)
+        self.assertAlmostEqual(ticks.max, 0.03)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+import threading
+import time
+import unittest
+
+from functions.periodic_scheduler import PeriodicScheduler
+
+
+class FakeClock:
+    """Clock that only advances when sleeping or when told to."""
+
+    def __init__(self):
+        self.now = 100.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class PeriodicSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.scheduler = PeriodicScheduler(4.0, clock=self.clock, sleep=self.clock.sleep)
+
+    def test_first_wait_returns_immediately(self):
+        self.assertTrue(self.scheduler.wait())
+        self.assertEqual(self.clock.sleeps, [])
+
+    def test_no_drift_with_variable_work(self):
+        self.scheduler.wait()
+        start = self.clock.now
+        for work in (0.01, 0.2, 0.05, 0.0, 0.13):
+            self.clock.now += work
+            self.scheduler.wait()
+        # Each tick starts exactly on the grid, regardless of how long the work took
+        self.assertAlmostEqual(self.clock.now - start, 5 * 0.25)
+        self.assertEqual(self.scheduler.stats.missed_deadlines, 0)
+
+    def test_overrun_starts_next_tick_immediately(self):
+        self.scheduler.wait()
+        # A read that blocks for 0.6 s misses the deadline at 0.25 s
+        self.clock.now += 0.6
+        self.scheduler.wait()
+        self.assertEqual(self.clock.sleeps, [])
+        stats = self.scheduler.stats
+        self.assertEqual(stats.missed_deadlines, 1)
+        self.assertEqual(stats.skipped_ticks, 1)
+        self.assertAlmostEqual(stats.max_overrun, 0.35)
+
+        # The schedule continues from the late tick
+        tick = self.clock.now
+        self.clock.now += 0.1
+        self.scheduler.wait()
+        self.assertAlmostEqual(self.clock.now, tick + 0.25)
+
+    def test_rate_change(self):
+        self.scheduler.wait()
+        start = self.clock.now
+        self.scheduler.rate_hz = 10.0
+        self.scheduler.wait()
+        self.assertAlmostEqual(self.clock.now - start, 0.1)
+
+    def test_stop_event_ends_wait_early(self):
+        stop_event = threading.Event()
+        scheduler = PeriodicScheduler(0.5, stop_event)
+        scheduler.wait()
+        threading.Timer(0.05, stop_event.set).start()
+        started = time.monotonic()
+        self.assertFalse(scheduler.wait())
+        self.assertLess(time.monotonic() - started, 1.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+import multiprocessing
+import pickle
+import unittest
+
+from functions.shared_ring import SharedRing
+
+
+def _echo_lengths(ring: SharedRing, conn) -> None:
+    # Runs in a spawned process, and sends back the length and first byte of each record
+    for _ in range(conn.recv()):
+        record = ring.get(timeout=5)
+        conn.send((len(record), record[:1]))
+    ring.close()
+
+
+class SharedRingTest(unittest.TestCase):
+    def setUp(self):
+        self.ring = SharedRing.create(64)
+        self.addCleanup(self.ring.close)
+
+    def test_records_come_out_in_order(self):
+        self.assertIsNone(self.ring.get(timeout=0))
+        for record in (b"a", b"", b"three"):
+            self.assertTrue(self.ring.put(record))
+        self.assertEqual(self.ring.used, 3 * 4 + 6)
+        self.assertEqual(self.ring.drain(), [b"a", b"", b"three"])
+        self.assertEqual(self.ring.used, 0)
+
+    def test_records_wrap_around_the_end(self):
+        for index in range(20):
+            record = bytes([index]) * (10 + index)
+            self.assertTrue(self.ring.put(record))
+            self.assertEqual(self.ring.get(timeout=0), record)
+        self.assertEqual(self.ring.stats.records, 20)
+
+    def test_a_full_ring_refuses_without_waiting(self):
+        self.assertTrue(self.ring.put(b"x" * 28))
+        self.assertTrue(self.ring.put(b"y" * 28))
+        self.assertFalse(self.ring.put(b"z"))
+        self.assertFalse(self.ring.put(b"z" * 61))
+        self.assertEqual(self.ring.stats.summary()["dropped"], 2)
+        self.assertEqual(self.ring.get(timeout=0), b"x" * 28)
+        # The space of a record that was taken can be used again
+        self.assertTrue(self.ring.put(b"z"))
+        self.assertEqual(self.ring.drain(), [b"y" * 28, b"z"])
+
+    def test_only_passed_to_a_starting_process(self):
+        with self.assertRaises(RuntimeError):
+            pickle.dumps(self.ring)
+
+    def test_another_process_reads_the_records(self):
+        context = multiprocessing.get_context("spawn")
+        ring = SharedRing.create(1024, context)
+        self.addCleanup(ring.close)
+        conn, child_conn = context.Pipe()
+        process = context.Process(target=_echo_lengths, args=(ring, child_conn))
+        process.start()
+        records = [bytes([index]) * (index * 50) for index in range(1, 20)]
+        conn.send(len(records))
+        received = []
+        for record in records:
+            # A record larger than the free space is refused, so wait for the reader when needed
+            while not ring.put(record):
+                received.append(conn.recv())
+        while len(received) < len(records):
+            received.append(conn.recv())
+        process.join(5)
+        self.assertEqual(received, [(len(record), record[:1]) for record in records])
+        self.assertEqual(process.exitcode, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
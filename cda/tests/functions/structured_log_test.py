@@ -0,0 +1,138 @@
+import io
+import json
+import logging
+import queue
+import threading
+import unittest
+
+from functions.structured_log import (
+    DroppingQueueHandler,
+    JsonFormatter,
+    KeyValueFormatter,
+    RateLimitFilter,
+    get_logger,
+    setup_logging,
+)
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class StructuredLoggerTest(unittest.TestCase):
+    def setUp(self):
+        self.handler = ListHandler()
+        self.logger = logging.getLogger("tests.structured_log")
+        self.logger.addHandler(self.handler)
+        self.logger.setLevel(logging.DEBUG)
+        self.logger.propagate = False
+        self.addCleanup(self.logger.removeHandler, self.handler)
+        self.addCleanup(setattr, self.logger, "propagate", True)
+
+    def test_keywords_become_fields(self):
+        log = get_logger("tests.structured_log", line=1).bind(lot="A1")
+        log.info("Progress", liters=0.5, line=2)
+        record = self.handler.records[0]
+        self.assertEqual(record.getMessage(), "Progress")
+        # The fields of the call win over the bound ones
+        self.assertEqual(record.fields, {"line": 2, "lot": "A1", "liters": 0.5})
+
+    def test_every_logs_the_first_of_each_n_calls(self):
+        log = get_logger("tests.structured_log")
+        for tick in range(10):
+            log.info("Progress", every=4, tick=tick)
+            log.info("Other", every=5, tick=tick)
+        self.assertEqual([(r.getMessage(), r.fields["tick"]) for r in self.handler.records],
+                         [("Progress", 0), ("Other", 0), ("Progress", 4), ("Other", 5), ("Progress", 8)])
+
+    def test_disabled_levels_are_not_logged(self):
+        self.logger.setLevel(logging.INFO)
+        get_logger("tests.structured_log").debug("Heating...", temp_c=50.0)
+        self.assertEqual(self.handler.records, [])
+
+    def test_exception_info_is_passed_on(self):
+        try:
+            raise ValueError("bad")
+        except ValueError:
+            get_logger("tests.structured_log").exception("Read failed", sensor="28-1")
+        record = self.handler.records[0]
+        self.assertIs(record.exc_info[0], ValueError)
+        self.assertEqual(record.fields, {"sensor": "28-1"})
+
+
+class FormatterTest(unittest.TestCase):
+    def record(self, **fields):
+        record = logging.LogRecord("cda.flow", logging.INFO, __file__, 1, "Progress", (), None)
+        record.fields = fields
+        return record
+
+    def test_key_value(self):
+        line = KeyValueFormatter().format(self.record(liters=0.123456789, lot="A 1", done=True))
+        self.assertTrue(line.endswith('INFO cda.flow: Progress liters=0.123457 lot="A 1" done=True'), line)
+
+    def test_json(self):
+        data = json.loads(JsonFormatter().format(self.record(liters=0.5, slaves={1: {"errors": 0}})))
+        self.assertEqual((data["level"], data["logger"], data["message"]), ("INFO", "cda.flow", "Progress"))
+        self.assertEqual((data["liters"], data["slaves"]), (0.5, {"1": {"errors": 0}}))
+
+
+class RateLimitFilterTest(unittest.TestCase):
+    def test_bursts_then_limits_and_counts_the_suppressed(self):
+        now = [0.0]
+        limit = RateLimitFilter(per_second=2, burst=3, clock=lambda: now[0])
+
+        def record(msg):
+            return logging.LogRecord("cda.flow", logging.WARNING, __file__, 1, msg, (), None)
+
+        self.assertEqual([limit.filter(record("No flow")) for _ in range(5)], [True, True, True, False, False])
+        # Other messages have their own bucket
+        self.assertTrue(limit.filter(record("Other")))
+        now[0] = 0.5
+        passed = record("No flow")
+        self.assertTrue(limit.filter(passed))
+        self.assertEqual(passed.fields, {"suppressed": 2})
+        self.assertFalse(limit.filter(record("No flow")))
+
+
+class QueueTest(unittest.TestCase):
+    def test_a_full_queue_drops_instead_of_blocking(self):
+        handler = DroppingQueueHandler(queue.Queue(2))
+        for index in range(5):
+            handler.handle(logging.LogRecord("cda.flow", logging.INFO, __file__, 1, "Progress %d", (index,), None))
+        self.assertEqual((handler.queue.qsize(), handler.dropped), (2, 3))
+        # Formatted by the listener, not by the caller
+        self.assertEqual(handler.queue.get_nowait().args, (0,))
+
+    def test_setup_writes_from_a_background_thread(self):
+        stream = io.StringIO()
+        threads = []
+
+        class Recording(io.StringIO):
+            def write(self, text):
+                threads.append(threading.current_thread())
+                return stream.write(text)
+
+        root = logging.getLogger()
+        level = root.level
+        self.addCleanup(root.setLevel, level)
+        listener = setup_logging("DEBUG", "json", stream=Recording())
+        try:
+            get_logger("tests.setup_logging").debug("Heating...", temp_c=50.0)
+        finally:
+            listener.stop()
+        self.assertEqual(json.loads(stream.getvalue())["temp_c"], 50.0)
+        self.assertNotIn(threading.current_thread(), threads)
+        self.assertNotIn(listener.handler, root.handlers)
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            setup_logging(fmt="xml")
+
+
+if __name__ == "__main__":
+    unittest.main()
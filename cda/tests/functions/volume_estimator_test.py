@@ -0,0 +1,76 @@
+import unittest
+
+from functions.volume_estimator import VolumeEstimator
+from simulation.physics import PumpModel
+
+
+def replay(estimator, flow_lph=1800.0, step=0.1, seconds=10.0, period=0.25, start=0.05):
+    """Run the pump model and feed the readings to *estimator*. Returns (estimates, true volumes)."""
+    pump = PumpModel(max_flow_lph=flow_lph, totalizer_step_liters=step)
+    # The fill starts partway into a totalizer step
+    pump.total_liters = start
+    baseline = pump.totalizer_liters
+    estimator.reset(0.0)
+    pump.set_running(True)
+    estimates, truth = [], []
+    for tick in range(1, int(seconds / period) + 1):
+        for _ in range(250):
+            pump.step(period / 250)
+        estimates.append(estimator.update(tick * period, pump.flow_lph, pump.totalizer_liters - baseline))
+        truth.append(pump.total_liters - start)
+    return estimates, truth
+
+
+class VolumeEstimatorTest(unittest.TestCase):
+    def test_constant_flow(self):
+        estimator = VolumeEstimator(totalizer_step_liters=0.0)
+        estimator.reset(0.0)
+        # 3600 L/h is one liter per second, and an exact totalizer agrees
+        for second in range(1, 11):
+            estimate = estimator.update(float(second), 3600.0, float(second))
+        self.assertAlmostEqual(estimate.volume_liters, 10.0)
+        self.assertAlmostEqual(estimate.flow_lph, 3600.0)
+
+    def test_coarse_totalizer(self):
+        estimates, truth = replay(VolumeEstimator(totalizer_step_liters=0.1))
+        errors = [estimate.volume_liters - true for estimate, true in zip(estimates, truth)]
+        # Much closer than the totalizer step, all along the fill
+        self.assertLess(max(abs(error) for error in errors), 0.03)
+        inside = sum(estimate.lower_liters <= true <= estimate.upper_liters for estimate, true in zip(estimates, truth))
+        self.assertGreaterEqual(inside / len(truth), 0.8)
+
+    def test_stays_within_a_step_of_the_totalizer(self):
+        estimator = VolumeEstimator(totalizer_step_liters=0.1)
+        estimator.reset(0.0)
+        # The flow reads far too high, but the totalizer does not move
+        for tick in range(1, 21):
+            estimate = estimator.update(tick * 0.25, 3600.0, 0.0)
+        self.assertLessEqual(estimate.volume_liters, 0.1)
+        self.assertLessEqual(estimate.upper_liters, 0.1 + 1e-9)
+
+    def test_missing_readings(self):
+        estimator = VolumeEstimator(totalizer_step_liters=0.0)
+        estimator.reset(0.0)
+        estimator.update(1.0, 3600.0, None)
+        # Without a flow reading, the last flow rate is assumed
+        estimate = estimator.update(2.0, None, None)
+        self.assertAlmostEqual(estimate.volume_liters, 1.5)
+        self.assertGreater(estimate.std_liters, 0.0)
+
+    def test_ignores_stale_readings(self):
+        estimator = VolumeEstimator(totalizer_step_liters=0.0)
+        estimator.reset(0.0)
+        estimator.update(1.0, 3600.0)
+        estimate = estimator.update(0.5, 3600.0)
+        self.assertAlmostEqual(estimate.volume_liters, 0.5)
+        self.assertEqual(estimate.timestamp, 1.0)
+
+    def test_invalid_parameters(self):
+        with self.assertRaises(ValueError):
+            VolumeEstimator(totalizer_step_liters=-0.1)
+        with self.assertRaises(ValueError):
+            VolumeEstimator(flow_noise_lph=-1.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
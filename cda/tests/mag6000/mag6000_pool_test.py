@@ -0,0 +1,190 @@
+import contextlib
+import io
+import os
+import unittest
+from unittest import mock
+
+import serial
+
+# The rig installs the fake GPIO module, so it must be imported before the device code
+from simulation.rig import SimulatedRig
+from simulation.fake_mqtt import FakeMqttConnector
+
+from devices.mag6000.mag6000_pool import Mag6000Pool
+from devices.mag6000.mag6000_reader import Mag6000Reader
+from devices.mag6000.rs485_bus import MAX_OPEN_BACKOFF, OPEN_BACKOFF, Rs485Bus
+from functions.line_config import LineConfig
+from functions.lot_runner import LotRunner
+from mqtt.device_status import DeviceStatusPublisher
+from mqtt.stop_router import StopRouter
+
+
+class ManualClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeBus:
+    port = "/dev/fake"
+
+    def __init__(self):
+        self.reopens = 0
+
+    def reopen(self):
+        self.reopens += 1
+
+
+class DeadConnector:
+    """A flow gauge that never answers."""
+
+    def __init__(self, slave_address):
+        self.slave_address = slave_address
+        self.bus = FakeBus()
+        self.instrument = self
+        self.closed = False
+
+    def transaction(self, priority):
+        return contextlib.nullcontext()
+
+    def read_registers(self, start, count):
+        raise OSError("No communication with the instrument (no answer)")
+
+    def close(self):
+        self.closed = True
+
+
+class PoolTest(unittest.TestCase):
+    def setUp(self):
+        self.rig = SimulatedRig()
+        self.rig.start()
+        self.clock = ManualClock()
+        self.pool = Mag6000Pool(probe_interval=10.0, clock=self.clock)
+
+    def tearDown(self):
+        self.pool.close()
+        self.rig.stop()
+
+    def test_opens_lazily_and_keeps_the_connector(self):
+        self.assertFalse(self.pool.is_warm(1))
+        self.assertEqual(self.pool._connectors, {})
+        with self.pool.lease(1) as first:
+            self.assertIsNotNone(Mag6000Reader(first).read_snapshot())
+        with self.pool.lease(1) as second:
+            self.assertIs(second, first)
+        # The serial port stays open between the leases
+        self.assertTrue(first.bus.serial.is_open)
+
+    def test_probes_when_due_and_not_in_use(self):
+        self.pool.add([1])
+        self.pool.check()
+        self.assertTrue(self.pool.is_warm(1))
+        self.assertEqual(self.pool.summary()[1]["probes"], 1)
+        # Not due yet
+        self.clock.now = 5.0
+        self.assertAlmostEqual(self.pool.check(), 5.0)
+        self.assertEqual(self.pool.summary()[1]["probes"], 1)
+        # A gauge in use is left to its lot
+        self.clock.now = 10.0
+        with self.pool.lease(1):
+            self.pool.check()
+        self.assertEqual(self.pool.summary()[1]["probes"], 1)
+        # The lease pushes the next probe back
+        self.clock.now = 19.0
+        self.pool.check()
+        self.assertEqual(self.pool.summary()[1]["probes"], 1)
+        self.clock.now = 20.0
+        self.pool.check()
+        self.assertEqual(self.pool.summary()[1]["probes"], 2)
+
+    def test_reopen_keeps_the_instrument_working(self):
+        with self.pool.lease(1) as connector:
+            connector.bus.reopen()
+            self.assertIsNotNone(Mag6000Reader(connector).read_snapshot())
+
+    def test_lots_use_the_pooled_connector(self):
+        mqtt = FakeMqttConnector()
+        runner = LotRunner(mqtt, DeviceStatusPublisher(mqtt, "pi"), StopRouter(mqtt), gauge_pool=self.pool)
+        config = LineConfig(1, self.rig.pump_relay_pin, self.rig.kettle_relay_pin, 1, self.rig.sensor_id)
+        self.pool.add([1])
+        self.pool.check()
+        connector = self.pool._connectors[1]
+        with contextlib.redirect_stdout(io.StringIO()):
+            for lot_number in ("A", "B"):
+                lot = runner.begin(config, {"liters": 0.05, "temperature": 30.0, "line": 1, "lot_number": lot_number})
+                try:
+                    self.assertTrue(runner.fill(lot))
+                finally:
+                    runner.end(lot)
+                self.assertGreater(lot.report["flow_time_to_first_sample_s"], 0.0)
+        self.assertIs(self.pool._connectors[1], connector)
+        self.assertTrue(connector.bus.serial.is_open)
+        self.assertIsNotNone(self.pool.summary()[1]["first_sample_mean_ms"])
+
+    def test_first_sample_times(self):
+        self.pool.record_first_sample(1, 0.02)
+        self.pool.record_first_sample(1, 0.04)
+        summary = self.pool.summary()[1]
+        self.assertAlmostEqual(summary["first_sample_mean_ms"], 30.0)
+        self.assertAlmostEqual(summary["first_sample_max_ms"], 40.0)
+
+
+class BackoffTest(unittest.TestCase):
+    def test_backs_off_and_reopens_a_gauge_that_does_not_answer(self):
+        clock = ManualClock()
+        pool = Mag6000Pool(probe_interval=10.0, min_backoff=0.5, max_backoff=2.0, reopen_after=2, connect=DeadConnector, clock=clock)
+        pool.add([1])
+        delays = []
+        with contextlib.redirect_stdout(io.StringIO()):
+            for _ in range(5):
+                delays.append(pool.check())
+                clock.now += delays[-1]
+        # Doubled after each failure, up to the maximum
+        self.assertEqual(delays, [0.5, 1.0, 2.0, 2.0, 2.0])
+        summary = pool.summary()[1]
+        self.assertFalse(summary["warm"])
+        self.assertEqual((summary["failures"], summary["reopens"]), (5, 2))
+        connector = pool._connectors[1]
+        self.assertEqual(connector.bus.reopens, 2)
+        pool.close()
+        self.assertTrue(connector.closed)
+
+    def test_missing_adapter_is_a_failed_probe(self):
+        clock = ManualClock()
+        pool = Mag6000Pool(probe_interval=10.0, min_backoff=0.5, max_backoff=2.0, clock=clock)
+        pool.add([1])
+        with mock.patch.dict(os.environ, {"FLOW_GAUGE_PORT": "/dev/does-not-exist"}), contextlib.redirect_stdout(io.StringIO()):
+            # The port is tried once per probe, the pool backs off by itself
+            self.assertFalse(pool.probe(1))
+            self.assertEqual(pool.check(), 0.5)
+            clock.now += 0.5
+            self.assertEqual(pool.check(), 1.0)
+            with self.assertRaises(serial.SerialException):
+                with pool.lease(1):
+                    pass
+        summary = pool.summary()[1]
+        self.assertEqual((summary["warm"], summary["failures"]), (False, 2))
+        self.assertEqual(pool._connectors, {})
+        pool.close()
+
+    def test_validates_the_delays(self):
+        with self.assertRaises(ValueError):
+            Mag6000Pool(min_backoff=5.0, max_backoff=1.0)
+
+    def test_open_gives_up_after_the_attempts(self):
+        sleeps = []
+        bus = Rs485Bus("/dev/does-not-exist", sleep=sleeps.append)
+        with contextlib.redirect_stdout(io.StringIO()):
+            with self.assertRaises(serial.SerialException):
+                bus.open(attempts=7)
+        self.assertEqual(sleeps[0], OPEN_BACKOFF)
+        self.assertEqual(sleeps[1], 2 * OPEN_BACKOFF)
+        self.assertEqual(max(sleeps), MAX_OPEN_BACKOFF)
+        self.assertEqual(len(sleeps), 6)
+        self.assertIsNone(bus.serial)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+import struct
+import unittest
+
+# The rig installs the fake GPIO module, so it must be imported before the device code
+from simulation.rig import SimulatedRig
+
+from devices.mag6000.mag6000_connector import Mag6000Connector
+from devices.mag6000.mag6000_reader import MODBUS_SECONDS, Mag6000Reader
+from devices.mag6000.mag6000_registers import SNAPSHOT_BLOCK, RegisterBlock, RegisterField
+
+
+class RegisterBlockTest(unittest.TestCase):
+    def test_snapshot_block_covers_3002_to_3017(self):
+        self.assertEqual(SNAPSHOT_BLOCK.start, 3002)
+        self.assertEqual(SNAPSHOT_BLOCK.count, 16)
+
+    def test_decode(self):
+        raw = bytearray(32)
+        struct.pack_into(">f", raw, 0, 0.0001)
+        struct.pack_into(">d", raw, 24, 123.456)
+        flow, total = SNAPSHOT_BLOCK.decode(list(struct.unpack(">16H", raw)))
+        self.assertAlmostEqual(flow, 360.0, places=3)
+        self.assertEqual(total, 123.456)
+
+    def test_overlapping_fields(self):
+        with self.assertRaises(ValueError):
+            RegisterBlock((RegisterField("a", 10, "d"), RegisterField("b", 12, "f")))
+
+
+class SnapshotReadTest(unittest.TestCase):
+    def setUp(self):
+        self.rig = SimulatedRig()
+        self.rig.start()
+        self.rig.pump.set_running(True)
+        self.rig.pump.step(10.0)
+
+    def tearDown(self):
+        self.rig.stop()
+
+    def test_single_transaction(self):
+        with Mag6000Connector() as connector:
+            reader = Mag6000Reader(connector)
+            transactions = self.rig.bus.transactions
+            snapshot = reader.read_snapshot()
+            self.assertEqual(self.rig.bus.transactions - transactions, 1)
+        self.assertAlmostEqual(snapshot.flow_rate_lph, self.rig.pump.max_flow_lph, delta=1.0)
+        self.assertGreater(snapshot.totalizer_liters, 0.0)
+
+    def test_transaction_time_by_registers(self):
+        block = MODBUS_SECONDS.labels("3002-3017")
+        count = block.count
+        with Mag6000Connector() as connector:
+            Mag6000Reader(connector).read_snapshot()
+        self.assertEqual(block.count - count, 1)
+        self.assertGreater(block.max, 0.0)
+
+    def test_fallback_when_block_reads_are_refused(self):
+        # Refuse any read that includes the registers between the fields
+        original = self.rig.meter.read_registers
+        self.rig.meter.read_registers = lambda start, count: None if count > 4 else original(start, count)
+        with Mag6000Connector() as connector:
+            reader = Mag6000Reader(connector)
+            snapshot = reader.read_snapshot()
+            self.assertFalse(reader.block_reads_supported)
+        self.assertAlmostEqual(snapshot.flow_rate_lph, self.rig.pump.max_flow_lph, delta=1.0)
+        self.assertGreater(snapshot.totalizer_liters, 0.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
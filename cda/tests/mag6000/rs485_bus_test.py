@@ -0,0 +1,98 @@
+import threading
+import time
+import unittest
+
+from devices.mag6000.rs485_bus import PRIORITY_CONTROL, PRIORITY_DIAGNOSTIC, Rs485Bus, interframe_seconds
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class Rs485BusTest(unittest.TestCase):
+    def test_interframe_seconds(self):
+        self.assertAlmostEqual(interframe_seconds(19200), 3.5 * 11 / 19200)
+        self.assertAlmostEqual(interframe_seconds(9600), 2 * interframe_seconds(19200))
+        self.assertEqual(interframe_seconds(115200), 0.00175)
+
+    def test_keeps_the_line_silent_between_frames(self):
+        clock = FakeClock()
+        bus = Rs485Bus("/dev/null", baudrate=19200, clock=clock, sleep=clock.sleep)
+        with bus.transaction(1):
+            clock.now += 0.010
+        # The next frame right after waits for the interframe time
+        with bus.transaction(2):
+            pass
+        self.assertEqual(len(clock.sleeps), 1)
+        self.assertAlmostEqual(clock.sleeps[0], bus.interframe_seconds)
+        # Once the line has been silent long enough, there is no wait
+        clock.now += 1.0
+        with bus.transaction(1):
+            pass
+        self.assertEqual(len(clock.sleeps), 1)
+
+    def test_control_reads_go_first(self):
+        bus = Rs485Bus("/dev/null")
+        order = []
+        holding = threading.Event()
+        release = threading.Event()
+
+        def hold():
+            with bus.transaction(1):
+                holding.set()
+                release.wait(5)
+
+        def read(address, priority):
+            with bus.transaction(address, priority):
+                order.append(address)
+
+        holder = threading.Thread(target=hold)
+        holder.start()
+        holding.wait(5)
+        # Queue two diagnostic reads, then a control read, while the bus is held
+        readers = []
+        for address, priority in ((2, PRIORITY_DIAGNOSTIC), (3, PRIORITY_DIAGNOSTIC), (4, PRIORITY_CONTROL)):
+            reader = threading.Thread(target=read, args=(address, priority))
+            reader.start()
+            readers.append(reader)
+            # Let the reader queue before the next one
+            deadline = time.monotonic() + 5
+            while len(bus._waiting) < len(readers) and time.monotonic() < deadline:
+                time.sleep(0.001)
+        release.set()
+        for thread in [holder, *readers]:
+            thread.join(5)
+        # The control read first, then the diagnostic reads in the order they arrived
+        self.assertEqual(order, [4, 2, 3])
+
+    def test_stats_per_slave(self):
+        clock = FakeClock()
+        bus = Rs485Bus("/dev/null", clock=clock, sleep=clock.sleep)
+        for _ in range(3):
+            with bus.transaction(1):
+                clock.now += 0.020
+            clock.now += 1.0
+        with self.assertRaises(OSError):
+            with bus.transaction(2):
+                clock.now += 0.050
+                raise OSError("timeout")
+        summary = bus.summary()
+        self.assertEqual(summary[1]["transactions"], 3)
+        self.assertAlmostEqual(summary[1]["mean_latency_ms"], 20.0)
+        self.assertEqual(summary[1]["errors"], 0)
+        self.assertEqual(summary[2]["errors"], 1)
+        self.assertAlmostEqual(summary[2]["max_latency_ms"], 50.0)
+        self.assertEqual(bus.stats(3).transactions, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
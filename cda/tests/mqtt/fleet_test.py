@@ -0,0 +1,88 @@
+import json
+import os
+import time
+import unittest
+import uuid
+
+from mqtt.mqtt_watcher import REQUEST_TOPIC
+from mqtt.order_admission import ACK_TOPIC
+from simulation.fake_broker import FakeBroker
+from simulation.fake_mqtt import FakeMqttConnector
+from simulation.fleet import SimulatedDevice
+from simulation.plant import wait_for
+
+
+def order(lot_number, line=1):
+    return json.dumps({"liters": 1.0, "temperature": 40.0, "line": line, "lot_number": lot_number})
+
+
+class FleetTest(unittest.TestCase):
+    def setUp(self):
+        self.broker = FakeBroker().start()
+        self.connectors = [FakeMqttConnector(self.broker) for _ in range(3)]
+        self.devices = [SimulatedDevice(connector, f"pi-{i}", lot_seconds=0.2).start() for i, connector in enumerate(self.connectors)]
+        self.sender = FakeMqttConnector(self.broker)
+
+    def tearDown(self):
+        for device in self.devices:
+            device.stop()
+        self.broker.stop()
+
+    def lots(self):
+        return [lot for device in self.devices for lot in device.lots]
+
+    def test_each_order_runs_once_on_an_available_device(self):
+        lots = [f"L{i}" for i in range(6)]
+        for lot in lots:
+            self.sender.publish(REQUEST_TOPIC, order(lot))
+        self.assertTrue(wait_for(lambda: len(self.lots()) == len(lots)))
+        time.sleep(0.1)
+        ran = self.lots()
+        self.assertEqual(sorted(lot for _, lot, _, _ in ran), lots)
+        # Three devices with one line each run the six lots in two rounds
+        self.assertEqual({name for name, _, _, _ in ran}, {"pi-0", "pi-1", "pi-2"})
+        self.assertLess(max(end for _, _, _, end in ran) - min(start for _, _, start, _ in ran), 0.6)
+        accepted = [json.loads(payload) for connector in self.connectors for payload in connector.messages(ACK_TOPIC)]
+        self.assertEqual(sorted(ack["lot_number"] for ack in accepted if ack["status"] == "accepted"), lots)
+
+    def test_stop_reaches_the_device_running_the_lot(self):
+        self.sender.publish(REQUEST_TOPIC, order("A"))
+        self.assertTrue(wait_for(lambda: any(len(device.stop_router) for device in self.devices)))
+        started = time.monotonic()
+        # The controller app sends stop requests on the shared order topic
+        self.sender.publish(REQUEST_TOPIC, json.dumps({"lot_number": "A"}))
+        self.assertTrue(wait_for(lambda: len(self.lots()) == 1))
+        self.assertLess(time.monotonic() - started, 0.15)
+
+
+@unittest.skipUnless(os.getenv("MQTT_TEST_BROKER"), "set MQTT_TEST_BROKER=host:port of a local mosquitto")
+class MosquittoFleetTest(unittest.TestCase):
+    def connector(self):
+        from mqtt.mqtt_connector import mqtt_connector
+        host, _, port = os.environ["MQTT_TEST_BROKER"].partition(":")
+        connector = mqtt_connector(host, mode="tcp", port=int(port or 1883))
+        connector.connect()
+        self.addCleanup(connector.disconnect)
+        return connector
+
+    def test_each_order_runs_once(self):
+        # A group of its own, so other runs on the same broker do not take orders
+        group = f"cda-test-{uuid.uuid4().hex[:8]}"
+        devices = [SimulatedDevice(self.connector(), f"pi-{i}", share_group=group, lot_seconds=0.2).start() for i in range(3)]
+        for device in devices:
+            self.addCleanup(device.stop)
+        sender = self.connector()
+        # Let the subscriptions reach the broker
+        time.sleep(0.5)
+        lots = [f"{group}-{i}" for i in range(9)]
+        for lot in lots:
+            sender.publish(REQUEST_TOPIC, order(lot), qos=1, retain=False)
+        ran = lambda: [lot for device in devices for _, lot, _, _ in device.lots]
+        self.assertTrue(wait_for(lambda: len(ran()) >= len(lots), timeout=20))
+        time.sleep(0.5)
+        self.assertEqual(sorted(ran()), sorted(lots))
+        self.assertTrue(all(device.lots for device in devices))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+import json
+import time
+import unittest
+import urllib.error
+import urllib.request
+
+from functions.metrics import MetricsRegistry
+from functions.metrics_endpoint import MetricsEndpoint
+from mqtt.metrics_publisher import MetricsPublisher
+from simulation.fake_mqtt import FakeMqttConnector
+
+
+class MetricsPublisherTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = MetricsRegistry()
+        self.registry.histogram("cda_modbus_transaction_seconds", "Modbus", ("registers",)).labels("3002-3017").observe(0.012)
+        self.mqtt = FakeMqttConnector()
+
+    def test_publishes_on_the_device_topic(self):
+        MetricsPublisher(self.mqtt, "pi", self.registry).publish_now()
+        (payload,) = self.mqtt.messages("devices/pi/metrics")
+        message = json.loads(payload)
+        self.assertEqual(message["device"], "pi")
+        (modbus,) = message["metrics"]["cda_modbus_transaction_seconds"]
+        self.assertEqual((modbus["labels"], modbus["count"]), ({"registers": "3002-3017"}, 1))
+
+    def test_publishes_periodically_and_once_more_when_stopped(self):
+        publisher = MetricsPublisher(self.mqtt, "pi", self.registry, interval=0.05).start()
+        published = lambda: len(self.mqtt.messages("devices/pi/metrics"))
+        deadline = time.monotonic() + 5
+        while published() < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        publisher.stop()
+        count = published()
+        self.assertGreaterEqual(count, 3)
+        time.sleep(0.1)
+        self.assertEqual(published(), count)
+
+    def test_validates_the_interval(self):
+        with self.assertRaises(ValueError):
+            MetricsPublisher(self.mqtt, "pi", self.registry, interval=0)
+
+
+class MetricsEndpointTest(unittest.TestCase):
+    def test_serves_prometheus_text(self):
+        registry = MetricsRegistry()
+        registry.counter("cda_lots_total", "Lots", ("result",)).labels("completed").inc()
+        endpoint = MetricsEndpoint(registry, port=0).start()
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{endpoint.port}/metrics", timeout=5) as response:
+                self.assertTrue(response.headers["Content-Type"].startswith("text/plain; version=0.0.4"))
+                self.assertIn('cda_lots_total{result="completed"} 1.0', response.read().decode())
+            with self.assertRaises(urllib.error.HTTPError):
+                urllib.request.urlopen(f"http://127.0.0.1:{endpoint.port}/other", timeout=5)
+        finally:
+            endpoint.stop()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+import warnings
+
+import paho.mqtt.client as mqtt
+
+from mqtt.mqtt_connector import INFLIGHT_MESSAGES, PUBLISH_ACK_SECONDS, mqtt_connector
+
+
+def connector(**options):
+    # paho warns about the version 1 callbacks, which the connector keeps for paho 1.x
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", DeprecationWarning)
+        return mqtt_connector("broker.example", **options)
+
+
+class TransportModeTest(unittest.TestCase):
+    def test_default_is_websockets_over_tls(self):
+        client = connector()
+        self.assertEqual((client._port, client._path, client._tls), (443, "/", True))
+        self.assertEqual(client._client._transport, "websockets")
+
+    def test_modes(self):
+        self.assertEqual((connector(mode="tls")._port, connector(mode="tls")._path), (8883, None))
+        plain = connector(mode="tcp", port=1884)
+        self.assertEqual((plain._port, plain._tls, plain._client._transport), (1884, False, "tcp"))
+        with self.assertRaises(ValueError):
+            connector(mode="udp")
+        with self.assertRaises(ValueError):
+            connector(protocol="4")
+
+    def test_session_and_window(self):
+        client = connector(mode="tcp", protocol="5", client_id="cda-1", persistent_session=True, max_inflight=100, max_queued=500)
+        self.assertEqual(client._client._protocol, mqtt.MQTTv5)
+        self.assertEqual(client._client._max_inflight_messages, 100)
+        self.assertEqual(client._client._max_queued_messages, 500)
+        # The broker finds a persistent session by its client id
+        with self.assertRaises(ValueError):
+            connector(persistent_session=True)
+
+    def test_handlers_take_both_protocol_signatures(self):
+        client = connector()
+        client._on_connect(None, None, {"session present": 1}, 0)
+        client._on_connect(None, None, {"session present": 0}, 0, None)
+        self.assertTrue(client._connected_event.is_set())
+        client._on_disconnect(None, None, 0, None)
+        self.assertFalse(client._connected_event.is_set())
+
+    def test_times_publishes_until_acknowledged(self):
+        client = connector(mode="tcp")
+        acks = PUBLISH_ACK_SECONDS.labels(1)
+        count = acks.count
+        # Not connected, so paho keeps the message to send after connecting
+        info = client.publish("t", "x", qos=1)
+        self.assertEqual(INFLIGHT_MESSAGES.labels().value, 1)
+        client._on_publish(None, None, info.mid)
+        self.assertEqual((acks.count - count, INFLIGHT_MESSAGES.labels().value), (1, 0))
+        # paho may acknowledge a message before publish() has returned its id
+        client._on_publish(None, None, info.mid + 1)
+        client.publish("t", "y", qos=1)
+        self.assertEqual((acks.count - count, INFLIGHT_MESSAGES.labels().value), (2, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+import threading
+import unittest
+
+from mqtt.device_status import DeviceStatusPublisher
+from mqtt.mqtt_process import RING_DROPPED, MqttProcess
+from simulation.fake_mqtt import loopback_connector
+
+
+class MqttProcessTest(unittest.TestCase):
+    def setUp(self):
+        # The network process publishes to a broker of its own, which delivers the messages back
+        self.mqtt = MqttProcess("broker.example", ring_bytes=4096, connector_factory=loopback_connector)
+        self.addCleanup(self.mqtt.disconnect)
+        self.received = []
+        self.done = threading.Event()
+
+    def collect(self, count):
+        def on_message(client, userdata, msg):
+            self.received.append(msg)
+            if len(self.received) == count:
+                self.done.set()
+        return on_message
+
+    def test_connects_and_relays_messages_both_ways(self):
+        connected = threading.Event()
+        self.mqtt.register_on_connect(connected.set)
+        self.mqtt.register_callback("request/+", self.collect(50))
+        self.mqtt.connect()
+        self.assertTrue(connected.is_set())
+        self.mqtt.subscribe("request/process")
+        for index in range(50):
+            self.mqtt.publish("request/process", f'{{"lot_number": {index}}}', qos=1, retain=False)
+        self.assertTrue(self.done.wait(5))
+        self.assertEqual([msg.payload for msg in self.received], [f'{{"lot_number": {index}}}'.encode() for index in range(50)])
+        self.assertEqual((self.received[0].topic, self.received[0].qos, self.received[0].retain), ("request/process", 1, False))
+
+    def test_flush_publishes_what_is_in_the_ring(self):
+        self.mqtt.register_callback("#", self.collect(3))
+        self.mqtt.connect()
+        self.mqtt.subscribe("#")
+        # The status publisher sets its Last Will through the client, as with a real connector
+        DeviceStatusPublisher(self.mqtt, "device-1").configure_lwt()
+        for payload in (b"\x00\x01", "text", b""):
+            self.mqtt.publish("sensor/flow_gauge/progress", payload)
+        self.mqtt.flush_outbox()
+        self.assertTrue(self.done.wait(5))
+        self.assertEqual([msg.payload for msg in self.received], [b"\x00\x01", b"text", b""])
+        self.assertEqual(self.mqtt.stats()["records"], 3)
+
+    def test_flush_publishes_the_record_taken_first(self):
+        mqtt = MqttProcess("broker.example", ring_bytes=4096, connector_factory=loopback_connector, subscribe_delay=0.5)
+        self.addCleanup(mqtt.disconnect)
+        mqtt.register_callback("#", self.collect(20))
+        # The network process is busy subscribing while the messages and the flush arrive, so it takes
+        # the first message from the ring and finds the flush before it has published it
+        mqtt.subscribe("#")
+        for index in range(20):
+            mqtt.publish("sensor/flow_gauge/progress", str(index))
+        mqtt.flush_outbox()
+        self.assertTrue(self.done.wait(5))
+        self.assertEqual([msg.payload for msg in self.received], [str(index).encode() for index in range(20)])
+
+    def test_a_full_ring_drops_instead_of_blocking(self):
+        dropped = RING_DROPPED.labels().value
+        # Not connected and never read while the payload is larger than the ring
+        self.mqtt.publish("sensor/flow_gauge/progress", b"x" * 5000)
+        self.assertEqual((RING_DROPPED.labels().value - dropped, self.mqtt.stats()["dropped"]), (1, 1))
+
+    def test_disconnect_ends_the_network_process(self):
+        self.mqtt.connect()
+        self.mqtt.disconnect()
+        self.assertEqual(self.mqtt._process.exitcode, 0)
+        self.assertFalse(self.mqtt._receiver.is_alive())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+import json
+import unittest
+
+from mqtt.mqtt_watcher import REQUEST_TOPIC, mqtt_watcher
+from mqtt.order_admission import ACK_TOPIC, DEFAULT_PRIORITY, OrderAdmission
+from mqtt.stop_router import StopRouter
+from simulation.fake_mqtt import FakeMqttConnector
+
+
+def order(lot_number, **fields):
+    return {"liters": 1.0, "temperature": 40.0, "line": 1, "lot_number": lot_number, **fields}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class OrderAdmissionTest(unittest.TestCase):
+    def setUp(self):
+        self.connector = FakeMqttConnector()
+        self.clock = FakeClock()
+        self.backlog = 0
+        self.admission = OrderAdmission(self.connector, max_pending=2, dedup_seconds=60.0, backlog=lambda: self.backlog, clock=self.clock)
+
+    def acks(self):
+        return [json.loads(payload) for payload in self.connector.messages(ACK_TOPIC)]
+
+    def test_duplicates_are_rejected_until_forgotten(self):
+        self.assertTrue(self.admission.admit(order("A")).accepted)
+        self.assertEqual(self.admission.admit(order("A")).reason, "duplicate")
+        self.clock.now = 61.0
+        self.assertTrue(self.admission.admit(order("A")).accepted)
+        self.assertEqual(len(self.admission), 1)
+        self.assertEqual(
+            self.acks(),
+            [
+                {"lot_number": "A", "line": 1, "status": "accepted"},
+                {"lot_number": "A", "line": 1, "status": "rejected", "reason": "duplicate"},
+                {"lot_number": "A", "line": 1, "status": "accepted"},
+            ],
+        )
+
+    def test_redelivered_order_does_not_stop_the_running_lot(self):
+        watcher = mqtt_watcher(self.connector, self.admission)
+        router = StopRouter(self.connector)
+        self.connector.deliver(REQUEST_TOPIC, json.dumps(order("A")))
+        self.assertEqual(watcher.wait_for_order()["lot_number"], "A")
+        stopped = router.watch("A")
+        # A QoS 1 redelivery of the order while the lot runs
+        self.connector.deliver(REQUEST_TOPIC, json.dumps(order("A")))
+        self.assertFalse(stopped.is_set())
+        self.assertEqual(self.acks()[-1]["reason"], "duplicate")
+        # A stop request on the same topic still stops it
+        self.connector.deliver(REQUEST_TOPIC, json.dumps({"lot_number": "A"}))
+        self.assertTrue(stopped.is_set())
+
+    def test_full_backlog_rejects_without_remembering(self):
+        self.backlog = 1
+        self.assertEqual(self.admission.admit(order("A"), queued=1).reason, "queue full")
+        # The sender can send the same lot again once there is room
+        self.backlog = 0
+        self.assertTrue(self.admission.admit(order("A"), queued=1).accepted)
+        self.assertEqual((self.admission.accepted, self.admission.rejected), (1, 1))
+
+    def test_retained_and_invalid_orders(self):
+        self.assertEqual(self.admission.admit(order("A"), retained=True).reason, "retained")
+        for priority in (-1, 10, "high", True, 2.5):
+            with self.subTest(priority=priority):
+                self.assertEqual(self.admission.admit(order("B", priority=priority)).reason, "invalid priority")
+        self.assertEqual(self.admission.admit(order(None)).reason, "missing lot_number")
+
+        accepted = order("C")
+        self.assertTrue(self.admission.admit(accepted).accepted)
+        self.assertEqual(accepted["priority"], DEFAULT_PRIORITY)
+        self.assertEqual(self.admission.admit(order("D", priority=0)).priority, 0)
+
+    def test_unknown_line(self):
+        admission = OrderAdmission(self.connector, has_line=lambda order: order["line"] == 1)
+        self.assertEqual(admission.admit(order("A", line=3)).reason, "unknown line")
+        self.assertTrue(admission.admit(order("A")).accepted)
+
+
+class WatcherAdmissionTest(unittest.TestCase):
+    def test_burst_and_redelivery_are_bounded(self):
+        connector = FakeMqttConnector()
+        watcher = mqtt_watcher(connector, OrderAdmission(connector, max_pending=3))
+        # A reconnect storm redelivers the same orders, and the retained one
+        connector.deliver(REQUEST_TOPIC, json.dumps(order("OLD")), retain=True)
+        for _ in range(3):
+            for lot in "ABCDE":
+                connector.deliver(REQUEST_TOPIC, json.dumps(order(lot)))
+        # Stop requests on the same topic are not orders, and are not acknowledged
+        connector.deliver(REQUEST_TOPIC, json.dumps({"lot_number": "A"}))
+
+        self.assertEqual([watcher.wait_for_order()["lot_number"] for _ in range(3)], ["A", "B", "C"])
+        self.assertTrue(watcher._orders.empty())
+        statuses = [json.loads(payload)["status"] for payload in connector.messages(ACK_TOPIC)]
+        self.assertEqual(len(statuses), 16)
+        self.assertEqual(statuses.count("accepted"), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,176 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+
+from mqtt.outbox import MessageOutbox, OutboxForwarder
+from simulation.plant import wait_for
+
+
+class FakeBroker:
+    """Records sent messages, and acknowledges them when told to."""
+
+    def __init__(self) -> None:
+        self.sent: list[tuple[int, str, bytes]] = []
+        self.accepting = True
+        self.forwarder: OutboxForwarder | None = None
+        self.auto_ack = False
+        self._next_mid = 0
+        self._lock = threading.Lock()
+
+    def send(self, topic, payload, qos, retain):
+        if not self.accepting:
+            return None
+        with self._lock:
+            self._next_mid += 1
+            mid = self._next_mid
+            self.sent.append((mid, topic, payload))
+        if self.auto_ack:
+            self.forwarder.on_publish(mid)
+        return mid
+
+    def ack_all(self) -> None:
+        for mid, _, _ in list(self.sent):
+            self.forwarder.on_publish(mid)
+
+
+class MessageOutboxTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "outbox.db")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_survives_restart(self):
+        outbox = MessageOutbox(self.path)
+        for i in range(5):
+            outbox.append("sensor/flow_gauge/progress", f'{{"liters": {i}}}')
+        outbox.remove([1, 2])
+        outbox.close()
+
+        reopened = MessageOutbox(self.path)
+        rows = reopened.peek()
+        self.assertEqual([payload for _, _, payload, _, _ in rows], [b'{"liters": 2}', b'{"liters": 3}', b'{"liters": 4}'])
+        self.assertEqual(reopened.depth, 3)
+        reopened.close()
+
+    def test_commits_are_batched(self):
+        now = [0.0]
+        outbox = MessageOutbox(self.path, sync_batch=10, sync_interval=1.0, clock=lambda: now[0])
+        for _ in range(25):
+            outbox.append("topic", b"x")
+            # As the forwarder does after each message
+            outbox.sync(force=False)
+        self.assertEqual(outbox.syncs, 2)
+        # The last five are committed once they are older than the interval
+        now[0] = 1.5
+        outbox.sync(force=False)
+        self.assertEqual(outbox.syncs, 3)
+        outbox.close()
+
+    def test_append_leaves_the_commit_to_sync(self):
+        outbox = MessageOutbox(self.path, sync_batch=10)
+        for i in range(25):
+            outbox.append("topic", str(i))
+        self.assertEqual(outbox.syncs, 0)
+        self.assertTrue(outbox.sync_due())
+        # Another connection only sees the messages once they are committed
+        reader = sqlite3.connect(self.path)
+        self.addCleanup(reader.close)
+        self.assertEqual(reader.execute("SELECT COUNT(*) FROM outbox").fetchone()[0], 0)
+        outbox.sync(force=False)
+        self.assertEqual(reader.execute("SELECT COUNT(*) FROM outbox").fetchone()[0], 25)
+        self.assertEqual(outbox.syncs, 1)
+        outbox.close()
+
+    def test_append_and_remove_do_not_wait_for_a_commit(self):
+        outbox = MessageOutbox(self.path)
+        outbox.append("topic", b"x")
+        done = threading.Event()
+
+        def publish():
+            outbox.append("topic", b"y")
+            outbox.remove([1])
+            done.set()
+
+        # Stands in for a slow commit of the forwarder thread
+        with outbox._db_lock:
+            threading.Thread(target=publish).start()
+            self.assertTrue(done.wait(1))
+        self.assertEqual([payload for _, _, payload, _, _ in outbox.peek()], [b"y"])
+        outbox.close()
+
+    def test_bounded_size_drops_oldest(self):
+        outbox = MessageOutbox(self.path, max_bytes=100)
+        for i in range(20):
+            outbox.append("t", b"%09d" % i)
+        self.assertLessEqual(outbox.size_bytes, 100)
+        self.assertEqual(outbox.depth, 10)
+        self.assertEqual(outbox.dropped, 10)
+        self.assertEqual(outbox.peek(limit=1)[0][2], b"000000010")
+        outbox.close()
+
+
+class OutboxForwarderTest(unittest.TestCase):
+    def setUp(self):
+        self.outbox = MessageOutbox(":memory:", sync_interval=0.05)
+        self.broker = FakeBroker()
+        self.forwarder = OutboxForwarder(self.outbox, self.broker.send, window=4)
+        self.broker.forwarder = self.forwarder
+        self.forwarder.start()
+
+    def tearDown(self):
+        self.forwarder.stop()
+        self.outbox.close()
+
+    def append(self, count, start=0):
+        for i in range(start, start + count):
+            self.outbox.append("topic", str(i))
+            self.forwarder.notify()
+
+    def test_stores_while_disconnected_and_replays_in_order(self):
+        self.append(10)
+        time.sleep(0.05)
+        self.assertEqual(self.broker.sent, [])
+
+        self.broker.auto_ack = True
+        self.forwarder.on_connect()
+        self.assertTrue(wait_for(lambda: self.outbox.depth == 0))
+        self.assertEqual([payload for _, _, payload in self.broker.sent], [str(i).encode() for i in range(10)])
+        self.assertTrue(wait_for(lambda: self.forwarder.replayed == 10))
+
+    def test_forwarder_commits_while_disconnected(self):
+        self.append(10)
+        # Stored messages are committed by the forwarder thread once they are older than the interval
+        self.assertTrue(wait_for(lambda: self.outbox.syncs >= 1))
+        self.assertFalse(self.outbox.sync_due())
+
+    def test_window_limits_messages_in_flight(self):
+        self.forwarder.on_connect()
+        self.append(10)
+        self.assertTrue(wait_for(lambda: len(self.broker.sent) == 4))
+        time.sleep(0.05)
+        self.assertEqual(len(self.broker.sent), 4)
+
+        # Each acknowledgement lets the next messages through
+        self.broker.ack_all()
+        self.assertTrue(wait_for(lambda: len(self.broker.sent) == 8))
+
+    def test_unacknowledged_messages_are_resent_after_reconnect(self):
+        self.forwarder.on_connect()
+        self.append(3)
+        self.assertTrue(wait_for(lambda: len(self.broker.sent) == 3))
+        self.forwarder.on_disconnect()
+        self.append(2, start=3)
+
+        self.broker.auto_ack = True
+        self.forwarder.on_connect()
+        self.assertTrue(wait_for(lambda: self.outbox.depth == 0))
+        self.assertEqual([payload for _, _, payload in self.broker.sent[3:]], [b"0", b"1", b"2", b"3", b"4"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+import json
+import unittest
+
+from mqtt.mqtt_publisher import FLOW_PROGRESS_TOPIC, TEMP_PROGRESS_TOPIC, mqtt_publisher
+from mqtt.mqtt_watcher import REQUEST_TOPIC, mqtt_watcher
+from mqtt.payload_codec import JsonCodec, StructCodec, decode_payload
+from simulation.fake_mqtt import FakeMqttConnector
+
+CONSTANTS = {"lot_number": "LOT-7", "line": 2, "device": "pi"}
+
+
+class JsonCodecTest(unittest.TestCase):
+    def test_matches_json_dumps(self):
+        codec = JsonCodec(CONSTANTS)
+        for data in (
+            {"liters": 1.25},
+            {"temperature": 71.9375, "timestamp": 1700000000.123456},
+            {"liters": 3},
+            {"liters": float("nan")},
+            {"error": 'quote " and ünicode'},
+            {},
+        ):
+            self.assertEqual(codec.encode(dict(data)), json.dumps(data | CONSTANTS))
+
+    def test_batch(self):
+        codec = JsonCodec(CONSTANTS)
+        samples = [{"liters": 0.5}, {"liters": 1.0}]
+        self.assertEqual(codec.encode_batch(samples), json.dumps([sample | CONSTANTS for sample in samples]))
+
+
+class StructCodecTest(unittest.TestCase):
+    def test_round_trip(self):
+        codec = StructCodec(CONSTANTS)
+        payload = codec.encode({"liters": 1.25, "timestamp": 1700000000.5})
+        self.assertIsInstance(payload, bytes)
+        self.assertEqual(
+            decode_payload(payload),
+            {"liters": 1.25, "timestamp": 1700000000.5} | CONSTANTS,
+        )
+
+    def test_batch_round_trip(self):
+        codec = StructCodec(CONSTANTS)
+        samples = [{"temperature": 20.0 + i, "timestamp": 1700000000.0 + i} for i in range(3)]
+        decoded = decode_payload(codec.encode_batch(samples))
+        self.assertEqual([message["temperature"] for message in decoded], [20.0, 21.0, 22.0])
+        self.assertEqual([message["timestamp"] for message in decoded], [1700000000.0, 1700000001.0, 1700000002.0])
+
+    def test_smaller_than_json(self):
+        data = {"liters": 12.34, "timestamp": 1700000000.25}
+        self.assertLess(len(StructCodec(CONSTANTS).encode(data)), len(JsonCodec(CONSTANTS).encode(data)))
+
+    def test_rejects_text_fields(self):
+        with self.assertRaises(KeyError):
+            StructCodec(CONSTANTS).encode({"error": "failed"})
+
+
+class DecodePayloadTest(unittest.TestCase):
+    def test_json(self):
+        self.assertEqual(decode_payload(b'{"lot_number": "A"}'), {"lot_number": "A"})
+
+    def test_malformed(self):
+        for payload in (b"not json", b"P6\x01", b"\xff\xfe"):
+            with self.assertRaises(ValueError):
+                decode_payload(payload)
+
+
+class PublisherCodecTest(unittest.TestCase):
+    def test_default_is_json(self):
+        connector = FakeMqttConnector()
+        publisher = mqtt_publisher(connector, "LOT-7", 2, policies={})
+        publisher.publish_flow_progress(1.5)
+        self.assertEqual(connector.messages(FLOW_PROGRESS_TOPIC), [json.dumps({"liters": 1.5} | CONSTANTS)])
+
+    def test_binary_topic(self):
+        connector = FakeMqttConnector()
+        publisher = mqtt_publisher(connector, "LOT-7", 2, policies={}, codecs={FLOW_PROGRESS_TOPIC: StructCodec})
+        publisher.publish_flow_progress(1.5)
+        publisher.publish_temp_progress(30.0)
+
+        # Binary messages only appear on the sub-topic, JSON topics are unchanged
+        self.assertEqual(connector.messages(FLOW_PROGRESS_TOPIC), [])
+        (payload,) = connector.messages(FLOW_PROGRESS_TOPIC + StructCodec.topic_suffix)
+        message = decode_payload(payload)
+        self.assertEqual(message["liters"], 1.5)
+        self.assertEqual(message["lot_number"], "LOT-7")
+        self.assertIn("timestamp", message)
+        self.assertEqual(len(connector.messages(TEMP_PROGRESS_TOPIC)), 1)
+
+    def test_errors_are_json(self):
+        connector = FakeMqttConnector()
+        publisher = mqtt_publisher(connector, "LOT-7", 2, policies={}, codecs={FLOW_PROGRESS_TOPIC: StructCodec})
+        publisher.publish_error("interrupted")
+        (payload,) = connector.messages(FLOW_PROGRESS_TOPIC)
+        self.assertEqual(json.loads(payload)["error"], "interrupted")
+
+
+class WatcherDecodeTest(unittest.TestCase):
+    def test_binary_and_invalid_orders(self):
+        connector = FakeMqttConnector()
+        watcher = mqtt_watcher(connector)
+        connector.deliver(REQUEST_TOPIC, b"[1, 2]")
+        connector.deliver(REQUEST_TOPIC, b"\x00garbage")
+        connector.deliver(REQUEST_TOPIC, json.dumps({"liters": 1.0, "temperature": 40.0, "line": 1, "lot_number": "A"}))
+        self.assertEqual(watcher.wait_for_order()["lot_number"], "A")
+        self.assertTrue(watcher._orders.empty())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+import json
+import unittest
+
+from mqtt.mqtt_publisher import (
+    BATCH_TOPIC_SUFFIX,
+    FLOW_FINAL_TOPIC,
+    FLOW_PROGRESS_TOPIC,
+    TEMP_PROGRESS_TOPIC,
+    mqtt_publisher,
+)
+from mqtt.telemetry_policy import TelemetryPolicy, TelemetryThrottle
+from simulation.fake_mqtt import FakeMqttConnector
+
+
+class TelemetryThrottleTest(unittest.TestCase):
+    def offer_all(self, throttle, values, interval=0.1):
+        sent = []
+        for tick, value in enumerate(values):
+            samples = throttle.offer(value, {"value": value}, tick * interval)
+            if samples:
+                sent.append([sample["value"] for sample in samples])
+        return sent
+
+    def test_passthrough(self):
+        throttle = TelemetryThrottle(TelemetryPolicy())
+        self.assertEqual(self.offer_all(throttle, [1.0, 1.0, 2.0]), [[1.0], [1.0], [2.0]])
+
+    def test_deadband(self):
+        throttle = TelemetryThrottle(TelemetryPolicy(deadband=0.5))
+        self.assertEqual(self.offer_all(throttle, [1.0, 1.2, 1.4, 1.6, 1.7]), [[1.0], [1.6]])
+
+    def test_min_interval_sends_latest(self):
+        throttle = TelemetryThrottle(TelemetryPolicy(min_interval=0.25))
+        # Samples every 0.1 s, so only every third sample goes out
+        self.assertEqual(self.offer_all(throttle, [1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 7.0]), [[1.0], [4.0], [7.0]])
+
+    def test_max_interval_inside_deadband(self):
+        throttle = TelemetryThrottle(TelemetryPolicy(deadband=10.0, max_interval=0.5))
+        self.assertEqual(self.offer_all(throttle, [1.0] * 12), [[1.0], [1.0], [1.0]])
+
+    def test_batching(self):
+        throttle = TelemetryThrottle(TelemetryPolicy(batch_size=3))
+        sent = self.offer_all(throttle, [1.0, 2.0, 3.0, 4.0, 5.0])
+        self.assertEqual(sent, [[1.0], [2.0, 3.0, 4.0]])
+        self.assertEqual(throttle.flush(), [{"value": 5.0}])
+
+
+class PublisherPolicyTest(unittest.TestCase):
+    def test_final_flushes_held_progress(self):
+        connector = FakeMqttConnector()
+        publisher = mqtt_publisher(connector, "lot1", 1, {FLOW_PROGRESS_TOPIC: TelemetryPolicy(min_interval=60.0)})
+        publisher.publish_flow_progress(1.0)
+        publisher.publish_flow_progress(2.0)
+        publisher.publish_flow_final(2.5)
+        topics = [topic for _, topic, _, _, _ in connector.published]
+        self.assertEqual(topics, [FLOW_PROGRESS_TOPIC, FLOW_PROGRESS_TOPIC, FLOW_FINAL_TOPIC])
+        self.assertEqual(json.loads(connector.messages(FLOW_PROGRESS_TOPIC)[-1])["liters"], 2.0)
+
+    def test_error_is_sent_immediately(self):
+        connector = FakeMqttConnector()
+        publisher = mqtt_publisher(connector, "lot1", 1, {TEMP_PROGRESS_TOPIC: TelemetryPolicy(min_interval=60.0)})
+        publisher.publish_temp_progress(20.0)
+        publisher.publish_temp_progress(21.0)
+        publisher.publish_error("boom")
+        temps = [json.loads(payload) for payload in connector.messages(TEMP_PROGRESS_TOPIC)]
+        self.assertEqual([m.get("temperature", m.get("error")) for m in temps], [20.0, 21.0, "boom"])
+
+    def test_qos0_batches_for_telegraf(self):
+        connector = FakeMqttConnector()
+        policy = TelemetryPolicy(batch_size=2, qos=0, retain=False)
+        publisher = mqtt_publisher(connector, "lot1", 3, {FLOW_PROGRESS_TOPIC: policy})
+        for liters in (0.1, 0.2, 0.3):
+            publisher.publish_flow_progress(liters)
+        _, topic, payload, qos, retain = connector.published[-1]
+        self.assertEqual(topic, FLOW_PROGRESS_TOPIC + BATCH_TOPIC_SUFFIX)
+        self.assertEqual((qos, retain), (0, False))
+        batch = json.loads(payload)
+        self.assertEqual([sample["liters"] for sample in batch], [0.2, 0.3])
+        for sample in batch:
+            self.assertEqual((sample["lot_number"], sample["line"], sample["device"]), ("lot1", 3, "pi"))
+            self.assertIn("timestamp", sample)
+
+    def test_no_policies_publishes_everything(self):
+        connector = FakeMqttConnector()
+        publisher = mqtt_publisher(connector, "lot1", 1, {})
+        for liters in (0.1, 0.1, 0.1):
+            publisher.publish_flow_progress(liters)
+        self.assertEqual(len(connector.messages(FLOW_PROGRESS_TOPIC)), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+import json
+import unittest
+
+from mqtt.stop_router import REQUEST_TOPIC, STOP_TOPIC, StopRouter
+from mqtt.topic_dispatcher import TopicDispatcher, validate_filter
+from simulation.fake_mqtt import FakeMessage, FakeMqttConnector
+
+
+class TopicDispatcherTest(unittest.TestCase):
+    def matches(self, topic_filter, topic) -> bool:
+        dispatcher = TopicDispatcher()
+        dispatcher.add(topic_filter, print)
+        return bool(dispatcher.match(topic))
+
+    def test_wildcards(self):
+        cases = [
+            ("request/process", "request/process", True),
+            ("request/process", "request/process/stop", False),
+            ("sensor/+/progress", "sensor/flow_gauge/progress", True),
+            ("sensor/+/progress", "sensor/flow_gauge/final", False),
+            ("sensor/+/progress", "sensor/progress", False),
+            ("sensor/#", "sensor/flow_gauge/progress/batch", True),
+            ("sensor/#", "sensor", True),
+            ("sensor/#", "devices/1/status", False),
+            ("#", "devices/1/status", True),
+            ("+/+", "devices/1", True),
+            ("#", "$SYS/broker/load", False),
+            ("+/broker/load", "$SYS/broker/load", False),
+            ("$SYS/#", "$SYS/broker/load", True),
+        ]
+        for topic_filter, topic, expected in cases:
+            with self.subTest(topic_filter=topic_filter, topic=topic):
+                self.assertEqual(self.matches(topic_filter, topic), expected)
+
+    def test_invalid_filters(self):
+        for topic_filter in ("", "a/#/b", "a/b#", "a/+b"):
+            with self.assertRaises(ValueError):
+                validate_filter(topic_filter)
+
+    def test_unregister(self):
+        dispatcher = TopicDispatcher()
+        calls = []
+        first = dispatcher.add("a/+", lambda c, u, m: calls.append("first"))
+        dispatcher.add("a/b", lambda c, u, m: calls.append("second"))
+        self.assertEqual(dispatcher.dispatch(None, None, FakeMessage("a/b", b"")), 2)
+
+        self.assertTrue(dispatcher.remove(first))
+        self.assertFalse(dispatcher.remove(first))
+        dispatcher.dispatch(None, None, FakeMessage("a/b", b""))
+        self.assertEqual(calls, ["first", "second", "second"])
+        self.assertEqual(len(dispatcher), 1)
+
+    def test_removing_prunes_the_tree(self):
+        dispatcher = TopicDispatcher()
+        handles = [dispatcher.add(f"lot/{i}/stop", print) for i in range(100)]
+        handles.append(dispatcher.add("lot/#", print))
+        for handle in handles:
+            dispatcher.remove(handle)
+        self.assertTrue(dispatcher._root.is_empty())
+
+    def test_failing_callback_does_not_stop_others(self):
+        dispatcher = TopicDispatcher()
+        calls = []
+        dispatcher.add("a", lambda c, u, m: 1 / 0)
+        dispatcher.add("a", lambda c, u, m: calls.append(m.topic))
+        dispatcher.dispatch(None, None, FakeMessage("a", b""))
+        self.assertEqual(calls, ["a"])
+
+
+class StopRouterTest(unittest.TestCase):
+    def test_routes_stop_to_lot(self):
+        connector = FakeMqttConnector()
+        router = StopRouter(connector)
+        first = router.watch("LOT-1")
+        second = router.watch("LOT-2")
+
+        connector.deliver(STOP_TOPIC, json.dumps({"lot_number": "LOT-2"}))
+        self.assertFalse(first.is_set())
+        self.assertTrue(second.is_set())
+
+        # The app sends stop requests on the order topic
+        connector.deliver(REQUEST_TOPIC, json.dumps({"lot_number": "LOT-1"}))
+        self.assertTrue(first.is_set())
+
+    def test_on_stop_runs_before_the_event_is_set(self):
+        connector = FakeMqttConnector()
+        router = StopRouter(connector)
+        calls = []
+        event = router.watch("LOT-1", on_stop=lambda: calls.append(event.is_set()))
+        other = router.watch("LOT-2", on_stop=lambda: 1 / 0)
+
+        connector.deliver(STOP_TOPIC, json.dumps({"lot_number": "LOT-1"}))
+        self.assertEqual(calls, [False])
+        self.assertTrue(event.is_set())
+        # A failing handler does not keep the lot from stopping
+        router.stop_all()
+        self.assertTrue(other.is_set())
+        self.assertEqual(calls, [False, True])
+
+    def test_released_lots_are_forgotten(self):
+        connector = FakeMqttConnector()
+        router = StopRouter(connector)
+        for i in range(1000):
+            router.watch(f"LOT-{i}")
+            router.release(f"LOT-{i}")
+        self.assertEqual(len(router), 0)
+        self.assertEqual(len(connector._dispatcher), 2)
+
+        router.close()
+        self.assertEqual(len(connector._dispatcher), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
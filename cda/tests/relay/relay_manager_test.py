@@ -0,0 +1,110 @@
+import unittest
+
+from simulation import fake_gpio
+
+# Install the fake GPIO module before the relay manager is imported
+fake_gpio.install()
+
+from devices.relay.relay_controller import RelayController  # noqa: E402
+from devices.relay.relay_manager import RelayManager  # noqa: E402
+
+
+class ManualClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class RelayManagerTest(unittest.TestCase):
+    def setUp(self):
+        fake_gpio.reset()
+        self.clock = ManualClock()
+        self.relays = RelayManager(clock=self.clock)
+
+    def tearDown(self):
+        self.relays.release()
+        fake_gpio.reset()
+
+    def test_sets_up_once_and_skips_redundant_writes(self):
+        self.relays.setup([5, 6])
+        self.relays.setup([5, 6])
+        self.assertEqual((fake_gpio.call_counts["setmode"], fake_gpio.call_counts["setup"]), (1, 2))
+        self.relays.set(5, True)
+        self.relays.set(5, True)
+        self.relays.set(6, False)
+        self.assertEqual(fake_gpio.call_counts["output"], 1)
+        self.assertEqual(fake_gpio.level(5), fake_gpio.HIGH)
+        stats = self.relays.summary()
+        self.assertEqual((stats[5]["switches_on"], stats[5]["skipped"], stats[6]["skipped"]), (1, 1, 1))
+
+    def test_switching_off_leaves_other_pins_alone(self):
+        self.relays.set_many([5, 6], True)
+        self.relays.set(5, False)
+        self.assertEqual((fake_gpio.level(5), fake_gpio.level(6)), (fake_gpio.LOW, fake_gpio.HIGH))
+        self.assertEqual(fake_gpio.call_counts["cleanup"], 0)
+
+    def test_all_off_in_one_write(self):
+        self.relays.set_many([5, 6, 7], True)
+        seen = []
+        # Each listener sees the other pins already switched, as the write happens under the lock
+        fake_gpio.add_listener(5, lambda pin, level: seen.append((fake_gpio.level(6), fake_gpio.level(7))))
+        outputs = fake_gpio.call_counts["output"]
+        self.relays.all_off()
+        self.assertEqual(fake_gpio.call_counts["output"] - outputs, 1)
+        self.assertEqual([fake_gpio.level(pin) for pin in (5, 6, 7)], [fake_gpio.LOW] * 3)
+        self.assertEqual(len(seen), 1)
+
+    def test_on_time(self):
+        self.relays.set(5, True)
+        self.clock.now = 2.5
+        self.assertAlmostEqual(self.relays.summary()[5]["on_seconds"], 2.5)
+        self.relays.set(5, False)
+        self.clock.now = 10.0
+        self.relays.set(5, True)
+        self.clock.now = 11.0
+        self.relays.set(5, False)
+        summary = self.relays.summary()[5]
+        self.assertAlmostEqual(summary["on_seconds"], 3.5)
+        self.assertEqual((summary["switches_on"], summary["switches_off"]), (2, 2))
+
+    def test_emergency_off_holds_the_pins_off(self):
+        self.relays.set_many([5, 6], True)
+        self.relays.emergency_off([5, 8])
+        self.assertEqual((fake_gpio.level(5), fake_gpio.level(6)), (fake_gpio.LOW, fake_gpio.HIGH))
+        # A pin held off keeps the others of the same write off too
+        self.assertFalse(self.relays.set_many([5, 7], True))
+        self.assertEqual(fake_gpio.level(7), fake_gpio.LOW)
+        self.assertTrue(self.relays.set(5, False))
+        self.relays.reset_interlock([5, 8])
+        self.assertTrue(self.relays.set(5, True))
+        self.assertEqual(self.relays.summary()[5]["emergency_offs"], 1)
+
+    def test_sets_pins_up_again_after_they_were_released_elsewhere(self):
+        self.relays.set(5, True)
+        self.relays.set(5, False)
+        fake_gpio.reset()
+        self.relays.set(5, True)
+        self.assertEqual(fake_gpio.level(5), fake_gpio.HIGH)
+
+
+class RelayControllerTest(unittest.TestCase):
+    def tearDown(self):
+        RelayController(5).cleanup()
+        RelayController(6).cleanup()
+        fake_gpio.reset()
+
+    def test_controllers_share_the_pin_state(self):
+        RelayController(5).toggle_relay(True)
+        # A new controller for a pin that is on does not switch it off
+        RelayController(5)
+        self.assertEqual(fake_gpio.level(5), fake_gpio.HIGH)
+        # Switching one line off keeps the relays of the other line as they are
+        RelayController(6).toggle_relay(True)
+        RelayController(5).toggle_relay(False)
+        self.assertEqual((fake_gpio.level(5), fake_gpio.level(6)), (fake_gpio.LOW, fake_gpio.HIGH))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+import json
+import threading
+import time
+import unittest
+
+# The rig installs the fake GPIO module, so it must be imported before the device code
+from simulation.plant import SimulatedPlant, fast_pump, wait_for
+from simulation.rig import SimulatedRig
+from simulation import fake_gpio
+
+from devices.relay.relay_controller import RelayController, emergency_off, is_tripped, reset_interlock
+from devices.relay.relay_manager import relay_manager
+from mqtt.mqtt_publisher import FLOW_FINAL_TOPIC
+from mqtt.stop_router import STOP_TOPIC
+
+PIN = 5
+
+
+class RelayInterlockTest(unittest.TestCase):
+    def tearDown(self):
+        reset_interlock([PIN])
+        relay_manager().release([PIN])
+
+    def test_tripped_relay_stays_off(self):
+        relay = RelayController(PIN)
+        relay.toggle_relay(True)
+        self.assertEqual(fake_gpio.level(PIN), fake_gpio.HIGH)
+        emergency_off([PIN])
+        self.assertEqual(fake_gpio.level(PIN), fake_gpio.LOW)
+        self.assertTrue(is_tripped(PIN))
+        # A control loop that has not noticed the stop yet cannot switch it back on
+        relay.toggle_relay(True)
+        self.assertEqual(fake_gpio.level(PIN), fake_gpio.LOW)
+        # Stopping again, or after the loop released the pin, does no harm
+        emergency_off([PIN])
+        relay.toggle_relay(False)
+        emergency_off([PIN])
+        self.assertEqual(fake_gpio.level(PIN), fake_gpio.LOW)
+
+    def test_reset_allows_the_relay_on_again(self):
+        relay = RelayController(PIN)
+        emergency_off([PIN])
+        reset_interlock([PIN])
+        self.assertFalse(is_tripped(PIN))
+        relay.toggle_relay(True)
+        self.assertEqual(fake_gpio.level(PIN), fake_gpio.HIGH)
+        relay.toggle_relay(False)
+
+
+class EmergencyStopTest(unittest.TestCase):
+    def setUp(self):
+        self.rig = SimulatedRig(pump=fast_pump())
+        self.rig.start()
+        self.plant = SimulatedPlant(self.rig).start()
+        self.mqtt = self.plant.mqtt
+        self.scheduler = self.plant.scheduler
+
+    def tearDown(self):
+        self.plant.stop()
+        self.rig.stop()
+
+    def test_stop_switches_the_pump_off_while_the_loop_waits_for_the_meter(self):
+        switched_off = threading.Event()
+        off_at = []
+
+        def on_level(pin, level):
+            if level == fake_gpio.LOW and not switched_off.is_set():
+                off_at.append(time.perf_counter())
+                switched_off.set()
+
+        self.scheduler.submit({"liters": 5.0, "temperature": 30.0, "line": 1, "lot_number": "A"})
+        self.assertTrue(wait_for(lambda: fake_gpio.level(self.rig.pump_relay_pin) == fake_gpio.HIGH))
+        fake_gpio.add_listener(self.rig.pump_relay_pin, on_level)
+        # Slow the meter down, so the filling loop is blocked in a read when the stop arrives
+        self.rig.bus.turnaround = 1.0
+        time.sleep(0.3)
+
+        sent_at = time.perf_counter()
+        self.mqtt.deliver(STOP_TOPIC, json.dumps({"lot_number": "A"}))
+        self.assertTrue(switched_off.wait(5))
+        # Switched off from the MQTT thread, well before the loop could sample again
+        self.assertLess(off_at[0] - sent_at, 0.05)
+
+        self.rig.bus.turnaround = 0.0
+        self.assertTrue(self.scheduler.wait_idle(timeout=10))
+        self.assertEqual(fake_gpio.level(self.rig.pump_relay_pin), fake_gpio.LOW)
+        self.assertEqual(self.mqtt.messages(FLOW_FINAL_TOPIC), [])
+        # The interlock is released with the lot, so the next lot can run its pump
+        self.assertFalse(is_tripped(self.rig.pump_relay_pin))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+import json
+import time
+import unittest
+
+# The rig installs the fake GPIO module, so it must be imported before the device code
+from simulation.plant import SimulatedPlant, fast_kettle, fast_pump
+from simulation.rig import SimulatedRig
+from simulation import fake_gpio
+
+from mqtt.mqtt_publisher import FLOW_FINAL_TOPIC, TEMP_FINAL_TOPIC
+from mqtt.stop_router import STOP_TOPIC
+
+
+class MultiLineTest(unittest.TestCase):
+    def setUp(self):
+        self.rig = SimulatedRig(pump=fast_pump(), kettle=fast_kettle(), time_scale=2.0)
+        self.rig.add_line(23, 24, 2, fast_pump(), fast_kettle())
+        self.rig.start()
+        self.plant = SimulatedPlant(self.rig).start()
+        self.mqtt = self.plant.mqtt
+        self.scheduler = self.plant.scheduler
+
+    def tearDown(self):
+        self.plant.stop()
+        self.rig.stop()
+
+    def test_lots_on_two_lines_overlap(self):
+        started = time.monotonic()
+        self.scheduler.submit({"liters": 0.5, "temperature": 25.0, "line": 1, "lot_number": "A"})
+        self.scheduler.submit({"liters": 0.5, "temperature": 25.0, "line": 2, "lot_number": "B"})
+        time.sleep(0.3)
+        # Both pumps run at the same time
+        self.assertEqual(len(self.scheduler.busy_lines()), 2)
+        self.assertTrue(self.scheduler.wait_idle(timeout=30))
+        elapsed = time.monotonic() - started
+
+        finals = [json.loads(payload) for payload in self.mqtt.messages(FLOW_FINAL_TOPIC)]
+        self.assertEqual(sorted((final["line"], final["lot_number"]) for final in finals), [(1, "A"), (2, "B")])
+        self.assertEqual(len(self.mqtt.messages(TEMP_FINAL_TOPIC)), 2)
+        # Each line's water went into its own kettle
+        for index in range(2):
+            self.assertGreaterEqual(self.rig.snapshot(index)["total_liters"], 0.45)
+        self.assertLess(elapsed, 30)
+
+    def test_stop_only_affects_its_lot(self):
+        self.scheduler.submit({"liters": 50.0, "temperature": 25.0, "line": 1, "lot_number": "A"})
+        self.scheduler.submit({"liters": 0.5, "temperature": 25.0, "line": 2, "lot_number": "B"})
+        time.sleep(0.5)
+        self.mqtt.deliver(STOP_TOPIC, json.dumps({"lot_number": "A"}))
+        self.assertTrue(self.scheduler.wait_idle(timeout=30))
+
+        finals = [json.loads(payload)["lot_number"] for payload in self.mqtt.messages(TEMP_FINAL_TOPIC)]
+        self.assertEqual(finals, ["B"])
+        self.assertEqual(fake_gpio.level(self.rig.pump_relay_pin), fake_gpio.LOW)
+
+
+if __name__ == "__main__":
+    unittest.main()
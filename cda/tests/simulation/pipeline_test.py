@@ -0,0 +1,69 @@
+import json
+import unittest
+
+# The rig installs the fake GPIO module, so it must be imported before the device code
+from simulation.plant import SimulatedPlant, fast_kettle, fast_pump, wait_for
+from simulation.rig import SimulatedRig
+from simulation import fake_gpio
+
+from mqtt.mqtt_publisher import FLOW_FINAL_TOPIC, TEMP_FINAL_TOPIC
+from mqtt.stop_router import STOP_TOPIC
+
+TRANSFER_RELAY_PIN = 27
+
+
+class PipelineTest(unittest.TestCase):
+    def setUp(self):
+        self.rig = SimulatedRig(pump=fast_pump(), kettle=fast_kettle(), transfer_relay_pin=TRANSFER_RELAY_PIN, time_scale=2.0)
+        self.rig.start()
+        self.plant = SimulatedPlant(self.rig).start()
+        self.mqtt = self.plant.mqtt
+        self.scheduler = self.plant.scheduler
+
+    def tearDown(self):
+        self.plant.stop()
+        self.rig.stop()
+
+    def test_next_lot_fills_while_the_last_one_heats(self):
+        self.scheduler.submit({"liters": 0.5, "temperature": 40.0, "line": 1, "lot_number": "A"})
+        self.scheduler.submit({"liters": 0.5, "temperature": 40.0, "line": 1, "lot_number": "B"})
+        self.assertTrue(wait_for(lambda: self.scheduler.busy_lots() == {"A": (1, "heat"), "B": (1, "fill")}))
+        self.assertTrue(self.scheduler.wait_idle(timeout=60))
+
+        # Each lot publishes under its own lot number, in order
+        flow_finals = [json.loads(payload)["lot_number"] for payload in self.mqtt.messages(FLOW_FINAL_TOPIC)]
+        temp_finals = [json.loads(payload)["lot_number"] for payload in self.mqtt.messages(TEMP_FINAL_TOPIC)]
+        self.assertEqual(flow_finals, ["A", "B"])
+        self.assertEqual(temp_finals, ["A", "B"])
+        self.assertEqual(self.scheduler.completed, 2)
+        # Both lots went through the fill vessel into the kettle
+        self.assertGreaterEqual(self.rig.snapshot()["water_liters"], 1.0)
+        self.assertLess(self.rig.snapshot()["fill_liters"], 0.05)
+        self.assertEqual(fake_gpio.level(TRANSFER_RELAY_PIN), fake_gpio.LOW)
+
+    def test_stop_only_affects_its_lot(self):
+        self.scheduler.submit({"liters": 0.5, "temperature": 90.0, "line": 1, "lot_number": "A"})
+        self.scheduler.submit({"liters": 0.5, "temperature": 30.0, "line": 1, "lot_number": "B"})
+        self.assertTrue(wait_for(lambda: self.scheduler.busy_lots().get("A") == (1, "heat")))
+        self.mqtt.deliver(STOP_TOPIC, json.dumps({"lot_number": "A"}))
+        self.assertTrue(self.scheduler.wait_idle(timeout=60))
+
+        temp_finals = [json.loads(payload)["lot_number"] for payload in self.mqtt.messages(TEMP_FINAL_TOPIC)]
+        self.assertEqual(temp_finals, ["B"])
+        self.assertEqual(fake_gpio.level(self.rig.kettle_relay_pin), fake_gpio.LOW)
+
+    def test_lot_stopped_while_waiting_for_the_heat_vessel(self):
+        self.scheduler.submit({"liters": 0.5, "temperature": 90.0, "line": 1, "lot_number": "A"})
+        self.scheduler.submit({"liters": 0.2, "temperature": 30.0, "line": 1, "lot_number": "B"})
+        self.assertTrue(wait_for(lambda: len(self.mqtt.messages(FLOW_FINAL_TOPIC)) == 2))
+        self.mqtt.deliver(STOP_TOPIC, json.dumps({"lot_number": "B"}))
+        self.assertTrue(wait_for(lambda: "B" not in self.scheduler.busy_lots(), timeout=5))
+        # A keeps heating
+        self.assertEqual(self.scheduler.busy_lots(), {"A": (1, "heat")})
+        self.mqtt.deliver(STOP_TOPIC, json.dumps({"lot_number": "A"}))
+        self.assertTrue(self.scheduler.wait_idle(timeout=10))
+        self.assertEqual(self.mqtt.messages(TEMP_FINAL_TOPIC), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,154 @@
+import threading
+import unittest
+
+# The rig installs the fake GPIO module, so it must be imported before the device code
+from simulation.rig import SimulatedRig
+from simulation.physics import KettleModel, PumpModel
+from simulation.recording_publisher import RecordingPublisher
+from simulation import fake_gpio
+
+from devices.ds18b20.ds18b20_reader import DS18B20Reader
+from devices.mag6000.mag6000_connector import Mag6000Connector
+from devices.mag6000.mag6000_reader import Mag6000Reader
+from functions.adaptive_rate import AdaptiveRate
+from functions.cutoff_predictor import CutoffPredictor
+from functions.flow_monitor import FlowMonitor
+from functions.heater import Heater
+from functions.volume_estimator import VolumeEstimator
+
+
+class SimulatedLotTest(unittest.TestCase):
+    def setUp(self):
+        self.rig = SimulatedRig(
+            pump=PumpModel(max_flow_lph=1800.0),
+            kettle=KettleModel(power_w=4000.0, dead_time=0.2, sensor_tau=0.3),
+            time_scale=2.0,
+        )
+        self.rig.start()
+
+    def tearDown(self):
+        self.rig.stop()
+
+    def test_devices_read_simulated_values(self):
+        # Run the pump directly and check the meter follows
+        self.rig.pump.set_running(True)
+        self.rig.pump.step(5.0)
+        with Mag6000Connector() as connector:
+            reader = Mag6000Reader(connector)
+            # The physics keep running, so compare with the true totals before and after each read
+            before = self.rig.snapshot()["total_liters"]
+            totalizer = reader.read_totalizer()
+            after = self.rig.snapshot()["total_liters"]
+            self.assertGreaterEqual(totalizer, before - self.rig.pump.totalizer_step_liters)
+            self.assertLessEqual(totalizer, after)
+            self.assertAlmostEqual(reader.read_flow_rate(), self.rig.pump.max_flow_lph, delta=20.0)
+
+        temperature = DS18B20Reader().read_temp_c()
+        self.assertAlmostEqual(temperature, self.rig.kettle.ambient_c, delta=0.1)
+
+    def test_full_lot(self):
+        publisher = RecordingPublisher()
+        stop_event = threading.Event()
+
+        with Mag6000Connector() as connector:
+            final_liters = FlowMonitor(
+                target_liters=0.5,
+                connector=connector,
+                pump_relay_pin=self.rig.pump_relay_pin,
+                publisher=publisher,
+                stop_event=stop_event,
+            ).run()
+        self.assertIsNotNone(final_liters)
+        self.assertGreaterEqual(final_liters, 0.45)
+        self.assertEqual(fake_gpio.level(self.rig.pump_relay_pin), fake_gpio.LOW)
+
+        final_temp = Heater(
+            target_temperature=25.0,
+            kettle_relay_pin=self.rig.kettle_relay_pin,
+            publisher=publisher,
+            stop_event=stop_event,
+        ).run()
+        self.assertIsNotNone(final_temp)
+        self.assertGreaterEqual(final_temp, 25.0)
+        self.assertEqual(fake_gpio.level(self.rig.kettle_relay_pin), fake_gpio.LOW)
+
+        # The true state of the rig should match what was reported
+        state = self.rig.settle()
+        self.assertGreaterEqual(state["total_liters"], 0.45)
+        self.assertGreaterEqual(state["peak_water_c"], 25.0)
+        self.assertTrue(publisher.flow_progress)
+        self.assertTrue(publisher.temp_progress)
+
+    def test_heater_holds_the_target(self):
+        publisher = RecordingPublisher()
+        with self.rig.lock:
+            self.rig.kettle.add_water(0.5)
+        heater = Heater(
+            target_temperature=25.0,
+            kettle_relay_pin=self.rig.kettle_relay_pin,
+            publisher=publisher,
+            stop_event=threading.Event(),
+            hold_seconds=2.0,
+        )
+        final_temp = heater.run()
+        self.assertIsNotNone(final_temp)
+        self.assertGreaterEqual(final_temp, 25.0 - 0.5)
+        self.assertEqual(fake_gpio.level(self.rig.kettle_relay_pin), fake_gpio.LOW)
+        # The heater kept sampling for the hold after the first sample at the target, the progress
+        # is published a little after each sample is taken
+        reached = next(timestamp for timestamp, temperature in publisher.temp_progress if temperature >= 25.0)
+        self.assertGreaterEqual(publisher.temp_progress[-1][0] - reached, 2.0 - 0.05)
+
+    def test_volume_estimator_reports_the_delivered_volume(self):
+        before = self.rig.snapshot()["total_liters"]
+        with Mag6000Connector() as connector:
+            final_liters = FlowMonitor(
+                target_liters=0.5,
+                connector=connector,
+                pump_relay_pin=self.rig.pump_relay_pin,
+                publisher=RecordingPublisher(),
+                stop_event=threading.Event(),
+                cutoff_predictor=CutoffPredictor(),
+                volume_estimator=VolumeEstimator(self.rig.pump.totalizer_step_liters),
+            ).run()
+        delivered = self.rig.settle()["total_liters"] - before
+        # The final volume is taken once the pump has coasted down, so it should match the true volume
+        self.assertIsNotNone(final_liters)
+        self.assertAlmostEqual(final_liters, delivered, delta=0.02)
+
+    def test_adaptive_rate_speeds_up_near_the_target(self):
+        with Mag6000Connector() as connector:
+            monitor = FlowMonitor(
+                target_liters=1.0,
+                connector=connector,
+                pump_relay_pin=self.rig.pump_relay_pin,
+                publisher=RecordingPublisher(),
+                stop_event=threading.Event(),
+                adaptive_rate=AdaptiveRate(min_hz=1.0, max_hz=20.0),
+            )
+            final_liters = monitor.run()
+        self.assertIsNotNone(final_liters)
+        self.assertAlmostEqual(monitor.cutoff_error, final_liters - 1.0)
+        # The last samples before the cutoff are taken faster than the default rate
+        self.assertGreater(monitor.scheduler.rate_hz, 4.0)
+
+    def test_stop_event_turns_off_pump(self):
+        publisher = RecordingPublisher()
+        stop_event = threading.Event()
+        # Stop as soon as the first progress message is published
+        publisher.publish_flow_progress = lambda liters: stop_event.set()
+
+        with Mag6000Connector() as connector:
+            result = FlowMonitor(
+                target_liters=100.0,
+                connector=connector,
+                pump_relay_pin=self.rig.pump_relay_pin,
+                publisher=publisher,
+                stop_event=stop_event,
+            ).run()
+        self.assertIsNone(result)
+        self.assertFalse(self.rig.pump.running)
+
+
+if __name__ == "__main__":
+    unittest.main()